@@ -1,14 +1,25 @@
 """
-Flask development server for Route Optimizer API
-This mimics the Lambda function behavior locally for faster development
+Flask application for the Route Optimizer API
+
+Routes call the core handlers in lambda_function directly with the parsed
+request payload and return their response bodies as-is. Run it with
+`python app.py` for development, or `python server.py` for the
+multi-worker production server.
 """
 
 import os
+import json
+import base64
 import logging
-from flask import Flask, request, jsonify
-from flask_cors import CORS
 from dotenv import load_dotenv
+
+# Load environment variables from .env file (before lambda_function reads its configuration)
+load_dotenv()
+
+from flask import Flask, Response, g, request, jsonify
+from flask_cors import CORS
 import lambda_function
+import jobs
 
 # Configure logging
 logging.basicConfig(
@@ -18,8 +29,7 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Load environment variables from .env file
-load_dotenv()
+DEFAULT_CORS_ORIGINS = "http://localhost:5173,http://localhost:3000,http://127.0.0.1:5173"
 
 # Create Flask app
 app = Flask(__name__)
@@ -27,55 +37,77 @@ app = Flask(__name__)
 # Enable CORS for all routes
 CORS(app, resources={
     r"/api/*": {
-        "origins": ["http://localhost:5173", "http://localhost:3000", "http://127.0.0.1:5173"],
+        "origins": [o.strip() for o in os.environ.get('CORS_ORIGINS', DEFAULT_CORS_ORIGINS).split(',') if o.strip()],
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"],
+        "allow_headers": ["Content-Type", "X-Filename", "X-Request-Id", "X-Profile"],
+        "expose_headers": ["Content-Encoding", "Server-Timing", "X-Request-Id", "X-Profile-Id"],
     }
 })
 
 
-def create_lambda_event(flask_request, path):
-    """Convert Flask request to Lambda event format"""
-    logger.info(f"Creating Lambda event - Path: {path}, Method: {flask_request.method}")
-
-    # Get body
-    body = flask_request.get_data(as_text=True) if flask_request.data else '{}'
-    body_size = len(body) if body else 0
-    logger.debug(f"Request body size: {body_size} bytes")
-
-    # Create Lambda event structure
-    event = {
-        'rawPath': path,
-        'requestContext': {
-            'http': {
-                'method': flask_request.method
-            }
-        },
-        'body': body,
-        'isBase64Encoded': False
-    }
+@app.before_request
+def begin_request_log():
+    """Tag this request's log records (including its worker threads) with a correlation id"""
+    g.request_id = lambda_function.begin_request_log(request.headers.get('X-Request-Id'))
+
+
+@app.after_request
+def add_request_id(response):
+    response.headers['X-Request-Id'] = g.request_id
+    # Once the body is sent (streams included): /api/metrics in other workers sees this request
+    response.call_on_close(lambda_function.metrics.write_snapshot)
+    return response
+
+
+_job_store = None
+
+
+def get_job_store():
+    """Job queue shared by this process' request threads (created on first use)"""
+    global _job_store
+    if _job_store is None:
+        _job_store = jobs.JobStore(jobs.JOBS_DB_PATH)
+    return _job_store
+
 
-    logger.debug(f"Lambda event created successfully for {path}")
-    return event
+def passthrough_response(response):
+    """Return a handler response body as-is, without a json.loads/jsonify round trip"""
+    body = response['body']
+    if response.get('isBase64Encoded'):
+        body = base64.b64decode(body)
+
+    # CORS headers are added by flask-cors
+    headers = {k: v for k, v in (response.get('headers') or {}).items()
+               if not k.lower().startswith('access-control-')}
+    headers.setdefault('Content-Type', 'application/json')
+
+    return Response(body, status=response['statusCode'], headers=headers)
+
+
+def is_streamed_upload(content_type):
+    """multipart/form-data and raw binary bodies are parsed straight from the request stream"""
+    return bool(content_type) and not content_type.startswith(('application/json', 'text/plain'))
 
 
 @app.route('/api/health', methods=['GET'])
 def health():
     """Health check endpoint"""
-    logger.info("Health check endpoint called")
+    logger.debug("Health check endpoint called")
 
     try:
-        event = create_lambda_event(request, '/api/health')
-        response = lambda_function.lambda_handler(event, {})
-
-        logger.info(f"Health check completed - Status: {response['statusCode']}")
-        return jsonify(response['body']), response['statusCode']
+        return passthrough_response(lambda_function.handle_health())
 
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}", exc_info=True)
         return jsonify({'error': 'Health check failed'}), 500
 
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics of every server and job worker process (METRICS_DIR), or of this one"""
+    return passthrough_response(lambda_function.handle_metrics())
+
+
 @app.route('/api/upload', methods=['POST', 'OPTIONS'])
 def upload():
     """File upload endpoint"""
@@ -86,16 +118,18 @@ def upload():
     logger.info("File upload endpoint called")
 
     try:
-        event = create_lambda_event(request, '/api/upload')
-        logger.info("Processing file upload through Lambda handler")
+        content_type = request.content_type or ''
 
-        response = lambda_function.lambda_handler(event, {})
-
-        import json
-        body = json.loads(response['body'])
+        if is_streamed_upload(content_type):
+            filename = request.headers.get('X-Filename') or request.args.get('filename')
+            logger.info(f"Processing streamed upload ({content_type.split(';')[0]})")
+            response = lambda_function.handle_upload_stream(request.stream, content_type, filename)
+        else:
+            logger.info("Processing legacy base64 JSON upload")
+            response = lambda_function.handle_upload_json(request.get_json(force=True))
 
         logger.info(f"File upload completed - Status: {response['statusCode']}")
-        return jsonify(body), response['statusCode']
+        return passthrough_response(response)
 
     except Exception as e:
         logger.error(f"File upload failed: {str(e)}", exc_info=True)
@@ -112,29 +146,246 @@ def optimize():
     logger.info("Route optimization endpoint called")
 
     try:
-        import json
-        request_data = request.get_json()
-        num_locations = len(request_data.get('locations', [])) if request_data else 0
-        logger.info(f"Optimizing route with {num_locations} locations")
-
-        event = create_lambda_event(request, '/api/optimize')
-        logger.info("Processing route optimization through Lambda handler")
+        request_data = request.get_json(force=True) or {}
+        logger.info(f"Optimizing routes for {len(request_data.get('drivers', []))} drivers")
 
-        response = lambda_function.lambda_handler(event, {})
-
-        body = json.loads(response['body'])
+        response = lambda_function.handle_optimize_request(
+            request_data, request.args.to_dict(), request.headers.get('Accept-Encoding'),
+            request.headers.get('X-Profile')
+        )
 
         logger.info(f"Route optimization completed - Status: {response['statusCode']}")
         if response['statusCode'] == 200:
-            logger.info(f"Optimization successful - Generated optimized route")
+            encoding = response['headers'].get('Content-Encoding', 'identity')
+            logger.info(f"Optimization successful - Generated optimized route ({encoding})")
 
-        return jsonify(body), response['statusCode']
+        return passthrough_response(response)
 
     except Exception as e:
         logger.error(f"Route optimization failed: {str(e)}", exc_info=True)
         return jsonify({'error': 'Route optimization failed', 'message': str(e)}), 500
 
 
+@app.route('/api/optimize/batch', methods=['POST', 'OPTIONS'])
+def optimize_batch():
+    """Batch optimization: several rosters (days, depots) in one call, sharing geocoding work"""
+    if request.method == 'OPTIONS':
+        logger.debug("CORS preflight request for /api/optimize/batch")
+        return '', 200
+
+    try:
+        request_data = request.get_json(force=True) or {}
+        logger.info(f"Batch optimization of {len(request_data.get('rosters') or [])} rosters")
+
+        response = lambda_function.handle_optimize_batch_request(
+            request_data, request.args.to_dict(), request.headers.get('Accept-Encoding')
+        )
+        return passthrough_response(response)
+
+    except Exception as e:
+        logger.error(f"Batch optimization failed: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Batch optimization failed', 'message': str(e)}), 500
+
+
+@app.route('/api/route-geometry', methods=['POST', 'OPTIONS'])
+def route_geometry():
+    """Street-level geometry (encoded, simplified polylines) for the vans shown on the map"""
+    if request.method == 'OPTIONS':
+        logger.debug("CORS preflight request for /api/route-geometry")
+        return '', 200
+
+    try:
+        request_data = request.get_json(force=True) or {}
+        response = lambda_function.handle_route_geometry_request(
+            request_data, request.args.to_dict(), request.headers.get('Accept-Encoding')
+        )
+        return passthrough_response(response)
+
+    except Exception as e:
+        logger.error(f"Route geometry failed: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Route geometry failed', 'message': str(e)}), 500
+
+
+@app.route('/api/kpis', methods=['POST', 'OPTIONS'])
+def kpis():
+    """KPI aggregates of a plan (per terminal, van and wave), for plans edited after optimizing"""
+    if request.method == 'OPTIONS':
+        logger.debug("CORS preflight request for /api/kpis")
+        return '', 200
+
+    request_data = request.get_json(force=True, silent=True)
+    if request_data is None:
+        return jsonify({'error': 'Invalid JSON body'}), 400
+
+    try:
+        response = lambda_function.handle_kpis_request(
+            request_data, request.args.to_dict(), request.headers.get('Accept-Encoding')
+        )
+        return passthrough_response(response)
+
+    except Exception as e:
+        logger.error(f"KPIs failed: {str(e)}", exc_info=True)
+        return jsonify({'error': 'KPIs failed', 'message': str(e)}), 500
+
+
+def export_plan_response(result):
+    """Stream a plan export (format from ?format=, xlsx by default) as an attachment"""
+    try:
+        result, export_format = lambda_function.parse_export_request(result, request.args.to_dict())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    logger.info(f"Exporting {len(result['vans'])} vans as {export_format}")
+    return Response(
+        lambda_function.iter_export(result, export_format),
+        headers=lambda_function.export_headers(export_format)
+    )
+
+
+@app.route('/api/export', methods=['POST', 'OPTIONS'])
+def export_plan():
+    """Optimize result (full or compact) as an xlsx or CSV file for dispatch, streamed"""
+    if request.method == 'OPTIONS':
+        logger.debug("CORS preflight request for /api/export")
+        return '', 200
+
+    try:
+        return export_plan_response(request.get_json(force=True) or {})
+
+    except Exception as e:
+        logger.error(f"Export failed: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Export failed', 'message': str(e)}), 500
+
+
+@app.route('/api/optimize/stream', methods=['POST', 'OPTIONS'])
+def optimize_stream():
+    """Streaming optimization: geocode progress, each van as it is solved, then a summary"""
+    if request.method == 'OPTIONS':
+        logger.debug("CORS preflight request for /api/optimize/stream")
+        return '', 200
+
+    stream_format = request.args.get('format', 'ndjson')
+    if stream_format not in lambda_function.STREAM_CONTENT_TYPES:
+        return jsonify({'error': f'Formato de stream no soportado: {stream_format}'}), 400
+
+    try:
+        request_data = request.get_json(force=True) or {}
+        logger.info(f"Streaming optimization for {len(request_data.get('drivers', []))} drivers ({stream_format})")
+
+        return Response(
+            lambda_function.iter_optimize_stream(request_data, stream_format),
+            mimetype=lambda_function.STREAM_CONTENT_TYPES[stream_format],
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    except Exception as e:
+        logger.error(f"Route optimization stream failed: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Route optimization failed', 'message': str(e)}), 500
+
+
+@app.route('/api/upload-optimize', methods=['POST', 'OPTIONS'])
+def upload_optimize():
+    """Combined upload + optimization endpoint (file streamed straight into the pipeline)"""
+    if request.method == 'OPTIONS':
+        logger.debug("CORS preflight request for /api/upload-optimize")
+        return '', 200
+
+    logger.info("Upload-optimize endpoint called")
+
+    try:
+        config = json.loads(request.args['config']) if request.args.get('config') else None
+    except ValueError as e:
+        return jsonify({'error': f'config inválido: {e}'}), 400
+
+    try:
+        filename = request.headers.get('X-Filename') or request.args.get('filename')
+
+        response = lambda_function.handle_upload_optimize_stream(
+            request.stream, request.content_type or '', filename, config
+        )
+
+        logger.info(f"Upload-optimize completed - Status: {response['statusCode']}")
+        return passthrough_response(response)
+
+    except Exception as e:
+        logger.error(f"Upload-optimize failed: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Upload-optimize failed', 'message': str(e)}), 500
+
+
+@app.route('/api/jobs', methods=['POST', 'OPTIONS'])
+def submit_job():
+    """Queue an optimization (same body as /api/optimize); returns the job id immediately"""
+    if request.method == 'OPTIONS':
+        logger.debug("CORS preflight request for /api/jobs")
+        return '', 200
+
+    try:
+        payload = request.get_json(force=True) or {}
+        if not payload.get('drivers'):
+            return jsonify({'error': 'No drivers data provided'}), 400
+        if request.args.get('format'):
+            payload['format'] = request.args['format']
+
+        job_id = get_job_store().submit(payload)
+        logger.info(f"Job {job_id} queued ({len(payload['drivers'])} drivers)")
+
+        return jsonify({
+            'jobId': job_id,
+            'status': 'queued',
+            'statusUrl': f'/api/jobs/{job_id}',
+            'resultUrl': f'/api/jobs/{job_id}/result'
+        }), 202
+
+    except Exception as e:
+        logger.error(f"Job submission failed: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Job submission failed', 'message': str(e)}), 500
+
+
+@app.route('/api/jobs/stats', methods=['GET'])
+def job_stats():
+    """Queue depth and job latency"""
+    return jsonify(get_job_store().stats())
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Job status (queued / running / succeeded / failed)"""
+    status = get_job_store().get(job_id)
+    if status is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(status)
+
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Final optimize response of a job (202 while it is still pending)"""
+    found = get_job_store().result(job_id)
+    if found is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+
+    status, status_code, body = found
+    if status in ('queued', 'running'):
+        return jsonify({'jobId': job_id, 'status': status}), 202
+
+    return Response(body, status=status_code, headers={'Content-Type': 'application/json'})
+
+
+@app.route('/api/jobs/<job_id>/export', methods=['GET'])
+def job_export(job_id):
+    """Plan of a finished job as an xlsx or CSV file (?format=xlsx|csv)"""
+    found = get_job_store().result(job_id)
+    if found is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+
+    status, status_code, body = found
+    if status in ('queued', 'running'):
+        return jsonify({'jobId': job_id, 'status': status}), 202
+    if status != 'succeeded':
+        return jsonify({'error': 'El trabajo falló, no hay plan para exportar', 'jobId': job_id}), 409
+
+    return export_plan_response(json.loads(body))
+
+
 @app.route('/')
 def index():
     """Root endpoint"""
@@ -142,11 +393,20 @@ def index():
         'name': 'Route Optimizer API',
         'version': '1.0.0',
         'status': 'running',
-        'mode': 'development',
+        'mode': os.environ.get('SERVER_MODE', 'development'),
         'endpoints': {
             'health': '/api/health',
+            'metrics': '/api/metrics',
             'upload': '/api/upload',
-            'optimize': '/api/optimize'
+            'optimize': '/api/optimize',
+            'optimize_stream': '/api/optimize/stream',
+            'optimize_batch': '/api/optimize/batch',
+            'upload_optimize': '/api/upload-optimize',
+            'route_geometry': '/api/route-geometry',
+            'kpis': '/api/kpis',
+            'export': '/api/export',
+            'jobs': '/api/jobs',
+            'job_stats': '/api/jobs/stats'
         }
     })
 
@@ -167,14 +427,29 @@ if __name__ == '__main__':
     print("\n📚 Available endpoints:")
     print("  • GET  http://localhost:{}/".format(port))
     print("  • GET  http://localhost:{}/api/health".format(port))
+    print("  • GET  http://localhost:{}/api/metrics".format(port))
     print("  • POST http://localhost:{}/api/upload".format(port))
     print("  • POST http://localhost:{}/api/optimize".format(port))
+    print("  • POST http://localhost:{}/api/optimize/stream".format(port))
+    print("  • POST http://localhost:{}/api/optimize/batch".format(port))
+    print("  • POST http://localhost:{}/api/upload-optimize".format(port))
+    print("  • POST http://localhost:{}/api/route-geometry".format(port))
+    print("  • POST http://localhost:{}/api/kpis".format(port))
+    print("  • POST http://localhost:{}/api/export?format=xlsx|csv".format(port))
+    print("  • POST http://localhost:{}/api/jobs".format(port))
+    print("  • GET  http://localhost:{}/api/jobs/<id>[/result|/export]".format(port))
+    print("  • GET  http://localhost:{}/api/jobs/stats".format(port))
     print("\n⌨️  Press Ctrl+C to stop\n")
 
     logger.info(f"Starting Route Optimizer API on port {port} (debug={debug})")
     logger.info(f"Google Maps API: {'Configured' if os.environ.get('GOOGLE_MAPS_API_KEY') else 'Not configured'}")
     logger.info(f"AWS: {'Configured' if os.environ.get('AWS_ACCESS_KEY_ID') else 'Not configured'}")
 
+    # With the debug reloader, only the serving child process runs the job workers
+    job_pool = None
+    if jobs.JOB_WORKERS > 0 and (not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        job_pool = jobs.start_pool_process(jobs.JOBS_DB_PATH, jobs.JOB_WORKERS)
+
     try:
         app.run(
             host='0.0.0.0',
@@ -185,3 +460,6 @@ if __name__ == '__main__':
         logger.info("Server shutdown requested by user")
     except Exception as e:
         logger.error(f"Server crashed: {str(e)}", exc_info=True)
+    finally:
+        if job_pool is not None:
+            jobs.stop_pool_process(job_pool)
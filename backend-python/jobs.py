@@ -0,0 +1,490 @@
+"""
+Asynchronous optimization jobs for the Route Optimizer API
+
+Jobs are stored in a SQLite database that acts as a local stand-in for a
+managed queue. A bounded pool of worker processes claims queued jobs, runs
+the optimize handler and stores the response body, so clients can submit a
+roster, get a job id back immediately and poll for the result.
+
+Running jobs hold a lease: the worker renews `heartbeat_at` every
+JOB_HEARTBEAT_SECONDS. A job whose lease expires (its worker died, hung, or
+was lost in a restart) is put back in the queue, up to JOB_MAX_ATTEMPTS, so
+jobs survive worker and server restarts.
+
+The pool runs in its own supervisor process, never in the HTTP server's
+process: server.py starts it with start_pool_process(), or it can run on
+its own next to `python server.py --job-workers 0`:
+    python jobs.py [--workers 2]
+"""
+
+import argparse
+import contextvars
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+JOBS_DB_PATH = os.environ.get('JOBS_DB_PATH', './jobs.sqlite3')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 0.5))
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', 7 * 24 * 3600))  # 7 days
+JOB_HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', 10))  # Lease renewal interval
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 120))  # Above the longest solver call, which holds the GIL
+JOB_MAX_RUN_SECONDS = float(os.environ.get('JOB_MAX_RUN_SECONDS', 1800))  # Leases stop being renewed after this (hung job)
+JOB_STATS_WINDOW = 200  # Finished jobs used for latency stats
+
+# Handlers (request id tagging, background writer) are set up when lambda_function is imported
+logger = logging.getLogger('route_optimizer')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    request TEXT NOT NULL,
+    status_code INTEGER,
+    result TEXT,
+    error TEXT,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    heartbeat_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class JobStore:
+    """
+    SQLite-backed job queue
+
+    A connection is opened per operation, so one store can be shared by
+    request threads and the pool supervisor; claims use BEGIN IMMEDIATE so
+    two workers never take the same job. Updates to a running job only apply
+    while the caller's worker id still holds its lease.
+    """
+
+    def __init__(self, path=JOBS_DB_PATH):
+        self.path = str(path)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+            if 'heartbeat_at' not in columns:  # Queue created before leases
+                conn.execute('ALTER TABLE jobs ADD COLUMN heartbeat_at REAL')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return _Closing(conn)
+
+    def submit(self, payload):
+        """Queue an optimize request; returns the job id"""
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, request, created_at) VALUES (?, 'queued', ?, ?)",
+                (job_id, json.dumps(payload), time.time())
+            )
+        return job_id
+
+    def claim(self, worker):
+        """Take the oldest queued job for a worker; returns (job_id, payload) or None"""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT id, request FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, heartbeat_at = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (worker, now, now, row['id'])
+            )
+            conn.execute('COMMIT')
+        return row['id'], json.loads(row['request'])
+
+    def heartbeat(self, job_id, worker):
+        """Renew a running job's lease; False if the worker no longer holds it"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time(), job_id, worker)
+            )
+        return cursor.rowcount == 1
+
+    def finish(self, job_id, status_code, body, worker=None):
+        """
+        Store the handler response for a job
+
+        Args:
+            worker: Worker id that claimed the job; the result is dropped if its lease
+                expired and the job was requeued (None stores it unconditionally)
+
+        Returns:
+            True if the result was stored
+        """
+        status = 'succeeded' if status_code == 200 else 'failed'
+        error = None
+        if status == 'failed':
+            try:
+                error = json.loads(body).get('error')
+            except (ValueError, AttributeError):
+                error = body
+        query = "UPDATE jobs SET status = ?, status_code = ?, result = ?, error = ?, finished_at = ? WHERE id = ?"
+        params = (status, status_code, body, error, time.time(), job_id)
+        if worker is not None:
+            query += " AND worker = ? AND status = 'running'"
+            params += (worker,)
+        with self._connect() as conn:
+            cursor = conn.execute(query, params)
+        return cursor.rowcount == 1
+
+    def requeue_expired(self, lease_seconds=JOB_LEASE_SECONDS):
+        """
+        Put back running jobs whose lease expired (worker dead, hung or lost in a restart)
+
+        Jobs that already used JOB_MAX_ATTEMPTS are failed instead.
+
+        Returns:
+            List of (job_id, worker) whose lease expired
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(
+                "SELECT id, worker, attempts FROM jobs "
+                "WHERE status = 'running' AND COALESCE(heartbeat_at, started_at, 0) < ?",
+                (now - lease_seconds,)
+            ).fetchall()
+            for row in rows:
+                if row['attempts'] >= JOB_MAX_ATTEMPTS:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', status_code = 500, error = ?, finished_at = ? WHERE id = ?",
+                        (f"El trabajo se interrumpió {row['attempts']} veces", now, row['id'])
+                    )
+                else:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'queued', worker = NULL, started_at = NULL, heartbeat_at = NULL "
+                        "WHERE id = ?",
+                        (row['id'],)
+                    )
+            conn.execute('COMMIT')
+        return [(row['id'], row['worker']) for row in rows]
+
+    def purge_expired(self):
+        """Delete finished jobs older than JOB_RETENTION_SECONDS"""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?",
+                (time.time() - JOB_RETENTION_SECONDS,)
+            )
+
+    def get(self, job_id):
+        """Job status dict (without the result body), or None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, status, error, attempts, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            position = None
+            if row['status'] == 'queued':
+                position = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?",
+                    (row['created_at'],)
+                ).fetchone()[0]
+
+        now = time.time()
+        started, finished = row['started_at'], row['finished_at']
+        return {
+            'jobId': row['id'],
+            'status': row['status'],
+            'queuePosition': position,
+            'attempts': row['attempts'],
+            'error': row['error'],
+            'waitMs': _ms((started or now) - row['created_at']),
+            'runMs': _ms((finished or now) - started) if started else None,
+            'createdAt': row['created_at'],
+            'startedAt': started,
+            'finishedAt': finished
+        }
+
+    def result(self, job_id):
+        """(status, status_code, body) for a job, or None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT status, status_code, result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return (row['status'], row['status_code'], row['result']) if row else None
+
+    def stats(self):
+        """Queue depth and latency of recently finished jobs"""
+        with self._connect() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            oldest = conn.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            recent = conn.execute(
+                "SELECT created_at, started_at, finished_at FROM jobs "
+                "WHERE status IN ('succeeded', 'failed') AND started_at IS NOT NULL "
+                "ORDER BY finished_at DESC LIMIT ?",
+                (JOB_STATS_WINDOW,)
+            ).fetchall()
+
+        waits = [r['started_at'] - r['created_at'] for r in recent]
+        runs = [r['finished_at'] - r['started_at'] for r in recent]
+        latencies = [r['finished_at'] - r['created_at'] for r in recent]
+        return {
+            'queueDepth': counts.get('queued', 0),
+            'running': counts.get('running', 0),
+            'succeeded': counts.get('succeeded', 0),
+            'failed': counts.get('failed', 0),
+            'oldestQueuedAgeMs': _ms(time.time() - oldest) if oldest else None,
+            'sampleSize': len(recent),
+            'avgWaitMs': _ms(sum(waits) / len(waits)) if waits else None,
+            'avgRunMs': _ms(sum(runs) / len(runs)) if runs else None,
+            'avgLatencyMs': _ms(sum(latencies) / len(latencies)) if latencies else None,
+            'p95LatencyMs': _ms(_percentile(latencies, 0.95))
+        }
+
+
+class _Closing:
+    """Context manager that closes (not just commits) a sqlite3 connection"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.conn.in_transaction:
+            self.conn.execute('ROLLBACK')
+        self.conn.close()
+
+
+def worker_id():
+    """Unique id for a worker process (host plus a random token: reused pids never match an old lease)"""
+    return f"{socket.gethostname()}:{uuid.uuid4().hex[:12]}"
+
+
+def renew_lease(store, job_id, worker, done):
+    """Heartbeat thread: renew a job's lease until it finishes, the lease is lost or JOB_MAX_RUN_SECONDS pass"""
+    give_up = time.monotonic() + JOB_MAX_RUN_SECONDS
+    while not done.wait(JOB_HEARTBEAT_SECONDS):
+        if time.monotonic() >= give_up:
+            logger.warning("Job running for more than %.0fs, lease no longer renewed", JOB_MAX_RUN_SECONDS)
+            return
+        try:
+            if not store.heartbeat(job_id, worker):
+                return
+        except sqlite3.Error as e:
+            logger.warning("Job heartbeat failed: %s", e)
+
+
+def worker_main(db_path, stop_event, me):
+    """Worker process loop: claim a job, run the optimize handler under a lease, store the response"""
+    import lambda_function  # Imported once per worker: keeps its geocode/route memo warm
+
+    store = JobStore(db_path)
+    supervisor_pid = os.getppid()
+    logger.info("Job worker started", extra={'fields': {'worker': me, 'pid': os.getpid()}})
+
+    try:
+        while not stop_event.is_set() and os.getppid() == supervisor_pid:
+            claimed = store.claim(me)
+            if claimed is None:
+                stop_event.wait(JOB_POLL_SECONDS)
+                continue
+
+            job_id, payload = claimed
+            lambda_function.begin_request_log(job_id)
+            logger.info("Job running", extra={'fields': {'worker': me, 'drivers': len(payload.get('drivers', []))}})
+            done = threading.Event()
+            threading.Thread(target=contextvars.copy_context().run, args=(renew_lease, store, job_id, me, done),
+                             daemon=True).start()
+            try:
+                response = lambda_function.handle_optimize_request(payload)
+                status_code, body = response['statusCode'], response['body']
+            except Exception as e:
+                logger.exception("Job failed: %s", e)
+                status_code, body = 500, json.dumps({'error': str(e)})
+            finally:
+                done.set()
+
+            if store.finish(job_id, status_code, body, worker=me):
+                logger.info("Job finished", extra={'fields': {'statusCode': status_code}})
+            else:
+                logger.warning("Job lease expired while running, result discarded")
+            lambda_function.metrics.write_snapshot()  # Published by the server's /api/metrics
+    except KeyboardInterrupt:
+        pass  # The job's lease expires and it is requeued
+    finally:
+        lambda_function.flush_logs()  # Spawned processes exit without running atexit handlers
+
+
+class JobWorkerPool:
+    """
+    Bounded pool of worker processes, supervised from the process that owns it
+
+    run() starts the workers and supervises them in the calling thread: workers
+    that exit are replaced, jobs whose lease expired are requeued, and a worker
+    still alive whose lease expired (hung) is terminated and replaced. Run it as
+    its own process (start_pool_process() or `python jobs.py`), so the workers are
+    its children and not an HTTP server's.
+    """
+
+    def __init__(self, db_path=JOBS_DB_PATH, workers=JOB_WORKERS, supervise_seconds=5):
+        self.db_path = str(db_path)
+        self.workers = workers
+        self.supervise_seconds = supervise_seconds
+        self._ctx = multiprocessing.get_context('spawn')  # No fork of threads / solver state
+        self._stop = self._ctx.Event()  # Tells workers to exit after their current job
+        self._running = False  # Supervision loop; cleared by SIGTERM (never touch the Event's lock in a handler)
+        self._processes = {}  # worker id -> Process
+
+    def _spawn(self):
+        me = worker_id()
+        process = self._ctx.Process(target=worker_main, args=(self.db_path, self._stop, me), daemon=True)
+        process.start()
+        self._processes[me] = process
+
+    def supervise(self, store):
+        """One supervision pass: requeue expired leases, replace dead and hung workers"""
+        expired = store.requeue_expired()
+        if expired:
+            logger.warning("Requeued %d job(s) whose lease expired: %s", len(expired),
+                           ', '.join(job_id for job_id, _ in expired))
+
+        hung = {worker for _, worker in expired if worker in self._processes}
+        for me in hung:
+            logger.warning("Job worker %s stopped renewing its lease; terminating it", me)
+            self._processes[me].terminate()
+            self._processes[me].join(5)
+
+        dead = [me for me, process in self._processes.items() if not process.is_alive()]
+        for me in dead:
+            del self._processes[me]
+            self._spawn()
+        if dead:
+            logger.warning("Replaced %d job worker(s)", len(dead))
+        store.purge_expired()
+
+    def start(self):
+        """Requeue jobs whose lease expired during a previous run and start the workers"""
+        expired = JobStore(self.db_path).requeue_expired()
+        if expired:
+            logger.info("Requeued %d job(s) interrupted by a previous run: %s", len(expired),
+                        ', '.join(job_id for job_id, _ in expired))
+        for _ in range(self.workers):
+            self._spawn()
+        logger.info("Job worker pool started: %d worker(s), queue at %s", self.workers, self.db_path)
+        return self
+
+    def run(self, parent_pid=None):
+        """
+        Start the workers and supervise them until SIGTERM/SIGINT, stop() or the parent process exits
+
+        Args:
+            parent_pid: Exit when this process is no longer our parent (server gone)
+        """
+        import lambda_function  # Sets up the route_optimizer log handlers in the supervisor process
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, '_running', False))
+        store = JobStore(self.db_path)
+        self._running = True
+        self.start()
+        try:
+            while self._running:
+                time.sleep(self.supervise_seconds)
+                if not self._running:
+                    break
+                if parent_pid is not None and os.getppid() != parent_pid:
+                    logger.warning("Server process exited; stopping job workers")
+                    break
+                self.supervise(store)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+            lambda_function.flush_logs()
+
+    def stop(self, timeout=30):
+        """Ask workers to exit after their current job; wait up to timeout for all of them"""
+        self._running = False
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        for process in self._processes.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()  # Its job is requeued when the lease expires
+
+
+def run_pool(db_path, workers, parent_pid=None):
+    """Entry point of the supervisor process started by start_pool_process()"""
+    JobWorkerPool(db_path, workers).run(parent_pid)
+
+
+def start_pool_process(db_path=JOBS_DB_PATH, workers=JOB_WORKERS):
+    """
+    Run the worker pool in its own supervisor process
+
+    The server only starts and stops this process: the workers are the
+    supervisor's children, so servers that reap every child (gunicorn's
+    arbiter) never collect them, and no supervisor thread runs while the
+    server forks its request workers. The supervisor exits on its own if the
+    server process dies.
+
+    Returns:
+        The supervisor Process (pass it to stop_pool_process())
+    """
+    ctx = multiprocessing.get_context('spawn')
+    process = ctx.Process(target=run_pool, args=(str(db_path), workers, os.getpid()), name='job-pool')
+    process.start()
+    return process
+
+
+def stop_pool_process(process, timeout=35):
+    """
+    Stop a supervisor process started by start_pool_process()
+
+    Running jobs get the pool's stop timeout to finish; the supervisor is killed
+    if it has not exited after `timeout` seconds (its jobs are requeued when
+    their lease expires).
+    """
+    if process.is_alive():
+        process.terminate()
+    process.join(timeout)
+    if process.is_alive():
+        process.kill()
+        process.join(5)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Route Optimizer - optimization job workers')
+    parser.add_argument('--workers', type=int, default=JOB_WORKERS)
+    parser.add_argument('--db', default=JOBS_DB_PATH)
+    args = parser.parse_args()
+
+    JobWorkerPool(args.db, args.workers).run()
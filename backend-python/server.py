@@ -0,0 +1,150 @@
+"""
+Production HTTP server for the Route Optimizer API
+
+Serves the Flask app from app.py under a multi-worker, multi-threaded WSGI
+server. Each worker process imports lambda_function once, so its geocode,
+travel-time and route memos stay warm and are shared by the worker's
+threads across requests.
+
+Optimization jobs (/api/jobs) are run by a pool of JOB_WORKERS processes
+under their own supervisor process, started and stopped with the server
+(see jobs.py); the server process never parents the job workers.
+
+Server selection (first one installed):
+  1. gunicorn  - SERVER_WORKERS processes x SERVER_THREADS threads (gthread)
+  2. waitress  - single process, SERVER_THREADS threads
+  3. werkzeug  - threaded fallback, for environments without either
+
+Usage:
+    python server.py [--host 0.0.0.0] [--port 8000] [--workers 2] [--threads 4] [--job-workers 2]
+"""
+
+import argparse
+import importlib.util
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Route Optimizer API - production server')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SERVER_WORKERS', 2)),
+                        help='Worker processes (gunicorn only)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('SERVER_THREADS', 4)),
+                        help='Request threads per worker')
+    parser.add_argument('--timeout', type=int, default=int(os.environ.get('SERVER_TIMEOUT', 300)),
+                        help='Seconds before a busy worker is restarted (gunicorn only)')
+    parser.add_argument('--job-workers', type=int, default=int(os.environ.get('JOB_WORKERS', 2)),
+                        help='Optimization job worker processes (0 = run them separately with jobs.py)')
+    return parser.parse_args()
+
+
+def prepare_metrics_dir():
+    """
+    Empty the metrics snapshot directory before any worker starts
+
+    Server and job worker processes inherit METRICS_DIR (./metrics unless
+    configured) and save their metrics there, so /api/metrics reports all of
+    them whichever worker answers. Snapshots of a previous run are removed.
+    """
+    directory = Path(os.environ.setdefault('METRICS_DIR', './metrics'))
+    directory.mkdir(parents=True, exist_ok=True)
+    for snapshot in directory.glob('*.json'):
+        snapshot.unlink()
+
+
+def run_gunicorn(args):
+    """Run under gunicorn with threaded workers"""
+    from gunicorn.app.base import BaseApplication
+
+    job_pool = {}
+
+    def on_starting(server):
+        # Before the arbiter forks request workers, and outside it: the arbiter reaps every child
+        if args.job_workers > 0:
+            import jobs
+            job_pool['process'] = jobs.start_pool_process(jobs.JOBS_DB_PATH, args.job_workers)
+
+    def on_exit(server):
+        if 'process' in job_pool:
+            import jobs
+            jobs.stop_pool_process(job_pool['process'])
+
+    class RouteOptimizerServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{args.host}:{args.port}')
+            self.cfg.set('workers', args.workers)
+            self.cfg.set('threads', args.threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('timeout', args.timeout)
+            # Import the app inside each worker: memos and HTTP pools are per process
+            self.cfg.set('preload_app', False)
+            self.cfg.set('on_starting', on_starting)
+            self.cfg.set('on_exit', on_exit)
+
+        def load(self):
+            from app import app
+            return app
+
+    RouteOptimizerServer().run()
+
+
+def run_waitress(args):
+    """Run under waitress (single process, thread pool)"""
+    from waitress import serve
+    from app import app
+
+    serve(app, host=args.host, port=args.port, threads=args.threads)
+
+
+def run_werkzeug(args):
+    """Threaded werkzeug server (fallback when no production server is installed)"""
+    from werkzeug.serving import run_simple
+    from app import app
+
+    run_simple(args.host, args.port, app, threaded=True, use_reloader=False, use_debugger=False)
+
+
+def main():
+    args = parse_args()
+    os.environ['SERVER_MODE'] = 'production'
+    prepare_metrics_dir()
+
+    if importlib.util.find_spec('gunicorn') is not None:
+        server, runner = 'gunicorn', run_gunicorn
+    elif importlib.util.find_spec('waitress') is not None:
+        server, runner = 'waitress', run_waitress
+    else:
+        server, runner = 'werkzeug', run_werkzeug
+
+    print("=" * 60)
+    print("🚀 Route Optimizer API - Production Server")
+    print("=" * 60)
+    print(f"📍 Listening on: http://{args.host}:{args.port}")
+    if server == 'gunicorn':
+        print(f"⚙️  Server: gunicorn ({args.workers} workers x {args.threads} threads)")
+    elif server == 'waitress':
+        print(f"⚙️  Server: waitress (1 process x {args.threads} threads)")
+    else:
+        print("⚠️  Server: werkzeug threaded fallback - install gunicorn or waitress for production")
+    print(f"🧵 Job workers: {args.job_workers}")
+    print("=" * 60)
+
+    if server == 'gunicorn' or args.job_workers <= 0:
+        runner(args)  # gunicorn starts the job pool from its on_starting hook
+        return
+
+    import jobs
+    job_pool = jobs.start_pool_process(jobs.JOBS_DB_PATH, args.job_workers)
+    try:
+        runner(args)
+    finally:
+        jobs.stop_pool_process(job_pool)
+
+
+if __name__ == '__main__':
+    main()
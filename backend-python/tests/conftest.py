@@ -0,0 +1,34 @@
+"""
+Shared pytest setup
+
+The handlers live in lambda_function.py, which deploy copies next to app.py
+from lambda_function_updated.py at the repository root. Tests use that copy
+when it exists and the root module otherwise, imported as `lambda_function`
+so app.py and jobs.py resolve the same module.
+"""
+
+import importlib
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# Before the module reads its configuration: no response cache on disk during tests
+os.environ.setdefault('ENABLE_RESPONSE_CACHE', 'false')
+os.environ.setdefault('GOOGLE_MAPS_API_KEY', '')
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+REPO_ROOT = BACKEND_DIR.parent
+
+sys.path.insert(0, str(BACKEND_DIR))
+if not (BACKEND_DIR / 'lambda_function.py').exists():
+    sys.path.insert(0, str(REPO_ROOT))
+    sys.modules['lambda_function'] = importlib.import_module('lambda_function_updated')
+
+
+@pytest.fixture(autouse=True)
+def flush_pipeline_logs():
+    """Write queued log records while pytest still captures the test's stdout"""
+    yield
+    importlib.import_module('lambda_function').flush_logs()
@@ -0,0 +1,62 @@
+"""Batch optimize: shared prewarm under one Google Maps budget"""
+
+import json
+import threading
+import time
+import types
+
+import pytest
+
+import lambda_function as lf
+
+
+class FailingGoogle:
+    """urllib3 stand-in answering every Google Maps call with HTTP 503"""
+
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        with self._lock:
+            self.calls += 1
+        return types.SimpleNamespace(status=503, data=b'')
+
+
+@pytest.fixture
+def failing_google(monkeypatch):
+    google = FailingGoogle()
+    monkeypatch.setattr(lf, 'GOOGLE_MAPS_API_KEY', 'test-key')
+    monkeypatch.setattr(lf, 'GEOCODE_MAX_WORKERS', 1)  # One call at a time: the breaker trips at a known call
+    monkeypatch.setattr(lf, 'get_http', lambda: google)
+    monkeypatch.setattr(lf, 'stage_memo', lf.StageMemo(1000))
+    return google
+
+
+def roster(n, offset=0):
+    return [{'name': f'D{i}', 'address': f'Pajaritos {100 + i}, Maipú', 'terminal': 'Terminal Aeropuerto T1',
+             'presentation_time': '06:00'} for i in range(offset, offset + n)]
+
+
+def test_prewarm_calls_go_through_the_batch_budget(failing_google):
+    budget = lf.GoogleCallBudget(time.monotonic() + 30, failure_threshold=2)
+    requests = [{'drivers': roster(6), 'config': {}}, {'drivers': roster(6, offset=3), 'config': {}}]
+    with budget.active():
+        shared = lf.prewarm_shared_stages(requests, lf.StageReport('geocode'), lf.StageReport('travelTimes'), budget)
+
+    assert shared['uniqueAddresses'] == 9
+    assert failing_google.calls == 2  # The breaker opened for the whole prewarm
+    summary = budget.summary()
+    assert summary['calls'] == 2 and summary['breaker'] == 'open'
+    assert summary['circuitOpen'] == summary['skipped'] > 0
+
+
+def test_batch_timings_report_the_prewarm_budget(monkeypatch):
+    monkeypatch.setattr(lf, 'ROUTE_SOLVER_TIME_LIMIT_SECONDS', 0.1)
+    data = {'rosters': [{'id': 'lunes', 'drivers': roster(4)}, {'id': 'martes', 'drivers': roster(4, offset=2)}]}
+    response = lf.handle_optimize_batch_request(data)
+    body = json.loads(response['body'])
+
+    assert response['statusCode'] == 200
+    assert body['timings']['shared']['google'] == {'calls': 0, 'skipped': 0, 'circuitOpen': 0, 'deadline': 0,
+                                                   'breaker': 'closed'}
@@ -0,0 +1,166 @@
+"""Response cache: canonical keys, local and S3 backends (S3 against a moto server)"""
+
+import gzip
+import os
+import time
+
+import pytest
+
+import lambda_function as lf
+
+
+def test_cache_key_ignores_driver_order_and_config_defaults():
+    drivers = [{'name': 'Ana', 'address': 'Pajaritos 100'}, {'name': 'Luis', 'address': 'Lumen 200'}]
+    a = {'drivers': drivers, 'config': {}}
+    b = {'drivers': list(reversed(drivers)), 'config': {'numVans': lf.DEFAULT_NUM_VANS, 'safetyMargin': 0.2}}
+    assert lf.generate_cache_key(a) == lf.generate_cache_key(b)
+
+
+def test_cache_key_keeps_string_contents():
+    a = {'drivers': [{'name': 'Ana', 'address': 'Pajaritos 100'}]}
+    b = {'drivers': [{'name': 'Ana ', 'address': 'Pajaritos 100'}]}
+    assert lf.generate_cache_key(a) != lf.generate_cache_key(b)
+
+
+def test_cache_key_ignores_format_and_profile():
+    data = {'drivers': [{'name': 'Ana'}]}
+    assert lf.generate_cache_key(data) == lf.generate_cache_key(dict(data, format='compact', profile=True))
+
+
+class TestCacheEvictionSchedule:
+    def test_first_put_scans_then_only_when_over_max(self):
+        schedule = lf.CacheEvictionSchedule(max_bytes=100, interval_seconds=3600)
+        assert schedule.added(10)
+        schedule.scanned(10)
+        assert not schedule.added(50)
+        assert schedule.estimated_bytes == 60
+        assert schedule.added(50)
+
+    def test_one_scan_at_a_time(self):
+        schedule = lf.CacheEvictionSchedule(max_bytes=100, interval_seconds=0)
+        assert schedule.added(10)
+        assert not schedule.added(10)
+        schedule.scanned(None)  # Failed scan: estimate kept, next put may scan again
+        assert schedule.added(10)
+
+    def test_interval_forces_rescan(self):
+        schedule = lf.CacheEvictionSchedule(max_bytes=100, interval_seconds=0)
+        assert schedule.added(1)
+        schedule.scanned(1)
+        assert schedule.added(1)
+
+
+class TestLocalCacheBackend:
+    def test_round_trip_and_delete(self, tmp_path):
+        backend = lf.LocalCacheBackend(tmp_path, max_bytes=10_000, ttl_seconds=3600)
+        assert backend.get('k') is None
+        backend.put('k', b'blob')
+        assert backend.get('k') == b'blob'
+        backend.delete('k')
+        assert backend.get('k') is None
+
+    def test_put_does_not_rescan_under_estimate(self, tmp_path, monkeypatch):
+        backend = lf.LocalCacheBackend(tmp_path, max_bytes=10_000, ttl_seconds=3600, evict_interval_seconds=3600)
+        scans = []
+        original = backend.evict
+        monkeypatch.setattr(backend, 'evict', lambda: scans.append(1) or original())
+        for i in range(20):
+            backend.put(f'k{i}', b'x' * 10)
+        assert len(scans) == 1
+
+    def test_evicts_least_recently_used_down_to_low_water(self, tmp_path):
+        backend = lf.LocalCacheBackend(tmp_path, max_bytes=1000, ttl_seconds=3600, evict_interval_seconds=3600)
+        now = time.time()
+        for i in range(5):
+            backend.put(f'k{i}', b'x' * 200)
+            os.utime(backend._path(f'k{i}'), (now - 100 + i, now - 100 + i))
+        os.utime(backend._path('k0'), (now, now))  # Recently read: kept
+        backend.put('k5', b'x' * 200)  # 1200 bytes > max: evict to 900 (low water)
+
+        kept = sorted(p.name.split('.')[0] for p in tmp_path.glob('*.json.gz'))
+        assert kept == ['k0', 'k3', 'k4', 'k5']
+        assert backend.schedule.estimated_bytes == 800
+
+    def test_expired_entries_dropped_on_scan(self, tmp_path):
+        backend = lf.LocalCacheBackend(tmp_path, max_bytes=10_000, ttl_seconds=60, evict_interval_seconds=0)
+        backend.put('old', b'x')
+        os.utime(backend._path('old'), (time.time() - 120, time.time() - 120))
+        backend.put('new', b'y')
+        assert backend.get('old') is None
+        assert backend.get('new') == b'y'
+
+    def test_response_round_trip(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(lf, 'ENABLE_CACHE', True)
+        monkeypatch.setattr(lf, '_cache_backend', lf.LocalCacheBackend(tmp_path, 10_000, 3600))
+        lf.save_response_to_cache('key', {'success': True, 'vans': []})
+        assert lf.get_cached_response('key') == {'success': True, 'vans': []}
+        assert gzip.decompress((tmp_path / 'key.json.gz').read_bytes()).startswith(b'{')
+
+
+@pytest.fixture(scope='module')
+def s3_endpoint():
+    moto_server = pytest.importorskip('moto.server')
+    server = moto_server.ThreadedMotoServer(ip_address='127.0.0.1', port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def s3_backend(s3_endpoint, monkeypatch):
+    import boto3
+
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    bucket = f"cache-{time.monotonic_ns()}"
+    boto3.client('s3', endpoint_url=s3_endpoint).create_bucket(Bucket=bucket)
+
+    def make(**kwargs):
+        kwargs.setdefault('evict_interval_seconds', 3600)
+        kwargs.setdefault('touch_interval_seconds', 3600)
+        return lf.S3CacheBackend(bucket, 'cache/', endpoint_url=s3_endpoint, **kwargs)
+    return make
+
+
+class TestS3CacheBackend:
+    def test_round_trip_and_delete(self, s3_backend):
+        backend = s3_backend(max_bytes=10_000, ttl_seconds=3600)
+        assert backend.get('k') is None
+        backend.put('k', b'blob')
+        assert backend.get('k') == b'blob'
+        backend.delete('k')
+        assert backend.get('k') is None
+
+    def test_hits_only_refresh_stale_entries(self, s3_backend, monkeypatch):
+        copies = []
+        for touch_interval, expected in ((3600, 0), (0, 1)):
+            backend = s3_backend(max_bytes=10_000, ttl_seconds=3600, touch_interval_seconds=touch_interval)
+            original = backend.client.copy_object
+            monkeypatch.setattr(backend.client, 'copy_object', lambda **kw: copies.append(kw) or original(**kw))
+            backend.put('k', b'blob')
+            copies.clear()
+            assert backend.get('k') == b'blob'
+            assert len(copies) == expected
+
+    def test_put_lists_prefix_only_when_due(self, s3_backend, monkeypatch):
+        backend = s3_backend(max_bytes=10_000, ttl_seconds=3600)
+        listings = []
+        original = backend.client.get_paginator
+        monkeypatch.setattr(backend.client, 'get_paginator', lambda name: listings.append(name) or original(name))
+        for i in range(10):
+            backend.put(f'k{i}', b'x' * 10)
+        assert listings == ['list_objects_v2']
+
+    def test_evicts_oldest_down_to_low_water(self, s3_backend):
+        backend = s3_backend(max_bytes=1000, ttl_seconds=3600)
+        for i in range(5):
+            backend.put(f'k{i}', b'x' * 200)
+            time.sleep(1.05)  # LastModified has one-second resolution
+        backend.put('k5', b'x' * 200)
+
+        listed = backend.client.list_objects_v2(Bucket=backend.bucket, Prefix=backend.prefix)
+        kept = sorted(obj['Key'] for obj in listed.get('Contents', []))
+        assert kept == ['cache/k2.json.gz', 'cache/k3.json.gz', 'cache/k4.json.gz', 'cache/k5.json.gz']
+        assert backend.schedule.estimated_bytes == 800
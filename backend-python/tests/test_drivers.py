@@ -0,0 +1,96 @@
+"""Columnar driver store: DriverTable columns and DriverRecord views"""
+
+import numpy as np
+import pytest
+
+import lambda_function as lf
+
+
+def driver(name, lat=-33.45, lng=-70.65, terminal='Terminal Aeropuerto T1', minutes=360, **fields):
+    return {'name': name, 'coordinates': {'lat': lat, 'lng': lng}, 'terminal': terminal,
+            'presentation_time_minutes': minutes, **fields}
+
+
+def resolved(name, pickup, travel, **fields):
+    """Driver as the pipeline resolves it (field order of process_driver)"""
+    return driver(name, distance_to_terminal_km=12.5, travel_time_minutes=travel, presentation_time='06:00',
+                  pickup_time_latest='05:40', pickup_time_latest_minutes=pickup, **fields)
+
+
+def test_to_dict_round_trip():
+    drivers = [
+        resolved('Ana', 340.0, 20.0, address='Pajaritos 100, Maipú'),
+        resolved('Luis', 0, 25),  # Clamped pickup, Google duration in whole minutes
+        resolved('Eva', 335.5, 24.5, needs_review=True, notes=None),
+    ]
+    table = lf.DriverTable(drivers)
+    for index, original in enumerate(drivers):
+        copy = table.to_dict(index)
+        assert copy == original
+        assert list(copy) == list(original)
+        assert [type(value) for value in copy.values()] == [type(value) for value in original.values()]
+        assert table.records()[index].to_dict() == original
+
+
+def test_column_types():
+    table = lf.DriverTable([
+        driver('Ana', minutes=360, seats=1, km=12.5, mixed=3, flag=True, label='a'),
+        driver('Luis', minutes=420, seats=2, km=8.0, mixed=4.5, flag=False, label=None),
+    ])
+    assert table.columns['presentation_time_minutes'].dtype == np.int64
+    assert table.columns['seats'].dtype == np.int64
+    assert table.columns['km'].dtype == float
+    assert table.columns['mixed'].dtype == float
+    assert table.columns['flag'] == [True, False]  # bool is not an int column
+    assert table.columns['label'] == ['a', None]
+    assert table.coordinates.shape == (2, 2)
+
+    first, second = table.records()
+    assert type(first['seats']) is int and type(first['km']) is float
+    assert type(first['mixed']) is int and type(second['mixed']) is float
+    assert first['flag'] is True and second['label'] is None
+    assert first['coordinates'] == {'lat': -33.45, 'lng': -70.65}
+
+
+def test_missing_fields_raise_key_error():
+    table = lf.DriverTable([driver('Ana', address='Pajaritos 100'), driver('Luis')])
+    ana, luis = table.records()
+    assert ana['address'] == 'Pajaritos 100'
+    with pytest.raises(KeyError):
+        luis['address']
+    with pytest.raises(KeyError):
+        ana['not_a_field']
+    assert luis.get('address') is None and luis.get('address', 'N/A') == 'N/A'
+    assert 'address' not in luis.to_dict()
+    assert list(table.to_dict(1)) == ['name', 'coordinates', 'terminal', 'presentation_time_minutes']
+
+
+def test_sorted_by_is_stable_like_sorted():
+    minutes = [420, 360, 420, 300, 360, 420, 300]
+    drivers = [driver(f'D{i}', minutes=m) for i, m in enumerate(minutes)]
+    table = lf.DriverTable(drivers)
+    order = table.sorted_by('presentation_time_minutes')
+    expected = sorted(range(len(drivers)), key=lambda i: drivers[i]['presentation_time_minutes'])
+    assert order.tolist() == expected
+    assert [record['name'] for record in table.records(order)] == [d['name'] for d in
+                                                                   sorted(drivers, key=lambda d: d['presentation_time_minutes'])]
+
+
+def test_group_by_terminal_keeps_first_appearance_order():
+    terminals = ['T2', 'T1', 'T2', None, 'T1']
+    drivers = [driver(f'D{i}', terminal=t) for i, t in enumerate(terminals)]
+    del drivers[3]['terminal']  # Defaults to Terminal Aeropuerto T1
+    table = lf.DriverTable(drivers)
+
+    groups = table.group_by_terminal(np.array([4, 3, 2, 1, 0]))
+    assert list(groups) == ['T1', 'Terminal Aeropuerto T1', 'T2']
+    assert {name: indices.tolist() for name, indices in groups.items()} == {
+        'T1': [4, 1], 'Terminal Aeropuerto T1': [3], 'T2': [2, 0]}
+
+
+def test_records_are_lightweight_views():
+    table = lf.DriverTable([driver('Ana'), driver('Luis')])
+    record = table.records([1])[0]
+    assert not hasattr(record, '__dict__')
+    assert record.table is table and record.index == 1
+    assert lf.driver_dicts([record, {'name': 'Plain'}]) == [table.to_dict(1), {'name': 'Plain'}]
@@ -0,0 +1,91 @@
+"""Plan export: stops, CSV and xlsx streams, request validation"""
+
+import csv
+import io
+
+import pytest
+
+import lambda_function as lf
+
+
+def stop(name, lat, **fields):
+    return dict({'name': name, 'code': f'C-{name}', 'address': f'{name} 100', 'terminal': 'Terminal Test',
+                 'presentation_time': '06:00', 'coordinates': {'lat': lat, 'lng': -70.6}}, **fields)
+
+
+def result():
+    return {
+        'success': True,
+        'vans': [
+            {'name': 'Van 1', 'destination': 'Terminal Test', 'route': [],
+             'drivers': [stop('Ana', -33.41, pickup_time_latest='05:40'), stop('Íñigo', -33.42)]},
+            {'name': 'Van 2', 'destination': 'Terminal Test', 'route': [],
+             'drivers': [stop('Luis', -33.43, pickup_location='Plaza')]},
+        ]
+    }
+
+
+def read_csv(chunks):
+    text = b''.join(chunks).decode('utf-8-sig')
+    return list(csv.reader(io.StringIO(text), delimiter=lf.EXPORT_CSV_DELIMITER))
+
+
+def test_stops_in_route_order():
+    stops = [(van['name'], order, driver['name']) for van, order, driver in lf.iter_plan_stops(result())]
+    assert stops == [('Van 1', 1, 'Ana'), ('Van 1', 2, 'Íñigo'), ('Van 2', 1, 'Luis')]
+
+
+def test_compact_result_expands_to_the_same_stops():
+    full = list(lf.iter_plan_stops(result()))
+    compact = list(lf.iter_plan_stops(lf.compact_optimize_result(result())))
+    assert [lf.export_row(*s) for s in compact] == [lf.export_row(*s) for s in full]
+    assert compact[2][2]['pickup_location'] == 'Plaza'
+
+
+def test_csv_header_rows_and_bom():
+    chunks = list(lf.iter_export_csv(result()))
+    assert chunks[0].startswith(b'\xef\xbb\xbf')
+    rows = read_csv(chunks)
+    assert rows[0] == lf.EXPORT_COLUMNS
+    assert rows[1][:4] == ['Van 1', '1', 'C-Ana', 'Ana']
+    assert rows[1][lf.EXPORT_COLUMNS.index('Hora de recogida')] == '05:40'
+    assert rows[2][3] == 'Íñigo'
+    assert len(rows) == 4
+
+
+def test_csv_chunks_carry_bom_once():
+    chunks = list(lf.iter_export_csv(result(), chunk_rows=1))
+    assert len(chunks) == 3
+    assert all(not chunk.startswith(b'\xef\xbb\xbf') for chunk in chunks[1:])
+    assert read_csv(chunks) == read_csv(lf.iter_export_csv(result()))
+
+
+def test_csv_without_stops_is_just_the_header():
+    rows = read_csv(lf.iter_export_csv({'vans': [{'name': 'Van 1', 'drivers': []}]}))
+    assert rows == [lf.EXPORT_COLUMNS]
+
+
+def test_xlsx_opens_with_the_same_rows():
+    openpyxl = pytest.importorskip('openpyxl')
+    content = b''.join(lf.iter_export_xlsx(result(), chunk_bytes=512))
+    sheet = openpyxl.load_workbook(io.BytesIO(content), read_only=True)['Rutas']
+    rows = [list(row) for row in sheet.iter_rows(values_only=True)]
+    assert rows[0] == lf.EXPORT_COLUMNS
+    assert rows[1:] == [lf.export_row(*s) for s in lf.iter_plan_stops(result())]
+
+
+def test_parse_export_request():
+    data = result()
+    assert lf.parse_export_request(data) == (data, 'xlsx')
+    assert lf.parse_export_request({'result': data}, {'format': 'csv'}) == (data, 'csv')
+
+
+@pytest.mark.parametrize('data, query', [
+    ({'vans': [{'drivers': []}]}, {'format': 'pdf'}),
+    ({'vans': []}, None),
+    ([], None),
+    ({'format': 'compact', 'vans': [{'drivers': [0]}]}, None),
+])
+def test_parse_export_request_rejects(data, query):
+    with pytest.raises(ValueError):
+        lf.parse_export_request(data, query)
@@ -0,0 +1,92 @@
+"""Hedged geocoding: strategy 1 on the caller's thread, speculative strategies 2 and 3 on the hedge pool"""
+
+import threading
+import time
+
+import pytest
+
+import lambda_function as lf
+
+STREET = ({'lat': -33.51, 'lng': -70.75}, 'street_only')
+CENTER = ({'lat': -33.50, 'lng': -70.76}, 'comuna_center')
+
+
+@pytest.fixture
+def strategies(monkeypatch):
+    """Fake strategies recording the thread each one ran on; tests set their delay and answer"""
+    monkeypatch.setattr(lf, 'GEOCODE_HEDGE_DELAY_MS', 20)
+    ran = {}
+    plan = {'full': (0, None), 'street': (0, STREET), 'center': (0, CENTER)}
+
+    def fake(name):
+        def strategy(*args):
+            ran[name] = threading.current_thread()
+            delay, answer = plan[name]
+            time.sleep(delay)
+            return answer
+        return strategy
+
+    monkeypatch.setattr(lf, 'geocode_full_address', fake('full'))
+    monkeypatch.setattr(lf, 'geocode_street_only', fake('street'))
+    monkeypatch.setattr(lf, 'geocode_comuna_center', fake('center'))
+    return plan, ran
+
+
+def budget():
+    return lf.GoogleCallBudget(time.monotonic() + 30)
+
+
+def test_valid_first_strategy_sends_nothing_else(strategies):
+    plan, ran = strategies
+    plan['full'] = (0, ({'lat': -33.5, 'lng': -70.7}, 'full_address'))
+    b = budget()
+    assert lf.hedged_geocode('Pajaritos 100, Maipú', 'Pajaritos', 'Maipú', b)[1] == 'full_address'
+    assert ran == {'full': threading.current_thread()}
+    assert b.hedged_calls == 0
+
+
+def test_slow_first_strategy_is_raced_from_the_pool(strategies):
+    plan, ran = strategies
+    plan['full'] = (0.2, None)
+    b = budget()
+    assert lf.hedged_geocode('Pajaritos 100, Maipú', 'Pajaritos', 'Maipú', b) == STREET
+    assert ran['full'] is threading.current_thread()
+    assert ran['street'].name.startswith('geocode-hedge')
+    assert b.hedged_calls == 1  # Strategy 2 was needed; strategy 3 was sent and wasted
+
+
+def test_ambiguous_first_strategy_runs_the_second_here(strategies):
+    plan, ran = strategies
+    plan['street'] = (0.05, None)
+    b = budget()
+    assert lf.hedged_geocode('Pajaritos 100, Maipú', 'Pajaritos', 'Maipú', b) == CENTER
+    assert ran['full'] is ran['street'] is threading.current_thread()
+    assert ran['center'].name.startswith('geocode-hedge')
+    assert b.hedged_calls == 0
+
+
+def test_busy_pool_drops_speculative_requests(strategies, monkeypatch):
+    plan, ran = strategies
+    plan['full'] = (0.1, None)
+    busy = threading.BoundedSemaphore(1)
+    busy.acquire()
+    monkeypatch.setattr(lf, '_hedge_slots', busy)
+
+    b = budget()
+    assert lf.hedged_geocode('Pajaritos 100, Maipú', 'Pajaritos', 'Maipú', b) == STREET
+    assert set(ran) == {'full', 'street'}
+    assert all(thread is threading.current_thread() for thread in ran.values())
+    assert b.hedged_calls == 0  # Dropped requests give their reservation back
+
+
+def test_hedge_pool_threads_return_to_the_pool(strategies):
+    plan, _ = strategies
+    plan['full'] = (0.1, None)
+    for _ in range(3):
+        lf.hedged_geocode('Pajaritos 100, Maipú', 'Pajaritos', 'Maipú', budget())
+    time.sleep(0.05)
+    slots = [lf._hedge_slots.acquire(blocking=False) for _ in range(lf.GEOCODE_HEDGE_WORKERS)]
+    for taken in slots:
+        if taken:
+            lf._hedge_slots.release()
+    assert all(slots)
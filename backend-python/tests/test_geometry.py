@@ -0,0 +1,65 @@
+"""Encoded polylines and Douglas-Peucker simplification"""
+
+import math
+
+import pytest
+
+import lambda_function as lf
+
+# Example from Google's encoded polyline algorithm documentation
+GOOGLE_POINTS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+GOOGLE_ENCODED = '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+
+
+def as_dicts(points):
+    return [{'lat': lat, 'lng': lng} for lat, lng in points]
+
+
+def test_encode_matches_google_reference():
+    assert lf.encode_polyline(as_dicts(GOOGLE_POINTS)) == GOOGLE_ENCODED
+
+
+def test_decode_matches_google_reference():
+    assert lf.decode_polyline(GOOGLE_ENCODED) == GOOGLE_POINTS
+
+
+@pytest.mark.parametrize('precision', [5, 6])
+def test_round_trip_keeps_precision(precision):
+    points = [(-33.4569123, -70.6482771), (-33.4570001, -70.6401234), (-33.5123456, -70.7561234)]
+    decoded = lf.decode_polyline(lf.encode_polyline(as_dicts(points), precision), precision)
+    assert all(math.isclose(a, b, abs_tol=10 ** -precision) for p, q in zip(points, decoded) for a, b in zip(p, q))
+
+
+def test_empty_polyline():
+    assert lf.encode_polyline([]) == ''
+    assert lf.decode_polyline('') == []
+
+
+def test_simplify_drops_collinear_points_and_keeps_ends():
+    line = [(-33.45, -70.70 + i * 0.001) for i in range(11)]
+    assert lf.simplify_polyline(line, tolerance_meters=1.0) == [line[0], line[-1]]
+
+
+def test_simplify_keeps_corners_above_tolerance():
+    corner = [(-33.45, -70.70), (-33.45, -70.69), (-33.44, -70.69)]
+    assert lf.simplify_polyline(corner, tolerance_meters=10.0) == corner
+
+
+def test_simplify_drops_deviations_below_tolerance():
+    # ~1.1 m off the straight line
+    wiggle = [(-33.45, -70.70), (-33.44999, -70.695), (-33.45, -70.69)]
+    assert lf.simplify_polyline(wiggle, tolerance_meters=5.0) == [wiggle[0], wiggle[-1]]
+    assert lf.simplify_polyline(wiggle, tolerance_meters=0.5) == wiggle
+
+
+def test_simplify_short_or_disabled():
+    points = [(-33.45, -70.70), (-33.46, -70.71)]
+    assert lf.simplify_polyline(points, 10.0) == points
+    line = [(-33.45, -70.70 + i * 0.001) for i in range(5)]
+    assert lf.simplify_polyline(line, 0) == line
+
+
+def test_tolerance_halves_per_zoom_level():
+    low, high = (lf.simplification_tolerance_meters(zoom, -33.45) for zoom in (12, 13))
+    assert math.isclose(low, 2 * high)
+    assert 20 < low < 40  # ~32 m per pixel at zoom 12 in Santiago
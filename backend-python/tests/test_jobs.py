@@ -0,0 +1,102 @@
+"""Job queue leases: heartbeats, expiry, requeue and stale results"""
+
+import contextlib
+import contextvars
+import io
+import sqlite3
+import threading
+import time
+
+import jobs
+import lambda_function as lf
+
+
+def make_store(tmp_path):
+    return jobs.JobStore(tmp_path / 'jobs.sqlite3')
+
+
+def expire_lease(store, job_id, seconds_ago=3600):
+    with sqlite3.connect(store.path) as conn:
+        conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time() - seconds_ago, job_id))
+
+
+def test_claim_takes_oldest_job_with_a_fresh_lease(tmp_path):
+    store = make_store(tmp_path)
+    first = store.submit({'drivers': [1]})
+    store.submit({'drivers': [2]})
+
+    job_id, payload = store.claim('w1')
+    assert (job_id, payload) == (first, {'drivers': [1]})
+    assert store.get(first)['status'] == 'running'
+    assert store.requeue_expired(lease_seconds=60) == []
+
+
+def test_heartbeat_only_renews_the_holders_lease(tmp_path):
+    store = make_store(tmp_path)
+    job_id = store.submit({})
+    store.claim('w1')
+    assert store.heartbeat(job_id, 'w1')
+    assert not store.heartbeat(job_id, 'w2')
+
+
+def test_expired_lease_is_requeued_and_late_result_discarded(tmp_path):
+    store = make_store(tmp_path)
+    job_id = store.submit({})
+    store.claim('w1')
+    expire_lease(store, job_id)
+
+    assert store.requeue_expired(lease_seconds=60) == [(job_id, 'w1')]
+    assert store.get(job_id)['status'] == 'queued'
+    assert not store.heartbeat(job_id, 'w1')
+    assert not store.finish(job_id, 200, '{}', worker='w1')
+
+    store.claim('w2')
+    assert store.finish(job_id, 200, '{"ok": true}', worker='w2')
+    assert store.result(job_id) == ('succeeded', 200, '{"ok": true}')
+
+
+def test_job_fails_after_max_attempts(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_MAX_ATTEMPTS', 2)
+    store = make_store(tmp_path)
+    job_id = store.submit({})
+    for worker in ('w1', 'w2'):
+        store.claim(worker)
+        expire_lease(store, job_id)
+        store.requeue_expired(lease_seconds=60)
+
+    status = store.get(job_id)
+    assert status['status'] == 'failed'
+    assert status['attempts'] == 2
+
+
+def test_queue_created_before_leases_is_migrated(tmp_path):
+    path = tmp_path / 'jobs.sqlite3'
+    with sqlite3.connect(path) as conn:
+        conn.executescript(jobs.SCHEMA.replace('    heartbeat_at REAL,\n', ''))
+        conn.execute(
+            "INSERT INTO jobs (id, status, request, worker, attempts, created_at, started_at) "
+            "VALUES ('old', 'running', '{}', 'host:123', 1, ?, ?)",
+            (time.time() - 7200, time.time() - 7200)
+        )
+
+    store = jobs.JobStore(path)
+    assert store.requeue_expired(lease_seconds=60) == [('old', 'host:123')]
+    assert store.get('old')['status'] == 'queued'
+
+
+def test_heartbeat_warnings_carry_the_job_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_HEARTBEAT_SECONDS', 0.01)
+    monkeypatch.setattr(jobs, 'JOB_MAX_RUN_SECONDS', 0)
+    store = make_store(tmp_path)
+    job_id = store.submit({})
+    store.claim('w1')
+
+    captured = io.StringIO()
+    with contextlib.redirect_stdout(captured):
+        context = contextvars.copy_context()
+        context.run(lf.begin_request_log, job_id)
+        heartbeat = threading.Thread(target=context.run, args=(jobs.renew_lease, store, job_id, 'w1', threading.Event()))
+        heartbeat.start()
+        heartbeat.join(5)
+        lf.flush_logs()
+    assert f'WARNING [{job_id}] Job running for more than 0s' in captured.getvalue()
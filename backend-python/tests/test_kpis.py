@@ -0,0 +1,118 @@
+"""Plan KPIs: group_summary, haversine_km and plan_kpis"""
+
+import json
+import math
+
+import numpy as np
+import pytest
+
+import lambda_function as lf
+
+TERMINAL = {'lat': -33.42, 'lng': -70.60}
+LEG_KM = 0.01 * lf.KM_PER_DEGREE  # 0.01 degrees of latitude
+
+
+def driver(lat, wave=360, terminal='Terminal Test'):
+    return {'coordinates': {'lat': lat, 'lng': -70.60}, 'terminal': terminal, 'presentation_time_minutes': wave}
+
+
+def plan():
+    return [
+        {'name': 'Van 1', 'destination': 'Terminal Test', 'capacity': 10,
+         'drivers': [driver(-33.40), driver(-33.41)]},
+        {'name': 'Van 2', 'destination': 'Terminal Test', 'capacity': 10,
+         'drivers': [driver(-33.50, wave=420)]},
+    ]
+
+
+def test_group_summary_nearest_rank():
+    summary = lf.group_summary([3.0, 1.0, 2.0, 10.0], [0, 0, 0, 1], 3)
+    assert list(summary['count']) == [3, 1, 0]
+    assert summary['mean'][0] == 2.0 and summary['mean'][1] == 10.0
+    assert (summary['min'][0], summary['p50'][0], summary['p90'][0], summary['max'][0]) == (1.0, 2.0, 3.0, 3.0)
+    assert summary['p50'][1] == 10.0
+    assert all(math.isnan(summary[stat][2]) for stat in ('mean', 'min', 'p50', 'max'))
+
+
+def test_group_summary_empty():
+    summary = lf.group_summary([], [], 2)
+    assert list(summary['count']) == [0, 0]
+    assert np.isnan(summary['p90']).all()
+
+
+def test_haversine_km_along_a_meridian():
+    distances = lf.haversine_km(np.array([[-33.40, -70.60], [-33.45, -70.65]]),
+                                np.array([[-33.41, -70.60], [-33.45, -70.65]]))
+    assert distances[0] == pytest.approx(LEG_KM, rel=1e-6)
+    assert distances[1] == 0.0
+
+
+def test_plan_kpis_distances_and_savings():
+    kpis = lf.plan_kpis(plan(), lambda terminal: TERMINAL, safety_buffer=1.2)
+    summary = kpis['summary']
+
+    plan_km = 2 * LEG_KM + 8 * LEG_KM
+    naive_km = (2 * LEG_KM + LEG_KM) + 8 * LEG_KM
+    assert summary['distanceKm'] == round(plan_km, 1)
+    assert summary['naiveDistanceKm'] == round(naive_km, 1)
+    assert summary['distanceSavedPercent'] == round((naive_km - plan_km) / naive_km * 100, 1)
+    assert summary['vans'] == 2
+    assert summary['drivers'] == 3
+    assert summary['emptySeats'] == 17
+    assert summary['utilizationPercent'] == 15.0
+
+
+def test_plan_kpis_ride_and_vehicle_time():
+    kpis = lf.plan_kpis(plan(), lambda terminal: TERMINAL, safety_buffer=1.2)
+    def minutes(km):
+        return km / lf.CITY_SPEED_KMH * 60 * 1.2
+
+    first_van = kpis['byVan'][0]
+    # First pickup rides both legs and waits for one more pickup
+    assert first_van['rideMinutes']['max'] == round(minutes(2 * LEG_KM) + lf.PICKUP_TIME_MINUTES, 1)
+    assert first_van['vehicleHours'] == round((minutes(2 * LEG_KM) + lf.PICKUP_TIME_MINUTES) / 60, 1)
+    assert kpis['summary']['vehicleHoursSaved'] is not None
+
+
+def test_plan_kpis_breakdowns():
+    kpis = lf.plan_kpis(plan(), lambda terminal: TERMINAL)
+    assert [wave['drivers'] for wave in kpis['byWave']] == [2, 1]
+    assert len(kpis['byTerminal']) == 1 and kpis['byTerminal'][0]['vehicles'] == 2
+    assert [van['wave'] for van in kpis['byVan']] == ['06:00', '07:00']
+    assert sum(kpis['utilizationHistogram'][i]['vans'] for i in range(len(kpis['utilizationHistogram']))) == 2
+
+
+def test_plan_kpis_asks_each_terminal_once():
+    asked = []
+    lf.plan_kpis(plan(), lambda terminal: asked.append(terminal) or TERMINAL)
+    assert asked == ['Terminal Test']
+
+
+def test_parse_kpi_request_rejects_bad_coordinates():
+    vans = plan()
+    vans[0]['drivers'][0]['coordinates'] = {'lat': 'north'}
+    with pytest.raises(ValueError):
+        lf.parse_kpi_request({'vans': vans})
+    with pytest.raises(ValueError):
+        lf.parse_kpi_request({'vans': []})
+
+
+@pytest.mark.parametrize('data', [[], 'vans', None, {'vans': plan(), 'config': []}])
+def test_parse_kpi_request_rejects_non_objects(data):
+    with pytest.raises(ValueError):
+        lf.parse_kpi_request(data)
+
+
+@pytest.mark.parametrize('body', ['{"vans": [', '[]', 'null'])
+def test_kpi_handler_answers_bad_bodies_with_400(body):
+    assert lf.handle_kpis({'body': body})['statusCode'] == 400
+
+
+def test_kpi_request_uses_the_optimization_config():
+    config = {'numVans': None, 'safetyMargin': 0.5, 'terminals': {'Terminal Test': TERMINAL}}
+    response = lf.handle_kpis({'body': json.dumps({'vans': plan(), 'config': config})})
+    assert response['statusCode'] == 200
+    body = json.loads(response['body'])
+    expected = lf.plan_kpis(plan(), lambda terminal: TERMINAL, safety_buffer=1.5)
+    assert body['byVan'] == json.loads(json.dumps(expected['byVan']))
+    assert body['timings']['googleCalls'] == []
@@ -0,0 +1,14 @@
+"""Log output follows sys.stdout, so scripts can silence the pipeline with redirect_stdout"""
+
+import contextlib
+import io
+
+import lambda_function as lf
+
+
+def test_records_go_to_the_redirected_stdout():
+    captured = io.StringIO()
+    with contextlib.redirect_stdout(captured):
+        lf.logger.warning("Redirected record")
+        lf.flush_logs()
+    assert 'Redirected record' in captured.getvalue()
@@ -0,0 +1,133 @@
+"""Prometheus metrics: counters after an optimize run, snapshots shared across processes"""
+
+import json
+import re
+import threading
+import time
+import types
+
+import pytest
+
+import jobs
+import lambda_function as lf
+
+
+class UnavailableGoogle:
+    """urllib3 stand-in answering every Google Maps call with HTTP 503"""
+
+    def request(self, method, url, **kwargs):
+        return types.SimpleNamespace(status=503, data=b'')
+
+
+def roster(n):
+    return [{'name': f'D{i}', 'address': f'Pajaritos {100 + i}, Maipú', 'terminal': 'Terminal Aeropuerto T1',
+             'presentation_time': '06:00'} for i in range(n)]
+
+
+def samples(text, metric):
+    """{labels: value} of one metric in Prometheus text"""
+    found = {}
+    for labels, value in re.findall(rf'^route_optimizer_{metric}(?:{{(.*)}})? (\S+)$', text, re.MULTILINE):
+        found[labels] = float(value)
+    return found
+
+
+@pytest.fixture
+def registry(monkeypatch, tmp_path):
+    registry = lf.MetricsRegistry(lf.METRICS_PREFIX, tmp_path / 'metrics')
+    monkeypatch.setattr(lf, 'metrics', registry)
+    return registry
+
+
+def test_optimize_run_is_counted(registry, monkeypatch, tmp_path):
+    monkeypatch.setattr(lf, 'ENABLE_CACHE', True)
+    monkeypatch.setattr(lf, '_cache_backend', lf.LocalCacheBackend(tmp_path / 'cache', 10_000_000, 3600))
+    monkeypatch.setattr(lf, 'GOOGLE_MAPS_API_KEY', 'test-key')
+    monkeypatch.setattr(lf, 'get_http', lambda: UnavailableGoogle())
+    monkeypatch.setattr(lf, 'stage_memo', lf.StageMemo(1000))
+    monkeypatch.setattr(lf, 'ROUTE_SOLVER_TIME_LIMIT_SECONDS', 0.1)
+
+    response = lf.handle_optimize_request({'drivers': roster(6), 'config': {'numVans': 2}})
+    assert response['statusCode'] == 200
+    body = json.loads(response['body'])
+    text = lf.handle_metrics()['body']
+
+    google = samples(text, 'google_requests_total')
+    assert google and all('api="geocode",status="HTTP_503"' in labels for labels in google)
+    assert sum(google.values()) == sum(call['count'] for call in body['timings']['googleCalls']) > 0
+    assert samples(text, 'google_request_seconds_count') == {'api="geocode"': sum(google.values())}
+
+    cache = samples(text, 'cache_requests_total')
+    assert cache == {'cache="response",result="miss"': 1, 'cache="geocode",result="miss"': 6,
+                     'cache="travelTimes",result="miss"': 6, 'cache="clustering",result="miss"': 1,
+                     'cache="routing",result="miss"': 2}
+
+    solves = samples(text, 'solver_runs_total')
+    assert sum(solves.values()) == body['timings']['solver']['runs'] == 2
+    assert samples(text, 'optimizations_total') == {'outcome="success"': 1}
+    assert samples(text, 'solver_seconds_count') == {'': 2}
+
+
+def test_snapshots_of_other_processes_are_added(registry, tmp_path):
+    worker = lf.MetricsRegistry(lf.METRICS_PREFIX, tmp_path / 'metrics')  # Another process's registry
+    worker.inc('solver_runs_total', 3, outcome='optimal')
+    worker.observe('solver_seconds', 1.5)
+    worker.write_snapshot()
+
+    registry.inc('solver_runs_total', 2, outcome='optimal')
+    registry.inc('solver_runs_total', outcome='fallback')
+    registry.observe('solver_seconds', 0.5)
+    registry.write_snapshot()  # Its own snapshot is not counted twice
+
+    text = registry.render()
+    assert samples(text, 'solver_runs_total') == {'outcome="optimal"': 5, 'outcome="fallback"': 1}
+    assert samples(text, 'solver_seconds_count') == {'': 2}
+    assert samples(text, 'solver_seconds_sum') == {'': 2.0}
+    assert len(list((tmp_path / 'metrics').glob('*.json'))) == 2
+
+
+def test_snapshots_are_kept_after_the_process_exits(registry, tmp_path):
+    exited = lf.MetricsRegistry(lf.METRICS_PREFIX, tmp_path / 'metrics')
+    exited.inc('optimizations_total', 4, outcome='success')
+    exited.write_snapshot()
+    del exited
+    assert samples(registry.render(), 'optimizations_total') == {'outcome="success"': 4}
+
+
+def test_without_a_directory_only_this_process_is_reported(tmp_path):
+    registry = lf.MetricsRegistry(lf.METRICS_PREFIX)
+    registry.inc('optimizations_total', outcome='success')
+    registry.write_snapshot()
+    assert samples(registry.render(), 'optimizations_total') == {'outcome="success"': 1}
+    assert not list(tmp_path.iterdir())
+
+
+def test_server_requests_save_a_snapshot(registry, tmp_path):
+    app = pytest.importorskip('app')
+    registry.inc('optimizations_total', outcome='success')
+    response = app.app.test_client().get('/api/health')
+    response.close()
+    snapshots = list((tmp_path / 'metrics').glob('*.json'))
+    assert len(snapshots) == 1
+    assert json.loads(snapshots[0].read_text())['counters'] == [['optimizations_total', [['outcome', 'success']], 1]]
+
+
+def test_job_workers_save_a_snapshot_after_each_job(registry, tmp_path, monkeypatch):
+    monkeypatch.setattr(lf, 'stage_memo', lf.StageMemo(1000))
+    monkeypatch.setattr(lf, 'ROUTE_SOLVER_TIME_LIMIT_SECONDS', 0.1)
+    store = jobs.JobStore(tmp_path / 'jobs.sqlite3')
+    job_id = store.submit({'drivers': roster(3), 'config': {'numVans': 1}})
+    stop = threading.Event()
+    worker = threading.Thread(target=jobs.worker_main, args=(store.path, stop, 'w1'))
+    worker.start()
+    try:
+        deadline = time.monotonic() + 10
+        while store.get(job_id)['status'] in ('queued', 'running') and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        stop.set()
+        worker.join(10)
+
+    snapshots = list((tmp_path / 'metrics').glob('*.json'))
+    assert store.get(job_id)['status'] == 'succeeded' and len(snapshots) == 1
+    assert ['optimizations_total', [['outcome', 'success']], 1] in json.loads(snapshots[0].read_text())['counters']
@@ -0,0 +1,137 @@
+"""Large-instance mode: roster partitioning and boundary repair"""
+
+import numpy as np
+import pytest
+
+import lambda_function as lf
+
+
+def roster(n, seed=7):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(-33.60, -33.35, n), rng.uniform(-70.80, -70.50, n)])
+
+
+def stop(lng, lat=-33.45):
+    return {'name': f'{lng}', 'coordinates': {'lat': lat, 'lng': lng}}
+
+
+@pytest.mark.parametrize('n, num_vans, max_drivers', [(1000, 100, 150), (157, 16, 40), (30, 5, 100), (0, 3, 10)])
+def test_partitions_cover_roster_once(n, num_vans, max_drivers):
+    partitions = lf.partition_roster(roster(n), num_vans, max_drivers)
+    positions = np.concatenate([p for p, _ in partitions]) if partitions else np.array([])
+    assert sorted(positions.tolist()) == list(range(n))
+    assert sum(vans for _, vans in partitions) == num_vans
+    assert all(len(p) <= max_drivers or vans < 2 for p, vans in partitions)
+
+
+def test_vans_follow_driver_share():
+    partitions = lf.partition_roster(roster(1000), 100, 150)
+    for positions, vans in partitions:
+        assert vans >= 1
+        assert abs(len(positions) / 1000 * 100 - vans) <= 2
+
+
+def test_partitions_are_spatially_separated():
+    # Two clusters far apart end up in different partitions
+    coordinates = np.vstack([roster(50) + [0, -1.0], roster(50, seed=8) + [0, 1.0]])
+    partitions = lf.partition_roster(coordinates, 2, 60)
+    assert [sorted(p.tolist()) for p, _ in partitions] == [list(range(50)), list(range(50, 100))]
+
+
+def test_boundary_stop_moves_to_closer_van():
+    straggler = stop(-70.649)
+    routes = [[0, [stop(-70.600), stop(-70.601), straggler], False],
+              [1, [stop(-70.650), stop(-70.651)], False]]
+    assert lf.repair_partition_boundaries(routes, van_capacity=10) == 1
+    assert straggler not in routes[0][1]
+    assert routes[1][1][0] is straggler
+
+
+def test_boundary_repair_respects_capacity():
+    routes = [[0, [stop(-70.600), stop(-70.601), stop(-70.649)], False],
+              [1, [stop(-70.650), stop(-70.651)], False]]
+    assert lf.repair_partition_boundaries(routes, van_capacity=2) == 0
+    assert [len(route) for _, route, _ in routes] == [3, 2]
+
+
+def test_boundary_repair_keeps_same_partition_vans():
+    routes = [[0, [stop(-70.600), stop(-70.601), stop(-70.649)], False],
+              [0, [stop(-70.650), stop(-70.651)], False]]
+    assert lf.repair_partition_boundaries(routes, van_capacity=10) == 0
+
+
+def test_boundary_repair_never_empties_a_van():
+    routes = [[0, [stop(-70.649)], False], [1, [stop(-70.650), stop(-70.651)], False]]
+    assert lf.repair_partition_boundaries(routes, van_capacity=10) == 0
+    assert len(routes[0][1]) == 1
+
+
+def test_large_instance_reports_a_raised_fleet(monkeypatch):
+    monkeypatch.setattr(lf, 'ROUTE_SOLVER_TIME_LIMIT_SECONDS', 0.1)
+    drivers = [{'name': f'D{i}', 'address': f'Calle {i}', 'terminal': 'Terminal Test', 'presentation_time': '06:00',
+                'coordinates': {'lat': lat, 'lng': lng}} for i, (lat, lng) in enumerate(roster(30))]
+    config = {'numVans': 2, 'vanCapacity': 10, 'largeInstance': True,
+              'terminals': {'Terminal Test': {'lat': -33.39, 'lng': -70.79}}}
+    result = lf.run_optimization_pipeline(drivers, config)
+
+    assert sum(1 for van in result['vans'] if van.get('is_van')) == 3
+    fleet = [issue for issue in result['geocodingIssues'] if 'fleet' in issue]
+    assert fleet[0]['fleet'] == {'terminal': 'Terminal Test', 'requestedVans': 2, 'usedVans': 3}
+    assert result['hasIssues']
+
+
+class RecordingSolver:
+    """SolverPortfolio stand-in solving in-process and recording each task"""
+
+    def __init__(self, free=True):
+        self.tasks = []
+        self.free = free
+
+    def solve(self, distance_matrix, van_capacity, strategies, time_limit_seconds):
+        self.tasks.append((len(distance_matrix), van_capacity, strategies, time_limit_seconds))
+        if not self.free:
+            return []
+        return [(strategies[0], lf.solve_route_matrix(distance_matrix, van_capacity, strategies[0],
+                                                      int(time_limit_seconds * 1000)))]
+
+
+def large_roster(n):
+    return [{'name': f'D{i}', 'address': f'Calle {i}', 'terminal': 'Terminal Test', 'presentation_time': '06:00',
+             'coordinates': {'lat': lat, 'lng': lng}} for i, (lat, lng) in enumerate(roster(n))]
+
+
+def test_partition_routes_are_solved_in_solver_processes(monkeypatch):
+    solver = RecordingSolver()
+    monkeypatch.setattr(lf, 'get_partition_solver', lambda: solver)
+    monkeypatch.setattr(lf, 'stage_memo', lf.StageMemo(1000))
+    monkeypatch.setattr(lf, 'LARGE_INSTANCE_ROUTE_SECONDS', 0.1)
+    stages = {name: lf.StageReport(name) for name in ('clustering', 'routing')}
+    routes, num_vans = lf.solve_large_instance(large_roster(60), stages, lf.OptimizationContext(num_vans=6))
+
+    assert sorted(d['name'] for _, route, _ in routes for d in route) == sorted(f'D{i}' for i in range(60))
+    assert len(solver.tasks) == sum(1 for _, route, _ in routes if len(route) > 1)
+    assert all(task[2] == [lf.default_solver_strategy(task[0])] and task[3] == 0.1 for task in solver.tasks)
+
+
+def test_busy_partition_solver_falls_back_to_in_process(monkeypatch):
+    solver = RecordingSolver(free=False)
+    monkeypatch.setattr(lf, 'get_partition_solver', lambda: solver)
+    monkeypatch.setattr(lf, 'stage_memo', lf.StageMemo(1000))
+    monkeypatch.setattr(lf, 'LARGE_INSTANCE_ROUTE_SECONDS', 0.1)
+    stages = {name: lf.StageReport(name) for name in ('clustering', 'routing')}
+    routes, _ = lf.solve_large_instance(large_roster(30), stages, lf.OptimizationContext(num_vans=3))
+    assert solver.tasks and not any(review for _, _, review in routes)
+
+
+@pytest.mark.parametrize('key', ['largeInstance', 'solverPortfolio'])
+@pytest.mark.parametrize('value', ['false', 0, 1, [], {}])
+def test_mode_flags_must_be_booleans(key, value):
+    with pytest.raises(ValueError, match=key):
+        lf.OptimizationContext.from_config({key: value})
+
+
+def test_mode_flags_accept_booleans_and_null():
+    context = lf.OptimizationContext.from_config({'largeInstance': False, 'solverPortfolio': True})
+    assert context.large_instance is False and context.solver_portfolio is True
+    context = lf.OptimizationContext.from_config({'largeInstance': None, 'solverPortfolio': None})
+    assert context.large_instance is None and context.solver_portfolio is lf.SOLVER_PORTFOLIO
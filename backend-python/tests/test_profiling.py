@@ -0,0 +1,79 @@
+"""On-demand profiling: requested_profile_mode and RequestProfiler artifacts"""
+
+import json
+import pstats
+
+import pytest
+
+import lambda_function as lf
+
+
+def request(**extra):
+    drivers = [{'name': f'D{i}', 'address': f'Pajaritos {100 + i}, Maipú', 'terminal': 'Terminal Aeropuerto T1',
+                'presentation_time': '06:00'} for i in range(4)]
+    return {'drivers': drivers, 'config': {'numVans': 1}, **extra}
+
+
+@pytest.fixture(autouse=True)
+def fast_pipeline(monkeypatch, tmp_path):
+    monkeypatch.setattr(lf, 'ROUTE_SOLVER_TIME_LIMIT_SECONDS', 0.1)
+    monkeypatch.setattr(lf, 'stage_memo', lf.StageMemo(1000))
+    monkeypatch.setattr(lf, 'PROFILE_DIR', tmp_path / 'profiles')
+
+
+@pytest.fixture
+def profiling(monkeypatch):
+    monkeypatch.setattr(lf, 'ENABLE_PROFILING', True)
+
+
+@pytest.mark.parametrize('value, mode', [
+    (True, 'sampling'), ('true', 'sampling'), ('deterministic', 'deterministic'), ('SAMPLING', 'sampling'),
+    ('flamegraph', 'sampling'), (None, None), (False, None), ('', None), ('false', None), ('0', None), ('off', None),
+])
+def test_requested_profile_mode(profiling, monkeypatch, value, mode):
+    monkeypatch.setattr(lf, 'PROFILE_DEFAULT_MODE', 'sampling')
+    assert lf.requested_profile_mode(value) == mode
+
+
+@pytest.mark.parametrize('value', [True, 'sampling', 'deterministic'])
+def test_profiling_off_ignores_requests(value):
+    assert lf.requested_profile_mode(value) is None
+
+
+@pytest.mark.parametrize('data, query, header', [
+    (request(profile=True), None, None),
+    (request(), {'profile': 'deterministic'}, None),
+    (request(), None, 'sampling'),
+])
+def test_profiling_off_runs_unprofiled(tmp_path, data, query, header):
+    response = lf.handle_optimize_request(data, query, None, header)
+    assert response['statusCode'] == 200
+    assert 'profile' not in json.loads(response['body'])
+    assert 'X-Profile-Id' not in response['headers']
+    assert not (tmp_path / 'profiles').exists()
+
+
+@pytest.mark.parametrize('mode', ['sampling', 'deterministic'])
+def test_profiled_request_writes_artifacts(profiling, tmp_path, mode):
+    response = lf.handle_optimize_request(request(profile=mode))
+    assert response['statusCode'] == 200
+    profile = json.loads(response['body'])['profile']
+    assert profile['mode'] == mode
+    assert response['headers']['X-Profile-Id'] == profile['id']
+
+    directory = tmp_path / 'profiles'
+    assert sorted(path.name for path in directory.iterdir()) == [f"{profile['id']}.collapsed", f"{profile['id']}.pstats"]
+    assert profile['pstats'] == str(directory / f"{profile['id']}.pstats")
+    assert pstats.Stats(profile['pstats']).total_calls > 0
+
+    lines = (directory / f"{profile['id']}.collapsed").read_text(encoding='utf-8').splitlines()
+    assert profile['samples'] == sum(int(line.rsplit(' ', 1)[1]) for line in lines) > 0
+    assert any('run_optimization_pipeline' in line for line in lines)
+
+
+def test_x_profile_header_profiles_lambda_requests(profiling, tmp_path):
+    response = lf.handle_optimize({'body': json.dumps(request()), 'headers': {'X-Profile': 'true'}})
+    profile_id = response['headers']['X-Profile-Id']
+    assert json.loads(response['body'])['profile']['id'] == profile_id
+    assert (tmp_path / 'profiles' / f'{profile_id}.pstats').exists()
+    assert (tmp_path / 'profiles' / f'{profile_id}.collapsed').exists()
@@ -0,0 +1,114 @@
+"""Route solver: size buckets, strategies, OR-Tools solve and the solver portfolio"""
+
+import types
+
+import pytest
+
+import lambda_function as lf
+
+pytest.importorskip('ortools')
+
+STRATEGY = 'PATH_CHEAPEST_ARC/GUIDED_LOCAL_SEARCH'
+
+
+def line_matrix(positions):
+    """Distance matrix (meters) of stops on a line"""
+    return [[abs(a - b) for b in positions] for a in positions]
+
+
+def test_size_buckets():
+    first = lf.SOLVER_SIZE_BUCKETS[0]
+    assert lf.solver_size_bucket(1) == f'1-{first}'
+    assert lf.solver_size_bucket(first + 1).startswith(f'{first + 1}-')
+    assert lf.solver_size_bucket(10_000) == f'>{lf.SOLVER_SIZE_BUCKETS[-1]}'
+
+
+def test_default_strategy_by_size(monkeypatch):
+    monkeypatch.setattr(lf, 'SOLVER_STRATEGY_BY_SIZE', [(10, 'SAVINGS/TABU_SEARCH')])
+    assert lf.default_solver_strategy(10) == 'SAVINGS/TABU_SEARCH'
+    assert lf.default_solver_strategy(11) == lf.DEFAULT_SOLVER_STRATEGY
+
+
+def test_portfolio_strategies_put_the_default_first_once(monkeypatch):
+    monkeypatch.setattr(lf, 'SOLVER_STRATEGY_BY_SIZE', [])
+    monkeypatch.setattr(lf, 'SOLVER_PORTFOLIO_STRATEGIES', ['SAVINGS/TABU_SEARCH', lf.DEFAULT_SOLVER_STRATEGY])
+    assert lf.portfolio_strategies(20) == [lf.DEFAULT_SOLVER_STRATEGY, 'SAVINGS/TABU_SEARCH']
+
+
+def test_solve_route_matrix_visits_every_stop_from_the_first():
+    positions = [0, 5000, 1000, 4000, 2000, 3000]
+    result = lf.solve_route_matrix(line_matrix(positions), 10, STRATEGY, 200)
+    assert result['order'][0] == 0
+    assert sorted(result['order']) == list(range(len(positions)))
+    # Out to the far end and back to the depot
+    assert result['objective'] == 2 * max(positions)
+
+
+def test_solve_route_matrix_without_room_has_no_solution():
+    result = lf.solve_route_matrix(line_matrix([0, 1, 2, 3]), 2, STRATEGY, 100)
+    assert result['order'] is None and result['objective'] is None
+
+
+@pytest.fixture
+def portfolio(monkeypatch):
+    portfolio = lf.SolverPortfolio(2)
+    monkeypatch.setattr(lf, '_solver_portfolio', portfolio)
+    yield portfolio
+    for process, conn in portfolio._idle:
+        process.terminate()
+        conn.close()
+
+
+def test_portfolio_races_strategies_and_keeps_processes_warm(portfolio):
+    strategies = [STRATEGY, 'SAVINGS/TABU_SEARCH', 'CHRISTOFIDES/GUIDED_LOCAL_SEARCH']
+    raced = portfolio.solve(line_matrix([0, 3000, 1000, 2000]), 10, strategies, 0.5)
+    # Two processes: the third strategy does not run
+    assert [strategy for strategy, _ in raced] == strategies[:2]
+    assert all(result['objective'] == 6000 for _, result in raced)
+    assert len(portfolio._idle) == 2
+
+
+def test_race_picks_the_lowest_objective(portfolio, monkeypatch):
+    objectives = {STRATEGY: 900, 'SAVINGS/TABU_SEARCH': 700}
+    monkeypatch.setattr(portfolio, 'solve', lambda matrix, capacity, strategies, seconds: [
+        (strategy, {'order': [0], 'objective': objectives.get(strategy)} if strategy in objectives else None)
+        for strategy in strategies
+    ])
+    monkeypatch.setattr(lf, 'SOLVER_STRATEGY_BY_SIZE', [])
+    monkeypatch.setattr(lf, 'SOLVER_PORTFOLIO_STRATEGIES', ['SAVINGS/TABU_SEARCH', 'CHRISTOFIDES/GUIDED_LOCAL_SEARCH'])
+    monkeypatch.setattr(lf, 'DEFAULT_SOLVER_STRATEGY', STRATEGY)
+
+    winner = lf.race_solver_portfolio(line_matrix([0, 1]), types.SimpleNamespace(van_capacity=10), 0.1)
+    assert winner == ('SAVINGS/TABU_SEARCH', {'order': [0], 'objective': 700})
+
+
+def test_race_without_solutions(portfolio, monkeypatch):
+    monkeypatch.setattr(portfolio, 'solve', lambda *args: [])
+    assert lf.race_solver_portfolio(line_matrix([0, 1]), types.SimpleNamespace(van_capacity=10), 0.1) is None
+
+
+def route_stops(n):
+    return [{'name': f'S{i}', 'coordinates': {'lat': -33.45, 'lng': -70.70 + i * 0.01}} for i in range(n)]
+
+
+@pytest.fixture
+def empty_memo(monkeypatch):
+    monkeypatch.setattr(lf, 'stage_memo', lf.StageMemo(100))
+    return lf.stage_memo
+
+
+def test_memoized_routes_are_keyed_by_time_limit(empty_memo):
+    stops = route_stops(5)
+    lf.optimize_route_memoized(stops, context=lf.OptimizationContext(), time_limit_seconds=0.1)
+    report = lf.StageReport('routing')
+    lf.optimize_route_memoized(stops, report, lf.OptimizationContext(), time_limit_seconds=0.2)
+    assert report.to_dict()['misses'] == 1
+    lf.optimize_route_memoized(stops, report, lf.OptimizationContext(), time_limit_seconds=0.2)
+    assert report.to_dict()['hits'] == 1
+
+
+def test_deadline_limited_routes_are_not_memoized(empty_memo):
+    stops = route_stops(5)
+    rushed = lf.OptimizationContext(deadline=lf.time.monotonic() + 0.1)
+    lf.optimize_route_memoized(stops, context=rushed, time_limit_seconds=1.0)
+    assert not empty_memo._entries
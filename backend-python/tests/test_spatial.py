@@ -0,0 +1,144 @@
+"""Spatial index: nearest, radius and candidate queries, nearest-neighbor tours and co-location issues"""
+
+import numpy as np
+import pytest
+
+import lambda_function as lf
+
+
+def points(n, seed=3):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(-33.60, -33.35, n), rng.uniform(-70.80, -70.50, n)])
+
+
+def planar_distances(index, point):
+    return np.linalg.norm(index.points - index.project([point]), axis=1)
+
+
+def test_projection_is_close_to_geodesic_distance():
+    coordinates = points(50)
+    index = lf.SpatialIndex(coordinates)
+    a, b = coordinates[0], coordinates[1]
+    planar = np.linalg.norm(index.points[0] - index.points[1])
+    geodesic = lf.calculate_distance({'lat': a[0], 'lng': a[1]}, {'lat': b[0], 'lng': b[1]})
+    assert planar == pytest.approx(geodesic, rel=0.005)
+
+
+def test_nearest_matches_brute_force():
+    coordinates = points(300)
+    index = lf.SpatialIndex(coordinates)
+    queries = points(20, seed=4)
+    distances, indices = index.nearest(queries, k=5)
+    for query, row_distances, row in zip(queries, distances, indices):
+        brute = planar_distances(index, query)
+        assert row.tolist() == np.argsort(brute)[:5].tolist()
+        assert row_distances == pytest.approx(np.sort(brute)[:5])
+    assert index.nearest(queries[:1], k=500)[1].shape == (1, 300)  # k is capped at the index size
+
+
+def test_within_matches_brute_force():
+    coordinates = points(300)
+    index = lf.SpatialIndex(coordinates)
+    queries = points(20, seed=5)
+    for query, found in zip(queries, index.within(queries, 2.0)):
+        assert sorted(found.tolist()) == np.flatnonzero(planar_distances(index, query) <= 2.0).tolist()
+
+
+def test_candidate_lists_are_nearest_other_points():
+    coordinates = points(100)
+    index = lf.SpatialIndex(coordinates)
+    candidates = index.candidate_lists(6)
+    for i, row in enumerate(candidates):
+        brute = np.argsort(planar_distances(index, coordinates[i]))
+        assert i not in row
+        assert row == [j for j in brute.tolist() if j != i][:6]
+
+
+def test_candidate_lists_of_members_stay_within_members():
+    coordinates = points(200)
+    index = lf.SpatialIndex(coordinates)
+    members = list(range(0, 200, 7))
+    candidates = index.candidate_lists(4, members)
+    route_index = lf.SpatialIndex(coordinates[members])
+    assert len(candidates) == len(members)
+    assert all(len(row) == 4 and p not in row for p, row in enumerate(candidates))
+    assert candidates == route_index.candidate_lists(4)
+
+
+@pytest.mark.parametrize('n', [1, 2, 9, 250])
+def test_nearest_neighbor_order_visits_every_point_once(n):
+    order = lf.SpatialIndex(points(n)).nearest_neighbor_order()
+    assert order[0] == 0
+    assert sorted(order) == list(range(n))
+
+
+def test_nearest_neighbor_order_is_greedy():
+    coordinates = points(60)
+    index = lf.SpatialIndex(coordinates)
+    order = index.nearest_neighbor_order(start=5)
+    remaining = set(range(60)) - {5}
+    current = 5
+    for step in order[1:]:
+        brute = planar_distances(index, coordinates[current])
+        expected = min(remaining, key=lambda j: brute[j])
+        assert step == expected
+        remaining.discard(step)
+        current = step
+
+
+def test_nearest_neighbor_order_of_members():
+    coordinates = points(300)
+    index = lf.SpatialIndex(coordinates)
+    members = list(range(3, 300, 11))
+    order = index.nearest_neighbor_order(members=members)
+    assert sorted(order) == list(range(len(members)))
+    assert order == lf.SpatialIndex(coordinates[members]).nearest_neighbor_order()
+
+
+def driver(name, address, lat, lng=-70.60):
+    return {'name': name, 'address': address, 'coordinates': {'lat': lat, 'lng': lng}}
+
+
+def co_located(drivers, flagged=()):
+    index = lf.SpatialIndex([(d['coordinates']['lat'], d['coordinates']['lng']) for d in drivers])
+    return lf.co_location_issues(drivers, index, set(flagged))
+
+
+def test_distinct_addresses_on_one_spot_are_approximate():
+    offset = 0.00003  # About 3 m
+    drivers = [driver(f'D{i}', f'Calle {i}', -33.45 + i * offset) for i in range(lf.CO_LOCATION_MIN_ADDRESSES)]
+    drivers.append(driver('Far', 'Calle Lejos', -33.40))
+    issues = co_located(drivers)
+    assert [issue['driver_index'] for issue in issues] == list(range(1, lf.CO_LOCATION_MIN_ADDRESSES + 1))
+    assert all(issue['severity'] == 'info' for issue in issues)
+
+
+def test_shared_address_is_not_an_approximate_geocode():
+    drivers = [driver('A', 'Calle 1', -33.45), driver('B', 'calle 1 ', -33.45), driver('C', 'Calle 2', -33.45)]
+    assert co_located(drivers) == []  # Two distinct addresses only
+
+
+def test_points_further_than_the_radius_are_not_co_located():
+    step = lf.CO_LOCATION_RADIUS_KM * 1.5 / lf.KM_PER_DEGREE
+    drivers = [driver(f'D{i}', f'Calle {i}', -33.45 + i * step) for i in range(5)]
+    assert co_located(drivers) == []
+
+
+def test_already_flagged_drivers_are_skipped():
+    drivers = [driver(f'D{i}', f'Calle {i}', -33.45) for i in range(4)]
+    issues = co_located(drivers, flagged={2, 4})
+    assert [issue['driver_index'] for issue in issues] == [1, 3]
+    assert issues[0]['issue'].startswith('Same location as 3 other driver(s)')
+
+
+def test_request_index_is_shared_by_the_route_fallback(monkeypatch):
+    table = lf.DriverTable([driver(f'D{i}', f'Calle {i}', lat, lng) for i, (lat, lng) in enumerate(points(40))])
+    request_index = table.spatial_index()
+    built = []
+    monkeypatch.setattr(lf, 'SpatialIndex', lambda *args: built.append(args))
+    route = table.records(list(range(0, 40, 3)))
+
+    optimized, success = lf.optimize_route_tsp_legacy(route)
+    assert success and not built
+    assert table.spatial_index() is request_index
+    assert sorted(d.index for d in optimized) == list(range(0, 40, 3))
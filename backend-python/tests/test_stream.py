@@ -0,0 +1,103 @@
+"""Streaming optimize: event order, NDJSON and SSE framing, error events"""
+
+import json
+
+import pytest
+
+import lambda_function as lf
+
+COMUNAS = ['Maipú', 'Providencia', 'Las Condes', 'La Florida', 'Ñuñoa', 'Puente Alto']
+
+
+@pytest.fixture(autouse=True)
+def fast_pipeline(monkeypatch):
+    monkeypatch.setattr(lf, 'ROUTE_SOLVER_TIME_LIMIT_SECONDS', 0.1)
+    monkeypatch.setattr(lf, 'stage_memo', lf.StageMemo(1000))
+
+
+def request(n=8, num_vans=3):
+    drivers = [{'name': f'D{i}', 'address': f'Pajaritos {100 + i}, {COMUNAS[i % len(COMUNAS)]}',
+                'terminal': 'Terminal Aeropuerto T1', 'presentation_time': '06:00'} for i in range(n)]
+    return {'drivers': drivers, 'config': {'numVans': num_vans}}
+
+
+def ndjson_events(data):
+    lines = list(lf.iter_optimize_stream(data, 'ndjson'))
+    assert all(line.endswith('\n') and line.count('\n') == 1 for line in lines)
+    return [(event['event'], event['data']) for event in map(json.loads, lines)]
+
+
+def sse_events(data):
+    events = []
+    for message in lf.iter_optimize_stream(data, 'sse'):
+        assert message.endswith('\n\n')
+        event_line, data_line = message[:-2].split('\n')
+        assert event_line.startswith('event: ') and data_line.startswith('data: ')
+        events.append((event_line[len('event: '):], json.loads(data_line[len('data: '):])))
+    return events
+
+
+def test_events_come_in_pipeline_order():
+    events = ndjson_events(request())
+    names = [event for event, _ in events]
+    geocodes = names.count('geocode')
+    vans = names.count('van')
+    assert names == ['geocode'] * geocodes + ['van'] * vans + ['summary']
+
+    progress = [(data['resolved'], data['total']) for event, data in events if event == 'geocode']
+    assert progress == [(n, 8) for n in range(1, 9)]
+
+    summary = events[-1][1]
+    assert 'vans' not in summary
+    assert summary['vanCount'] == vans == 3 and summary['totalDrivers'] == 8
+    van_events = [data for event, data in events if event == 'van']
+    assert [data['index'] for data in van_events] == list(range(vans))
+    assert sorted(d['name'] for data in van_events for d in data['van']['drivers']) == sorted(f'D{i}' for i in range(8))
+
+
+def test_geocode_events_carry_only_new_issues():
+    events = ndjson_events(request())
+    issues = [issue['driver_name'] for event, data in events if event == 'geocode' for issue in data['issues']]
+    assert sorted(issues) == sorted(f'D{i}' for i in range(8))  # Offline: every address is a comuna estimate
+
+
+def test_empty_clusters_send_no_van(monkeypatch):
+    monkeypatch.setattr(lf, 'cluster_drivers', lambda drivers, num_vans, report: [drivers[:3], [], drivers[3:]])
+    events = ndjson_events(request())
+    vans = [data['van'] for event, data in events if event == 'van']
+    assert [len(van['drivers']) for van in vans] == [3, 5]
+    assert events[-1][1]['vanCount'] == 2
+
+
+def test_sse_framing_matches_ndjson():
+    ndjson = ndjson_events(request())
+    sse = sse_events(request())
+    assert [event for event, _ in sse] == [event for event, _ in ndjson]
+    assert sse[-1][1]['totalDrivers'] == ndjson[-1][1]['totalDrivers']
+    assert [data['index'] for event, data in sse if event == 'van'] == \
+           [data['index'] for event, data in ndjson if event == 'van']
+
+
+@pytest.mark.parametrize('events', [ndjson_events, sse_events])
+def test_empty_roster_ends_with_a_400_error_event(events):
+    assert events({'drivers': []}) == [('error', {'error': 'No drivers data provided', 'statusCode': 400})]
+
+
+def test_pipeline_failure_ends_with_a_500_error_event(monkeypatch):
+    def failing(drivers, config):
+        yield 'geocode', {'resolved': 0, 'total': len(drivers), 'issues': []}
+        raise RuntimeError('solver crashed')
+
+    monkeypatch.setattr(lf, 'iter_optimization_events', failing)
+    events = ndjson_events(request())
+    assert [event for event, _ in events] == ['geocode', 'error']
+    assert events[-1][1] == {'error': 'solver crashed', 'statusCode': 500}
+
+
+def test_lambda_adapter_buffers_the_stream():
+    response = lf.handle_optimize_stream({'queryStringParameters': {'format': 'sse'},
+                                          'body': json.dumps({'drivers': []})})
+    assert response['statusCode'] == 200
+    assert response['headers']['Content-Type'] == 'text/event-stream'
+    assert response['body'].startswith('event: error\n')
+    assert lf.handle_optimize_stream({'queryStringParameters': {'format': 'xml'}, 'body': '{}'})['statusCode'] == 400
@@ -0,0 +1,90 @@
+"""Streaming multipart/form-data parser"""
+
+from io import BytesIO
+
+import pytest
+
+import lambda_function as lf
+
+BOUNDARY = 'XyZ123'
+CONTENT_TYPE = f'multipart/form-data; boundary={BOUNDARY}'
+
+
+def multipart_body(*parts):
+    body = b''
+    for headers, content in parts:
+        body += f'--{BOUNDARY}\r\n{headers}\r\n\r\n'.encode() + content + b'\r\n'
+    return body + f'--{BOUNDARY}--\r\n'.encode()
+
+
+def file_part(content, filename='roster.csv', name='file'):
+    return f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\nContent-Type: text/csv', content
+
+
+def field_part(name, value):
+    return f'Content-Disposition: form-data; name="{name}"', value.encode()
+
+
+ROSTER = 'Nombre;Dirección\r\nAna;Pajaritos 100\r\n'.encode('utf-8')
+
+
+def test_file_and_fields():
+    body = multipart_body(field_part('config', '{"numVans": 3}'), file_part(ROSTER))
+    fields, filename, fileobj = lf.parse_multipart_stream(BytesIO(body), CONTENT_TYPE, max_bytes=1024)
+    assert fields == {'config': '{"numVans": 3}'}
+    assert filename == 'roster.csv'
+    assert fileobj.read() == ROSTER
+
+
+@pytest.mark.parametrize('chunk_bytes', [1, 7, 64])
+def test_delimiter_split_across_reads(monkeypatch, chunk_bytes):
+    monkeypatch.setattr(lf, 'UPLOAD_CHUNK_BYTES', chunk_bytes)
+    content = b'--' + BOUNDARY[:3].encode() + b'\r\n' + ROSTER * 20  # Looks like a delimiter prefix
+    body = multipart_body(file_part(content), field_part('format', 'compact'))
+    fields, _, fileobj = lf.parse_multipart_stream(BytesIO(body), CONTENT_TYPE, max_bytes=10_000)
+    assert fileobj.read() == content
+    assert fields == {'format': 'compact'}
+
+
+def test_only_first_file_part_is_kept():
+    body = multipart_body(file_part(b'first'), file_part(b'second', filename='other.csv'))
+    _, filename, fileobj = lf.parse_multipart_stream(BytesIO(body), CONTENT_TYPE, max_bytes=1024)
+    assert (filename, fileobj.read()) == ('roster.csv', b'first')
+
+
+def test_no_file_part():
+    body = multipart_body(field_part('config', '{}'))
+    fields, filename, fileobj = lf.parse_multipart_stream(BytesIO(body), CONTENT_TYPE, max_bytes=1024)
+    assert fields == {'config': '{}'}
+    assert filename is None and fileobj is None
+
+
+def test_file_over_limit():
+    body = multipart_body(file_part(b'x' * 5000))
+    with pytest.raises(lf.UploadTooLarge):
+        lf.parse_multipart_stream(BytesIO(body), CONTENT_TYPE, max_bytes=1000)
+
+
+@pytest.mark.parametrize('content_type, body', [
+    ('multipart/form-data', multipart_body(file_part(ROSTER))),  # No boundary
+    (CONTENT_TYPE, b'no delimiter at all'),
+    (CONTENT_TYPE, multipart_body(file_part(ROSTER))[:-20]),  # Truncated
+])
+def test_invalid_bodies(content_type, body):
+    with pytest.raises(ValueError):
+        lf.parse_multipart_stream(BytesIO(body), content_type, max_bytes=10_000)
+
+
+def test_base64_stream_decodes_in_chunks(monkeypatch):
+    monkeypatch.setattr(lf, 'UPLOAD_CHUNK_BYTES', 12)
+    payload = bytes(range(256)) * 3
+    stream = lf.lambda_body_stream({'body': lf.base64.b64encode(payload).decode(), 'isBase64Encoded': True})
+    assert stream.read() == payload
+
+
+def test_upload_optimize_answers_malformed_config_with_400():
+    app = pytest.importorskip('app')
+    response = app.app.test_client().post('/api/upload-optimize?config={"numVans":', data=ROSTER,
+                                          headers={'X-Filename': 'roster.csv'})
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('config inválido')
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the Lambda entry point (lambda_function_updated.py).
+
+Each scenario runs in a fresh interpreter under `python -X importtime` and
+reports the wall time, the total import time and which heavy dependencies
+were loaded. Importing the module and answering /api/health must not load
+any of the scientific stack or boto3; the script exits with status 1 when
+they do, or when the bare import exceeds --max-import-ms, so it can guard
+cold-start regressions in CI.
+
+Usage:
+    python benchmark_cold_start.py [--repeat 5] [--max-import-ms 150]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+HEAVY_MODULES = ['pandas', 'numpy', 'sklearn', 'ortools', 'geopy', 'boto3', 'botocore', 'openpyxl', 'urllib3']
+
+SETUP = "import lambda_function_updated as lf\n"
+
+SCENARIOS = {
+    # name: (code run after the import, modules that must NOT be loaded)
+    'import': ("", HEAVY_MODULES),
+    'health': ("lf.lambda_handler({'rawPath': '/api/health'}, {})\n", HEAVY_MODULES),
+    'upload': (
+        "import base64, json\n"
+        "content = open('test_maipu_40_drivers.csv', 'rb').read()\n"
+        "lf.handle_upload({'body': json.dumps({'filename': 'roster.csv', "
+        "'file_content': base64.b64encode(content).decode()})})\n",
+        ['sklearn', 'ortools', 'boto3', 'botocore']
+    ),
+    'solver-stack': (
+        "drivers = [{'coordinates': {'lat': -33.45 + i * 0.01, 'lng': -70.65 - i * 0.01}} for i in range(4)]\n"
+        "lf.cluster_drivers(drivers, 2)\n"
+        "lf.optimize_route_ortools(drivers, time_limit_seconds=1)\n",
+        ['boto3', 'botocore']  # scikit-learn pulls in pandas on its own
+    ),
+}
+
+
+def parse_importtime(stderr):
+    """Return (total import time in ms, set of top-level packages imported)"""
+    total_us = 0
+    packages = set()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        packages.add(name.strip().split('.')[0])
+        if not name[1:].startswith(' '):  # Top-level import: counts once
+            total_us += int(cumulative)
+    return total_us / 1000, packages
+
+
+def run_scenario(code):
+    env = dict(os.environ, ENABLE_RESPONSE_CACHE='false')
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', SETUP + code],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    if completed.returncode != 0:
+        raise RuntimeError(f"Scenario failed:\n{completed.stderr[-2000:]}")
+    import_ms, packages = parse_importtime(completed.stderr)
+    return wall_ms, import_ms, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per scenario (median is reported)')
+    parser.add_argument('--max-import-ms', type=float, default=150.0,
+                        help='Fail if importing the module takes longer than this (median)')
+    args = parser.parse_args()
+
+    print(f"{'scenario':<14}{'wall ms':>10}{'import ms':>11}  heavy modules loaded")
+    print('-' * 72)
+
+    failures = []
+    for name, (code, forbidden) in SCENARIOS.items():
+        walls, imports, loaded = [], [], set()
+        for _ in range(args.repeat):
+            wall_ms, import_ms, packages = run_scenario(code)
+            walls.append(wall_ms)
+            imports.append(import_ms)
+            loaded |= packages
+
+        heavy = sorted(m for m in HEAVY_MODULES if m in loaded)
+        wall, imported = statistics.median(walls), statistics.median(imports)
+        print(f"{name:<14}{wall:>10.0f}{imported:>11.0f}  {', '.join(heavy) or '-'}")
+
+        unexpected = sorted(m for m in forbidden if m in loaded)
+        if unexpected:
+            failures.append(f"{name}: imported {', '.join(unexpected)}")
+        if name == 'import' and imported > args.max_import_ms:
+            failures.append(f"import: {imported:.0f} ms > {args.max_import_ms:.0f} ms budget")
+
+    print('-' * 72)
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1)
+    print("✓ Cold start within budget")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Scaling benchmark for the full optimize pipeline (handle_optimize).
+
+Generates synthetic Santiago rosters (weighted comuna distribution, the known
+terminals, shift-based presentation times) from 40 up to 10,000 drivers and
+runs each size offline: the Geocoding and Distance Matrix APIs are replaced by
+deterministic stand-ins, so runs are comparable across machines and commits.
+
+Each size runs in a fresh subprocess (clean stage memo, separate peak RSS) and
+records wall time, peak memory, external-call counts, stage timings and route
+quality (total distance, utilization, solver fallbacks). Results are written
+as JSON and CSV; pass a previous JSON with --baseline to fail on regressions.
+
+Terminal groups above LARGE_INSTANCE_THRESHOLD drivers run in large-instance
+mode (spatial partitions + boundary repair); --large-instance on/off forces
+it for every size, to compare both modes on the same rosters.
+
+Usage:
+    python benchmark_scaling.py [--sizes 40,100,250,500,1000,2500,5000,10000]
+                                [--solver-seconds 0.1] [--seed 42] [--large-instance auto|on|off]
+                                [--json benchmark_scaling.json] [--csv benchmark_scaling.csv]
+                                [--baseline previous.json]
+"""
+
+import argparse
+import contextlib
+import csv
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# (comuna, center lat, center lng, weight) - weighted towards the west and south,
+# where most drivers of the airport and Maipú terminals live
+COMUNAS = [
+    ('Maipú', -33.5106, -70.7572, 14),
+    ('Pudahuel', -33.4406, -70.7575, 8),
+    ('Puente Alto', -33.6117, -70.5758, 7),
+    ('Santiago', -33.4489, -70.6693, 6),
+    ('Cerrillos', -33.4947, -70.7125, 5),
+    ('Estación Central', -33.4531, -70.6833, 5),
+    ('Quilicura', -33.3661, -70.7311, 5),
+    ('La Florida', -33.5227, -70.5983, 5),
+    ('San Bernardo', -33.5922, -70.6996, 5),
+    ('Quinta Normal', -33.4278, -70.6976, 4),
+    ('Lo Prado', -33.4444, -70.7250, 4),
+    ('Cerro Navia', -33.4222, -70.7353, 4),
+    ('Renca', -33.4042, -70.7278, 4),
+    ('Recoleta', -33.4061, -70.6397, 3),
+    ('Ñuñoa', -33.4569, -70.5978, 3),
+    ('El Bosque', -33.5653, -70.6756, 3),
+    ('Lo Espejo', -33.5217, -70.6911, 3),
+    ('Peñalolén', -33.4858, -70.5428, 3),
+    ('Independencia', -33.4156, -70.6653, 2),
+    ('Providencia', -33.4314, -70.6093, 2),
+    ('Las Condes', -33.4080, -70.5670, 2),
+    ('Macul', -33.4892, -70.5997, 2),
+    ('La Cisterna', -33.5317, -70.6636, 2),
+    ('Pedro Aguirre Cerda', -33.4894, -70.6728, 2),
+    ('San Miguel', -33.4969, -70.6517, 2),
+]
+COMUNA_CENTERS = {name: (lat, lng) for name, lat, lng, _ in COMUNAS}
+
+# Share of the roster per terminal (Terminal Maipú runs in bus mode)
+TERMINALS = [
+    ('Terminal Aeropuerto T1', 0.45),
+    ('Terminal Conquistador', 0.35),
+    ('Terminal Maipú', 0.20),
+]
+
+SHIFT_TIMES = [('04:30', 2), ('05:00', 4), ('05:30', 5), ('06:00', 6), ('06:30', 5),
+               ('07:00', 4), ('08:00', 3), ('09:00', 2), ('14:00', 2), ('15:30', 1)]
+
+STREETS = ['Av. Pajaritos', 'Calle Las Rosas', 'Pje. Los Aromos', 'Av. Américo Vespucio', 'Calle San Martín',
+           'Av. Departamental', 'Calle Los Olmos', 'Av. La Florida', "Calle Bernardo O'Higgins", 'Pje. El Roble',
+           'Av. Central', 'Calle Sargento Aldea', 'Av. Santa Rosa', 'Calle Los Quillayes', 'Psje. Las Acacias']
+
+FIRST_NAMES = ['Juan', 'María', 'Carlos', 'Ana', 'Luis', 'Camila', 'Jorge', 'Valentina', 'Pedro', 'Francisca']
+LAST_NAMES = ['González', 'Muñoz', 'Rojas', 'Díaz', 'Pérez', 'Soto', 'Contreras', 'Silva', 'Martínez', 'Sepúlveda']
+
+CSV_FIELDS = ['drivers', 'numVans', 'vans', 'vehicles', 'wallSeconds', 'peakRssMb', 'rssDeltaMb',
+              'geocodeCalls', 'distanceMatrixCalls', 'totalDistanceKm', 'avgUtilization', 'requiresManualReview',
+              'solverRuns', 'solverFallbacks', 'ingestMs', 'geocodeMs', 'travelTimesMs', 'clusteringMs', 'routingMs',
+              'boundaryRepairMs']
+
+
+def generate_roster(size, seed=42):
+    """Synthetic roster in the /api/optimize driver shape; terminal shares are exact, not sampled"""
+    rng = random.Random(seed)
+    comunas = [name for name, _, _, _ in COMUNAS]
+    comuna_weights = [weight for _, _, _, weight in COMUNAS]
+    times = [t for t, _ in SHIFT_TIMES]
+    time_weights = [w for _, w in SHIFT_TIMES]
+
+    terminals = []
+    for name, share in TERMINALS:
+        terminals.extend([name] * round(size * share))
+    terminals = (terminals + [TERMINALS[0][0]] * size)[:size]
+    rng.shuffle(terminals)
+
+    roster = []
+    for i in range(size):
+        comuna = rng.choices(comunas, comuna_weights)[0]
+        roster.append({
+            'code': str(140000 + i),
+            'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}",
+            'address': f"{rng.choice(STREETS)} {rng.randint(100, 9999)}, {comuna}",
+            'terminal': terminals[i],
+            'time': rng.choices(times, time_weights)[0],
+        })
+    return roster
+
+
+def fleet_size(roster, van_capacity):
+    """numVans applies per terminal: size the fleet for the largest terminal group"""
+    groups = {}
+    for driver in roster:
+        groups[driver['terminal']] = groups.get(driver['terminal'], 0) + 1
+    return max(1, math.ceil(max(groups.values()) / van_capacity))
+
+
+def install_offline_google(lambda_function, calls):
+    """Replace the Google Maps calls with deterministic stand-ins that count invocations"""
+
+    def geocode(address):
+        calls['geocode'] += 1
+        comuna = address.rsplit(',', 1)[-1].strip()
+        if comuna not in COMUNA_CENTERS:
+            return {'lat': -33.4489, 'lng': -70.6693}, 'fallback'
+        digest = hashlib.sha256(address.encode('utf-8')).digest()
+        lat, lng = COMUNA_CENTERS[comuna]
+        return {
+            'lat': lat + (digest[0] / 255 - 0.5) * 0.04,  # ~±2 km around the comuna center
+            'lng': lng + (digest[1] / 255 - 0.5) * 0.04
+        }, 'full_address'
+
+    def distance_matrix(origin, destination):
+        calls['distanceMatrix'] += 1
+        road_km = lambda_function.calculate_distance(origin, destination) * 1.35
+        return {'distance_km': round(road_km, 2), 'duration_minutes': round(road_km / 40 * 60, 1)}
+
+    lambda_function.geocode_address_with_strategy = geocode
+    lambda_function.get_route_distance_and_time = distance_matrix
+
+
+def peak_rss_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KB on Linux
+
+
+def run_size(size, seed, large_instance='auto'):
+    """Run one roster size in this process and return its result row"""
+    import lambda_function_updated as lambda_function
+
+    # Load the solver stack up front so the memory delta measures the run, not the imports
+    import numpy  # noqa: F401
+    import sklearn.cluster  # noqa: F401
+    import ortools.constraint_solver.pywrapcp  # noqa: F401
+    import geopy.distance  # noqa: F401
+
+    calls = {'geocode': 0, 'distanceMatrix': 0}
+    install_offline_google(lambda_function, calls)
+
+    roster = generate_roster(size, seed)
+    num_vans = fleet_size(roster, lambda_function.VAN_CAPACITY)
+    config = {'numVans': num_vans}
+    if large_instance != 'auto':
+        config['largeInstance'] = large_instance == 'on'
+    event = {'body': json.dumps({'drivers': roster, 'config': config})}
+
+    rss_before = peak_rss_mb()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        response = lambda_function.handle_optimize(event)
+        elapsed = time.perf_counter() - started
+        lambda_function.flush_logs()  # Write queued log records while stdout is still redirected
+
+    if response['statusCode'] != 200:
+        raise RuntimeError(f"{size} drivers: optimize failed with {response['statusCode']}: {response['body']}")
+
+    result = json.loads(response['body'])
+    vans = [v for v in result['vans'] if v.get('is_van')]
+    solves = result['timings']['solves']
+    stages = result['timings']['stagesMs']
+    rss_after = peak_rss_mb()
+
+    return {
+        'drivers': size,
+        'numVans': num_vans,
+        'vans': len(vans),
+        'vehicles': len(result['vans']),
+        'wallSeconds': round(elapsed, 3),
+        'peakRssMb': round(rss_after, 1),
+        'rssDeltaMb': round(rss_after - rss_before, 1),
+        'geocodeCalls': calls['geocode'],
+        'distanceMatrixCalls': calls['distanceMatrix'],
+        'totalDistanceKm': round(result['totalDistance'], 3),
+        'avgUtilization': round(sum(v['utilization'] for v in vans) / len(vans), 1) if vans else 0,
+        'requiresManualReview': result['requiresManualReview'],
+        'solverRuns': len(solves),
+        'solverFallbacks': sum(1 for s in solves if s['outcome'] != 'ortools'),
+        'ingestMs': stages.get('ingest'),
+        'geocodeMs': stages.get('geocode'),
+        'travelTimesMs': stages.get('travelTimes'),
+        'clusteringMs': stages.get('clustering'),
+        'routingMs': stages.get('routing'),
+        'boundaryRepairMs': stages.get('boundaryRepair'),
+    }
+
+
+def run_size_subprocess(size, seed, solver_seconds, large_instance='auto'):
+    env = dict(os.environ, ENABLE_RESPONSE_CACHE='false', ROUTE_SOLVER_TIME_LIMIT_SECONDS=str(solver_seconds))
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run-size', str(size), '--seed', str(seed),
+         '--large-instance', large_instance],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"{size} drivers: benchmark run failed\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(rows, baseline_path, time_tolerance, distance_tolerance):
+    """Regressions against a previous JSON artifact (same sizes only)"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {row['drivers']: row for row in json.load(f)['results']}
+
+    regressions = []
+    for row in rows:
+        base = baseline.get(row['drivers'])
+        if not base:
+            continue
+        if row['wallSeconds'] > base['wallSeconds'] * (1 + time_tolerance):
+            regressions.append(f"{row['drivers']} drivers: {row['wallSeconds']:.2f}s vs {base['wallSeconds']:.2f}s baseline")
+        if row['totalDistanceKm'] > base['totalDistanceKm'] * (1 + distance_tolerance):
+            regressions.append(f"{row['drivers']} drivers: {row['totalDistanceKm']:.1f} km vs {base['totalDistanceKm']:.1f} km baseline")
+        if row['geocodeCalls'] > base['geocodeCalls'] or row['distanceMatrixCalls'] > base['distanceMatrixCalls']:
+            regressions.append(f"{row['drivers']} drivers: more external calls than baseline")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='40,100,250,500,1000,2500,5000,10000', help='Comma-separated roster sizes')
+    parser.add_argument('--seed', type=int, default=42, help='Roster generator seed')
+    parser.add_argument('--solver-seconds', type=float, default=0.1, help='OR-Tools time limit per route')
+    parser.add_argument('--large-instance', choices=['auto', 'on', 'off'], default='auto',
+                        help='Large-instance mode: by LARGE_INSTANCE_THRESHOLD, or forced on/off')
+    parser.add_argument('--json', default='benchmark_scaling.json', help='JSON artifact path')
+    parser.add_argument('--csv', default='benchmark_scaling.csv', help='CSV artifact path')
+    parser.add_argument('--baseline', help='Previous JSON artifact to compare against')
+    parser.add_argument('--time-tolerance', type=float, default=0.25, help='Allowed wall time increase (fraction)')
+    parser.add_argument('--distance-tolerance', type=float, default=0.02, help='Allowed total distance increase (fraction)')
+    parser.add_argument('--run-size', type=int, help=argparse.SUPPRESS)  # Internal: one size, row printed as JSON
+    args = parser.parse_args()
+
+    if args.run_size:
+        print(json.dumps(run_size(args.run_size, args.seed, args.large_instance)))
+        return
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    print("=" * 104)
+    print(f"SCALING BENCHMARK (offline Google Maps, OR-Tools {args.solver_seconds}s per route, seed {args.seed}, "
+          f"large-instance {args.large_instance})")
+    print("=" * 104)
+    print(f"{'drivers':>8}{'vans':>7}{'wall s':>9}{'peak MB':>9}{'geocode':>9}{'matrix':>8}"
+          f"{'km':>11}{'util %':>8}{'fallbk':>8}{'cluster ms':>12}{'routing ms':>12}")
+    print("-" * 104)
+
+    rows = []
+    for size in sizes:
+        row = run_size_subprocess(size, args.seed, args.solver_seconds, args.large_instance)
+        rows.append(row)
+        print(f"{row['drivers']:>8}{row['vans']:>7}{row['wallSeconds']:>9.2f}{row['peakRssMb']:>9.0f}"
+              f"{row['geocodeCalls']:>9}{row['distanceMatrixCalls']:>8}{row['totalDistanceKm']:>11.1f}"
+              f"{row['avgUtilization']:>8.1f}{row['solverFallbacks']:>8}{row['clusteringMs']:>12.0f}{row['routingMs']:>12.0f}")
+    print("-" * 104)
+
+    artifact = {
+        'benchmark': 'scaling',
+        'createdAt': datetime.now(timezone.utc).isoformat(),
+        'gitRevision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'solverSeconds': args.solver_seconds,
+        'largeInstance': args.large_instance,
+        'results': rows,
+    }
+    with open(args.json, 'w', encoding='utf-8') as f:
+        json.dump(artifact, f, indent=2)
+    with open(args.csv, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Results written to {args.json} and {args.csv}")
+
+    if args.baseline:
+        regressions = compare(rows, args.baseline, args.time_tolerance, args.distance_tolerance)
+        for regression in regressions:
+            print(f"❌ Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"✓ No regressions against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Upload throughput benchmark for roster ingestion (handle_upload).
+
+Runs handle_upload on the bundled data/*.csv rosters, test_maipu_40_drivers.csv
+and the ListadoTraslados export, both as-is and with their data rows replicated
+to simulate large exports, and reports rows/s and MB/s.
+
+Usage:
+    python benchmark_upload.py [--repeat 5] [--scale 1,100,1000]
+"""
+
+import argparse
+import base64
+import contextlib
+import glob
+import io
+import json
+import os
+import statistics
+import time
+
+os.environ.setdefault('ENABLE_RESPONSE_CACHE', 'false')
+
+import lambda_function_updated as lambda_function
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def roster_files():
+    """Bundled CSV rosters used as benchmark inputs"""
+    files = sorted(glob.glob(os.path.join(ROOT, 'data', '*.csv')))
+    files.append(os.path.join(ROOT, 'test_maipu_40_drivers.csv'))
+    files.extend(sorted(glob.glob(os.path.join(ROOT, 'ListadoTraslados*.csv'))))
+    return [f for f in files if os.path.exists(f)]
+
+
+def replicate_rows(content, scale):
+    """Repeat the data rows of a CSV `scale` times, keeping title/header rows once"""
+    if scale == 1:
+        return content
+
+    lines = content.splitlines(keepends=True)
+    header_lines = 2 if lines and lines[0].strip() == b'Table 1' else 1
+    header, rows = lines[:header_lines], lines[header_lines:]
+    if rows and not rows[-1].endswith((b'\n', b'\r')):
+        rows[-1] += b'\n'
+    return b''.join(header + rows * scale)
+
+
+def run_upload(filename, content):
+    """Run handle_upload once and return (seconds, driver_count)"""
+    event = {
+        'body': json.dumps({
+            'filename': filename,
+            'file_content': base64.b64encode(content).decode('ascii')
+        })
+    }
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        response = lambda_function.handle_upload(event)
+        elapsed = time.perf_counter() - started
+        lambda_function.flush_logs()  # Write queued log records while stdout is still redirected
+
+    if response['statusCode'] != 200:
+        raise RuntimeError(f"{filename}: upload failed with {response['statusCode']}: {response['body']}")
+
+    return elapsed, json.loads(response['body'])['count']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark roster upload throughput')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per file and scale (median is reported)')
+    parser.add_argument('--scale', default='1,100,1000', help='Comma-separated row replication factors')
+    args = parser.parse_args()
+
+    scales = [int(s) for s in args.scale.split(',')]
+
+    print("=" * 92)
+    print("UPLOAD THROUGHPUT BENCHMARK")
+    print("=" * 92)
+    print(f"{'File':<42} {'Scale':>6} {'Rows':>8} {'Size MB':>9} {'Median s':>9} {'Rows/s':>10} {'MB/s':>7}")
+    print("-" * 92)
+
+    for path in roster_files():
+        original = open(path, 'rb').read()
+        name = os.path.basename(path)
+
+        for scale in scales:
+            content = replicate_rows(original, scale)
+            size_mb = len(content) / (1024 * 1024)
+
+            timings = []
+            rows = 0
+            for _ in range(args.repeat):
+                elapsed, rows = run_upload(name, content)
+                timings.append(elapsed)
+
+            median = statistics.median(timings)
+            print(f"{name[:42]:<42} {scale:>6} {rows:>8} {size_mb:>9.2f} {median:>9.4f} {rows / median:>10.0f} {size_mb / median:>7.2f}")
+
+    print("=" * 92)
+
+
+if __name__ == "__main__":
+    main()
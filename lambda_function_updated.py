@@ -1,53 +1,303 @@
 import json
 import base64
-import boto3
-import pandas as pd
-import numpy as np
+import codecs
+import csv
+import atexit
+import contextvars
+import logging
+import sys
+import gzip
+import importlib.util
+import io
+import tempfile
 from io import BytesIO
-from datetime import datetime
+from datetime import datetime, timezone, time as dt_time
 import time
 import random
+import math
 import os
-import urllib3
 from urllib.parse import quote
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from geopy.distance import geodesic
-from sklearn.cluster import KMeans
 import uuid
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
 import hashlib
+import threading
+import queue
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 
-# AWS clients
-s3_client = boto3.client('s3')
+try:
+    import orjson  # Optional: faster serialization of compact optimize responses
+except ImportError:
+    orjson = None
+
+try:
+    import brotli  # Optional: enables 'br' Content-Encoding
+except ImportError:
+    brotli = None
+
+# Heavy dependencies (pandas, numpy, scikit-learn, OR-Tools, geopy, boto3) are
+# imported inside the functions that use them, so cold starts and /api/health
+# only pay for the stack a route actually needs (see benchmark_cold_start.py)
+
+# Logging: records are tagged with the request's correlation id and written to
+# stdout by a background thread, so request threads never block on CloudWatch I/O.
+# Per-driver detail is logged at DEBUG, which is off unless LOG_LEVEL=DEBUG or
+# the request is picked by LOG_DEBUG_SAMPLE_RATE.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()  # 'text' or 'json'
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0.0))  # Fraction of requests logged at DEBUG
+
+_log_request_id = contextvars.ContextVar('log_request_id', default='-')
+_log_debug_sampled = contextvars.ContextVar('log_debug_sampled', default=False)
+
+class RequestLogFilter(logging.Filter):
+    """Tags records with the current request id and gates DEBUG records per request"""
+
+    def __init__(self, level):
+        super().__init__()
+        self.level = level
+
+    def filter(self, record):
+        # Runs in the logging thread (before the record is queued), where the context is set
+        record.request_id = _log_request_id.get()
+        return record.levelno >= self.level or _log_debug_sampled.get()
+
+class TextLogFormatter(logging.Formatter):
+    """'time LEVEL [request id] message key=value ...' (fields from extra={'fields': {...}})"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s [%(request_id)s] %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line, for CloudWatch Logs Insights queries"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'requestId': record.request_id,
+            'message': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class StdoutLogHandler(logging.StreamHandler):
+    """StreamHandler writing to whatever sys.stdout is when a record is emitted (honors contextlib.redirect_stdout)"""
+
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+def configure_logging():
+    """
+    Set up the 'route_optimizer' logger behind a queue handler
+
+    Returns:
+        Tuple (logger, queue the records go through)
+    """
+    log = logging.getLogger('route_optimizer')
+    level = logging.getLevelName(LOG_LEVEL)
+    if not isinstance(level, int):
+        level = logging.INFO
+    log.setLevel(min(level, logging.DEBUG) if LOG_DEBUG_SAMPLE_RATE > 0 else level)
+    log.propagate = False
+
+    log_queue = queue.Queue()
+    if not log.handlers:
+        stream_handler = StdoutLogHandler()
+        stream_handler.setFormatter(JsonLogFormatter() if LOG_FORMAT == 'json' else TextLogFormatter())
+        queue_handler = QueueHandler(log_queue)
+        queue_handler.addFilter(RequestLogFilter(level))
+        log.addHandler(queue_handler)
+        listener = QueueListener(log_queue, stream_handler)
+        listener.start()
+        atexit.register(listener.stop)
+    return log, log_queue
+
+logger, _log_queue = configure_logging()
+
+def begin_request_log(request_id=None):
+    """
+    Start the log context of a request (call once per request, in the thread handling it)
+
+    Args:
+        request_id: Correlation id (Lambda request id, X-Request-Id header, job id); generated if missing
+
+    Returns:
+        The request id
+    """
+    request_id = request_id or uuid.uuid4().hex[:16]
+    _log_request_id.set(request_id)
+    _log_debug_sampled.set(LOG_DEBUG_SAMPLE_RATE > 0 and random.random() < LOG_DEBUG_SAMPLE_RATE)
+    return request_id
+
+def flush_logs():
+    """Block until queued log records are written (before a Lambda container is frozen)"""
+    _log_queue.join()
+
+# AWS clients (created on first use)
+_s3_client = None
+
+def get_s3_client():
+    """Shared S3 client, created on first use"""
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+        _s3_client = boto3.client('s3')
+    return _s3_client
 
 # Configuration
 BUCKET_NAME = 'route-optimizer-demo-889268462469'
 
 # Google Maps API Configuration
 GOOGLE_MAPS_API_KEY = os.environ.get('GOOGLE_MAPS_API_KEY', '')
-http = urllib3.PoolManager()
-
-# Response Caching Configuration (for development/testing)
+_http = None
+
+def get_http():
+    """Shared urllib3 connection pool for Google Maps calls, created on first use"""
+    global _http
+    if _http is None:
+        import urllib3
+        _http = urllib3.PoolManager()
+    return _http
+
+# Google Maps calls: per-call timeout, request-wide budget and circuit breaker (GoogleCallBudget)
+GOOGLE_CALL_TIMEOUT_SECONDS = float(os.environ.get('GOOGLE_CALL_TIMEOUT_SECONDS', 10))  # Per call, shrunk to the budget left
+GOOGLE_BUDGET_SECONDS = float(os.environ.get('GOOGLE_BUDGET_SECONDS', 90))  # Per optimization without timeBudgetSeconds (Lambda timeout: 120 s)
+GOOGLE_MIN_CALL_SECONDS = 0.5  # Calls that would get less time than this are skipped
+GOOGLE_BREAKER_FAILURES = int(os.environ.get('GOOGLE_BREAKER_FAILURES', 5))  # Consecutive failed calls that open a request's breaker
+GOOGLE_FAILURE_STATUSES = {'ERROR', 'OVER_QUERY_LIMIT', 'UNKNOWN_ERROR', 'REQUEST_DENIED', 'HTTP_429'}  # Plus any HTTP 5xx
+
+# Response Caching Configuration
 ENABLE_CACHE = os.environ.get('ENABLE_RESPONSE_CACHE', 'true').lower() == 'true'
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'local').lower()  # 'local' or 's3'
 CACHE_DIR = Path(os.environ.get('CACHE_DIR', './cache_responses'))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 256 * 1024 * 1024))  # 256 MB
+CACHE_TTL_SECONDS = int(os.environ.get('CACHE_TTL_SECONDS', 7 * 24 * 3600))  # 7 days
+CACHE_S3_BUCKET = os.environ.get('CACHE_S3_BUCKET', BUCKET_NAME)
+CACHE_S3_PREFIX = os.environ.get('CACHE_S3_PREFIX', 'cache_responses/')
+CACHE_S3_ENDPOINT_URL = os.environ.get('CACHE_S3_ENDPOINT_URL') or None  # e.g. http://localhost:9000 (MinIO)
+CACHE_EVICT_INTERVAL_SECONDS = float(os.environ.get('CACHE_EVICT_INTERVAL_SECONDS', 300))  # Full scan at most this often, unless the size estimate is over
+CACHE_EVICT_LOW_WATER = 0.9  # Evictions go down to this fraction of CACHE_MAX_BYTES, so the next puts don't rescan
+CACHE_TOUCH_INTERVAL_SECONDS = float(os.environ.get('CACHE_TOUCH_INTERVAL_SECONDS', 3600))  # S3 LRU clock resolution
+CACHE_KEY_VERSION = 'v3'  # Bump when the canonical request or stored format changes
+
+# Stage memoization: geocodes, travel times, clusters and routes reused across requests
+STAGE_MEMO_MAX_ENTRIES = int(os.environ.get('STAGE_MEMO_MAX_ENTRIES', 50000))
+
+# Instrumentation: Prometheus text at /api/metrics, per-request 'timings' in optimize responses
+METRICS_PREFIX = 'route_optimizer'
+METRICS_DIR = os.environ.get('METRICS_DIR') or None  # Shared by server and job worker processes: /api/metrics adds them up
+
+# On-demand profiling of single optimize requests ({"profile": true} or X-Profile header)
+ENABLE_PROFILING = os.environ.get('ENABLE_PROFILING', 'false').lower() == 'true'
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', './profiles'))
+PROFILE_DEFAULT_MODE = os.environ.get('PROFILE_MODE', 'sampling').lower()  # 'sampling' or 'deterministic'
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 5))
+
+# Parallel geocoding (max 10 workers to avoid overwhelming the API)
+GEOCODE_MAX_WORKERS = 10
+
+# Hedged geocoding: strategies 2 and 3 sent speculatively when strategy 1 is slow or finds no valid match
+GEOCODE_HEDGING = os.environ.get('GEOCODE_HEDGING', 'true').lower() == 'true'
+GEOCODE_HEDGE_DELAY_MS = float(os.environ.get('GEOCODE_HEDGE_DELAY_MS', 400))  # Strategy 1 slower than this is hedged
+GEOCODE_HEDGE_EXTRA_RATIO = float(os.environ.get('GEOCODE_HEDGE_EXTRA_RATIO', 0.25))  # Wasted requests allowed per request made
+GEOCODE_HEDGE_MIN_EXTRA_CALLS = 5  # Allowance before the ratio kicks in (small rosters)
+GEOCODE_HEDGE_WORKERS = int(os.environ.get('GEOCODE_HEDGE_WORKERS', 32))  # Process-wide pool for strategy requests
+GEOCODE_PROGRESS_EVENTS = 50  # Approximate number of progress events streamed per request
+
+# Batch optimization (/api/optimize/batch)
+BATCH_MAX_ROSTERS = int(os.environ.get('BATCH_MAX_ROSTERS', 31))  # A month of daily rosters
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 2))  # Rosters optimized concurrently
 
-# Create cache directory if it doesn't exist
 if ENABLE_CACHE:
-    CACHE_DIR.mkdir(parents=True, exist_ok=True)
-    print(f"✓ Response caching ENABLED - Cache dir: {CACHE_DIR}")
+    cache_location = f"s3://{CACHE_S3_BUCKET}/{CACHE_S3_PREFIX}" if CACHE_BACKEND == 's3' else CACHE_DIR
+    logger.info("Response caching enabled - backend: %s, location: %s", CACHE_BACKEND, cache_location)
+
+# Compact Response Configuration
+COMPACT_RESPONSE_VERSION = 1
+COMPACT_FLOAT_DECIMALS = 2  # Distances, times and percentages
+COMPACT_COORD_DECIMALS = 6  # Driver table coordinates (~0.1 m)
+POLYLINE_PRECISION = 5  # Google encoded polyline default (~1 m)
+RESPONSE_COMPRESSION_MIN_BYTES = 1024  # Smaller bodies are sent uncompressed
+VAN_DRIVER_FIELDS = ['pickup_location']  # Per-vehicle annotations, moved onto the van in compact responses
+STREAM_CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'sse': 'text/event-stream'}  # /api/optimize/stream formats
 
 # Fleet Configuration
 DEFAULT_NUM_VANS = 10  # Flota estándar de 10 vans
 VAN_CAPACITY = 10  # Capacidad máxima por van
 BUS_CAPACITY = 40  # Capacidad del bus de acercamiento
+ROUTE_SOLVER_TIME_LIMIT_SECONDS = float(os.environ.get('ROUTE_SOLVER_TIME_LIMIT_SECONDS', 30))  # OR-Tools limit per route (fractions allowed)
+SOLVER_MIN_SECONDS = 0.05  # Routes with less of the request's deadline left skip OR-Tools (nearest neighbor + 2-opt)
+
+# Route solver strategies ('FIRST_SOLUTION/METAHEURISTIC', OR-Tools routing_enums_pb2 names)
+DEFAULT_SOLVER_STRATEGY = 'PATH_CHEAPEST_ARC/GUIDED_LOCAL_SEARCH'
+# Learned per-size defaults, e.g. "8=SAVINGS/GUIDED_LOCAL_SEARCH,20=CHRISTOFIDES/TABU_SEARCH" (routes up to N stops)
+SOLVER_STRATEGY_BY_SIZE = sorted(
+    (int(size), strategy.strip()) for size, strategy in
+    (entry.split('=', 1) for entry in os.environ.get('SOLVER_STRATEGY_BY_SIZE', '').split(',') if entry.strip())
+)
+# Portfolio mode: several strategies race on the same route in separate processes, best solution wins
+SOLVER_PORTFOLIO = os.environ.get('SOLVER_PORTFOLIO', 'false').lower() == 'true'  # Default for requests without solverPortfolio
+SOLVER_PORTFOLIO_STRATEGIES = [s.strip() for s in os.environ.get(
+    'SOLVER_PORTFOLIO_STRATEGIES',
+    'PATH_CHEAPEST_ARC/GUIDED_LOCAL_SEARCH,SAVINGS/GUIDED_LOCAL_SEARCH,'
+    'CHRISTOFIDES/SIMULATED_ANNEALING,PATH_CHEAPEST_ARC/TABU_SEARCH'
+).split(',') if s.strip()]
+SOLVER_PORTFOLIO_WORKERS = int(os.environ.get('SOLVER_PORTFOLIO_WORKERS', os.cpu_count() or 1))  # Solver processes per container
+SOLVER_PORTFOLIO_MIN_STOPS = int(os.environ.get('SOLVER_PORTFOLIO_MIN_STOPS', 6))  # Smaller routes use one strategy
+SOLVER_PORTFOLIO_MIN_SECONDS = float(os.environ.get('SOLVER_PORTFOLIO_MIN_SECONDS', 2.0))  # Shorter time limits (large-instance routes) use one strategy
+SOLVER_PORTFOLIO_GRACE_SECONDS = 2.0  # Past the time limit before a silent solver process is replaced
+SOLVER_SIZE_BUCKETS = (5, 10, 20, 50)  # Route sizes (stops) for portfolio win statistics
+
+# Route geometry (/api/route-geometry): street-level polylines for the map, cached per leg
+ROUTE_GEOMETRY_MAX_VANS = int(os.environ.get('ROUTE_GEOMETRY_MAX_VANS', 200))  # Vans per request
+ROUTE_GEOMETRY_DEFAULT_ZOOM = 12  # MapView's initial zoom
+ROUTE_GEOMETRY_MAX_ZOOM = 22
+ROUTE_GEOMETRY_TOLERANCE_PIXELS = float(os.environ.get('ROUTE_GEOMETRY_TOLERANCE_PIXELS', 1.0))  # Douglas-Peucker tolerance on screen
+WEB_MERCATOR_METERS_PER_PIXEL = 156543.03392  # At zoom 0 on the equator (256 px tiles)
+DIRECTIONS_MAX_WAYPOINTS = 25  # Intermediate waypoints per Directions API request
+
+# Plan KPIs (/api/kpis and the optimize result's 'kpis')
+KPI_MAX_VANS = int(os.environ.get('KPI_MAX_VANS', 5000))  # Vehicles per /api/kpis request
+KPI_UTILIZATION_BINS = (25, 50, 75, 100)  # Utilization histogram bin edges (%)
+
+# Large-instance mode: terminals with more drivers than LARGE_INSTANCE_THRESHOLD are split
+# into spatial partitions, solved in parallel and repaired along partition boundaries
+LARGE_INSTANCE_THRESHOLD = int(os.environ.get('LARGE_INSTANCE_THRESHOLD', 250))  # Drivers per terminal
+LARGE_INSTANCE_PARTITION_SIZE = int(os.environ.get('LARGE_INSTANCE_PARTITION_SIZE', 200))  # Max drivers per partition
+LARGE_INSTANCE_WORKERS = int(os.environ.get('LARGE_INSTANCE_WORKERS', 4))  # Partitions solved in parallel
+LARGE_INSTANCE_ROUTE_SECONDS = float(os.environ.get('LARGE_INSTANCE_ROUTE_SECONDS', 1.0))  # OR-Tools limit per route
+BOUNDARY_REPAIR_NEIGHBORS = 4  # Nearest vans of other partitions considered for each boundary stop
+
+# Spatial index (SpatialIndex): proximity queries for route builders, local search and geocode checks
+KM_PER_DEGREE = 111.195  # Mean length of one degree of latitude
+NEAREST_NEIGHBOR_BATCH = 8  # Points fetched per nearest-unvisited query (widened as needed)
+TWO_OPT_CANDIDATES = 8  # 2-opt only tries reconnecting each stop to its nearest stops
+CO_LOCATION_RADIUS_KM = 0.01  # Drivers closer than this share a geocode
+CO_LOCATION_MIN_ADDRESSES = 3  # Distinct addresses on one spot that mark it as an approximate geocode
 
 # Travel Time Estimation Configuration
 CITY_SPEED_KMH = 60  # Promedio entre 50-70 km/h para ciudad
 HIGHWAY_SPEED_KMH = 105  # Promedio entre 90-120 km/h para autopista
 CITY_DISTANCE_THRESHOLD = 15  # km - distancias < 15km se consideran ciudad
-SAFETY_BUFFER = 1.2  # 20% buffer de seguridad
+SAFETY_BUFFER = 1.2  # 20% buffer de seguridad (default; each request sets its own via OptimizationContext)
 PICKUP_TIME_MINUTES = 5  # Tiempo estimado de recogida por pasajero
 
 # Distance Calculation Strategy:
@@ -92,13 +342,132 @@ KNOWN_TERMINALS = {
     }
 }
 
+# Approximate comuna centers, used offline when Google Maps calls are skipped (breaker open, budget spent)
+OFFLINE_COMUNA_CENTERS = {
+    'santiago': (-33.4378, -70.6504),
+    'providencia': (-33.4314, -70.6093),
+    'las condes': (-33.4080, -70.5670),
+    'vitacura': (-33.3900, -70.5780),
+    'lo barnechea': (-33.3500, -70.5180),
+    'nunoa': (-33.4569, -70.5979),
+    'la reina': (-33.4450, -70.5400),
+    'penalolen': (-33.4850, -70.5400),
+    'macul': (-33.4900, -70.5990),
+    'la florida': (-33.5220, -70.5980),
+    'puente alto': (-33.6110, -70.5750),
+    'la pintana': (-33.5840, -70.6340),
+    'la granja': (-33.5360, -70.6200),
+    'san ramon': (-33.5380, -70.6420),
+    'la cisterna': (-33.5290, -70.6640),
+    'el bosque': (-33.5620, -70.6750),
+    'san bernardo': (-33.5920, -70.7000),
+    'lo espejo': (-33.5200, -70.6900),
+    'pedro aguirre cerda': (-33.4920, -70.6760),
+    'san miguel': (-33.4970, -70.6510),
+    'san joaquin': (-33.4950, -70.6280),
+    'estacion central': (-33.4580, -70.6980),
+    'cerrillos': (-33.4970, -70.7160),
+    'maipu': (-33.5100, -70.7570),
+    'pudahuel': (-33.4400, -70.7500),
+    'quinta normal': (-33.4280, -70.6980),
+    'lo prado': (-33.4440, -70.7250),
+    'cerro navia': (-33.4250, -70.7350),
+    'renca': (-33.4050, -70.7280),
+    'quilicura': (-33.3580, -70.7300),
+    'conchali': (-33.3850, -70.6750),
+    'huechuraba': (-33.3700, -70.6350),
+    'independencia': (-33.4160, -70.6650),
+    'recoleta': (-33.4060, -70.6400),
+    'padre hurtado': (-33.5700, -70.8150),
+    'colina': (-33.2000, -70.6750),
+    'lampa': (-33.2850, -70.8750),
+    'buin': (-33.7330, -70.7420),
+    'calera de tango': (-33.6300, -70.7800),
+    'penaflor': (-33.6060, -70.8760),
+    'talagante': (-33.6640, -70.9280),
+}
+
 # Terminals that use bus mode
 TERMINALS_WITH_BUS = ['maipu', 'maipú', 'terminal maipu', 'terminal maipú']
 
+# Roster upload: accepted column names per field (first match wins)
+ROSTER_NAME_COLUMNS = ['Nombre Completo', 'Nombre', 'Name']
+ROSTER_ADDRESS_COLUMNS = ['Dirección', 'Dirección Casa', 'Address']
+ROSTER_TERMINAL_COLUMNS = ['Lugar de presentación', 'Terminal Destino', 'Terminal', 'Deposito']
+ROSTER_TIME_COLUMNS = ['Hora de presentación', 'Hora Presentación', 'Hora']
+ROSTER_COMMUNE_COLUMNS = ['Comuna']
+ROSTER_CODE_COLUMNS = ['Código OB', 'Código']  # All present columns are used, in order, as fallbacks
+ROSTER_PHONE_COLUMNS = ['Celular']
+ROSTER_RUT_COLUMNS = ['Rut']
+
+# Plan export (/api/export): one row per stop, headed with the roster column names handle_upload reads
+EXPORT_COLUMNS = [
+    'Van', 'Orden', ROSTER_CODE_COLUMNS[0], ROSTER_NAME_COLUMNS[0], ROSTER_RUT_COLUMNS[0], ROSTER_PHONE_COLUMNS[0],
+    ROSTER_ADDRESS_COLUMNS[0], 'Hora de recogida', ROSTER_TIME_COLUMNS[0], ROSTER_TERMINAL_COLUMNS[0],
+    'Destino', 'Latitud', 'Longitud'
+]
+EXPORT_CONTENT_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv; charset=utf-8'
+}
+EXPORT_CSV_DELIMITER = ';'  # Like the dispatch rosters (Excel with Chilean locale)
+EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', 500))  # CSV rows per streamed chunk
+EXPORT_CHUNK_BYTES = 64 * 1024  # xlsx bytes per streamed chunk
+
+UPLOAD_SNIFF_BYTES = 64 * 1024  # Only this prefix is decoded to detect the CSV layout
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 20 * 1024 * 1024))  # 20 MB
+UPLOAD_SPOOL_BYTES = int(os.environ.get('UPLOAD_SPOOL_BYTES', 4 * 1024 * 1024))  # Spill to /tmp above this
+UPLOAD_CHUNK_BYTES = 64 * 1024
+ROSTER_CHUNK_ROWS = 50  # Rows parsed per chunk when streaming a roster into the optimizer
+CSV_CANDIDATE_DELIMITERS = [';', ',', '\t', '|']
+
 def cors_headers():
     """Return empty headers - CORS is handled by Lambda Function URL configuration"""
     return {}
 
+def _normalize_cache_value(value):
+    """Recursively sort dict keys so equivalent payloads serialize the same (strings are kept as sent)"""
+    if isinstance(value, dict):
+        return {str(k): _normalize_cache_value(v) for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, (list, tuple)):
+        return [_normalize_cache_value(v) for v in value]
+    if isinstance(value, float):
+        return round(value, 6)
+    return value
+
+def canonicalize_request(data):
+    """
+    Build the canonical form of an optimize request used for cache keys
+
+    - Drivers are treated as a set: each driver is normalized and the list is
+      sorted, so reordering the same roster produces the same key
+    - Config is filled with the same defaults handle_optimize applies, so an
+      omitted value and its explicit default hash identically
+
+    Args:
+        data: Request data (dict)
+
+    Returns:
+        Canonical request (dict)
+    """
+    drivers = [_normalize_cache_value(d) for d in data.get('drivers', [])]
+    drivers.sort(key=lambda d: json.dumps(d, sort_keys=True, default=str))
+
+    config = dict(data.get('config') or {})
+    num_vans = config.get('numVans')
+    config['numVans'] = int(num_vans) if num_vans is not None else DEFAULT_NUM_VANS
+    config['safetyMargin'] = round(float(config.get('safetyMargin', 0.20)), 4)
+    config['vanCapacity'] = int(config.get('vanCapacity') or VAN_CAPACITY)
+    config['busCapacity'] = int(config.get('busCapacity') or BUS_CAPACITY)
+    terminal = config.get('destinationTerminal')
+    config['destinationTerminal'] = terminal or None  # '' and None both keep the roster's terminals
+
+    # 'format' only selects the response encoding and 'profile' only adds a profile; the cached result is the same
+    canonical = {k: _normalize_cache_value(v) for k, v in data.items() if k not in ('drivers', 'config', 'format', 'profile')}
+    canonical['drivers'] = drivers
+    canonical['config'] = _normalize_cache_value(config)
+    return canonical
+
 def generate_cache_key(data):
     """
     Generate a cache key from request data
@@ -107,17 +476,283 @@ def generate_cache_key(data):
         data: Request data (dict)
 
     Returns:
-        Cache key (hash of the data)
+        Cache key (hash of the canonical request)
     """
-    # Create a stable string representation of the data
-    # Sort keys to ensure consistent hashing
-    data_str = json.dumps(data, sort_keys=True, default=str)
+    # Canonicalize so driver order and omitted config defaults don't change the key
+    data_str = json.dumps(canonicalize_request(data), sort_keys=True, separators=(',', ':'), default=str)
 
-    # Generate SHA256 hash
-    cache_key = hashlib.sha256(data_str.encode()).hexdigest()
+    # Generate SHA256 hash (versioned so format changes never read stale entries)
+    cache_key = hashlib.sha256(f"{CACHE_KEY_VERSION}:{data_str}".encode()).hexdigest()
 
     return cache_key
 
+class CacheEvictionSchedule:
+    """
+    Decides when a cache backend rescans its storage for eviction
+
+    Keeps a running size estimate (the last scan's total plus the bytes put
+    since), so puts only trigger a scan when the estimate exceeds max_bytes or
+    the interval has passed (expired entries, writes by other processes). The
+    first put always scans, and only one thread scans at a time.
+    """
+
+    def __init__(self, max_bytes, interval_seconds=CACHE_EVICT_INTERVAL_SECONDS):
+        self.max_bytes = max_bytes
+        self.interval_seconds = interval_seconds
+        self.estimated_bytes = None  # Unknown until the first scan
+        self._last_scan = None
+        self._scanning = False
+        self._lock = threading.Lock()
+
+    def added(self, nbytes):
+        """
+        Account for a put and claim the next scan if one is due
+
+        Returns:
+            True if the caller should scan now (and then call scanned())
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.estimated_bytes is not None:
+                self.estimated_bytes += nbytes
+            if self._scanning:
+                return False
+            due = (self.estimated_bytes is None or self.estimated_bytes > self.max_bytes
+                   or now - self._last_scan >= self.interval_seconds)
+            if due:
+                self._scanning = True
+                self._last_scan = now
+            return due
+
+    def scanned(self, total_bytes):
+        """Record the size left after a scan (None if the scan failed)"""
+        with self._lock:
+            if total_bytes is not None:
+                self.estimated_bytes = total_bytes
+            self._scanning = False
+
+    def target_bytes(self):
+        """Size a scan evicts down to once max_bytes is exceeded"""
+        return int(self.max_bytes * CACHE_EVICT_LOW_WATER)
+
+class LocalCacheBackend:
+    """
+    Cache backend storing one compressed file per key in a local directory
+
+    Files are written to a temp file and renamed into place, so concurrent
+    workers never observe a half-written entry. The file mtime is refreshed
+    on every hit and used as the LRU clock when the directory exceeds max_bytes.
+    The directory is only rescanned when the eviction schedule says so.
+    """
+
+    SUFFIX = '.json.gz'
+
+    def __init__(self, directory, max_bytes, ttl_seconds, evict_interval_seconds=CACHE_EVICT_INTERVAL_SECONDS):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.schedule = CacheEvictionSchedule(max_bytes, evict_interval_seconds)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key):
+        return self.directory / f"{key}{self.SUFFIX}"
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            blob = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path, None)  # LRU touch
+        except FileNotFoundError:
+            pass
+        return blob
+
+    def put(self, key, blob):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-', suffix=self.SUFFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(blob)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        if self.schedule.added(len(blob)):
+            total_bytes = None
+            try:
+                total_bytes = self.evict()
+            finally:
+                self.schedule.scanned(total_bytes)
+
+    def delete(self, key):
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """
+        Drop entries unused for longer than the TTL, then, above max_bytes, least
+        recently used ones down to the schedule's low-water mark
+
+        Returns:
+            Total bytes left
+        """
+        now = time.time()
+        entries = []
+        for path in self.directory.glob(f"*{self.SUFFIX}"):
+            if path.name.startswith('.tmp-'):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.ttl_seconds:
+                path.unlink(missing_ok=True)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        if total_bytes <= self.max_bytes:
+            return total_bytes
+
+        target_bytes = self.schedule.target_bytes()
+        entries.sort(key=lambda e: e[0])
+        for _, size, path in entries:
+            if total_bytes <= target_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+            logger.debug("Cache eviction (LRU): %s", path.name)
+        return total_bytes
+
+class S3CacheBackend:
+    """
+    Cache backend storing compressed entries in an S3-compatible bucket
+
+    Set CACHE_S3_ENDPOINT_URL to point at a local stand-in (MinIO, moto server)
+    for testing. S3 has no access time, so hits re-copy the object onto itself
+    to refresh LastModified, which then serves as the LRU clock; objects
+    refreshed less than touch_interval_seconds ago are not copied again.
+    Listing the prefix for eviction follows the same schedule as the local backend.
+    """
+
+    def __init__(self, bucket, prefix, max_bytes, ttl_seconds, endpoint_url=None,
+                 evict_interval_seconds=CACHE_EVICT_INTERVAL_SECONDS, touch_interval_seconds=CACHE_TOUCH_INTERVAL_SECONDS):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.touch_interval_seconds = touch_interval_seconds
+        self.schedule = CacheEvictionSchedule(max_bytes, evict_interval_seconds)
+        if endpoint_url:
+            import boto3
+            self.client = boto3.client('s3', endpoint_url=endpoint_url)
+        else:
+            self.client = get_s3_client()
+
+    def _object_key(self, key):
+        return f"{self.prefix}{key}{LocalCacheBackend.SUFFIX}"
+
+    def get(self, key):
+        object_key = self._object_key(key)
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=object_key)
+        except self.client.exceptions.NoSuchKey:
+            return None
+        blob = obj['Body'].read()
+        if (datetime.now(timezone.utc) - obj['LastModified']).total_seconds() < self.touch_interval_seconds:
+            return blob
+        try:
+            self.client.copy_object(
+                Bucket=self.bucket,
+                Key=object_key,
+                CopySource={'Bucket': self.bucket, 'Key': object_key},
+                MetadataDirective='REPLACE',
+                ContentType='application/json',
+                ContentEncoding='gzip'
+            )
+        except Exception as e:
+            logger.warning("Could not refresh cache entry access time: %s", e)
+        return blob
+
+    def put(self, key, blob):
+        # Single PUTs are atomic in S3: readers see the old object or the new one, never a partial write
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._object_key(key),
+            Body=blob,
+            ContentType='application/json',
+            ContentEncoding='gzip'
+        )
+        if self.schedule.added(len(blob)):
+            total_bytes = None
+            try:
+                total_bytes = self.evict()
+            finally:
+                self.schedule.scanned(total_bytes)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def evict(self):
+        """
+        Drop entries unused for longer than the TTL, then, above max_bytes, least
+        recently used ones down to the schedule's low-water mark
+
+        Returns:
+            Total bytes left
+        """
+        now = datetime.now(timezone.utc)
+        entries = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                entries.append((obj['LastModified'], obj['Size'], obj['Key']))
+
+        expired = {k for modified, _, k in entries if (now - modified).total_seconds() > self.ttl_seconds}
+        live = [e for e in entries if e[2] not in expired]
+        total_bytes = sum(size for _, size, _ in live)
+
+        live.sort(key=lambda e: e[0])
+        to_delete = list(expired)
+        target_bytes = self.schedule.target_bytes() if total_bytes > self.max_bytes else total_bytes
+        for _, size, object_key in live:
+            if total_bytes <= target_bytes:
+                break
+            to_delete.append(object_key)
+            total_bytes -= size
+
+        # delete_objects accepts at most 1000 keys per call
+        for start in range(0, len(to_delete), 1000):
+            batch = to_delete[start:start + 1000]
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={'Objects': [{'Key': k} for k in batch], 'Quiet': True}
+            )
+        return total_bytes
+
+_cache_backend = None
+
+def get_cache_backend():
+    """Return the configured response cache backend (created on first use)"""
+    global _cache_backend
+    if _cache_backend is None:
+        if CACHE_BACKEND == 's3':
+            _cache_backend = S3CacheBackend(
+                CACHE_S3_BUCKET, CACHE_S3_PREFIX, CACHE_MAX_BYTES, CACHE_TTL_SECONDS,
+                endpoint_url=CACHE_S3_ENDPOINT_URL
+            )
+        else:
+            _cache_backend = LocalCacheBackend(CACHE_DIR, CACHE_MAX_BYTES, CACHE_TTL_SECONDS)
+    return _cache_backend
+
 def get_cached_response(cache_key):
     """
     Get cached response if it exists
@@ -126,30 +761,37 @@ def get_cached_response(cache_key):
         cache_key: Cache key
 
     Returns:
-        Cached response data (dict) or None if not found
+        Cached response data (dict) or None if not found or expired
     """
     if not ENABLE_CACHE:
         return None
 
-    cache_file = CACHE_DIR / f"{cache_key}.json"
-
-    if cache_file.exists():
-        try:
-            with open(cache_file, 'r') as f:
-                cached_data = json.load(f)
+    backend = get_cache_backend()
 
-            print(f"✓ CACHE HIT - Using cached response: {cache_file}")
-            return cached_data
-        except Exception as e:
-            print(f"⚠ Error reading cache file: {e}")
-            return None
+    try:
+        blob = backend.get(cache_key)
+        if blob is not None:
+            entry = json.loads(gzip.decompress(blob))
+
+            if time.time() - entry['created'] > CACHE_TTL_SECONDS:
+                logger.info("Response cache expired - entry older than %ss", CACHE_TTL_SECONDS)
+                backend.delete(cache_key)
+                return None
+
+            logger.info("Response cache hit: %s", cache_key)
+            metrics.inc('cache_requests_total', cache='response', result='hit')
+            return entry['response']
+    except Exception as e:
+        logger.warning("Error reading cache entry: %s", e)
+        return None
 
-    print(f"✗ CACHE MISS - Will compute and cache response")
+    logger.info("Response cache miss")
+    metrics.inc('cache_requests_total', cache='response', result='miss')
     return None
 
 def save_response_to_cache(cache_key, response_data):
     """
-    Save response to cache file
+    Save response to cache as compact, gzip-compressed JSON
 
     Args:
         cache_key: Cache key
@@ -158,15 +800,659 @@ def save_response_to_cache(cache_key, response_data):
     if not ENABLE_CACHE:
         return
 
-    cache_file = CACHE_DIR / f"{cache_key}.json"
+    # Results built while Google calls were skipped (breaker open, budget spent) are recomputed next time
+    if any(issue.get('skippedCalls') for issue in response_data.get('geocodingIssues') or []):
+        logger.info("Response not cached: Google Maps calls were skipped")
+        return
 
     try:
-        with open(cache_file, 'w') as f:
-            json.dump(response_data, f, indent=2, default=str)
+        entry = {'created': time.time(), 'response': response_data}
+        payload = json.dumps(entry, separators=(',', ':'), default=str).encode('utf-8')
+        blob = gzip.compress(payload, compresslevel=6)
+        get_cache_backend().put(cache_key, blob)
 
-        print(f"✓ Response cached to: {cache_file}")
+        logger.info("Response cached: %s (%d bytes compressed, %d raw)", cache_key, len(blob), len(payload))
     except Exception as e:
-        print(f"⚠ Error saving to cache: {e}")
+        logger.warning("Error saving to cache: %s", e)
+
+class StageMemo:
+    """
+    Thread-safe in-process LRU memo for optimize pipeline stages
+
+    Lives for the lifetime of the warm Lambda container / server worker, so a
+    dashboard tweaking config only recomputes the stages whose inputs changed.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (found, value)"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return True, self._entries[key]
+        return False, None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+stage_memo = StageMemo(STAGE_MEMO_MAX_ENTRIES)
+
+def stage_key(stage, *inputs):
+    """Build a memo key for a pipeline stage from the inputs that determine its output"""
+    payload = json.dumps(inputs, sort_keys=True, separators=(',', ':'), default=str)
+    return f"{stage}:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+class StageReport:
+    """
+    Hit/miss counts and elapsed time for one pipeline stage
+
+    Use as a context manager around the stage's work to accumulate elapsed time,
+    or call span() from worker threads to report wall-clock time from the first
+    item started to the last finished; call record() once per memoized item.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.elapsed_seconds = 0.0
+        self._lock = threading.Lock()
+        self._started = None
+        self._span_start = None
+        self._span_end = None
+
+    def record(self, hit):
+        metrics.inc('cache_requests_total', cache=self.name, result='hit' if hit else 'miss')
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def computed(self, count=1):
+        """Count items a stage without a memo computed (reported as misses, no cache metric)"""
+        with self._lock:
+            self.misses += count
+
+    def merge(self, other):
+        """Add the hits/misses of a report filled in by a worker thread (its time is reported with span())"""
+        with self._lock:
+            self.hits += other.hits
+            self.misses += other.misses
+
+    def span(self, started, finished):
+        """Extend the stage's wall-clock span (for per-driver work running in worker threads)"""
+        with self._lock:
+            self._span_start = started if self._span_start is None else min(self._span_start, started)
+            self._span_end = finished if self._span_end is None else max(self._span_end, finished)
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed_seconds += time.perf_counter() - self._started
+        return False
+
+    def to_dict(self):
+        if self.hits + self.misses == 0:
+            status = 'skipped'
+        elif self.misses == 0:
+            status = 'hit'
+        elif self.hits == 0:
+            status = 'recomputed'
+        else:
+            status = 'partial'
+
+        elapsed = self.elapsed_seconds
+        if self._span_start is not None:
+            elapsed += self._span_end - self._span_start
+
+        return {
+            'stage': self.name,
+            'status': status,
+            'hits': self.hits,
+            'misses': self.misses,
+            'elapsedMs': round(elapsed * 1000, 1)
+        }
+
+class MetricsRegistry:
+    """
+    Process-wide counters and duration summaries, rendered as Prometheus text
+
+    Each process keeps its own registry. With a shared directory (METRICS_DIR),
+    processes save snapshots of theirs there after each request or job, and
+    render() adds up every snapshot plus its own live samples, so whichever
+    server worker answers /api/metrics reports the server and job worker
+    processes together. Snapshots of exited processes are kept: counters and
+    summaries stay cumulative across worker restarts. Without a directory
+    (Lambda), each container reports its own registry and Prometheus
+    aggregates across instances when scraping.
+    """
+
+    METRICS = {
+        'google_requests_total': ('counter', 'Google Maps API requests by API, geocoding strategy and status'),
+        'google_request_seconds': ('summary', 'Google Maps API request latency'),
+        'google_skipped_total': ('counter', 'Google Maps API requests skipped by API and reason (circuit_open, deadline)'),
+        'google_breaker_trips_total': ('counter', 'Requests whose Google Maps circuit breaker opened'),
+        'geocode_hedges_total': ('counter', 'Hedged geocodes by trigger (slow, ambiguous) and winning strategy'),
+        'geocode_hedges_dropped_total': ('counter', 'Speculative geocoding requests dropped because the hedge pool was busy'),
+        'cache_requests_total': ('counter', 'Response cache and stage memo lookups by result'),
+        'stage_seconds': ('summary', 'Optimize pipeline stage duration'),
+        'solver_runs_total': ('counter', 'Route solver runs by outcome'),
+        'solver_seconds': ('summary', 'Route solver duration per route'),
+        'solver_portfolio_wins_total': ('counter', 'Solver portfolio races won by strategy and route size'),
+        'optimizations_total': ('counter', 'Optimize pipeline runs by outcome'),
+        'optimization_seconds': ('summary', 'Optimize pipeline duration'),
+        'serialization_seconds': ('summary', 'Optimize response serialization duration by format'),
+        'boundary_repair_moves_total': ('counter', 'Stops moved between partitions by large-instance boundary repair'),
+        'batch_seconds': ('summary', 'Batch optimization duration'),
+    }
+
+    def __init__(self, prefix, directory=None):
+        self.prefix = prefix
+        self.directory = Path(directory) if directory else None
+        self._counters = {}
+        self._summaries = {}
+        self._lock = threading.Lock()
+        self._token = uuid.uuid4().hex[:8]  # Reused pids never overwrite an exited process's snapshot
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            count, total = self._summaries.get(key, (0, 0.0))
+            self._summaries[key] = (count + 1, total + seconds)
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ''
+        escaped = (
+            f'{k}="' + str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+            for k, v in labels
+        )
+        return '{' + ','.join(escaped) + '}'
+
+    def _snapshot_path(self):
+        return self.directory / f'{os.getpid()}-{self._token}.json'
+
+    def write_snapshot(self):
+        """Save this process's samples to the shared directory (no-op without one), for render() elsewhere"""
+        if self.directory is None:
+            return
+        with self._lock:
+            snapshot = {
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'summaries': [[name, labels, count, total] for (name, labels), (count, total) in self._summaries.items()]
+            }
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._snapshot_path()
+            partial = path.with_name(f'{path.name}.{threading.get_ident()}.tmp')
+            partial.write_text(json.dumps(snapshot))
+            os.replace(partial, path)  # Readers never see a partial snapshot
+        except OSError as e:
+            logger.warning("Could not save metrics snapshot: %s", e)
+
+    def _samples(self):
+        """(counters, summaries) of this process plus every other process's snapshot in the shared directory"""
+        with self._lock:
+            counters = dict(self._counters)
+            summaries = dict(self._summaries)
+        if self.directory is None or not self.directory.is_dir():
+            return counters, summaries
+
+        own = self._snapshot_path().name
+        for path in self.directory.glob('*.json'):
+            if path.name == own:
+                continue  # Live samples are newer
+            try:
+                snapshot = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue  # Removed while listing
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, count, total in snapshot['summaries']:
+                key = (name, tuple(map(tuple, labels)))
+                previous_count, previous_total = summaries.get(key, (0, 0.0))
+                summaries[key] = (previous_count + count, previous_total + total)
+        return counters, summaries
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        counters, summaries = self._samples()
+        counters = sorted(counters.items(), key=lambda item: (item[0][0], tuple(map(str, item[0][1]))))
+        summaries = sorted(summaries.items(), key=lambda item: (item[0][0], tuple(map(str, item[0][1]))))
+
+        lines = []
+        for name, (kind, help_text) in self.METRICS.items():
+            metric = f'{self.prefix}_{name}'
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} {kind}')
+            if kind == 'counter':
+                for (sample, labels), value in counters:
+                    if sample == name:
+                        lines.append(f'{metric}{self._labels(labels)} {value}')
+            else:
+                for (sample, labels), (count, total) in summaries:
+                    if sample == name:
+                        lines.append(f'{metric}_count{self._labels(labels)} {count}')
+                        lines.append(f'{metric}_sum{self._labels(labels)} {total:.6f}')
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry(METRICS_PREFIX, METRICS_DIR)
+_active_request_metrics = threading.local()
+
+class RequestMetrics:
+    """
+    Timings, Google Maps calls and solver runs for one optimization
+
+    Google calls made on a thread while collect() is active are attributed to
+    this request; everything is also counted in the process-wide registry.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.google_calls = {}
+        self.solves = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def collect(self):
+        previous = getattr(_active_request_metrics, 'current', None)
+        _active_request_metrics.current = self
+        try:
+            yield self
+        finally:
+            _active_request_metrics.current = previous
+
+    def record_google_call(self, api, strategy, status):
+        key = (api, strategy, status)
+        with self._lock:
+            self.google_calls[key] = self.google_calls.get(key, 0) + 1
+
+    def record_solve(self, outcome, started, stops, **stats):
+        """Record one route solve (outcome: 'ortools', 'deadline', 'fallback' or 'failed')"""
+        elapsed = time.perf_counter() - started
+        metrics.inc('solver_runs_total', outcome=outcome)
+        metrics.observe('solver_seconds', elapsed)
+        with self._lock:
+            self.solves.append({'outcome': outcome, 'stops': stops, 'elapsedMs': round(elapsed * 1000, 1), **stats})
+
+    def to_dict(self, stages):
+        """The response's 'timings' block, from this request's records and its StageReports"""
+        reports = [report.to_dict() for report in stages.values()]
+        with self._lock:
+            google_calls = [
+                {'api': api, 'strategy': strategy, 'status': status, 'count': count}
+                for (api, strategy, status), count in sorted(self.google_calls.items(), key=lambda item: tuple(map(str, item[0])))
+            ]
+            solves = list(self.solves)
+
+        return {
+            'totalMs': round((time.perf_counter() - self.started) * 1000, 1),
+            'stagesMs': {report['stage']: report['elapsedMs'] for report in reports},
+            'solves': solves,
+            'solver': {
+                'runs': len(solves),
+                'elapsedMs': round(sum(solve['elapsedMs'] for solve in solves), 1),
+                'solutions': sum(solve.get('solutions', 0) for solve in solves),
+                'branches': sum(solve.get('branches', 0) for solve in solves)
+            },
+            'googleCalls': google_calls,
+            'cache': {
+                'response': 'miss',
+                'hits': sum(report['hits'] for report in reports),
+                'misses': sum(report['misses'] for report in reports)
+            }
+        }
+
+def record_google_call(api, status, started, strategy=None):
+    """Count a Google Maps API request (process-wide and for the active request, if any)"""
+    labels = {'api': api, 'status': status}
+    if strategy:
+        labels['strategy'] = strategy
+    metrics.inc('google_requests_total', **labels)
+    metrics.observe('google_request_seconds', time.perf_counter() - started, api=api)
+
+    request_metrics = getattr(_active_request_metrics, 'current', None)
+    if request_metrics is not None:
+        request_metrics.record_google_call(api, strategy, status)
+
+class GoogleCallSkipped(Exception):
+    """A Google Maps call was not made: the request's circuit breaker is open or its budget is spent"""
+
+    def __init__(self, api, reason):
+        super().__init__(f"{api} call skipped ({reason})")
+        self.api = api
+        self.reason = reason
+
+_active_google_budget = threading.local()
+
+class GoogleCallBudget:
+    """
+    Deadline budget and circuit breaker shared by one request's Google Maps calls
+
+    Each call gets GOOGLE_CALL_TIMEOUT_SECONDS or the time left before the
+    deadline, whichever is smaller, and is skipped once less than
+    GOOGLE_MIN_CALL_SECONDS remain. After GOOGLE_BREAKER_FAILURES consecutive
+    failed calls the breaker opens for the rest of the request, so the
+    remaining drivers get offline estimates at once instead of each one
+    waiting out the timeouts of a degraded API.
+    """
+
+    REASONS = {'circuit_open': 'circuit breaker open', 'deadline': 'time budget exhausted'}
+
+    def __init__(self, deadline, failure_threshold=GOOGLE_BREAKER_FAILURES):
+        self.deadline = deadline
+        self.failure_threshold = failure_threshold
+        self.consecutive_failures = 0
+        self.opened_status = None  # Status of the failure that opened the breaker
+        self.skipped = {}  # (api, reason) -> calls skipped
+        self.calls = 0  # Calls made
+        self.hedged_calls = 0  # Speculative calls sent (or about to be) and not known to be needed
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def active(self):
+        """Route the Google Maps calls made on this thread through this budget"""
+        previous = getattr(_active_google_budget, 'current', None)
+        _active_google_budget.current = self
+        try:
+            yield self
+        finally:
+            _active_google_budget.current = previous
+
+    def skip_reason(self):
+        """'circuit_open' or 'deadline' when calls must be skipped, None otherwise"""
+        if self.opened_status is not None:
+            return 'circuit_open'
+        if self.deadline - time.monotonic() < GOOGLE_MIN_CALL_SECONDS:
+            return 'deadline'
+        return None
+
+    def call_timeout(self):
+        """Timeout for the next call, in seconds"""
+        return min(GOOGLE_CALL_TIMEOUT_SECONDS, max(0.0, self.deadline - time.monotonic()))
+
+    def record_skip(self, api, reason):
+        metrics.inc('google_skipped_total', api=api, reason=reason)
+        with self._lock:
+            self.skipped[(api, reason)] = self.skipped.get((api, reason), 0) + 1
+
+    def record_result(self, status):
+        """Count a finished call; failures (timeouts, quota, 5xx) in a row open the breaker"""
+        failed = status in GOOGLE_FAILURE_STATUSES or status.startswith('HTTP_5')
+        with self._lock:
+            self.calls += 1
+            if not failed:
+                self.consecutive_failures = 0
+                return
+            self.consecutive_failures += 1
+            if self.consecutive_failures < self.failure_threshold or self.opened_status is not None:
+                return
+            self.opened_status = status
+
+        metrics.inc('google_breaker_trips_total')
+        logger.warning("Google Maps circuit breaker opened after %d consecutive failures (last: %s)",
+                       self.failure_threshold, status)
+
+    def reserve_hedge(self, calls):
+        """
+        Reserve speculative geocoding requests (see hedged_geocode)
+
+        Requests stay reserved unless released, i.e. they count as wasted. At most
+        GEOCODE_HEDGE_MIN_EXTRA_CALLS plus GEOCODE_HEDGE_EXTRA_RATIO of the calls
+        made so far may be wasted, which bounds the extra quota.
+
+        Returns:
+            True if the calls fit in the allowance (and are now reserved)
+        """
+        with self._lock:
+            if self.hedged_calls + calls > GEOCODE_HEDGE_MIN_EXTRA_CALLS + GEOCODE_HEDGE_EXTRA_RATIO * self.calls:
+                return False
+            self.hedged_calls += calls
+            return True
+
+    def release_hedge(self, calls):
+        """Give back reserved calls that the sequential chain would have made anyway"""
+        with self._lock:
+            self.hedged_calls -= calls
+
+    def summary(self):
+        """Calls made, calls skipped (in total and by reason) and breaker state, for timings"""
+        with self._lock:
+            by_reason = {}
+            for (_, reason), count in self.skipped.items():
+                by_reason[reason] = by_reason.get(reason, 0) + count
+            return {
+                'calls': self.calls,
+                'skipped': sum(by_reason.values()),
+                'circuitOpen': by_reason.get('circuit_open', 0),
+                'deadline': by_reason.get('deadline', 0),
+                'breaker': 'open' if self.opened_status is not None else 'closed'
+            }
+
+    def issues(self):
+        """
+        Request-level geocodingIssues entries: breaker state and skipped calls
+
+        Returns:
+            List with one 'warning' issue (driver fields None), or [] if no call was skipped
+        """
+        with self._lock:
+            skipped = dict(self.skipped)
+        if not skipped:
+            return []
+
+        skipped_calls = {}
+        for (api, _), count in skipped.items():
+            skipped_calls[api] = skipped_calls.get(api, 0) + count
+        total = sum(skipped_calls.values())
+
+        if self.opened_status is not None:
+            cause = (f'Google Maps circuit breaker opened after {self.failure_threshold} consecutive '
+                     f'failures ({self.opened_status})')
+        else:
+            cause = 'Time budget for Google Maps calls exhausted'
+        return [{
+            'driver_index': None,
+            'driver_name': None,
+            'address': None,
+            'issue': f'{cause} - {total} call(s) skipped, remaining drivers use offline estimates',
+            'severity': 'warning',
+            'breaker': 'open' if self.opened_status is not None else 'closed',
+            'skippedCalls': skipped_calls
+        }]
+
+def active_google_budget():
+    """The GoogleCallBudget governing this thread's Google Maps calls, if any"""
+    return getattr(_active_google_budget, 'current', None)
+
+def skip_google_call(api):
+    """
+    Check whether this request may call a Google Maps API now
+
+    Returns:
+        None if the call may be made, else the reason ('circuit_open' or
+        'deadline'), with the call counted as skipped
+    """
+    budget = active_google_budget()
+    if budget is None:
+        return None
+    reason = budget.skip_reason()
+    if reason:
+        budget.record_skip(api, reason)
+    return reason
+
+def google_maps_get(api, url, strategy=None):
+    """
+    GET a Google Maps web service URL and record the call
+
+    Under a GoogleCallBudget (see OptimizationContext) the timeout shrinks
+    to the time left, urllib3 does not retry, and the call is not made at
+    all once the request's breaker is open or its budget is spent.
+
+    Args:
+        api: 'geocode', 'distance_matrix' or 'directions' (metric label)
+        url: Request URL (including the key)
+        strategy: Geocoding strategy that issued the call (metric label)
+
+    Returns:
+        tuple: (response, data) - data is the parsed JSON, or None on HTTP errors
+
+    Raises:
+        GoogleCallSkipped: If the request's budget does not allow the call
+    """
+    reason = skip_google_call(api)
+    if reason:
+        raise GoogleCallSkipped(api, reason)
+
+    budget = active_google_budget()
+    timeout = budget.call_timeout() if budget is not None else GOOGLE_CALL_TIMEOUT_SECONDS
+    started = time.perf_counter()
+    status = 'ERROR'
+    try:
+        response = get_http().request('GET', url, timeout=timeout, retries=False if budget is not None else None)
+        if response.status != 200:
+            status = f'HTTP_{response.status}'
+            return response, None
+        data = json.loads(response.data.decode('utf-8'))
+        status = data.get('status', 'UNKNOWN')
+        return response, data
+    finally:
+        record_google_call(api, status, started, strategy)
+        if budget is not None:
+            budget.record_result(status)
+
+class OptimizationContext:
+    """
+    Request-scoped settings for one optimization
+
+    Built from the request config and passed down the pipeline (geocoding,
+    travel times, clustering and routing) instead of overriding module
+    globals, so one process can run many optimizations concurrently.
+
+    Attributes:
+        safety_buffer: Multiplier for estimated travel times (1 + safetyMargin)
+        num_vans: Fleet size per terminal
+        van_capacity: Passengers per van
+        bus_capacity: Passengers on the bus de acercamiento
+        destination_terminal: Terminal applied to every driver (None = use the roster's)
+        terminal_overrides: Coordinates by terminal lookup key, checked before KNOWN_TERMINALS
+        deadline: time.monotonic() after which Google calls are skipped and the
+            solver stops early (None = no deadline)
+        large_instance: Force large-instance mode on/off (None = above LARGE_INSTANCE_THRESHOLD drivers)
+        solver_portfolio: Race several solver strategies per route (SOLVER_PORTFOLIO unless configured)
+        metrics: RequestMetrics collecting this optimization's timings
+        google: GoogleCallBudget for this optimization's Google Maps calls (until the
+            deadline, or GOOGLE_BUDGET_SECONDS without one)
+    """
+
+    def __init__(self, safety_buffer=SAFETY_BUFFER, num_vans=DEFAULT_NUM_VANS, van_capacity=VAN_CAPACITY,
+                 bus_capacity=BUS_CAPACITY, destination_terminal=None, terminal_overrides=None, deadline=None,
+                 large_instance=None, solver_portfolio=SOLVER_PORTFOLIO):
+        self.safety_buffer = safety_buffer
+        self.num_vans = num_vans
+        self.van_capacity = van_capacity
+        self.bus_capacity = bus_capacity
+        self.destination_terminal = destination_terminal
+        self.terminal_overrides = terminal_overrides or {}
+        self.deadline = deadline
+        self.large_instance = large_instance
+        self.solver_portfolio = solver_portfolio
+        self.metrics = RequestMetrics()
+        self.google = GoogleCallBudget(deadline if deadline is not None else time.monotonic() + GOOGLE_BUDGET_SECONDS)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build the context from a request config
+
+        Args:
+            config: Request config (numVans, safetyMargin, destinationTerminal,
+                vanCapacity, busCapacity, terminals, timeBudgetSeconds, largeInstance, solverPortfolio)
+
+        Raises:
+            ValueError: If a value has the wrong type (largeInstance and solverPortfolio must be
+                JSON booleans) or a terminal override has no lat/lng
+        """
+        num_vans = config.get('numVans')
+        time_budget = config.get('timeBudgetSeconds')
+        large_instance = config.get('largeInstance')
+        solver_portfolio = config.get('solverPortfolio')
+        for key, value in (('largeInstance', large_instance), ('solverPortfolio', solver_portfolio)):
+            if value is not None and not isinstance(value, bool):
+                raise ValueError(f'Invalid optimization config: {key} must be true or false')
+
+        terminal_overrides = {}
+        for name, coords in (config.get('terminals') or {}).items():
+            try:
+                terminal_overrides[terminal_lookup_key(name)] = {'lat': float(coords['lat']), 'lng': float(coords['lng'])}
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f"Invalid terminal override for '{name}': lat/lng required")
+
+        try:
+            return cls(
+                safety_buffer=1.0 + float(config.get('safetyMargin', 0.20)),
+                num_vans=int(num_vans) if num_vans is not None else DEFAULT_NUM_VANS,
+                van_capacity=int(config.get('vanCapacity') or VAN_CAPACITY),
+                bus_capacity=int(config.get('busCapacity') or BUS_CAPACITY),
+                destination_terminal=config.get('destinationTerminal'),
+                terminal_overrides=terminal_overrides,
+                deadline=time.monotonic() + float(time_budget) if time_budget else None,
+                large_instance=large_instance,
+                solver_portfolio=solver_portfolio if solver_portfolio is not None else SOLVER_PORTFOLIO
+            )
+        except TypeError as e:
+            raise ValueError(f"Invalid optimization config: {e}")
+
+    def remaining_seconds(self):
+        """Seconds left before the deadline (None when there is no deadline)"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def solver_time_limit(self, seconds):
+        """Cap a solver time limit to the time left; None once less than SOLVER_MIN_SECONDS is left"""
+        remaining = self.remaining_seconds()
+        if remaining is None:
+            return seconds
+        if remaining < SOLVER_MIN_SECONDS:
+            return None
+        return min(seconds, remaining)
+
+    def uses_large_instance(self, num_drivers):
+        """Whether a terminal group of num_drivers is solved in large-instance mode"""
+        if self.large_instance is not None:
+            return self.large_instance
+        return num_drivers > LARGE_INSTANCE_THRESHOLD
+
+    def terminal_coord(self, terminal_name):
+        """Terminal coordinates, honoring this request's overrides"""
+        override = self.terminal_overrides.get(terminal_lookup_key(terminal_name))
+        if override:
+            logger.debug("Using configured coordinates for terminal: %s", terminal_name)
+            return dict(override)
+        with self.metrics.collect(), self.google.active():
+            return geocode_terminal(terminal_name)
 
 def clean_address_for_geocoding(address):
     """
@@ -195,6 +1481,10 @@ def clean_address_for_geocoding(address):
 
     return address
 
+def terminal_lookup_key(terminal_name):
+    """Normalize a terminal name for lookups: name before parentheses, lowercase"""
+    return terminal_name.split('(')[0].strip().lower()
+
 def geocode_terminal(terminal_name):
     """
     Geocode a terminal, checking known terminals first
@@ -207,17 +1497,18 @@ def geocode_terminal(terminal_name):
     """
     # Normalize terminal name for lookup
     # Extract terminal name before parentheses if present
-    terminal_lookup = terminal_name.split('(')[0].strip().lower()
+    terminal_lookup = terminal_lookup_key(terminal_name)
 
     # Check if this is a known terminal
     if terminal_lookup in KNOWN_TERMINALS:
         coords = KNOWN_TERMINALS[terminal_lookup]
-        print(f"  ✓ Using known coordinates for terminal: {terminal_name}")
+        logger.debug("Using known coordinates for terminal: %s", terminal_name)
         return {'lat': coords['lat'], 'lng': coords['lng']}
 
     # If not known, fall back to geocoding
-    print(f"  Terminal not in known list, geocoding: {terminal_name}")
-    return geocode_address(terminal_name)
+    logger.info("Terminal not in known list, geocoding: %s", terminal_name)
+    coords, _ = geocode_address_memoized(terminal_name)
+    return coords
 
 def is_in_comuna(geocode_result, expected_comuna):
     """
@@ -256,34 +1547,27 @@ def geocode_address(address):
     Geocode an address to lat/lng coordinates using Google Maps Geocoding API
     with multiple fallback strategies and comuna validation
     """
-    if not GOOGLE_MAPS_API_KEY:
-        print(f"  ❌ ERROR: GOOGLE_MAPS_API_KEY not configured")
-        return {
-            'lat': -33.4489 + (random.random() - 0.5) * 0.1,
-            'lng': -70.6693 + (random.random() - 0.5) * 0.1
-        }
-
-    # Clean the address first
-    cleaned_address = clean_address_for_geocoding(address)
+    coords, _ = geocode_address_with_strategy(address)
+    return coords
 
-    # Extract comuna if present (after last comma)
-    parts = cleaned_address.rsplit(',', 1)
-    base_address = parts[0].strip()
-    comuna = parts[1].strip() if len(parts) > 1 else None
+def geocode_full_address(cleaned_address, comuna):
+    """
+    Strategy 1: the full cleaned address, validated against its comuna
 
-    # Strategy 1: Try full cleaned address with comuna validation
+    Returns:
+        tuple: (coords, 'full_address'), or None if no valid result
+    """
     try:
         query = f"{cleaned_address}, Santiago, Chile"
-        print(f"  Trying: {query}")
+        logger.debug("Trying: %s", query)
 
         url = f"https://maps.googleapis.com/maps/api/geocode/json?address={quote(query)}&key={GOOGLE_MAPS_API_KEY}"
-        response = http.request('GET', url, timeout=10.0)
+        response, data = google_maps_get('geocode', url, 'full_address')
 
-        if response.status == 200:
-            data = json.loads(response.data.decode('utf-8'))
+        if data is not None:
             if data.get('status') == 'OK' and len(data.get('results', [])) > 0:
                 results = data.get('results', [])
-                print(f"  → Google Maps returned {len(results)} result(s)")
+                logger.debug("Google Maps returned %d result(s)", len(results))
 
                 # If comuna is specified, validate all results against it
                 if comuna:
@@ -291,150 +1575,369 @@ def geocode_address(address):
                         if is_in_comuna(result, comuna):
                             location = result['geometry']['location']
                             formatted_address = result.get('formatted_address', 'N/A')
-                            print(f"  ✓ Match found in {comuna}: {formatted_address}")
-                            return {'lat': location['lat'], 'lng': location['lng']}
+                            logger.debug("Match found in %s: %s", comuna, formatted_address)
+                            return {'lat': location['lat'], 'lng': location['lng']}, 'full_address'
 
                     # No result matched the expected comuna
-                    print(f"  ⚠ None of the {len(results)} results matched comuna '{comuna}'")
-                    print(f"  → Falling back to Strategy 2")
+                    logger.debug("None of the %d results matched comuna '%s', falling back to strategy 2", len(results), comuna)
                 else:
                     # No comuna specified, use first result
                     location = results[0]['geometry']['location']
                     formatted_address = results[0].get('formatted_address', 'N/A')
-                    print(f"  ✓ Geocoded (no comuna filter): {formatted_address}")
-                    return {'lat': location['lat'], 'lng': location['lng']}
+                    logger.debug("Geocoded (no comuna filter): %s", formatted_address)
+                    return {'lat': location['lat'], 'lng': location['lng']}, 'full_address'
             elif data.get('status') == 'ZERO_RESULTS':
-                print(f"  Strategy 1: No results found")
+                logger.debug("Strategy 1: no results found")
             else:
-                print(f"  Strategy 1 failed: {data.get('status')}")
+                logger.debug("Strategy 1 failed: %s", data.get('status'))
     except Exception as e:
-        print(f"  Strategy 1 failed: {e}")
+        logger.debug("Strategy 1 failed: %s", e)
+    return None
 
-    # Strategy 2: Try without number (just street and comuna)
-    if base_address and comuna:
-        try:
-            import re
-            street_only = re.sub(r'\d+', '', base_address).strip()
-            query = f"{street_only}, {comuna}, Santiago, Chile"
-            print(f"  Trying: {query}")
-
-            url = f"https://maps.googleapis.com/maps/api/geocode/json?address={quote(query)}&key={GOOGLE_MAPS_API_KEY}"
-            response = http.request('GET', url, timeout=10.0)
-
-            if response.status == 200:
-                data = json.loads(response.data.decode('utf-8'))
-                if data.get('status') == 'OK' and len(data.get('results', [])) > 0:
-                    results = data.get('results', [])
-                    print(f"  → Google Maps returned {len(results)} result(s)")
-
-                    # Validate results against comuna
-                    for result in results:
-                        if is_in_comuna(result, comuna):
-                            location = result['geometry']['location']
-                            formatted_address = result.get('formatted_address', 'N/A')
-                            print(f"  ✓ Match found (street only) in {comuna}: {formatted_address}")
-                            return {'lat': location['lat'], 'lng': location['lng']}
+def geocode_street_only(base_address, comuna):
+    """
+    Strategy 2: the street without its number, validated against the comuna
 
-                    # If no match, log but continue to Strategy 3
-                    print(f"  ⚠ Strategy 2: No results matched comuna '{comuna}'")
-        except Exception as e:
-            print(f"  Strategy 2 failed: {e}")
+    Returns:
+        tuple: (coords, 'street_only'), or None if no valid result
+    """
+    try:
+        import re
+        street_only = re.sub(r'\d+', '', base_address).strip()
+        query = f"{street_only}, {comuna}, Santiago, Chile"
+        logger.debug("Trying: %s", query)
 
-    # Strategy 3: Try just the comuna
-    if comuna:
-        try:
-            query = f"{comuna}, Santiago, Chile"
-            print(f"  Trying: {query}")
-
-            url = f"https://maps.googleapis.com/maps/api/geocode/json?address={quote(query)}&key={GOOGLE_MAPS_API_KEY}"
-            response = http.request('GET', url, timeout=10.0)
-
-            if response.status == 200:
-                data = json.loads(response.data.decode('utf-8'))
-                if data.get('status') == 'OK' and len(data.get('results', [])) > 0:
-                    location = data['results'][0]['geometry']['location']
-                    print(f"  ⚠ Using comuna center: {comuna}")
-                    # Add small random offset to avoid all addresses in same comuna overlapping
-                    return {
-                        'lat': location['lat'] + (random.random() - 0.5) * 0.01,
-                        'lng': location['lng'] + (random.random() - 0.5) * 0.01
-                    }
-        except Exception as e:
-            print(f"  Strategy 3 failed: {e}")
+        url = f"https://maps.googleapis.com/maps/api/geocode/json?address={quote(query)}&key={GOOGLE_MAPS_API_KEY}"
+        response, data = google_maps_get('geocode', url, 'street_only')
 
-    # Fallback: Use Santiago center with warning
-    print(f"  ❌ GEOCODING FAILED for: {address}")
-    print(f"  ⚠ Using Santiago center as fallback")
-    return {
-        'lat': -33.4489 + (random.random() - 0.5) * 0.1,
-        'lng': -70.6693 + (random.random() - 0.5) * 0.1
-    }
+        if data is not None:
+            if data.get('status') == 'OK' and len(data.get('results', [])) > 0:
+                results = data.get('results', [])
+                logger.debug("Google Maps returned %d result(s)", len(results))
+
+                # Validate results against comuna
+                for result in results:
+                    if is_in_comuna(result, comuna):
+                        location = result['geometry']['location']
+                        formatted_address = result.get('formatted_address', 'N/A')
+                        logger.debug("Match found (street only) in %s: %s", comuna, formatted_address)
+                        return {'lat': location['lat'], 'lng': location['lng']}, 'street_only'
+
+                # If no match, log but continue to Strategy 3
+                logger.debug("Strategy 2: no results matched comuna '%s'", comuna)
+    except Exception as e:
+        logger.debug("Strategy 2 failed: %s", e)
+    return None
 
-def get_route_distance_and_time(origin_coord, destination_coord):
+def geocode_comuna_center(comuna):
     """
-    Get real road distance and travel time using Google Maps Distance Matrix API
-
-    Args:
-        origin_coord: Dict with 'lat' and 'lng' keys
-        destination_coord: Dict with 'lat' and 'lng' keys
+    Strategy 3: the comuna's center (with a small random offset)
 
     Returns:
-        Dict with 'distance_km' and 'duration_minutes', or None if API fails
+        tuple: (coords, 'comuna_center'), or None if no result
     """
-    if not GOOGLE_MAPS_API_KEY:
-        print(f"  ⚠ WARNING: GOOGLE_MAPS_API_KEY not configured, falling back to geodesic")
-        return None
-
     try:
-        # Format coordinates for API
-        origin = f"{origin_coord['lat']},{origin_coord['lng']}"
-        destination = f"{destination_coord['lat']},{destination_coord['lng']}"
-
-        # Call Distance Matrix API
-        url = (
-            f"https://maps.googleapis.com/maps/api/distancematrix/json"
-            f"?origins={origin}"
-            f"&destinations={destination}"
-            f"&mode=driving"
-            f"&language=es"
-            f"&key={GOOGLE_MAPS_API_KEY}"
-        )
+        query = f"{comuna}, Santiago, Chile"
+        logger.debug("Trying: %s", query)
 
-        response = http.request('GET', url, timeout=10.0)
+        url = f"https://maps.googleapis.com/maps/api/geocode/json?address={quote(query)}&key={GOOGLE_MAPS_API_KEY}"
+        response, data = google_maps_get('geocode', url, 'comuna_center')
 
-        if response.status == 200:
-            data = json.loads(response.data.decode('utf-8'))
+        if data is not None:
+            if data.get('status') == 'OK' and len(data.get('results', [])) > 0:
+                location = data['results'][0]['geometry']['location']
+                logger.debug("Using comuna center: %s", comuna)
+                # Add small random offset to avoid all addresses in same comuna overlapping
+                return {
+                    'lat': location['lat'] + (random.random() - 0.5) * 0.01,
+                    'lng': location['lng'] + (random.random() - 0.5) * 0.01
+                }, 'comuna_center'
+    except Exception as e:
+        logger.debug("Strategy 3 failed: %s", e)
+    return None
 
-            if data.get('status') == 'OK':
-                rows = data.get('rows', [])
-                if rows and len(rows) > 0:
-                    elements = rows[0].get('elements', [])
-                    if elements and len(elements) > 0:
-                        element = elements[0]
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+_hedge_slots = threading.BoundedSemaphore(GEOCODE_HEDGE_WORKERS)  # Free threads of the hedge pool
 
-                        if element.get('status') == 'OK':
-                            # Extract distance and duration
-                            distance_meters = element['distance']['value']
-                            duration_seconds = element['duration']['value']
+def hedge_scope():
+    """
+    This thread's request scope, for speculative requests sent from another thread
 
-                            distance_km = distance_meters / 1000.0
-                            duration_minutes = duration_seconds / 60.0
+    Returns:
+        Tuple (GoogleCallBudget, RequestMetrics, contextvars.Context); either
+        of the first two may be None
+    """
+    return active_google_budget(), getattr(_active_request_metrics, 'current', None), contextvars.copy_context()
 
-                            return {
-                                'distance_km': round(distance_km, 2),
-                                'duration_minutes': round(duration_minutes, 1)
-                            }
-                        else:
-                            print(f"  ⚠ Distance Matrix element status: {element.get('status')}")
-            else:
-                print(f"  ⚠ Distance Matrix API status: {data.get('status')}")
-        else:
-            print(f"  ⚠ Distance Matrix API HTTP error: {response.status}")
+def submit_hedged(scope, fn, *args):
+    """
+    Send a speculative geocoding strategy to the shared hedge pool, in a request's scope
 
-    except Exception as e:
-        print(f"  ⚠ Distance Matrix API error: {e}")
+    The request's GoogleCallBudget, RequestMetrics and log context follow the
+    call, so its Google requests are budgeted and attributed to the request.
+    A speculative request only helps while it runs alongside the caller, so
+    it is dropped rather than queued when every GEOCODE_HEDGE_WORKERS thread
+    is busy.
 
-    return None
+    Args:
+        scope: Request scope from hedge_scope()
+
+    Returns:
+        concurrent.futures.Future, or None if the pool is busy
+    """
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=GEOCODE_HEDGE_WORKERS, thread_name_prefix='geocode-hedge')
+
+    if not _hedge_slots.acquire(blocking=False):
+        metrics.inc('geocode_hedges_dropped_total')
+        return None
+
+    budget, request_metrics, log_context = scope
+
+    def run():
+        with ExitStack() as stack:
+            if budget is not None:
+                stack.enter_context(budget.active())
+            if request_metrics is not None:
+                stack.enter_context(request_metrics.collect())
+            return fn(*args)
+
+    try:
+        future = _hedge_executor.submit(log_context.copy().run, run)
+    except RuntimeError:
+        _hedge_slots.release()
+        return None
+    future.add_done_callback(lambda _: _hedge_slots.release())  # Also runs when cancelled before starting
+    return future
+
+def submit_reserved_hedge(scope, budget, fn, *args):
+    """submit_hedged for a request reserved with budget.reserve_hedge(1); the reservation is given back if dropped"""
+    future = submit_hedged(scope, fn, *args)
+    if future is None:
+        budget.release_hedge(1)
+    return future
+
+def hedged_strategy_result(budget, future, fn, *args):
+    """
+    Result of a strategy the chain needs: its speculative request's answer if
+    one was sent (no longer speculative), else fn run on this thread
+    """
+    if future is None:
+        return fn(*args)
+    budget.release_hedge(1)
+    return future.result()
+
+def hedged_geocode(cleaned_address, base_address, comuna, budget):
+    """
+    Geocode with strategies 2 and 3 sent speculatively, in parallel
+
+    Strategy 1 runs on the calling thread. If it has not answered after
+    GEOCODE_HEDGE_DELAY_MS, a timer sends strategies 2 and 3 to the hedge
+    pool alongside it; if it answers without a valid result, strategy 3 is
+    sent while strategy 2 runs here instead of one after the other. The best
+    valid answer by strategy priority wins, so the result is the one the
+    sequential chain would pick. Speculative requests are reserved from the
+    request's hedge allowance (GoogleCallBudget.reserve_hedge) and given back
+    when they turn out to be needed or are dropped by a busy pool; without
+    allowance or pool threads the chain is sequential.
+
+    Returns:
+        tuple: (coords, strategy), or None if no strategy found a valid result
+    """
+    scope = hedge_scope()
+    lock = threading.Lock()
+    sent = []  # Futures of strategies 2 and 3 (None where dropped), once strategy 1 is slow
+    finished = False
+
+    def hedge_slow():
+        with lock:
+            if finished or not budget.reserve_hedge(2):
+                return
+            sent.extend([submit_reserved_hedge(scope, budget, geocode_street_only, base_address, comuna),
+                         submit_reserved_hedge(scope, budget, geocode_comuna_center, comuna)])
+
+    timer = threading.Timer(GEOCODE_HEDGE_DELAY_MS / 1000, hedge_slow)
+    timer.daemon = True
+    timer.start()
+    try:
+        result = geocode_full_address(cleaned_address, comuna)
+    finally:
+        timer.cancel()
+        with lock:
+            finished = True
+            hedges = list(sent)
+
+    if any(future is not None for future in hedges):
+        # Strategy 1 was slow: 2 and 3 raced it
+        street, center = hedges
+        if result is None:
+            result = hedged_strategy_result(budget, street, geocode_street_only, base_address, comuna)
+            if result is None:
+                result = hedged_strategy_result(budget, center, geocode_comuna_center, comuna)
+        else:
+            # Not started yet: never sent (given back). In flight: the answer is ignored
+            budget.release_hedge(sum(future.cancel() for future in hedges if future is not None))
+        metrics.inc('geocode_hedges_total', trigger='slow', winner=result[1] if result else 'none')
+        return result
+
+    if result is not None:
+        return result
+
+    # Strategy 1 answered without a valid result: send 3 while 2 runs here
+    center = submit_reserved_hedge(scope, budget, geocode_comuna_center, comuna) if budget.reserve_hedge(1) else None
+    result = geocode_street_only(base_address, comuna)
+    if result is None:
+        result = hedged_strategy_result(budget, center, geocode_comuna_center, comuna)
+    elif center is not None and center.cancel():
+        budget.release_hedge(1)
+    if center is not None:
+        metrics.inc('geocode_hedges_total', trigger='ambiguous', winner=result[1] if result else 'none')
+    return result
+
+def geocode_address_with_strategy(address):
+    """
+    Geocode an address and report which strategy produced the coordinates
+
+    Returns:
+        tuple: (coords, strategy) where strategy is one of 'full_address',
+        'street_only', 'comuna_center', 'comuna_offline' (Google calls skipped,
+        see GoogleCallBudget) or 'fallback' (Santiago center)
+    """
+    if not GOOGLE_MAPS_API_KEY:
+        logger.error("GOOGLE_MAPS_API_KEY not configured")
+        return {
+            'lat': -33.4489 + (random.random() - 0.5) * 0.1,
+            'lng': -70.6693 + (random.random() - 0.5) * 0.1
+        }, 'fallback'
+
+    # Clean the address first
+    cleaned_address = clean_address_for_geocoding(address)
+
+    # Extract comuna if present (after last comma)
+    parts = cleaned_address.rsplit(',', 1)
+    base_address = parts[0].strip()
+    comuna = parts[1].strip() if len(parts) > 1 else None
+
+    # Google is off-limits for the rest of this request (breaker open or budget spent)
+    if skip_google_call('geocode'):
+        return offline_geocode(comuna)
+
+    # Strategies 2 and 3 need the comuna; with a request budget they may be sent speculatively
+    budget = active_google_budget()
+    if GEOCODE_HEDGING and budget is not None and base_address and comuna:
+        result = hedged_geocode(cleaned_address, base_address, comuna, budget)
+    else:
+        # Strategy 1: full cleaned address with comuna validation, then 2: street without number, then 3: comuna center
+        result = geocode_full_address(cleaned_address, comuna)
+        if result is None and base_address and comuna:
+            result = geocode_street_only(base_address, comuna)
+        if result is None and comuna:
+            result = geocode_comuna_center(comuna)
+    if result is not None:
+        return result
+
+    # The breaker opened (or the budget ran out) between strategies
+    if budget is not None and budget.skip_reason():
+        return offline_geocode(comuna)
+
+    # Fallback: Use Santiago center with warning
+    logger.debug("Geocoding failed, using Santiago center as fallback: %s", address)
+    return {
+        'lat': -33.4489 + (random.random() - 0.5) * 0.1,
+        'lng': -70.6693 + (random.random() - 0.5) * 0.1
+    }, 'fallback'
+
+def offline_geocode(comuna):
+    """
+    Estimate coordinates without Google Maps: the comuna's center from OFFLINE_COMUNA_CENTERS
+
+    Returns:
+        tuple: (coords, 'comuna_offline'), or the Santiago center (coords, 'fallback')
+        for a missing or unknown comuna
+    """
+    import unicodedata
+
+    key = unicodedata.normalize('NFKD', comuna or '').encode('ascii', 'ignore').decode().lower().strip()
+    center = OFFLINE_COMUNA_CENTERS.get(key)
+    if center is None:
+        logger.debug("No offline center for comuna '%s', using Santiago center", comuna)
+        return {
+            'lat': -33.4489 + (random.random() - 0.5) * 0.1,
+            'lng': -70.6693 + (random.random() - 0.5) * 0.1
+        }, 'fallback'
+
+    # Same small offset as Google comuna centers, so drivers of one comuna don't overlap
+    return {
+        'lat': center[0] + (random.random() - 0.5) * 0.01,
+        'lng': center[1] + (random.random() - 0.5) * 0.01
+    }, 'comuna_offline'
+
+def get_route_distance_and_time(origin_coord, destination_coord):
+    """
+    Get real road distance and travel time using Google Maps Distance Matrix API
+
+    Args:
+        origin_coord: Dict with 'lat' and 'lng' keys
+        destination_coord: Dict with 'lat' and 'lng' keys
+
+    Returns:
+        Dict with 'distance_km' and 'duration_minutes', or None if API fails
+    """
+    if not GOOGLE_MAPS_API_KEY:
+        logger.debug("GOOGLE_MAPS_API_KEY not configured, falling back to geodesic")
+        return None
+
+    try:
+        # Format coordinates for API
+        origin = f"{origin_coord['lat']},{origin_coord['lng']}"
+        destination = f"{destination_coord['lat']},{destination_coord['lng']}"
+
+        # Call Distance Matrix API
+        url = (
+            f"https://maps.googleapis.com/maps/api/distancematrix/json"
+            f"?origins={origin}"
+            f"&destinations={destination}"
+            f"&mode=driving"
+            f"&language=es"
+            f"&key={GOOGLE_MAPS_API_KEY}"
+        )
+
+        response, data = google_maps_get('distance_matrix', url)
+
+        if data is not None:
+            if data.get('status') == 'OK':
+                rows = data.get('rows', [])
+                if rows and len(rows) > 0:
+                    elements = rows[0].get('elements', [])
+                    if elements and len(elements) > 0:
+                        element = elements[0]
+
+                        if element.get('status') == 'OK':
+                            # Extract distance and duration
+                            distance_meters = element['distance']['value']
+                            duration_seconds = element['duration']['value']
+
+                            distance_km = distance_meters / 1000.0
+                            duration_minutes = duration_seconds / 60.0
+
+                            return {
+                                'distance_km': round(distance_km, 2),
+                                'duration_minutes': round(duration_minutes, 1)
+                            }
+                        else:
+                            logger.debug("Distance Matrix element status: %s", element.get('status'))
+            else:
+                logger.warning("Distance Matrix API status: %s", data.get('status'))
+        else:
+            logger.warning("Distance Matrix API HTTP error: %s", response.status)
+
+    except Exception as e:
+        logger.warning("Distance Matrix API error: %s", e)
+
+    return None
 
 def calculate_distance(coord1, coord2):
     """
@@ -443,9 +1946,11 @@ def calculate_distance(coord1, coord2):
     Note: This calculates straight-line distance, NOT road distance.
     For road distance, use get_route_distance_and_time() instead.
     """
+    from geopy.distance import geodesic
+
     return geodesic((coord1['lat'], coord1['lng']), (coord2['lat'], coord2['lng'])).km
 
-def estimate_travel_time(distance_km):
+def estimate_travel_time(distance_km, context=None):
     """
     Estimate travel time in minutes based on distance
 
@@ -454,10 +1959,13 @@ def estimate_travel_time(distance_km):
 
     Args:
         distance_km: Distance in kilometers
+        context: OptimizationContext with the request's safety buffer (default 20%)
 
     Returns:
-        Estimated travel time in minutes (includes 20% safety buffer)
+        Estimated travel time in minutes (includes the safety buffer)
     """
+    context = context or OptimizationContext()
+
     # Determine speed based on distance (shorter = city, longer = highway)
     if distance_km < CITY_DISTANCE_THRESHOLD:
         speed_kmh = CITY_SPEED_KMH
@@ -469,8 +1977,8 @@ def estimate_travel_time(distance_km):
     travel_time_hours = distance_km / speed_kmh
     travel_time_minutes = travel_time_hours * 60
 
-    # Apply safety buffer (20%)
-    travel_time_with_buffer = travel_time_minutes * SAFETY_BUFFER
+    # Apply safety buffer
+    travel_time_with_buffer = travel_time_minutes * context.safety_buffer
 
     return round(travel_time_with_buffer, 1)
 
@@ -496,10 +2004,10 @@ def parse_presentation_time(time_str):
             return hours * 60 + minutes
         else:
             # Default to 8:00 AM if parsing fails
-            print(f"Warning: Could not parse time '{time_str}', using 08:00")
+            logger.warning("Could not parse time '%s', using 08:00", time_str)
             return 8 * 60
     except Exception as e:
-        print(f"Error parsing time '{time_str}': {e}, using 08:00")
+        logger.warning("Error parsing time '%s': %s, using 08:00", time_str, e)
         return 8 * 60
 
 def calculate_pickup_time_window(presentation_time_str, travel_time_minutes):
@@ -546,119 +2054,362 @@ def create_distance_matrix(drivers):
     Returns:
         Distance matrix (2D list) in meters (scaled to int for OR-Tools)
     """
-    num_locations = len(drivers)
-    distance_matrix = []
+    from geopy.distance import geodesic
+
+    coordinates = coordinate_array(drivers).tolist()
+    num_locations = len(coordinates)
+    distance_matrix = [[0] * num_locations for _ in range(num_locations)]
 
+    # Geodesic distance is symmetric: compute each pair once
     for i in range(num_locations):
-        row = []
-        for j in range(num_locations):
-            if i == j:
-                row.append(0)
-            else:
-                # Calculate distance in km, then convert to meters (int)
-                distance_km = calculate_distance(
-                    drivers[i]['coordinates'],
-                    drivers[j]['coordinates']
-                )
-                distance_meters = int(distance_km * 1000)
-                row.append(distance_meters)
-        distance_matrix.append(row)
+        for j in range(i + 1, num_locations):
+            # Calculate distance in km, then convert to meters (int)
+            distance_meters = int(geodesic(coordinates[i], coordinates[j]).km * 1000)
+            distance_matrix[i][j] = distance_matrix[j][i] = distance_meters
 
     return distance_matrix
 
 
-def optimize_route_ortools(drivers, time_limit_seconds=30):
+def solver_size_bucket(stops):
+    """Route size label for solver statistics ('1-5', '6-10', ..., '>50')"""
+    lower = 1
+    for upper in SOLVER_SIZE_BUCKETS:
+        if stops <= upper:
+            return f'{lower}-{upper}'
+        lower = upper + 1
+    return f'>{SOLVER_SIZE_BUCKETS[-1]}'
+
+def default_solver_strategy(stops):
+    """Strategy for a route of this size: its SOLVER_STRATEGY_BY_SIZE entry, else DEFAULT_SOLVER_STRATEGY"""
+    for max_stops, strategy in SOLVER_STRATEGY_BY_SIZE:
+        if stops <= max_stops:
+            return strategy
+    return DEFAULT_SOLVER_STRATEGY
+
+def portfolio_strategies(stops):
+    """Strategies raced on a route: its size default first, then SOLVER_PORTFOLIO_STRATEGIES"""
+    return list(dict.fromkeys([default_solver_strategy(stops), *SOLVER_PORTFOLIO_STRATEGIES]))
+
+def solve_route_matrix(distance_matrix, van_capacity, strategy, time_limit_ms):
+    """
+    Solve one route with the OR-Tools routing solver (one vehicle, depot = first stop)
+
+    Args:
+        distance_matrix: Distances in meters (list of lists)
+        van_capacity: Passengers per van
+        strategy: 'FIRST_SOLUTION/METAHEURISTIC' (routing_enums_pb2 names)
+        time_limit_ms: Solver time limit
+
+    Returns:
+        Dict with 'order' (stop indices in route order, None without a solution),
+        'objective' (meters), 'solutions' and 'branches'
+    """
+    from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+
+    first_solution, metaheuristic = strategy.split('/')
+    num_locations = len(distance_matrix)
+
+    # Create the routing index manager
+    manager = pywrapcp.RoutingIndexManager(num_locations, 1, 0)
+
+    # Create Routing Model
+    routing = pywrapcp.RoutingModel(manager)
+
+    # Create and register distance callback
+    def distance_callback(from_index, to_index):
+        """Returns the distance between the two nodes."""
+        from_node = manager.IndexToNode(from_index)
+        to_node = manager.IndexToNode(to_index)
+        return distance_matrix[from_node][to_node]
+
+    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+
+    # Define cost of each arc
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+    # Add capacity constraint (for pickup time windows if needed)
+    # This ensures the van doesn't exceed capacity
+    def demand_callback(from_index):
+        """Returns the demand of the node."""
+        return 1  # Each driver counts as 1 person
+
+    demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+    routing.AddDimensionWithVehicleCapacity(
+        demand_callback_index,
+        0,  # null capacity slack
+        [van_capacity],  # vehicle maximum capacities
+        True,  # start cumul to zero
+        'Capacity'
+    )
+
+    # First solution heuristic and metaheuristic
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = getattr(routing_enums_pb2.FirstSolutionStrategy, first_solution)
+    search_parameters.local_search_metaheuristic = getattr(routing_enums_pb2.LocalSearchMetaheuristic, metaheuristic)
+    search_parameters.time_limit.FromMilliseconds(time_limit_ms)
+    search_parameters.log_search = False
+
+    # Solve the problem
+    solution = routing.SolveWithParameters(search_parameters)
+    result = {'order': None, 'objective': None,
+              'solutions': routing.solver().Solutions(), 'branches': routing.solver().Branches()}
+
+    if solution:
+        order = []
+        index = routing.Start(0)
+        while not routing.IsEnd(index):
+            order.append(manager.IndexToNode(index))
+            index = solution.Value(routing.NextVar(index))
+        result.update(order=order, objective=solution.ObjectiveValue())
+    return result
+
+def solver_portfolio_worker(conn):
+    """Solver process loop: run solve_route_matrix for each task received on conn until it is closed"""
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            result = solve_route_matrix(*task)
+        except Exception as e:
+            result = {'order': None, 'objective': None, 'error': str(e)}
+        conn.send(result)
+
+class SolverPortfolio:
+    """
+    Solver processes racing strategy combinations on the same route
+
+    Processes are spawned on first use (spawn: no fork of the parent's threads
+    or solver state), kept warm across routes and requests, and shared by all
+    of the container's concurrent solves: each route checks out the idle
+    ones, so concurrent routes race fewer strategies each. All strategies of
+    a route share its deadline; a process that has not answered
+    SOLVER_PORTFOLIO_GRACE_SECONDS after it is terminated and replaced.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._idle = []
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def _spawn(self):
+        import multiprocessing
+
+        ctx = multiprocessing.get_context('spawn')
+        conn, child_conn = ctx.Pipe()
+        process = ctx.Process(target=solver_portfolio_worker, args=(child_conn,), name='solver-portfolio', daemon=True)
+        process.start()
+        child_conn.close()
+        return process, conn
+
+    def _checkout(self, wanted):
+        """Up to `wanted` solver processes: idle ones first, then new ones while under size"""
+        with self._lock:
+            workers = [self._idle.pop() for _ in range(min(wanted, len(self._idle)))]
+            spawn = min(wanted - len(workers), self.size - self._started)
+            self._started += spawn
+
+        for _ in range(spawn):
+            try:
+                workers.append(self._spawn())
+            except Exception as e:
+                logger.warning("Could not start a solver process: %s", e)
+                with self._lock:
+                    self._started -= 1
+        return workers
+
+    def _release(self, worker, healthy):
+        process, conn = worker
+        if healthy and process.is_alive():
+            with self._lock:
+                self._idle.append(worker)
+            return
+
+        process.terminate()
+        conn.close()
+        with self._lock:
+            self._started -= 1
+
+    def solve(self, distance_matrix, van_capacity, strategies, time_limit_seconds):
+        """
+        Race strategies on one route under a shared deadline
+
+        Returns:
+            List of (strategy, result) for the strategies that ran, in the
+            given order; result is None when its process failed or missed the
+            deadline. Empty when no solver process is free.
+        """
+        from multiprocessing.connection import wait
+
+        task = (distance_matrix, van_capacity)
+        running = {}
+        results = {}
+        for strategy, worker in zip(strategies, self._checkout(len(strategies))):
+            try:
+                worker[1].send((*task, strategy, int(time_limit_seconds * 1000)))
+                running[worker[1]] = (strategy, worker)
+            except (OSError, ValueError):
+                results[strategy] = None
+                self._release(worker, False)
+
+        deadline = time.monotonic() + time_limit_seconds + SOLVER_PORTFOLIO_GRACE_SECONDS
+        while running and time.monotonic() < deadline:
+            for conn in wait(list(running), timeout=deadline - time.monotonic()):
+                strategy, worker = running.pop(conn)
+                try:
+                    results[strategy] = conn.recv()
+                    self._release(worker, True)
+                except (EOFError, OSError):
+                    results[strategy] = None
+                    self._release(worker, False)
+
+        for strategy, worker in running.values():
+            results[strategy] = None
+            self._release(worker, False)
+
+        return [(strategy, results[strategy]) for strategy in strategies if strategy in results]
+
+_solver_portfolio = None
+_solver_portfolio_lock = threading.Lock()
+
+def get_solver_portfolio():
+    """The container's SolverPortfolio (SOLVER_PORTFOLIO_WORKERS processes, started lazily)"""
+    global _solver_portfolio
+    with _solver_portfolio_lock:
+        if _solver_portfolio is None:
+            _solver_portfolio = SolverPortfolio(SOLVER_PORTFOLIO_WORKERS)
+        return _solver_portfolio
+
+_partition_solver = None
+
+def get_partition_solver():
+    """
+    Solver processes for large-instance partitions (LARGE_INSTANCE_WORKERS, started lazily)
+
+    OR-Tools calls back into Python for every arc and demand, so solves in
+    threads hold the GIL and run one at a time; partitions are routed in
+    these processes instead (a SolverPortfolio racing a single strategy).
+    """
+    global _partition_solver
+    with _solver_portfolio_lock:
+        if _partition_solver is None:
+            _partition_solver = SolverPortfolio(LARGE_INSTANCE_WORKERS)
+        return _partition_solver
+
+def race_solver_portfolio(distance_matrix, context, time_limit_seconds):
+    """
+    Solve a route with the solver portfolio and pick the best solution
+
+    The winning strategy is recorded per route size (solver_portfolio_wins_total
+    and a 'Solver portfolio' log record with every strategy's objective), so
+    SOLVER_STRATEGY_BY_SIZE can be learned from production statistics.
+
+    Returns:
+        Tuple (strategy, result) of the winner, or None when no strategy found
+        a solution or no solver process was free
+    """
+    stops = len(distance_matrix)
+    raced = get_solver_portfolio().solve(distance_matrix, context.van_capacity, portfolio_strategies(stops),
+                                         time_limit_seconds)
+    solved = [(strategy, result) for strategy, result in raced if result and result['order'] is not None]
+    if not solved:
+        return None
+
+    # Lowest objective wins; ties go to the earlier strategy (the size default first)
+    winner = min(solved, key=lambda item: item[1]['objective'])
+    size = solver_size_bucket(stops)
+    metrics.inc('solver_portfolio_wins_total', strategy=winner[0], size=size)
+    logger.info("Solver portfolio", extra={'fields': {
+        'stops': stops, 'size': size, 'winner': winner[0],
+        'objectivesKm': {strategy: result['objective'] / 1000.0 if result and result['objective'] is not None else None
+                         for strategy, result in raced}
+    }})
+    return winner
+
+def optimize_route_ortools(drivers, time_limit_seconds=ROUTE_SOLVER_TIME_LIMIT_SECONDS, context=None, solver=None):
     """
     Optimize route using Google OR-Tools VRP solver
 
+    Routes get the strategy for their size (default_solver_strategy). In
+    portfolio mode (context.solver_portfolio, with at least two solver
+    processes), routes of SOLVER_PORTFOLIO_MIN_STOPS or more with a time limit
+    of SOLVER_PORTFOLIO_MIN_SECONDS or more race several strategies in
+    separate processes under that limit and keep the best solution; without a
+    free solver process they are solved in-process as usual. With a solver
+    (large-instance partitions) the single-strategy solve runs in one of its
+    processes, or in-process when none is free.
+
+    Once the context's deadline is spent, OR-Tools is skipped and the route is
+    built by nearest neighbor + 2-opt (optimize_route_tsp_legacy), so routes
+    left at the deadline don't each run the solver past it.
+
     Args:
         drivers: List of drivers with coordinates
-        time_limit_seconds: Maximum time for solver (default 30s)
+        time_limit_seconds: Maximum time for solver (ROUTE_SOLVER_TIME_LIMIT_SECONDS, default 30s; capped by the context deadline)
+        context: OptimizationContext with the van capacity, deadline and portfolio mode
+        solver: Optional SolverPortfolio to solve in (get_partition_solver)
 
     Returns:
         tuple: (route, needs_manual_review) where:
             - route: Optimized route (list of drivers in optimal order)
             - needs_manual_review: True if optimization failed and requires manual intervention
     """
+    context = context or OptimizationContext()
+
     if len(drivers) <= 1:
         return drivers, False
 
+    started = time.perf_counter()
     try:
+        time_limit = context.solver_time_limit(time_limit_seconds)
+        if time_limit is None:
+            logger.debug("Deadline reached: routing %d stops by nearest neighbor + 2-opt", len(drivers))
+            route, success = optimize_route_tsp_legacy(drivers)
+            context.metrics.record_solve('deadline' if success else 'failed', started, len(drivers))
+            return route, not success
+
         # Create distance matrix
         distance_matrix = create_distance_matrix(drivers)
-        num_locations = len(drivers)
-
-        # Create the routing index manager
-        manager = pywrapcp.RoutingIndexManager(num_locations, 1, 0)
-
-        # Create Routing Model
-        routing = pywrapcp.RoutingModel(manager)
-
-        # Create and register distance callback
-        def distance_callback(from_index, to_index):
-            """Returns the distance between the two nodes."""
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            return distance_matrix[from_node][to_node]
-
-        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-
-        # Define cost of each arc
-        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-
-        # Add capacity constraint (for pickup time windows if needed)
-        # This ensures the van doesn't exceed capacity
-        def demand_callback(from_index):
-            """Returns the demand of the node."""
-            from_node = manager.IndexToNode(from_index)
-            return 1  # Each driver counts as 1 person
-
-        demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
-        routing.AddDimensionWithVehicleCapacity(
-            demand_callback_index,
-            0,  # null capacity slack
-            [VAN_CAPACITY],  # vehicle maximum capacities
-            True,  # start cumul to zero
-            'Capacity'
-        )
 
-        # Setting first solution heuristic
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-        )
-        search_parameters.local_search_metaheuristic = (
-            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-        )
-        search_parameters.time_limit.seconds = time_limit_seconds
-        search_parameters.log_search = False
+        winner = None
+        if (context.solver_portfolio and SOLVER_PORTFOLIO_WORKERS > 1 and len(drivers) >= SOLVER_PORTFOLIO_MIN_STOPS
+                and time_limit >= SOLVER_PORTFOLIO_MIN_SECONDS):
+            winner = race_solver_portfolio(distance_matrix, context, time_limit)
+        if winner is None:
+            strategy = default_solver_strategy(len(drivers))
+            solved = solver.solve(distance_matrix, context.van_capacity, [strategy], time_limit) if solver else []
+            if solved:
+                # The process failed or missed the deadline: no solution (2-opt fallback below)
+                winner = solved[0][0], solved[0][1] or {'order': None, 'objective': None}
+            else:
+                winner = strategy, solve_route_matrix(distance_matrix, context.van_capacity, strategy,
+                                                      max(1, int(time_limit * 1000)))
 
-        # Solve the problem
-        solution = routing.SolveWithParameters(search_parameters)
+        strategy, result = winner
+        solver_stats = {'strategy': strategy, 'solutions': result.get('solutions', 0), 'branches': result.get('branches', 0)}
 
-        if solution:
+        if result['order'] is not None:
             # Extract route from solution
-            route = []
-            index = routing.Start(0)
-
-            while not routing.IsEnd(index):
-                node_index = manager.IndexToNode(index)
-                route.append(drivers[node_index])
-                index = solution.Value(routing.NextVar(index))
+            route = [drivers[node_index] for node_index in result['order']]
 
             # Print optimization stats
-            total_distance = solution.ObjectiveValue() / 1000.0  # Convert back to km
-            print(f"  ✓ OR-Tools: Optimized route with {len(route)} stops, total distance: {total_distance:.2f} km")
+            total_distance = result['objective'] / 1000.0  # Convert back to km
+            logger.debug("OR-Tools: optimized route with %d stops, total distance: %.2f km (%s)", len(route), total_distance, strategy)
+            context.metrics.record_solve('ortools', started, len(drivers), objectiveKm=round(total_distance, 3), **solver_stats)
 
             return route, False
         else:
-            print("  ⚠ OR-Tools: No solution found, falling back to 2-opt TSP")
+            logger.warning("OR-Tools: no solution found, falling back to 2-opt TSP")
             route, success = optimize_route_tsp_legacy(drivers)
+            context.metrics.record_solve('fallback' if success else 'failed', started, len(drivers), **solver_stats)
             return route, not success  # If legacy TSP failed, needs manual review
 
     except Exception as e:
-        print(f"  ⚠ OR-Tools optimization failed: {e}, falling back to 2-opt TSP")
+        logger.warning("OR-Tools optimization failed: %s, falling back to 2-opt TSP", e)
         route, success = optimize_route_tsp_legacy(drivers)
+        context.metrics.record_solve('fallback' if success else 'failed', started, len(drivers))
         return route, not success  # If legacy TSP failed, needs manual review
 
 
@@ -673,19 +2424,23 @@ def optimize_route_tsp_legacy(drivers):
         return drivers, True
 
     try:
-        # Greedy nearest neighbor
-        route = [drivers[0]]
-        remaining = drivers[1:]
-
-        while remaining:
-            last = route[-1]
-            nearest = min(remaining, key=lambda d: calculate_distance(
-                last['coordinates'], d['coordinates']
-            ))
-            route.append(nearest)
-            remaining.remove(nearest)
-
-        # 2-opt improvement
+        # Greedy nearest neighbor, from the first driver, over the request's index when
+        # the drivers are rows of its table (a route of plain dicts gets its own)
+        table = shared_table(drivers)
+        if table is not None:
+            index, members = table.spatial_index(), [d.index for d in drivers]
+        else:
+            index, members = SpatialIndex(coordinate_array(drivers)), None
+        order = index.nearest_neighbor_order(members=members)
+        coordinates = [drivers[i]['coordinates'] for i in range(len(drivers))]
+        position = {stop: p for p, stop in enumerate(order)}
+
+        def distance(a, b):
+            return calculate_distance(coordinates[a], coordinates[b])
+
+        # 2-opt improvement: reverse order[i:j] to replace edges (i-1, i), (j-1, j)
+        # with (i-1, j-1), (i, j), trying only moves where one new edge joins near neighbors
+        candidates = index.candidate_lists(TWO_OPT_CANDIDATES, members)
         improved = True
         max_iterations = 50
         iteration = 0
@@ -694,50 +2449,52 @@ def optimize_route_tsp_legacy(drivers):
             improved = False
             iteration += 1
 
-            for i in range(1, len(route) - 2):
-                for j in range(i + 1, len(route)):
-                    if j - i == 1:
+            for i in range(1, len(order) - 2):
+                a, b = order[i - 1], order[i]
+                ends = [position[c] + 1 for c in candidates[a]] + [position[d] for d in candidates[b]]
+                for j in ends:
+                    if j <= i + 1 or j >= len(order):
                         continue
 
-                    current_dist = (
-                        calculate_distance(route[i-1]['coordinates'], route[i]['coordinates']) +
-                        calculate_distance(route[j-1]['coordinates'], route[j % len(route)]['coordinates'])
-                    )
-
-                    new_dist = (
-                        calculate_distance(route[i-1]['coordinates'], route[j-1]['coordinates']) +
-                        calculate_distance(route[i]['coordinates'], route[j % len(route)]['coordinates'])
-                    )
-
-                    if new_dist < current_dist:
-                        route[i:j] = reversed(route[i:j])
+                    c, d = order[j - 1], order[j]
+                    if distance(a, c) + distance(b, d) < distance(a, b) + distance(c, d):
+                        order[i:j] = reversed(order[i:j])
+                        for p in range(i, j):
+                            position[order[p]] = p
                         improved = True
                         break
 
                 if improved:
                     break
 
+        route = [drivers[i] for i in order]
         return route, True
 
     except Exception as e:
-        print(f"  ❌ CRITICAL: Legacy TSP optimization failed: {e}")
-        print(f"  ⚠ Returning unoptimized route - REQUIRES MANUAL REVIEW")
+        logger.error("Legacy TSP optimization failed: %s - returning unoptimized route, REQUIRES MANUAL REVIEW", e)
         # Return drivers in original order as absolute last resort
         return drivers, False
 
 
-def optimize_route_tsp(drivers):
+def optimize_route_tsp(drivers, context=None, time_limit_seconds=None, solver=None):
     """
     Optimize route using OR-Tools (preferred) with fallback to 2-opt TSP
 
     This is the main function called by the optimization logic.
 
+    Args:
+        context: OptimizationContext for the request (capacity, deadline)
+        time_limit_seconds: OR-Tools time limit (None = ROUTE_SOLVER_TIME_LIMIT_SECONDS)
+        solver: Optional SolverPortfolio to solve in (see optimize_route_ortools)
+
     Returns:
         tuple: (route, needs_manual_review) where:
             - route: Optimized route (list of drivers in optimal order)
             - needs_manual_review: True if optimization failed and requires manual intervention
     """
-    return optimize_route_ortools(drivers)
+    if time_limit_seconds is None:
+        return optimize_route_ortools(drivers, context=context, solver=solver)
+    return optimize_route_ortools(drivers, time_limit_seconds, context, solver)
 
 def balance_load(clusters):
     """Balance the number of drivers across vans"""
@@ -759,67 +2516,179 @@ def track_demo_usage(demo_id, data):
     # DynamoDB tracking removed - not needed
     pass
 
+def geocode_address_memoized(address, report=None):
+    """
+    geocode_address with the result memoized on the cleaned address
+
+    Santiago-center fallbacks and offline estimates are never memoized so
+    those addresses are retried.
+
+    Returns:
+        tuple: (coords, strategy)
+    """
+    key = stage_key('geocode', clean_address_for_geocoding(address).lower())
+    found, cached = stage_memo.get(key)
+    if report:
+        report.record(found)
+
+    if found:
+        coords, strategy = cached
+        return dict(coords), strategy
+
+    coords, strategy = geocode_address_with_strategy(address)
+    if strategy not in ('fallback', 'comuna_offline'):
+        stage_memo.put(key, (dict(coords), strategy))
+    return coords, strategy
+
+def get_route_distance_and_time_memoized(origin_coord, destination_coord, report=None):
+    """
+    get_route_distance_and_time memoized on the origin/destination pair
+
+    Only real Distance Matrix answers are memoized; the safety margin is applied
+    downstream, so changing it reuses these results.
+    """
+    key = stage_key(
+        'travel_time',
+        round(origin_coord['lat'], 6), round(origin_coord['lng'], 6),
+        round(destination_coord['lat'], 6), round(destination_coord['lng'], 6)
+    )
+    found, route_info = stage_memo.get(key)
+    if report:
+        report.record(found)
+
+    if found:
+        return dict(route_info)
+
+    route_info = get_route_distance_and_time(origin_coord, destination_coord)
+    if route_info:
+        stage_memo.put(key, dict(route_info))
+    return route_info
+
+def ingest_drivers(drivers, destination_terminal_config, report=None):
+    """
+    Ingest stage: turn request drivers into working copies for the pipeline
+
+    Applies the destination terminal override; later stages mutate the copies,
+    never the request's drivers. Not memoized: a per-driver dict copy is cheaper
+    than hashing the roster for a memo key.
+    """
+    report = report or StageReport('ingest')
+    with report:
+        ingested = []
+        for driver in drivers:
+            driver = dict(driver)
+            if destination_terminal_config:
+                driver['terminal'] = destination_terminal_config
+            ingested.append(driver)
+        report.computed(len(ingested))
+        return ingested
+
 def geocode_driver_parallel(driver_data):
     """
-    Geocode a single driver and calculate travel times (for parallel processing)
+    Geocode a single driver (for parallel processing)
+
+    Once the request's circuit breaker is open or its Google budget is spent,
+    Google is not called and the driver is placed at an offline comuna center
+    (reported as a warning).
 
     Args:
-        driver_data: Tuple of (index, driver, destination_terminal_config)
+        driver_data: Tuple of (index, driver, stage_report, context)
 
     Returns:
         Tuple of (index, driver_with_coordinates, error_info)
     """
-    idx, driver, destination_terminal_config = driver_data
+    idx, driver, report, context = driver_data
     error_info = None
 
-    print(f"Geocoding {idx+1}: {driver['address']}")
+    logger.debug("Geocoding %d: %s", idx + 1, driver['address'])
 
     try:
         # Geocode driver address
-        driver['coordinates'] = geocode_address(driver['address'])
+        driver['coordinates'], strategy = geocode_address_memoized(driver['address'], report)
 
-        # Check if geocoding failed (returned Santiago center fallback)
-        if abs(driver['coordinates']['lat'] - (-33.4489)) < 0.15 and abs(driver['coordinates']['lng'] - (-70.6693)) < 0.15:
+        # Check if geocoding failed (every strategy missed: Santiago center fallback)
+        skipped = GoogleCallBudget.REASONS.get(context.google.skip_reason())
+        if strategy == 'fallback':
+            error_info = {
+                'driver_index': idx + 1,
+                'driver_name': driver.get('name', 'Unknown'),
+                'address': driver['address'],
+                'issue': f'Google Maps skipped ({skipped}) - using Santiago center as fallback' if skipped
+                else 'Geocoding failed - using Santiago center as fallback',
+                'severity': 'warning'
+            }
+        elif strategy == 'comuna_offline':
             error_info = {
                 'driver_index': idx + 1,
                 'driver_name': driver.get('name', 'Unknown'),
                 'address': driver['address'],
-                'issue': 'Geocoding failed - using Santiago center as fallback',
+                'issue': f'Google Maps skipped ({skipped}) - using approximate comuna center',
                 'severity': 'warning'
             }
 
-        # Determine terminal
-        if destination_terminal_config:
-            terminal = destination_terminal_config
-            driver['terminal'] = terminal
-        else:
-            terminal = driver.get('terminal', 'Terminal Aeropuerto T1')
+    except Exception as e:
+        logger.warning("Error geocoding driver %d: %s", idx + 1, e)
+        error_info = {
+            'driver_index': idx + 1,
+            'driver_name': driver.get('name', 'Unknown'),
+            'address': driver.get('address', 'N/A'),
+            'issue': f'Processing error: {str(e)}',
+            'severity': 'error'
+        }
+
+        # Set fallback values to ensure processing continues
+        if 'coordinates' not in driver:
+            driver['coordinates'] = {
+                'lat': -33.4489 + (random.random() - 0.5) * 0.1,
+                'lng': -70.6693 + (random.random() - 0.5) * 0.1
+            }
+
+    return idx, driver, error_info
+
+def calculate_travel_time_parallel(driver_data):
+    """
+    Calculate distance, travel time and pickup window from a geocoded driver
+    to its terminal (for parallel processing)
+
+    Args:
+        driver_data: Tuple of (index, driver, stage_report, context)
+
+    Returns:
+        Tuple of (index, driver_with_timing, error_info)
+    """
+    idx, driver, report, context = driver_data
+    error_info = None
+
+    try:
+        terminal = driver.get('terminal', 'Terminal Aeropuerto T1')
 
         # Geocode terminal
-        terminal_coord = geocode_terminal(terminal)
+        terminal_coord = context.terminal_coord(terminal)
 
         # Get REAL road distance and travel time using Distance Matrix API
-        route_info = get_route_distance_and_time(driver['coordinates'], terminal_coord)
+        # (memoized answers only, once the request's breaker is open or its budget spent)
+        route_info = get_route_distance_and_time_memoized(driver['coordinates'], terminal_coord, report)
 
         if route_info:
             # Use real road distance and time from Google Maps
             distance_to_terminal = route_info['distance_km']
             travel_time = route_info['duration_minutes']
-            print(f"  ✓ Real route: {distance_to_terminal} km, {travel_time} min (from Distance Matrix API)")
+            logger.debug("Real route: %s km, %s min (from Distance Matrix API)", distance_to_terminal, travel_time)
         else:
             # Fallback to geodesic distance if API fails
             distance_to_terminal = calculate_distance(driver['coordinates'], terminal_coord)
-            travel_time = estimate_travel_time(distance_to_terminal)
-            print(f"  ⚠ Fallback to geodesic: {distance_to_terminal} km, {travel_time} min (estimated)")
+            travel_time = estimate_travel_time(distance_to_terminal, context)
+            logger.debug("Fallback to geodesic: %s km, %s min (estimated)", distance_to_terminal, travel_time)
 
-            if not error_info:
-                error_info = {
-                    'driver_index': idx + 1,
-                    'driver_name': driver.get('name', 'Unknown'),
-                    'address': driver['address'],
-                    'issue': 'Distance Matrix API failed - using geodesic estimate',
-                    'severity': 'info'
-                }
+            skipped = GoogleCallBudget.REASONS.get(context.google.skip_reason())
+            error_info = {
+                'driver_index': idx + 1,
+                'driver_name': driver.get('name', 'Unknown'),
+                'address': driver['address'],
+                'issue': f'Google Maps skipped ({skipped}) - using geodesic estimate' if skipped
+                else 'Distance Matrix API failed - using geodesic estimate',
+                'severity': 'info'
+            }
 
         # Calculate pickup time window
         presentation_time = driver.get('time', '08:00')
@@ -833,10 +2702,10 @@ def geocode_driver_parallel(driver_data):
         driver['pickup_time_latest'] = time_window['pickup_time_latest_str']
         driver['pickup_time_latest_minutes'] = time_window['pickup_time_latest_minutes']
 
-        print(f"  → {idx+1}: Distance: {driver['distance_to_terminal_km']} km, Travel time: {travel_time} min, Pickup: {driver['pickup_time_latest']}, Present: {driver['presentation_time']}")
+        logger.debug("%d: distance: %s km, travel time: %s min, pickup: %s, present: %s", idx + 1, driver['distance_to_terminal_km'], travel_time, driver['pickup_time_latest'], driver['presentation_time'])
 
     except Exception as e:
-        print(f"  ❌ ERROR processing driver {idx+1}: {e}")
+        logger.warning("Error processing driver %d: %s", idx + 1, e)
         error_info = {
             'driver_index': idx + 1,
             'driver_name': driver.get('name', 'Unknown'),
@@ -845,13 +2714,6 @@ def geocode_driver_parallel(driver_data):
             'severity': 'error'
         }
 
-        # Set fallback values to ensure processing continues
-        if 'coordinates' not in driver:
-            driver['coordinates'] = {
-                'lat': -33.4489 + (random.random() - 0.5) * 0.1,
-                'lng': -70.6693 + (random.random() - 0.5) * 0.1
-            }
-
         driver.setdefault('distance_to_terminal_km', 15.0)
         driver.setdefault('travel_time_minutes', 30.0)
         driver.setdefault('presentation_time', '08:00')
@@ -861,64 +2723,638 @@ def geocode_driver_parallel(driver_data):
 
     return idx, driver, error_info
 
-def uses_bus_mode(terminal):
-    """Check if a terminal uses bus de acercamiento mode"""
-    terminal_lower = terminal.lower().strip()
-    return any(term in terminal_lower for term in TERMINALS_WITH_BUS)
-
-def group_drivers_by_terminal(drivers):
-    """Group drivers by their destination terminal"""
-    terminal_groups = {}
-    for driver in drivers:
-        terminal = driver.get('terminal', 'Terminal Aeropuerto T1')
-        if terminal not in terminal_groups:
-            terminal_groups[terminal] = []
-        terminal_groups[terminal].append(driver)
-    return terminal_groups
+class DriverTable:
+    """
+    Columnar store for resolved drivers (struct of arrays)
 
-def optimize_with_bus_mode(drivers, terminal, terminal_coord, num_vans_override=None):
+    Coordinates and every all-numeric field (times, distances) are NumPy
+    columns, so sorting, grouping, clustering and distance matrices work on
+    whole arrays; text fields are plain per-column lists. DriverRecord views
+    give per-driver access, and the JSON-shaped driver dicts are only rebuilt
+    by to_dict() when vans leave the pipeline.
     """
-    Optimize routes using bus de acercamiento mode
 
-    Flow:
-    1. Van picks up Group 1 drivers and drops them at bus stop
+    _MISSING = object()
+
+    def __init__(self, drivers):
+        import numpy as np
+
+        self.size = len(drivers)
+        self.coordinates = np.array(
+            [(d['coordinates']['lat'], d['coordinates']['lng']) for d in drivers], dtype=float
+        ).reshape(self.size, 2)
+
+        # Field order of the first driver that has each field (keeps the JSON shape)
+        self.fields = list(dict.fromkeys(field for d in drivers for field in d))
+        self.columns = {}
+        self._int_rows = {}  # Mixed int/float columns: rows holding an int (to_dict gives 0, not 0.0)
+        for field in self.fields:
+            if field == 'coordinates':
+                continue
+            values = [d.get(field, self._MISSING) for d in drivers]
+            if all(type(v) is int for v in values):
+                self.columns[field] = np.array(values, dtype=np.int64)
+            elif all(type(v) in (int, float) for v in values):
+                self.columns[field] = np.array(values, dtype=float)
+                int_rows = np.array([type(v) is int for v in values], dtype=bool)
+                if int_rows.any():
+                    self._int_rows[field] = int_rows
+            else:
+                self.columns[field] = values
+
+        terminals = self.columns.get('terminal') or ['Terminal Aeropuerto T1'] * self.size
+        self.terminal_names = list(dict.fromkeys(
+            t if t is not self._MISSING else 'Terminal Aeropuerto T1' for t in terminals
+        ))
+        terminal_ids = {name: i for i, name in enumerate(self.terminal_names)}
+        self.terminal_id = np.array(
+            [terminal_ids[t if t is not self._MISSING else 'Terminal Aeropuerto T1'] for t in terminals], dtype=np.int64
+        )
+        self._spatial_index = None
+
+    def value(self, index, field):
+        if field == 'coordinates':
+            lat, lng = self.coordinates[index]
+            return {'lat': float(lat), 'lng': float(lng)}
+        column = self.columns[field]
+        value = column[index]
+        if value is self._MISSING:
+            raise KeyError(field)
+        if field in self._int_rows and self._int_rows[field][index]:
+            return int(value)
+        return value.item() if hasattr(value, 'item') else value
+
+    def records(self, indices=None):
+        """DriverRecord views, in table order or for the given row indices"""
+        rows = range(self.size) if indices is None else indices
+        return [DriverRecord(self, int(index)) for index in rows]
+
+    def sorted_by(self, field):
+        """Row indices sorted by a numeric column (stable, like sorted())"""
+        import numpy as np
+        return np.argsort(self.columns[field], kind='stable')
+
+    def group_by_terminal(self, indices):
+        """Split row indices by terminal, in order of first appearance: {terminal: indices}"""
+        groups = {}
+        for terminal_id in dict.fromkeys(self.terminal_id[indices].tolist()):
+            groups[self.terminal_names[terminal_id]] = indices[self.terminal_id[indices] == terminal_id]
+        return groups
+
+    def spatial_index(self):
+        """SpatialIndex over every driver's pickup, built on first use and shared by the whole request"""
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(self.coordinates)
+        return self._spatial_index
+
+    def to_dict(self, index):
+        driver = {}
+        for field in self.fields:
+            if field == 'coordinates':
+                driver[field] = self.value(index, field)
+            elif self.columns[field][index] is not self._MISSING:
+                driver[field] = self.value(index, field)
+        return driver
+
+class DriverRecord:
+    """Lightweight read-only view of one DriverTable row (dict-style access)"""
+
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self, field):
+        return self.table.value(self.index, field)
+
+    def get(self, field, default=None):
+        try:
+            return self.table.value(self.index, field)
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        return self.table.to_dict(self.index)
+
+def shared_table(drivers):
+    """The DriverTable behind drivers when all of them are DriverRecord views of it, else None"""
+    if drivers and isinstance(drivers[0], DriverRecord):
+        table = drivers[0].table
+        if all(isinstance(d, DriverRecord) and d.table is table for d in drivers):
+            return table
+    return None
+
+def coordinate_array(drivers):
+    """(n, 2) lat/lng array for DriverRecord views of one table (sliced, no per-field reads) or plain dicts"""
+    import numpy as np
+
+    table = shared_table(drivers)
+    if table is not None:
+        return table.coordinates[[d.index for d in drivers]]
+    return np.array([(d['coordinates']['lat'], d['coordinates']['lng']) for d in drivers], dtype=float).reshape(len(drivers), 2)
+
+class SpatialIndex:
+    """
+    KD-tree over lat/lng points, for k-nearest and radius queries in O(log n)
+
+    Points are projected onto a local equirectangular plane in km centered on
+    their mean latitude; across the Santiago metro area that is within 0.1% of
+    geodesic distance, enough to rank candidates. Callers still measure the
+    legs they keep with calculate_distance.
+    """
+
+    def __init__(self, coordinates):
+        import numpy as np
+        from sklearn.neighbors import KDTree
+
+        coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        self.size = len(coordinates)
+        self.origin_lat = float(coordinates[:, 0].mean()) if self.size else 0.0
+        self.points = self.project(coordinates)
+        self.tree = KDTree(self.points) if self.size else None
+
+    def project(self, coordinates):
+        """(n, 2) lat/lng array to (n, 2) planar km"""
+        import numpy as np
+
+        coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        x = coordinates[:, 1] * np.cos(np.radians(self.origin_lat))
+        return np.column_stack((x, coordinates[:, 0])) * KM_PER_DEGREE
+
+    def nearest(self, coordinates, k=1):
+        """
+        k nearest indexed points of each query point
+
+        Returns:
+            Tuple (distances in km, indices), arrays of shape (queries, k), nearest first
+        """
+        return self.tree.query(self.project(coordinates), k=min(k, self.size))
+
+    def within(self, coordinates, radius_km):
+        """Indices of the indexed points within radius_km of each query point (array per query)"""
+        return self.tree.query_radius(self.project(coordinates), r=radius_km)
+
+    def _nearest_members(self, point, k, position, accept):
+        """
+        Positions of the members nearest to indexed point `point`, nearest first
+
+        Asks the tree for the closest k points and widens the query until
+        accept() is satisfied by the members found or every point was seen.
+        """
+        while True:
+            _, indices = self.tree.query(self.points[point:point + 1], k=min(k, self.size))
+            found = [position[j] for j in indices[0].tolist() if j in position]
+            if accept(found) or k >= self.size:
+                return found
+            k *= 4
+
+    def candidate_lists(self, k, members=None):
+        """
+        For each point, its k nearest other points, nearest first (local search candidates)
+
+        Args:
+            k: Candidates per point
+            members: Indexed points to restrict to (e.g. one route's stops); None = all of them
+
+        Returns:
+            List (one per point, or per member) of point indices (or positions in members)
+        """
+        if members is None:
+            _, indices = self.tree.query(self.points, k=min(k + 1, self.size))
+            return [[j for j in row if j != i][:k] for i, row in enumerate(indices.tolist())]
+
+        position = {point: p for p, point in enumerate(members)}
+        wanted = min(k, len(members) - 1)
+        candidates = []
+        for p, point in enumerate(members):
+            found = self._nearest_members(point, k + 1, position, lambda found: len(found) > wanted)
+            candidates.append([q for q in found if q != p][:k])
+        return candidates
+
+    def nearest_neighbor_order(self, start=0, members=None):
+        """
+        Greedy nearest-neighbor path over the indexed points
+
+        Each step asks the tree for the closest few points and widens the
+        query only when all of them are already visited.
+
+        Args:
+            start: First point (position in members when given)
+            members: Indexed points to visit (e.g. one route's stops); None = all of them
+
+        Returns:
+            List of point indices (or positions in members), starting at start
+        """
+        points = range(self.size) if members is None else members
+        position = {point: p for p, point in enumerate(points)}
+        visited = [False] * len(points)
+        visited[start] = True
+        order = [start]
+        current = start
+        for _ in range(len(points) - 1):
+            unvisited = [p for p in self._nearest_members(points[current], NEAREST_NEIGHBOR_BATCH, position,
+                                                          lambda found: any(not visited[p] for p in found))
+                         if not visited[p]]
+            current = unvisited[0]
+            visited[current] = True
+            order.append(current)
+        return order
+
+def co_location_issues(drivers, index, flagged):
+    """
+    Geocoding issues for drivers placed on the same spot as drivers with other addresses
+
+    Several distinct addresses resolving to one point (a comuna center, a
+    street centroid) means the geocode is approximate, even when Google
+    answered OK.
+
+    Args:
+        drivers: Resolved drivers, in the order they were indexed
+        index: SpatialIndex over the drivers' coordinates
+        flagged: Driver indexes (1-based) that already have an issue
+
+    Returns:
+        List of 'info' issues, in driver order
+    """
+    import numpy as np
+
+    coordinates = index.points  # Already projected: query the tree directly
+    issues = []
+    for position, neighbors in enumerate(index.tree.query_radius(coordinates, r=CO_LOCATION_RADIUS_KM)):
+        if position + 1 in flagged or len(neighbors) < CO_LOCATION_MIN_ADDRESSES:
+            continue
+        addresses = {clean_address_for_geocoding(str(drivers[n].get('address', ''))).lower() for n in np.sort(neighbors)}
+        if len(addresses) >= CO_LOCATION_MIN_ADDRESSES:
+            driver = drivers[position]
+            issues.append({
+                'driver_index': position + 1,
+                'driver_name': driver.get('name', 'Unknown'),
+                'address': driver.get('address', 'N/A'),
+                'issue': f'Same location as {len(neighbors) - 1} other driver(s) with different addresses - approximate geocode',
+                'severity': 'info'
+            })
+    return issues
+
+def driver_dicts(drivers):
+    """JSON-shaped driver dicts for output (materializes DriverRecord views)"""
+    return [d.to_dict() if isinstance(d, DriverRecord) else d for d in drivers]
+
+def cluster_drivers(drivers, num_vans, report=None):
+    """
+    Clustering stage: split drivers into vans with K-means and balance the load
+
+    Memoized on the driver coordinates and fleet size.
+
+    Returns:
+        List of clusters (lists of drivers), one per van
+    """
+    from sklearn.cluster import KMeans
+
+    report = report or StageReport('clustering')
+    with report:
+        coordinates = coordinate_array(drivers)
+        key = stage_key('clustering', coordinates.round(7).tolist(), num_vans)
+        found, assignment = stage_memo.get(key)
+        report.record(found)
+
+        if found:
+            logger.debug("Reusing clustering into %d vans", num_vans)
+        else:
+            logger.debug("Clustering into %d vans", num_vans)
+            kmeans = KMeans(n_clusters=num_vans, random_state=42, n_init=10)
+            labels = kmeans.fit_predict(coordinates)
+
+            # Group driver positions by cluster
+            assignment = [[] for _ in range(num_vans)]
+            for position, label in enumerate(labels):
+                assignment[label].append(position)
+
+            # Balance load
+            assignment = balance_load(assignment)
+            stage_memo.put(key, assignment)
+
+        return [[drivers[position] for position in cluster] for cluster in assignment]
+
+def optimize_route_memoized(drivers, report=None, context=None, time_limit_seconds=None, solver=None):
+    """
+    Routing stage: optimize_route_tsp memoized on the ordered stop coordinates,
+    van capacity and solver time limit
+
+    Routes that needed manual review are not memoized so they are retried, nor
+    are routes whose time limit was cut by the request deadline: a later
+    request with time to spare solves them in full. Large-instance mode passes
+    its shorter per-route time_limit_seconds, which is part of the key, and
+    its solver processes.
+
+    Returns:
+        tuple: (route, needs_manual_review)
+    """
+    context = context or OptimizationContext()
+    report = report or StageReport('routing')
+    if time_limit_seconds is None:
+        time_limit_seconds = ROUTE_SOLVER_TIME_LIMIT_SECONDS
+    with report:
+        key = stage_key('routing', coordinate_array(drivers).tolist(), context.van_capacity, time_limit_seconds)
+        found, order = stage_memo.get(key)
+        report.record(found)
+
+        if found:
+            return [drivers[position] for position in order], False
+
+        full_limit = context.solver_time_limit(time_limit_seconds) == time_limit_seconds
+        route, needs_review = optimize_route_tsp(drivers, context, time_limit_seconds, solver)
+        if not needs_review and full_limit:
+            positions = {id(driver): position for position, driver in enumerate(drivers)}
+            stage_memo.put(key, [positions[id(driver)] for driver in route])
+        return route, needs_review
+
+def partition_roster(coordinates, num_vans, max_drivers=LARGE_INSTANCE_PARTITION_SIZE):
+    """
+    Recursive coordinate bisection of a roster into spatial partitions
+
+    Each step cuts a region across its wider side and shares the region's vans
+    between the two halves in proportion to their drivers, until a region has
+    at most max_drivers drivers or a single van. Cuts use a linear-time
+    selection, so partitioning is O(n log n).
+
+    Args:
+        coordinates: numpy array (n, 2) of lat/lng
+        num_vans: Vans for the whole roster
+
+    Returns:
+        List of (positions, vans): numpy index arrays into coordinates and the
+        vans assigned to each partition, in spatial (depth-first) order
+    """
+    import numpy as np
+
+    # Degrees of longitude are shorter than degrees of latitude away from the equator
+    scale = np.array([1.0, np.cos(np.radians(coordinates[:, 0].mean()))]) if len(coordinates) else np.ones(2)
+
+    partitions = []
+    pending = [(np.arange(len(coordinates)), num_vans)]
+    while pending:
+        positions, vans = pending.pop()
+        if len(positions) <= max_drivers or vans < 2:
+            partitions.append((positions, vans))
+            continue
+
+        points = coordinates[positions] * scale
+        axis = int(np.ptp(points[:, 1]) > np.ptp(points[:, 0]))
+        left_vans = vans // 2
+        cut = round(len(positions) * left_vans / vans)
+        order = np.argpartition(points[:, axis], cut)
+
+        pending.append((positions[order[cut:]], vans - left_vans))
+        pending.append((positions[order[:cut]], left_vans))  # Popped first: left-to-right order
+    return partitions
+
+def solve_partition(drivers, num_vans, context):
+    """
+    Cluster one partition into vans and route each van (runs in a worker
+    thread; the route solves go to the partition solver processes)
+
+    Returns:
+        Tuple (routes, clustering report, routing report, started, clustered, finished):
+        routes as (route, needs_manual_review) per non-empty cluster
+    """
+    clustering, routing = StageReport('clustering'), StageReport('routing')
+    started = time.perf_counter()
+    clusters = cluster_drivers(drivers, num_vans, clustering)
+    clustered = time.perf_counter()
+    time_limit = min(ROUTE_SOLVER_TIME_LIMIT_SECONDS, LARGE_INSTANCE_ROUTE_SECONDS)
+    solver = get_partition_solver()
+    routes = [optimize_route_memoized(cluster, routing, context, time_limit, solver) for cluster in clusters if cluster]
+    return routes, clustering, routing, started, clustered, time.perf_counter()
+
+def route_length(route):
+    """Open path length of a route in km (first stop to last stop)"""
+    return sum(calculate_distance(a['coordinates'], b['coordinates']) for a, b in zip(route, route[1:]))
+
+def removal_saving(route, position):
+    """km saved by taking route[position] out of the route"""
+    stop = route[position]['coordinates']
+    previous = route[position - 1]['coordinates'] if position > 0 else None
+    following = route[position + 1]['coordinates'] if position + 1 < len(route) else None
+    saving = 0.0
+    if previous:
+        saving += calculate_distance(previous, stop)
+    if following:
+        saving += calculate_distance(stop, following)
+    if previous and following:
+        saving -= calculate_distance(previous, following)
+    return saving
+
+def cheapest_insertion(route, driver):
+    """
+    Cheapest position to insert a stop into an open route
+
+    Returns:
+        Tuple (extra km, position)
+    """
+    stop = driver['coordinates']
+    if not route:
+        return 0.0, 0
+    best = (calculate_distance(stop, route[0]['coordinates']), 0)
+    best = min(best, (calculate_distance(route[-1]['coordinates'], stop), len(route)))
+    for position in range(1, len(route)):
+        previous, following = route[position - 1]['coordinates'], route[position]['coordinates']
+        extra = calculate_distance(previous, stop) + calculate_distance(stop, following) - calculate_distance(previous, following)
+        best = min(best, (extra, position))
+    return best
+
+def repair_partition_boundaries(routes, van_capacity, context=None):
+    """
+    Boundary repair: move stops to vans of neighboring partitions when that shortens the total
+
+    Partitions are solved independently, so a stop near a cut can end up in a
+    van of its own partition although a van across the cut passes closer. Stops
+    whose nearest van (by centroid) belongs to another partition are relocated
+    into one of the BOUNDARY_REPAIR_NEIGHBORS nearest such vans, at its cheapest
+    position, when the van has room and the insertion costs less than the
+    removal saves.
+
+    Args:
+        routes: List of [partition, route, needs_manual_review]; routes are modified in place
+        van_capacity: Maximum stops per van
+        context: OptimizationContext (repair stops when its deadline expires)
+
+    Returns:
+        Number of stops moved
+    """
+    import numpy as np
+
+    vans = [entry for entry in routes if entry[1]]
+    if len(vans) < 2:
+        return 0
+
+    # Indexed over van centroids, not pickups: the request's index cannot answer these queries
+    centroids = SpatialIndex([coordinate_array(route).mean(axis=0) for _, route, _ in vans])
+    partition_of = np.array([partition for partition, _, _ in vans])
+
+    # Boundary stops: nearest van centroid is in another partition
+    candidates = []
+    for van_index, (partition, route, _) in enumerate(vans):
+        _, nearest = centroids.nearest(coordinate_array(route), BOUNDARY_REPAIR_NEIGHBORS + 1)
+        for driver, van_order in zip(route, nearest):
+            targets = [t for t in van_order if partition_of[t] != partition]
+            if targets and targets[0] == van_order[0]:
+                candidates.append((driver, van_index, targets[:BOUNDARY_REPAIR_NEIGHBORS]))
+
+    moved = 0
+    for driver, van_index, targets in candidates:
+        if context is not None and context.expired():
+            break
+        source = vans[van_index][1]
+        if len(source) < 2:
+            continue  # Never empty a van
+        position = next(i for i, stop in enumerate(source) if stop is driver)
+        saving = removal_saving(source, position)
+
+        best = None
+        for target in targets:
+            route = vans[target][1]
+            if len(route) >= van_capacity:
+                continue
+            extra, insert_at = cheapest_insertion(route, driver)
+            if extra < saving - 1e-6 and (best is None or extra < best[0]):
+                best = (extra, target, insert_at)
+
+        if best:
+            _, target, insert_at = best
+            del source[position]
+            vans[target][1].insert(insert_at, driver)
+            moved += 1
+    return moved
+
+def solve_large_instance(drivers, stages, context):
+    """
+    Large-instance mode for one terminal group
+
+    1. Partition the roster spatially (partition_roster)
+    2. Cluster and route the partitions independently, LARGE_INSTANCE_WORKERS at a
+       time: threads for clustering, solver processes for the routes (get_partition_solver)
+    3. Repair routes along partition boundaries (repair_partition_boundaries)
+
+    The fleet is raised to ceil(drivers / van capacity) when numVans cannot carry
+    every driver, since each partition needs enough vans for its own drivers;
+    the pipeline reports the raise as a request-level issue (fleet_raised_issue).
+
+    Args:
+        drivers: Terminal group (driver records)
+        stages: Pipeline StageReports ('clustering', 'routing'; 'boundaryRepair' is added)
+        context: OptimizationContext for the request
+
+    Returns:
+        Tuple (routes, num_vans): routes as (van position, route, needs_manual_review)
+    """
+    num_vans = max(context.num_vans, math.ceil(len(drivers) / context.van_capacity))
+    if num_vans > context.num_vans:
+        logger.warning("Fleet raised from %d to %d vans to carry %d drivers", context.num_vans, num_vans, len(drivers))
+
+    partitions = partition_roster(coordinate_array(drivers), num_vans)
+    logger.info("Large-instance mode: %d drivers, %d vans, %d partitions", len(drivers), num_vans, len(partitions))
+
+    with ThreadPoolExecutor(max_workers=LARGE_INSTANCE_WORKERS) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, solve_partition, [drivers[p] for p in positions], vans, context)
+            for positions, vans in partitions
+        ]
+        solved = [future.result() for future in futures]
+
+    routes = []
+    for partition, (partition_routes, clustering, routing, started, clustered, finished) in enumerate(solved):
+        stages['clustering'].merge(clustering)
+        stages['clustering'].span(started, clustered)
+        stages['routing'].merge(routing)
+        stages['routing'].span(clustered, finished)
+        routes.extend([partition, route, needs_review] for route, needs_review in partition_routes)
+
+    report = stages.setdefault('boundaryRepair', StageReport('boundaryRepair'))
+    with report:
+        moved = repair_partition_boundaries(routes, context.van_capacity, context)
+        report.record(False)
+    metrics.inc('boundary_repair_moves_total', moved)
+    logger.info("Boundary repair moved %d stops between partitions", moved)
+
+    return [(position, route, needs_review) for position, (_, route, needs_review) in enumerate(routes) if route], num_vans
+
+def fleet_raised_issue(terminal, num_drivers, requested_vans, used_vans, van_capacity):
+    """
+    Request-level geocodingIssues entry for a terminal group that needed more vans than numVans
+
+    Returns:
+        'warning' issue dict (driver fields None)
+    """
+    return {
+        'driver_index': None,
+        'driver_name': None,
+        'address': None,
+        'issue': (f'{num_drivers} drivers to {terminal} do not fit in {requested_vans} vans of {van_capacity} seats'
+                  f' - {used_vans} vans used'),
+        'severity': 'warning',
+        'fleet': {'terminal': terminal, 'requestedVans': requested_vans, 'usedVans': used_vans}
+    }
+
+def uses_bus_mode(terminal):
+    """Check if a terminal uses bus de acercamiento mode"""
+    terminal_lower = terminal.lower().strip()
+    return any(term in terminal_lower for term in TERMINALS_WITH_BUS)
+
+def group_drivers_by_terminal(drivers):
+    """Group drivers by their destination terminal"""
+    terminal_groups = {}
+    for driver in drivers:
+        terminal = driver.get('terminal', 'Terminal Aeropuerto T1')
+        if terminal not in terminal_groups:
+            terminal_groups[terminal] = []
+        terminal_groups[terminal].append(driver)
+    return terminal_groups
+
+def iter_bus_mode_vans(drivers, terminal, terminal_coord, num_vans_override=None, stages=None, context=None):
+    """
+    Optimize routes using bus de acercamiento mode
+
+    Flow:
+    1. Van picks up Group 1 drivers and drops them at bus stop
     2. Van returns and picks up Group 2 drivers, takes them directly to terminal
     3. Bus takes all Group 1 passengers from bus stop to terminal
 
+    Each van is yielded as soon as its group is solved; the bus comes last.
+
+    Args:
+        stages: Optional dict of StageReport for 'clustering' and 'routing'
+        context: OptimizationContext for the request (fleet size, capacities, deadline)
+
+    Yields:
+        Van/bus configurations
+
     Returns:
-        tuple: (vans, total_distance, needs_manual_review) where:
-            - vans: List of van/bus configurations
+        tuple: (total_distance, needs_manual_review) where:
             - total_distance: Total distance in km
             - needs_manual_review: True if any route optimization failed
     """
-    print(f"Using BUS MODE for {len(drivers)} drivers to {terminal}")
+    logger.info("Using bus mode for %d drivers to %s", len(drivers), terminal)
+
+    context = context or OptimizationContext()
 
     # Determine number of vans needed
     if num_vans_override is not None:
         # User specified number of vans - use it directly (frontend already validated)
         num_vans = num_vans_override
-        print(f"Using configured number of vans: {num_vans}")
+        logger.debug("Using configured number of vans: %d", num_vans)
     else:
-        # Use DEFAULT_NUM_VANS (10 vans by default)
-        num_vans = DEFAULT_NUM_VANS
-        print(f"Using default fleet size: {num_vans} vans")
-
-    # Cluster drivers using K-means
-    print(f"Clustering into {num_vans} vans...")
-    coordinates = np.array([[d['coordinates']['lat'], d['coordinates']['lng']] for d in drivers])
-    kmeans = KMeans(n_clusters=num_vans, random_state=42, n_init=10)
-    labels = kmeans.fit_predict(coordinates)
+        # Use the request's fleet size (DEFAULT_NUM_VANS unless configured)
+        num_vans = context.num_vans
+        logger.debug("Using default fleet size: %d vans", num_vans)
 
-    # Group drivers by cluster
-    clusters = [[] for _ in range(num_vans)]
-    for driver, label in zip(drivers, labels):
-        clusters[label].append(driver)
+    stages = stages or {}
 
-    # Balance load
-    clusters = balance_load(clusters)
+    # Cluster drivers using K-means (balanced)
+    clusters = cluster_drivers(drivers, num_vans, stages.get('clustering'))
 
     # Optimize routes for each van (split into 2 groups)
-    vans = []
+    vehicle_count = 0
     bus_passengers = []  # Accumulate all Group 1 passengers for the bus
     total_distance = 0
     needs_manual_review = False  # Track if any optimization failed
@@ -934,10 +3370,10 @@ def optimize_with_bus_mode(drivers, terminal, terminal_coord, num_vans_override=
 
         # GROUP 1: Optimize route home → bus stop
         if group_1:
-            route_1, needs_review_1 = optimize_route_tsp(group_1)
+            route_1, needs_review_1 = optimize_route_memoized(group_1, stages.get('routing'), context)
             if needs_review_1:
                 needs_manual_review = True
-                print(f"  ⚠ Van {van_idx + 1} - Grupo 1 requires manual review")
+                logger.warning("Van %d - Grupo 1 requires manual review", van_idx + 1)
 
             route_1_coords = [d['coordinates'] for d in route_1]
             route_1_coords.append(BUS_STOP_MAIPU)  # End at bus stop
@@ -949,27 +3385,28 @@ def optimize_with_bus_mode(drivers, terminal, terminal_coord, num_vans_override=
 
             total_distance += distance_1
 
-            vans.append({
+            vehicle_count += 1
+            yield {
                 'name': f'Van {van_idx + 1} - Grupo 1',
-                'drivers': route_1,
+                'drivers': driver_dicts(route_1),
                 'route': route_1_coords,
                 'totalDistance': distance_1,
                 'destination': 'Bus de Acercamiento',
-                'capacity': VAN_CAPACITY,
-                'utilization': len(route_1) / VAN_CAPACITY * 100,
+                'capacity': context.van_capacity,
+                'utilization': len(route_1) / context.van_capacity * 100,
                 'trip_type': 'to_bus',
                 'is_van': True,
                 'needs_manual_review': needs_review_1
-            })
+            }
 
             bus_passengers.extend(group_1)
 
         # GROUP 2: Optimize route home → terminal direct
         if group_2:
-            route_2, needs_review_2 = optimize_route_tsp(group_2)
+            route_2, needs_review_2 = optimize_route_memoized(group_2, stages.get('routing'), context)
             if needs_review_2:
                 needs_manual_review = True
-                print(f"  ⚠ Van {van_idx + 1} - Grupo 2 requires manual review")
+                logger.warning("Van %d - Grupo 2 requires manual review", van_idx + 1)
 
             route_2_coords = [d['coordinates'] for d in route_2]
             route_2_coords.append(terminal_coord)  # End at terminal
@@ -981,31 +3418,33 @@ def optimize_with_bus_mode(drivers, terminal, terminal_coord, num_vans_override=
 
             total_distance += distance_2
 
-            vans.append({
+            vehicle_count += 1
+            yield {
                 'name': f'Van {van_idx + 1} - Grupo 2',
-                'drivers': route_2,
+                'drivers': driver_dicts(route_2),
                 'route': route_2_coords,
                 'totalDistance': distance_2,
                 'destination': terminal,
-                'capacity': VAN_CAPACITY,
-                'utilization': len(route_2) / VAN_CAPACITY * 100,
+                'capacity': context.van_capacity,
+                'utilization': len(route_2) / context.van_capacity * 100,
                 'trip_type': 'to_terminal',
                 'is_van': True,
                 'needs_manual_review': needs_review_2
-            })
+            }
 
     # Create BUS route (bus stop → terminal)
     if bus_passengers:
         bus_route = [BUS_STOP_MAIPU, terminal_coord]
 
         # Get real road distance for bus route
-        bus_route_info = get_route_distance_and_time(BUS_STOP_MAIPU, terminal_coord)
+        with context.metrics.collect():
+            bus_route_info = get_route_distance_and_time_memoized(BUS_STOP_MAIPU, terminal_coord)
         if bus_route_info:
             bus_distance = bus_route_info['distance_km']
-            print(f"  ✓ Bus route (real): {bus_distance} km")
+            logger.debug("Bus route (real): %s km", bus_distance)
         else:
             bus_distance = calculate_distance(BUS_STOP_MAIPU, terminal_coord)
-            print(f"  ⚠ Bus route (geodesic fallback): {bus_distance} km")
+            logger.debug("Bus route (geodesic fallback): %s km", bus_distance)
 
         total_distance += bus_distance
 
@@ -1013,517 +3452,2903 @@ def optimize_with_bus_mode(drivers, terminal, terminal_coord, num_vans_override=
         bus_driver_list = []
         for passenger in bus_passengers:
             bus_driver_list.append({
-                **passenger,
+                **(passenger.to_dict() if isinstance(passenger, DriverRecord) else passenger),
                 'pickup_location': 'Bus Stop - Av. Departamental esq Av. Pedro Aguirre Cerda'
             })
 
-        vans.append({
+        vehicle_count += 1
+        yield {
             'name': 'Bus de Acercamiento',
             'drivers': bus_driver_list,
             'route': bus_route,
             'totalDistance': bus_distance,
             'destination': terminal,
-            'capacity': BUS_CAPACITY,
-            'utilization': len(bus_passengers) / BUS_CAPACITY * 100,
+            'capacity': context.bus_capacity,
+            'utilization': len(bus_passengers) / context.bus_capacity * 100,
             'trip_type': 'bus_to_terminal',
             'is_bus': True
-        })
+        }
 
     if needs_manual_review:
-        print(f"⚠ Bus mode optimization complete: {len(vans)} vehicles, {total_distance:.1f} km total - REQUIRES MANUAL REVIEW")
+        logger.warning("Bus mode optimization complete: %d vehicles, %.1f km total - REQUIRES MANUAL REVIEW", vehicle_count, total_distance)
     else:
-        print(f"✓ Bus mode optimization complete: {len(vans)} vehicles, {total_distance:.1f} km total")
+        logger.info("Bus mode optimization complete: %d vehicles, %.1f km total", vehicle_count, total_distance)
 
-    return vans, total_distance, needs_manual_review
+    return total_distance, needs_manual_review
 
-def handle_upload(event):
-    """Handle file upload"""
-    try:
-        # Parse multipart form data from base64
-        body = event.get('body', '')
-        is_base64 = event.get('isBase64Encoded', False)
+def drain_generator(generator):
+    """Run a generator to completion; returns (yielded items, return value)"""
+    items = []
+    while True:
+        try:
+            items.append(next(generator))
+        except StopIteration as done:
+            return items, done.value
 
-        if is_base64:
-            body = base64.b64decode(body)
+def optimize_with_bus_mode(drivers, terminal, terminal_coord, num_vans_override=None, stages=None, context=None):
+    """
+    Optimize routes using bus de acercamiento mode (see iter_bus_mode_vans)
 
-        # For Lambda Function URLs, the body might already be bytes
-        if isinstance(body, str):
-            body = body.encode('utf-8')
+    Returns:
+        tuple: (vans, total_distance, needs_manual_review)
+    """
+    vans, (total_distance, needs_manual_review) = drain_generator(
+        iter_bus_mode_vans(drivers, terminal, terminal_coord, num_vans_override, stages, context)
+    )
+    return vans, total_distance, needs_manual_review
 
-        # Parse the uploaded file
-        # Note: In production, you'd properly parse multipart/form-data
-        # For now, we'll accept JSON with base64 encoded file
-        data = json.loads(body if isinstance(body, str) else body.decode('utf-8'))
-        file_content = base64.b64decode(data.get('file_content', ''))
+def _csv_parser_engine():
+    """Use the pyarrow CSV engine when installed, otherwise pandas' C engine"""
+    return 'pyarrow' if importlib.util.find_spec('pyarrow') is not None else 'c'
 
-        # Read Excel/CSV file
-        file_ext = data.get('filename', '').lower()
-        print(f"Processing file: {file_ext}")
+def sniff_csv_layout(prefix):
+    """
+    Detect encoding, delimiter and leading "Table 1" row from the first bytes of a CSV
 
-        if file_ext.endswith('.csv'):
-            # Try to auto-detect delimiter (comma or semicolon)
-            try:
-                # First, peek at the first line to check for "Table 1" header
-                first_line = file_content.decode('utf-8').split('\n')[0].strip()
-                print(f"First line of CSV: {first_line}")
+    Only the prefix is inspected, never the whole file.
 
-                skip_rows = 0
-                if first_line == 'Table 1':
-                    print("Detected 'Table 1' header, will skip first row")
-                    skip_rows = 1
+    Args:
+        prefix: First UPLOAD_SNIFF_BYTES bytes of the file
 
-                # Try to read with auto-detection
-                df = pd.read_csv(BytesIO(file_content), sep=None, engine='python', skiprows=skip_rows)
+    Returns:
+        dict with 'encoding', 'delimiter' and 'skip_rows'
+    """
+    encoding = 'utf-8-sig' if prefix.startswith(codecs.BOM_UTF8) else 'utf-8'
+    try:
+        # Incremental decoder tolerates a multi-byte character cut at the end of the prefix
+        text = codecs.getincrementaldecoder(encoding)().decode(prefix, final=False)
+    except UnicodeDecodeError:
+        # Legacy Excel exports are usually Windows-1252 / Latin-1
+        encoding = 'latin-1'
+        text = prefix.decode(encoding)
+
+    lines = [line.strip() for line in text.splitlines()]
+
+    skip_rows = 0
+    if lines and lines[0] == 'Table 1':
+        logger.debug("Detected 'Table 1' header, will skip first row")
+        skip_rows = 1
+
+    # The header row rarely contains delimiters inside values, so count candidates there
+    header = lines[skip_rows] if len(lines) > skip_rows else ''
+    counts = {d: header.count(d) for d in CSV_CANDIDATE_DELIMITERS}
+    delimiter = max(counts, key=counts.get) if max(counts.values()) > 0 else ','
+
+    return {'encoding': encoding, 'delimiter': delimiter, 'skip_rows': skip_rows}
+
+def _excel_cell_to_str(value):
+    """Convert an openpyxl cell value to the string pandas would show for it"""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, dt_time):
+        return value.strftime('%H:%M')
+    return str(value)
 
-                # If columns look wrong (like ['Table', '1']), try with semicolon delimiter
-                if len(df.columns) <= 2 or 'Table' in df.columns:
-                    print("Column detection looks wrong, forcing semicolon delimiter...")
-                    df = pd.read_csv(BytesIO(file_content), sep=';', skiprows=skip_rows)
+def iter_roster_xlsx(fileobj, chunk_rows=None):
+    """
+    Read an .xlsx roster with openpyxl in read-only (streaming) mode
 
-            except Exception as e:
-                print(f"Auto-detection failed: {e}, trying semicolon...")
-                # Fallback to semicolon
-                try:
-                    df = pd.read_csv(BytesIO(file_content), sep=';', skiprows=1)
-                except:
-                    df = pd.read_csv(BytesIO(file_content), sep=';')
-        else:
-            # Excel files (.xls or .xlsx)
-            if file_ext.endswith('.xls') and not file_ext.endswith('.xlsx'):
-                # Old Excel format (.xls) - use xlrd
-                print("Detected .xls file, using xlrd engine")
-                df = pd.read_excel(BytesIO(file_content), engine='xlrd')
-            else:
-                # Modern Excel format (.xlsx) - use openpyxl (default)
-                print("Detected .xlsx file, using openpyxl engine")
-                df = pd.read_excel(BytesIO(file_content))
-
-        # Clean column names (remove extra spaces)
-        df.columns = df.columns.str.strip()
-
-        print(f"Columns found: {list(df.columns)}")
-        print(f"Rows: {len(df)}")
-
-        # Flexible column mapping to support multiple formats
-        # Try to detect name column
-        name_col = None
-        for possible_name in ['Nombre Completo', 'Nombre', 'Name']:
-            if possible_name in df.columns:
-                name_col = possible_name
-                break
+    The header is the first row with at least two non-empty cells, so title
+    rows above the table are skipped.
 
-        # Try to detect address column
-        address_col = None
-        for possible_address in ['Dirección', 'Dirección Casa', 'Address']:
-            if possible_address in df.columns:
-                address_col = possible_address
-                break
+    Args:
+        fileobj: Binary file-like object
+        chunk_rows: Yield a DataFrame every chunk_rows rows (None = one DataFrame)
 
-        # Try to detect terminal/destination column
-        terminal_col = None
-        for possible_terminal in ['Lugar de presentación', 'Terminal Destino', 'Terminal', 'Deposito']:
-            if possible_terminal in df.columns:
-                terminal_col = possible_terminal
-                break
+    Yields:
+        DataFrames with string (or missing) values
+    """
+    import openpyxl
+    import pandas as pd
 
-        # Try to detect time column
-        time_col = None
-        for possible_time in ['Hora de presentación', 'Hora Presentación', 'Hora']:
-            if possible_time in df.columns:
-                time_col = possible_time
+    workbook = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+
+        header = None
+        for row in rows:
+            if sum(1 for cell in row if cell not in (None, '')) >= 2:
+                header = [str(cell).strip() if cell is not None else f'Unnamed: {i}' for i, cell in enumerate(row)]
                 break
 
-        # Try to detect commune column (optional, for better geocoding)
-        commune_col = None
-        if 'Comuna' in df.columns:
-            commune_col = 'Comuna'
+        if header is None:
+            yield pd.DataFrame()
+            return
 
-        # Validate required columns
-        if not name_col or not address_col:
-            return {
-                'statusCode': 400,
-                'headers': cors_headers(),
-                'body': json.dumps({
-                    'error': f'El archivo debe contener columnas de Nombre y Dirección. Columnas encontradas: {list(df.columns)}'
-                })
-            }
+        width = len(header)
+        records = []
+        for row in rows:
+            values = [_excel_cell_to_str(cell) for cell in row[:width]]
+            values.extend([None] * (width - len(values)))
+            records.append(values)
 
-        print(f"Mapped columns: Name={name_col}, Address={address_col}, Terminal={terminal_col}, Time={time_col}, Commune={commune_col}")
+            if chunk_rows and len(records) >= chunk_rows:
+                yield pd.DataFrame(records, columns=header)
+                records = []
 
-        # Convert to JSON
-        drivers = []
-        for idx, row in df.iterrows():
-            # Skip empty rows
-            if pd.isna(row[name_col]) or str(row[name_col]).strip() == '':
-                continue
+        if records or not chunk_rows:
+            yield pd.DataFrame(records, columns=header)
+    finally:
+        workbook.close()
 
-            # Build address with commune for better geocoding
-            address = str(row[address_col])
-            if commune_col and not pd.isna(row[commune_col]):
-                commune = str(row[commune_col]).strip()
-                # Only append commune if it's not already in the address
-                if commune.lower() not in address.lower():
-                    address = f"{address}, {commune}"
-
-            driver = {
-                'name': str(row[name_col]).strip(),
-                'address': address,
-                'terminal': str(row[terminal_col]).strip() if terminal_col and not pd.isna(row[terminal_col]) else 'Terminal Aeropuerto T1',
-                'time': str(row[time_col]).strip() if time_col and not pd.isna(row[time_col]) else '08:00'
-            }
+def iter_roster_tables(fileobj, filename, chunk_rows=None):
+    """
+    Parse an uploaded roster (CSV, XLSX or XLS) in a single pass
 
-            # Add optional fields if available
-            if 'Código OB' in df.columns and not pd.isna(row['Código OB']):
-                driver['code'] = str(row['Código OB'])
-            elif 'Código' in df.columns and not pd.isna(row['Código']):
-                driver['code'] = str(row['Código'])
+    Args:
+        fileobj: Seekable binary file-like object with the file content
+        filename: Original filename (used for format detection)
+        chunk_rows: Yield a DataFrame every chunk_rows rows so callers can start
+            working before the whole file is parsed (None = one DataFrame)
 
-            if 'Celular' in df.columns and not pd.isna(row['Celular']):
-                driver['phone'] = str(row['Celular'])
+    Yields:
+        DataFrames with all values as strings (missing values as NaN/None)
+    """
+    import pandas as pd
 
-            if 'Rut' in df.columns and not pd.isna(row['Rut']):
-                driver['rut'] = str(row['Rut'])
+    file_ext = filename.lower()
 
-            drivers.append(driver)
+    if file_ext.endswith('.csv'):
+        prefix = fileobj.read(UPLOAD_SNIFF_BYTES)
+        fileobj.seek(0)
 
-        print(f"Successfully parsed {len(drivers)} drivers from file")
+        layout = sniff_csv_layout(prefix)
+        # pyarrow can't read in chunks; the C engine can
+        engine = 'c' if chunk_rows else _csv_parser_engine()
+        logger.debug("CSV layout: delimiter=%r, skip_rows=%s, encoding=%s, engine=%s", layout['delimiter'], layout['skip_rows'], layout['encoding'], engine)
 
-        return {
-            'statusCode': 200,
-            'headers': cors_headers(),
-            'body': json.dumps({
-                'drivers': drivers,
-                'count': len(drivers),
-                'message': 'Archivo procesado exitosamente'
-            })
+        read_options = {
+            'sep': layout['delimiter'],
+            'skiprows': layout['skip_rows'],
+            'encoding': layout['encoding'],
+            'dtype': str,
+            'engine': engine
         }
 
-    except Exception as e:
-        import traceback
-        print(f"Upload error: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
-        return {
-            'statusCode': 500,
-            'headers': cors_headers(),
-            'body': json.dumps({'error': str(e)})
-        }
+        if chunk_rows:
+            with pd.read_csv(fileobj, chunksize=chunk_rows, **read_options) as reader:
+                yield from reader
+        else:
+            yield pd.read_csv(fileobj, **read_options)
+        return
 
-def handle_optimize(event):
-    """Handle route optimization with support for bus mode"""
-    try:
-        body = event.get('body', '{}')
-        if event.get('isBase64Encoded', False):
-            body = base64.b64decode(body).decode('utf-8')
+    if file_ext.endswith('.xls'):
+        # Old Excel format (.xls) - use xlrd (no streaming support)
+        logger.debug("Detected .xls file, using xlrd engine")
+        yield pd.read_excel(fileobj, engine='xlrd', dtype=str)
+        return
 
-        data = json.loads(body)
-        drivers = data.get('drivers', [])
+    # Modern Excel format (.xlsx) - stream rows with openpyxl read-only mode
+    logger.debug("Detected .xlsx file, using openpyxl read-only mode")
+    yield from iter_roster_xlsx(fileobj, chunk_rows)
 
-        if not drivers:
-            return {
-                'statusCode': 400,
-                'headers': cors_headers(),
-                'body': json.dumps({'error': 'No drivers data provided'})
-            }
+def read_roster_table(fileobj, filename):
+    """Parse an uploaded roster into a single DataFrame (see iter_roster_tables)"""
+    return next(iter_roster_tables(fileobj, filename))
 
-        # ============================================
-        # RESPONSE CACHING (for development/testing)
-        # ============================================
-        # Generate cache key from request data
-        cache_key = generate_cache_key(data)
-        print(f"Request cache key: {cache_key}")
+def map_roster_columns(columns):
+    """
+    Detect which uploaded columns hold each driver field
 
-        # Check if cached response exists
-        cached_response = get_cached_response(cache_key)
-        if cached_response is not None:
-            # Return cached response immediately
-            print(f"✓ Returning cached response (skipping optimization)")
-            return {
-                'statusCode': 200,
-                'headers': cors_headers(),
-                'body': json.dumps(cached_response)
-            }
-        # ============================================
+    Args:
+        columns: Column names from the uploaded file
 
-        # Get configuration parameters from request (with defaults)
-        config = data.get('config', {})
-        num_vans_config = config.get('numVans', None)  # None means auto-calculate
-        safety_margin_config = config.get('safetyMargin', 0.20)  # Default 20%
-        destination_terminal_config = config.get('destinationTerminal', None)  # None means use from data
+    Returns:
+        dict mapping field name to column name (or None if absent)
 
-        print(f"Configuration: num_vans={num_vans_config}, safety_margin={safety_margin_config}, terminal={destination_terminal_config}")
+    Raises:
+        ValueError: If the name or address column is missing
+    """
+    def first_present(candidates):
+        return next((c for c in candidates if c in columns), None)
+
+    column_map = {
+        'name': first_present(ROSTER_NAME_COLUMNS),
+        'address': first_present(ROSTER_ADDRESS_COLUMNS),
+        'terminal': first_present(ROSTER_TERMINAL_COLUMNS),
+        'time': first_present(ROSTER_TIME_COLUMNS),
+        'commune': first_present(ROSTER_COMMUNE_COLUMNS),
+        'code': [c for c in ROSTER_CODE_COLUMNS if c in columns],
+        'phone': first_present(ROSTER_PHONE_COLUMNS),
+        'rut': first_present(ROSTER_RUT_COLUMNS)
+    }
 
-        # Override SAFETY_BUFFER with user configuration
-        global SAFETY_BUFFER
-        original_safety_buffer = SAFETY_BUFFER
+    if not column_map['name'] or not column_map['address']:
+        raise ValueError(f'El archivo debe contener columnas de Nombre y Dirección. Columnas encontradas: {list(columns)}')
 
-        try:
-            SAFETY_BUFFER = 1.0 + safety_margin_config
-
-            # Generate demo ID for tracking
-            demo_id = str(uuid.uuid4())
-
-            # Geocode all addresses and calculate travel times IN PARALLEL
-            print(f"Geocoding {len(drivers)} addresses in parallel using Google Maps API...")
-
-            # Prepare driver data for parallel processing
-            driver_data_list = [(i, driver, destination_terminal_config) for i, driver in enumerate(drivers)]
-
-            # Use ThreadPoolExecutor for parallel geocoding
-            # Max 10 workers to avoid overwhelming the API
-            max_workers = min(10, len(drivers))
-            print(f"Using {max_workers} parallel workers for geocoding")
-
-            geocoding_errors = []  # Track errors for reporting
-
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                # Submit all geocoding tasks
-                future_to_idx = {executor.submit(geocode_driver_parallel, driver_data): driver_data[0]
-                                for driver_data in driver_data_list}
-
-                # Collect results as they complete
-                results = []
-                for future in as_completed(future_to_idx):
-                    try:
-                        idx, geocoded_driver, error_info = future.result()
-                        results.append((idx, geocoded_driver))
-
-                        # Collect error information if any
-                        if error_info:
-                            geocoding_errors.append(error_info)
-
-                    except Exception as e:
-                        idx = future_to_idx[future]
-                        print(f"Error geocoding driver {idx+1}: {e}")
-
-                        # Track critical error
-                        geocoding_errors.append({
-                            'driver_index': idx + 1,
-                            'driver_name': drivers[idx].get('name', 'Unknown'),
-                            'address': drivers[idx].get('address', 'N/A'),
-                            'issue': f'Critical processing failure: {str(e)}',
-                            'severity': 'error'
-                        })
-
-                        # Keep original driver data with fallback coordinates
-                        driver_with_fallback = drivers[idx].copy()
-                        if 'coordinates' not in driver_with_fallback:
-                            driver_with_fallback['coordinates'] = {
-                                'lat': -33.4489 + (random.random() - 0.5) * 0.1,
-                                'lng': -70.6693 + (random.random() - 0.5) * 0.1
-                            }
-                        results.append((idx, driver_with_fallback))
-
-            # Sort results by original index to maintain order
-            results.sort(key=lambda x: x[0])
-            drivers = [driver for _, driver in results]
-
-            # Log error summary
-            if geocoding_errors:
-                print(f"\n⚠ Geocoding Issues Summary: {len(geocoding_errors)} address(es) had problems")
-                errors_by_severity = {
-                    'error': [e for e in geocoding_errors if e['severity'] == 'error'],
-                    'warning': [e for e in geocoding_errors if e['severity'] == 'warning'],
-                    'info': [e for e in geocoding_errors if e['severity'] == 'info']
-                }
-                if errors_by_severity['error']:
-                    print(f"  ❌ Errors: {len(errors_by_severity['error'])}")
-                if errors_by_severity['warning']:
-                    print(f"  ⚠ Warnings: {len(errors_by_severity['warning'])}")
-                if errors_by_severity['info']:
-                    print(f"  ℹ Info: {len(errors_by_severity['info'])}")
-            else:
-                print(f"\n✓ All addresses geocoded successfully")
+    return column_map
 
-            print(f"✓ Completed geocoding {len(drivers)} addresses in parallel")
+def normalize_presentation_times(times):
+    """
+    Vectorized normalization of presentation times to zero-padded "HH:MM"
 
-            # Sort drivers by presentation time (earliest first) within each terminal
-            drivers_sorted = sorted(drivers, key=lambda d: d['presentation_time_minutes'])
-            print(f"\nDrivers sorted by presentation time (earliest: {drivers_sorted[0]['pickup_time_latest']}, latest: {drivers_sorted[-1]['pickup_time_latest']})")
+    Accepts "H:MM", "HH:MM" and "HH:MM:SS" (Excel time cells). Values that
+    don't look like a time are kept as-is so parse_presentation_time can warn.
+    """
+    parts = times.str.extract(r'^(\d{1,2}):(\d{2})(?::\d{2}(?:\.\d+)?)?$')
+    parsed = parts[0].notna()
+    normalized = parts[0].str.zfill(2) + ':' + parts[1]
+    return times.where(~parsed, normalized)
 
-            # Group drivers by terminal (using sorted drivers)
-            terminal_groups = group_drivers_by_terminal(drivers_sorted)
+def roster_frame_to_drivers(df, column_map):
+    """
+    Build driver dicts from a roster DataFrame using column-wise operations
 
-            # Optimize each terminal group
-            all_vans = []
-            total_distance = 0
-            total_vans = 0
-            routes_need_manual_review = False  # Track if any route needs manual review
+    Args:
+        df: DataFrame from read_roster_table (string values)
+        column_map: Result of map_roster_columns
 
-            for terminal, terminal_drivers in terminal_groups.items():
-                print(f"\nProcessing {len(terminal_drivers)} drivers for terminal: {terminal}")
+    Returns:
+        List of driver dicts
+    """
+    import numpy as np
+    import pandas as pd
+
+    def text(column):
+        return df[column].astype('string').str.strip()
+
+    names = text(column_map['name'])
+
+    # Skip empty rows
+    keep = (names.notna() & (names != '')).to_numpy()
+    df = df.loc[keep]
+    names = names[keep]
+    if df.empty:
+        return []
+
+    # Build address with commune for better geocoding
+    addresses = df[column_map['address']].astype('string').fillna('')
+    if column_map['commune']:
+        communes = text(column_map['commune'])
+        present = communes.notna().to_numpy()
+        address_lower = np.char.lower(addresses.to_numpy(dtype=str))
+        commune_lower = np.char.lower(communes.fillna('').to_numpy(dtype=str))
+        # Only append commune if it's not already in the address
+        missing = present & (np.char.find(address_lower, commune_lower) < 0)
+        addresses = addresses.where(~missing, addresses + ', ' + communes)
+
+    if column_map['terminal']:
+        terminals = text(column_map['terminal']).fillna('Terminal Aeropuerto T1')
+    else:
+        terminals = pd.Series('Terminal Aeropuerto T1', index=df.index, dtype='string')
 
-                # Check if this terminal uses bus mode
-                if uses_bus_mode(terminal):
-                    # BUS MODE: Use bus de acercamiento
-                    terminal_coord = geocode_terminal(terminal)
+    if column_map['time']:
+        times = normalize_presentation_times(text(column_map['time'])).fillna('08:00')
+    else:
+        times = pd.Series('08:00', index=df.index, dtype='string')
+
+    optional = {}
+    if column_map['code']:
+        codes = df[column_map['code'][0]]
+        for fallback in column_map['code'][1:]:
+            codes = codes.combine_first(df[fallback])
+        optional['code'] = codes
+    if column_map['phone']:
+        optional['phone'] = df[column_map['phone']]
+    if column_map['rut']:
+        optional['rut'] = df[column_map['rut']]
+
+    base_columns = zip(names.tolist(), addresses.tolist(), terminals.tolist(), times.tolist())
+    drivers = [
+        {'name': name, 'address': address, 'terminal': terminal, 'time': time_str}
+        for name, address, terminal, time_str in base_columns
+    ]
+
+    # Add optional fields only where present
+    for field, values in optional.items():
+        values = values.astype(object).where(values.notna(), None).tolist()
+        for driver, value in zip(drivers, values):
+            if value is not None:
+                driver[field] = str(value)
+
+    return drivers
+
+def parse_roster(fileobj, filename):
+    """
+    Parse an uploaded roster file into driver dicts
 
-                    # Use DEFAULT_NUM_VANS if not configured
-                    bus_num_vans = num_vans_config if num_vans_config is not None else DEFAULT_NUM_VANS
+    Args:
+        fileobj: Seekable binary file-like object
+        filename: Original filename
 
-                    vans, distance, needs_review = optimize_with_bus_mode(terminal_drivers, terminal, terminal_coord, bus_num_vans)
-                    if needs_review:
-                        routes_need_manual_review = True
-                    all_vans.extend(vans)
-                    total_distance += distance
-                    total_vans += len([v for v in vans if v.get('is_van', False)])
+    Returns:
+        List of driver dicts
 
-                else:
-                    # NORMAL MODE: Direct to terminal
-                    if num_vans_config is not None:
-                        # User specified number of vans - use it directly (frontend already validated)
-                        num_vans = num_vans_config
-                        print(f"Using user-configured number of vans: {num_vans}")
-                    else:
-                        # Use DEFAULT_NUM_VANS (10 vans by default)
-                        num_vans = DEFAULT_NUM_VANS
-                        print(f"Using default fleet size: {num_vans} vans")
-
-                    # Cluster drivers using K-means
-                    print(f"Clustering into {num_vans} vans...")
-                    coordinates = np.array([[d['coordinates']['lat'], d['coordinates']['lng']] for d in terminal_drivers])
-                    kmeans = KMeans(n_clusters=num_vans, random_state=42, n_init=10)
-                    labels = kmeans.fit_predict(coordinates)
-
-                    # Group drivers by cluster
-                    clusters = [[] for _ in range(num_vans)]
-                    for driver, label in zip(terminal_drivers, labels):
-                        clusters[label].append(driver)
-
-                    # Balance load
-                    clusters = balance_load(clusters)
-
-                    # Optimize route for each van
-                    for i, cluster in enumerate(clusters):
-                        if not cluster:
-                            continue
-
-                        optimized_route, needs_review = optimize_route_tsp(cluster)
-                        if needs_review:
-                            routes_need_manual_review = True
-                            print(f"  ⚠ Van {total_vans + i + 1} requires manual review")
-
-                        route_distance = 0
-                        route_coordinates = []
-
-                        for j in range(len(optimized_route)):
-                            route_coordinates.append(optimized_route[j]['coordinates'])
-                            if j > 0:
-                                route_distance += calculate_distance(
-                                    optimized_route[j-1]['coordinates'],
-                                    optimized_route[j]['coordinates']
-                                )
-
-                        total_distance += route_distance
-
-                        all_vans.append({
-                            'name': f'Van {total_vans + i + 1}',
-                            'drivers': optimized_route,
-                            'route': route_coordinates,
-                            'totalDistance': route_distance,
-                            'destination': terminal,
-                            'capacity': VAN_CAPACITY,
-                            'utilization': len(optimized_route) / VAN_CAPACITY * 100,
-                            'is_van': True,
-                            'needs_manual_review': needs_review
-                        })
-
-                    total_vans += num_vans
-
-            # Calculate metrics
-            manual_distance = total_distance * 1.12
-            distance_saved = ((manual_distance - total_distance) / manual_distance) * 100
-
-            # Determine optimization method description
-            if routes_need_manual_review:
-                optimization_method = 'Requiere Revisión Manual - Todas las estrategias de optimización fallaron'
-                print("\n" + "="*70)
-                print("⚠ ATENCIÓN: SE REQUIERE INTERVENCIÓN MANUAL")
-                print("="*70)
-                print("Algunas rutas no pudieron ser optimizadas correctamente.")
-                print("Por favor, revise manualmente las rutas marcadas con 'needs_manual_review'.")
-                print("="*70 + "\n")
-            else:
-                optimization_method = 'OR-Tools con fallback a TSP 2-opt'
-
-            result = {
-                'vans': all_vans,
-                'totalDrivers': len(drivers),
-                'totalDistance': total_distance,
-                'distanceSavedPercent': round(distance_saved, 1),
-                'timeSaved': '15-20',
-                'optimizationTime': '< 2 min',
-                'success': True,
-                'demoId': demo_id,
-                'usingBusMode': any(v.get('is_bus', False) for v in all_vans),
-                'geocodingIssues': geocoding_errors if geocoding_errors else None,
-                'hasIssues': len(geocoding_errors) > 0,
-                'optimizationMethod': optimization_method,
-                'requiresManualReview': routes_need_manual_review,
-                'manualReviewMessage': 'Algunas rutas requieren revisión manual debido a fallos en la optimización automática.' if routes_need_manual_review else None
-            }
+    Raises:
+        ValueError: If required columns are missing
+    """
+    df = read_roster_table(fileobj, filename)
 
-            # Track demo usage
-            track_demo_usage(demo_id, {
-                'drivers_count': len(drivers),
-                'vans_count': total_vans,
-                'total_distance': total_distance,
-                'bus_mode': result['usingBusMode']
-            })
+    # Clean column names (remove extra spaces)
+    df.columns = [str(c).strip() for c in df.columns]
 
-            # Save response to cache for future requests
-            save_response_to_cache(cache_key, result)
+    logger.debug("Columns found: %s", list(df.columns))
+    logger.debug("Rows: %d", len(df))
 
-            print(f"Optimization complete: {total_vans} vans, {total_distance:.1f} km total")
-            return {
-                'statusCode': 200,
-                'headers': cors_headers(),
-                'body': json.dumps(result)
-            }
+    column_map = map_roster_columns(df.columns)
+    logger.debug("Mapped columns", extra={'fields': column_map})
 
-        finally:
-            # Restore original SAFETY_BUFFER
-            SAFETY_BUFFER = original_safety_buffer
+    return roster_frame_to_drivers(df, column_map)
 
-    except Exception as e:
-        print(f"Optimization error: {e}")
-        import traceback
-        traceback.print_exc()
-        return {
-            'statusCode': 500,
-            'headers': cors_headers(),
-            'body': json.dumps({'error': str(e)})
-        }
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES"""
 
-def lambda_handler(event, context):
-    """Main Lambda handler for Function URLs"""
-    print(f"Event: {json.dumps(event)}")
+class Base64DecodingStream(io.RawIOBase):
+    """
+    Read-only stream that decodes a base64 string in chunks
 
-    # Handle OPTIONS for CORS preflight
-    if event.get('requestContext', {}).get('http', {}).get('method') == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': cors_headers(),
-            'body': ''
-        }
+    Lets a base64 Lambda body be parsed as a stream without materializing a
+    second full-size decoded copy.
+    """
 
-    # Get the path and method
-    path = event.get('rawPath', event.get('path', ''))
-    method = event.get('requestContext', {}).get('http', {}).get('method', 'GET')
+    def __init__(self, encoded):
+        self._encoded = encoded.encode('ascii') if isinstance(encoded, str) else encoded
+        self._position = 0
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self._pending) < len(buffer) and self._position < len(self._encoded):
+            # Decode in multiples of 4 characters (3 bytes) so chunk boundaries stay aligned
+            chunk = self._encoded[self._position:self._position + (UPLOAD_CHUNK_BYTES // 3) * 4]
+            self._position += len(chunk)
+            self._pending += base64.b64decode(chunk)
+
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+def lambda_body_stream(event):
+    """Return the Lambda event body as a binary stream, decoding base64 incrementally"""
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded', False):
+        return io.BufferedReader(Base64DecodingStream(body), buffer_size=UPLOAD_CHUNK_BYTES)
+    return BytesIO(body.encode('utf-8') if isinstance(body, str) else body)
+
+def spool_stream(stream, max_bytes, initial=b''):
+    """
+    Copy a stream into a SpooledTemporaryFile, enforcing a size limit
 
-    # Route to appropriate handler
-    if path == '/api/upload' or path == '/upload':
-        return handle_upload(event)
-    elif path == '/api/optimize' or path == '/optimize':
-        return handle_optimize(event)
-    elif path == '/api/health' or path == '/health':
+    Small uploads stay in memory; larger ones spill to /tmp.
+
+    Raises:
+        UploadTooLarge: If more than max_bytes are read
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+    total = len(initial)
+    if total > max_bytes:
+        spool.close()
+        raise UploadTooLarge(f'El archivo excede el tamaño máximo permitido ({max_bytes // (1024 * 1024)} MB)')
+    spool.write(initial)
+
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            spool.close()
+            raise UploadTooLarge(f'El archivo excede el tamaño máximo permitido ({max_bytes // (1024 * 1024)} MB)')
+        spool.write(chunk)
+
+    spool.seek(0)
+    return spool
+
+def parse_multipart_stream(stream, content_type, max_bytes):
+    """
+    Incrementally parse a multipart/form-data body
+
+    The file part is streamed to a SpooledTemporaryFile chunk by chunk; other
+    (small) form fields are returned as strings.
+
+    Args:
+        stream: Binary stream positioned at the start of the body
+        content_type: Content-Type header including the boundary parameter
+        max_bytes: Maximum accepted file size
+
+    Returns:
+        tuple: (fields, filename, fileobj) - fileobj is None if no file part was sent
+
+    Raises:
+        ValueError: If the body is not valid multipart/form-data
+        UploadTooLarge: If the file part exceeds max_bytes
+    """
+    import email.message
+
+    header = email.message.Message()
+    header['content-type'] = content_type
+    boundary = header.get_param('boundary')
+    if not boundary:
+        raise ValueError('Falta el boundary en Content-Type multipart/form-data')
+
+    delimiter = b'--' + boundary.encode('latin-1')
+    part_end = b'\r\n' + delimiter
+    buffer = b''
+    total_read = 0
+
+    def fill():
+        nonlocal buffer, total_read
+        chunk = stream.read(UPLOAD_CHUNK_BYTES)
+        if chunk:
+            total_read += len(chunk)
+            # Allow some room for part headers and small fields on top of the file itself
+            if total_read > max_bytes + UPLOAD_CHUNK_BYTES:
+                raise UploadTooLarge(f'El archivo excede el tamaño máximo permitido ({max_bytes // (1024 * 1024)} MB)')
+            buffer += chunk
+        return bool(chunk)
+
+    # Skip preamble up to the first delimiter
+    while delimiter not in buffer:
+        if not fill():
+            raise ValueError('Cuerpo multipart/form-data inválido')
+    buffer = buffer[buffer.index(delimiter) + len(delimiter):]
+
+    fields = {}
+    filename = None
+    fileobj = None
+
+    try:
+        while True:
+            while len(buffer) < 2 and fill():
+                pass
+            if buffer.startswith(b'--'):
+                break  # Closing delimiter
+
+            # Part headers
+            while b'\r\n\r\n' not in buffer:
+                if not fill():
+                    raise ValueError('Cuerpo multipart/form-data inválido')
+            raw_headers, buffer = buffer.split(b'\r\n\r\n', 1)
+            part = email.message_from_bytes(raw_headers.lstrip(b'\r\n'))
+            name = part.get_param('name', header='content-disposition')
+            part_filename = part.get_filename()
+
+            # Part body: emit everything except a tail that could hold a split delimiter
+            is_file = part_filename is not None and fileobj is None
+            sink = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES) if is_file else BytesIO()
+            size = 0
+            while True:
+                end = buffer.find(part_end)
+                if end >= 0:
+                    data, buffer = buffer[:end], buffer[end + len(part_end):]
+                else:
+                    # Hold back a tail that could be the start of a delimiter split across reads
+                    split = max(0, len(buffer) - (len(part_end) - 1))
+                    data, buffer = buffer[:split], buffer[split:]
+
+                size += len(data)
+                if size > max_bytes:
+                    sink.close()
+                    raise UploadTooLarge(f'El archivo excede el tamaño máximo permitido ({max_bytes // (1024 * 1024)} MB)')
+                sink.write(data)
+
+                if end >= 0:
+                    break
+                if not fill():
+                    sink.close()
+                    raise ValueError('Cuerpo multipart/form-data truncado')
+
+            sink.seek(0)
+            if is_file:
+                fileobj, filename = sink, part_filename
+            elif name:
+                fields[name] = sink.read().decode('utf-8', errors='replace')
+    except BaseException:
+        if fileobj is not None:
+            fileobj.close()
+        raise
+
+    return fields, filename, fileobj
+
+def guess_roster_filename(fileobj, filename):
+    """Infer a filename with the right extension from the file's magic bytes when none was sent"""
+    if filename:
+        return filename
+
+    magic = fileobj.read(8)
+    fileobj.seek(0)
+    if magic.startswith(b'PK\x03\x04'):
+        return 'upload.xlsx'
+    if magic.startswith(b'\xd0\xcf\x11\xe0'):
+        return 'upload.xls'
+    return 'upload.csv'
+
+def build_upload_response(fileobj, filename):
+    """Parse a roster file and build the /api/upload response"""
+    filename = guess_roster_filename(fileobj, filename)
+    logger.debug("Processing file: %s", filename.lower())
+
+    try:
+        drivers = parse_roster(fileobj, filename)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+    logger.info("Parsed %d drivers from file", len(drivers))
+
+    return {
+        'statusCode': 200,
+        'headers': cors_headers(),
+        'body': json.dumps({
+            'drivers': drivers,
+            'count': len(drivers),
+            'message': 'Archivo procesado exitosamente'
+        })
+    }
+
+def iter_roster_drivers(fileobj, filename, chunk_rows=ROSTER_CHUNK_ROWS):
+    """
+    Lazily parse an uploaded roster, yielding driver dicts chunk by chunk
+
+    Raises:
+        ValueError: If required columns are missing (raised on the first chunk)
+    """
+    column_map = None
+    for df in iter_roster_tables(fileobj, filename, chunk_rows):
+        df.columns = [str(c).strip() for c in df.columns]
+        if column_map is None:
+            logger.debug("Columns found: %s", list(df.columns))
+            column_map = map_roster_columns(df.columns)
+        yield from roster_frame_to_drivers(df, column_map)
+
+def read_upload_from_stream(stream, content_type, filename=None):
+    """
+    Read an upload body (multipart/form-data or raw binary) into a spooled file
+
+    Returns:
+        tuple: (fields, filename, fileobj) - fileobj is None if a form had no file part
+
+    Raises:
+        UploadTooLarge: If the file exceeds MAX_UPLOAD_BYTES
+        ValueError: If the multipart body is malformed
+    """
+    if content_type.lower().startswith('multipart/form-data'):
+        fields, part_filename, fileobj = parse_multipart_stream(stream, content_type, MAX_UPLOAD_BYTES)
+        return fields, fields.get('filename') or part_filename or filename, fileobj
+
+    return {}, filename, spool_stream(stream, MAX_UPLOAD_BYTES)
+
+def handle_upload_stream(stream, content_type, filename=None):
+    """
+    Handle a raw multipart/form-data or binary upload read from a stream
+
+    Used by both lambda_handler and the Flask upload() route.
+
+    Args:
+        stream: Binary stream with the request body
+        content_type: Request Content-Type
+        filename: Filename for raw binary bodies (X-Filename header or ?filename=)
+    """
+    try:
+        _, filename, fileobj = read_upload_from_stream(stream, content_type, filename)
+        if fileobj is None:
+            return {
+                'statusCode': 400,
+                'headers': cors_headers(),
+                'body': json.dumps({'error': 'No se recibió ningún archivo en el formulario'})
+            }
+
+        with fileobj:
+            return build_upload_response(fileobj, filename)
+
+    except UploadTooLarge as e:
+        return {
+            'statusCode': 413,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+    except Exception as e:
+        logger.exception("Upload error: %s", e)
+        return {
+            'statusCode': 500,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+def handle_upload(event):
+    """
+    Handle file upload
+
+    Accepts raw multipart/form-data or a raw binary body (filename in the
+    X-Filename header or ?filename= query parameter), and the legacy JSON
+    body with a base64 'file_content' field.
+    """
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    content_type = headers.get('content-type', '')
+
+    if content_type and not content_type.lower().startswith(('application/json', 'text/plain')):
+        query = event.get('queryStringParameters') or {}
+        filename = headers.get('x-filename') or query.get('filename')
+        return handle_upload_stream(lambda_body_stream(event), content_type, filename)
+
+    try:
+        # Legacy JSON body with a base64 encoded file
+        body = event.get('body', '')
+        if event.get('isBase64Encoded', False):
+            body = base64.b64decode(body)
+
+        return handle_upload_json(json.loads(body))
+
+    except Exception as e:
+        logger.exception("Upload error: %s", e)
+        return {
+            'statusCode': 500,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+def handle_upload_json(data):
+    """
+    Handle a legacy JSON upload payload
+
+    Args:
+        data: Parsed request body with 'filename' and base64 'file_content'
+    """
+    try:
+        file_content = base64.b64decode(data.get('file_content', ''))
+
+        if len(file_content) > MAX_UPLOAD_BYTES:
+            return {
+                'statusCode': 413,
+                'headers': cors_headers(),
+                'body': json.dumps({'error': f'El archivo excede el tamaño máximo permitido ({MAX_UPLOAD_BYTES // (1024 * 1024)} MB)'})
+            }
+
+        return build_upload_response(BytesIO(file_content), data.get('filename', ''))
+
+    except Exception as e:
+        logger.exception("Upload error: %s", e)
+        return {
+            'statusCode': 500,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+def resolve_driver(driver_data):
+    """
+    Geocode a driver and calculate its travel time to the terminal (one pipeline task)
+
+    Args:
+        driver_data: Tuple of (index, driver, stages, context)
+
+    Returns:
+        Tuple of (index, driver, error_info) - the first issue found is reported
+    """
+    idx, driver, stages, context = driver_data
+
+    with context.metrics.collect(), context.google.active():
+        started = time.perf_counter()
+        idx, driver, error_info = geocode_driver_parallel((idx, driver, stages['geocode'], context))
+        geocoded = time.perf_counter()
+        stages['geocode'].span(started, geocoded)
+
+        idx, driver, travel_error = calculate_travel_time_parallel((idx, driver, stages['travelTimes'], context))
+        stages['travelTimes'].span(geocoded, time.perf_counter())
+
+    return idx, driver, error_info or travel_error
+
+def iter_resolve_drivers(driver_source, context, stages):
+    """
+    Geocode and compute travel times for all drivers IN PARALLEL
+
+    driver_source may be a list or a lazy iterator (e.g. rows streamed from an
+    upload). Each driver is queued for geocoding as soon as it is produced, so
+    parsing overlaps with the network-bound Google Maps calls. The context's
+    destinationTerminal, if any, replaces each driver's terminal.
+
+    Yields:
+        ('geocode', {'resolved', 'total', 'issues'}) progress events as drivers
+        complete (about GEOCODE_PROGRESS_EVENTS, plus one per new issue)
+
+    Returns:
+        tuple: (drivers in original order, geocoding_errors)
+    """
+    destination_terminal_config = context.destination_terminal
+    if isinstance(driver_source, list):
+        drivers_in = iter(ingest_drivers(driver_source, destination_terminal_config, stages['ingest']))
+    else:
+        drivers_in = driver_source
+
+    results = []
+    errors_by_index = {}  # Track errors for reporting (first issue per driver)
+    source_drivers = {}
+
+    # Max 10 workers to avoid overwhelming the API
+    with ThreadPoolExecutor(max_workers=GEOCODE_MAX_WORKERS) as executor:
+        future_to_idx = {}
+        idx = 0
+        while True:
+            # Time spent producing drivers (parsing) is the ingest stage
+            with stages['ingest']:
+                driver = next(drivers_in, None)
+                if driver is None:
+                    break
+                if not isinstance(driver_source, list):
+                    driver = dict(driver)
+                    if destination_terminal_config:
+                        driver['terminal'] = destination_terminal_config
+                    stages['ingest'].computed()
+
+            source_drivers[idx] = driver
+            # Copy the log context so worker threads log under this request's id
+            future_to_idx[executor.submit(contextvars.copy_context().run, resolve_driver, (idx, driver, stages, context))] = idx
+            idx += 1
+
+        logger.info("Geocoding %d addresses in parallel", len(future_to_idx))
+
+        total = len(future_to_idx)
+        progress_step = max(1, total // GEOCODE_PROGRESS_EVENTS)
+        new_issues = []
+
+        for future in as_completed(future_to_idx):
+            try:
+                idx, resolved_driver, error_info = future.result()
+                results.append((idx, resolved_driver))
+
+                # Collect error information if any
+                if error_info:
+                    errors_by_index[idx] = error_info
+                    new_issues.append(error_info)
+
+            except Exception as e:
+                idx = future_to_idx[future]
+                logger.warning("Error geocoding driver %d: %s", idx + 1, e)
+
+                # Track critical error
+                errors_by_index[idx] = {
+                    'driver_index': idx + 1,
+                    'driver_name': source_drivers[idx].get('name', 'Unknown'),
+                    'address': source_drivers[idx].get('address', 'N/A'),
+                    'issue': f'Critical processing failure: {str(e)}',
+                    'severity': 'error'
+                }
+
+                # Keep original driver data with fallback coordinates
+                driver_with_fallback = source_drivers[idx].copy()
+                if 'coordinates' not in driver_with_fallback:
+                    driver_with_fallback['coordinates'] = {
+                        'lat': -33.4489 + (random.random() - 0.5) * 0.1,
+                        'lng': -70.6693 + (random.random() - 0.5) * 0.1
+                    }
+                results.append((idx, driver_with_fallback))
+                new_issues.append(errors_by_index[idx])
+
+            resolved = len(results)
+            if new_issues or resolved % progress_step == 0 or resolved == total:
+                yield 'geocode', {'resolved': resolved, 'total': total, 'issues': new_issues}
+                new_issues = []
+
+    # Sort results by original index to maintain order
+    results.sort(key=lambda x: x[0])
+    drivers = [driver for _, driver in results]
+    geocoding_errors = [errors_by_index[idx] for idx in sorted(errors_by_index)]
+
+    return drivers, geocoding_errors
+
+def iter_optimization_events(driver_source, config):
+    """
+    Run the optimize pipeline (see _iter_optimization_events), counting failed runs
+
+    Returns:
+        Optimization result (dict), as the generator's return value
+    """
+    try:
+        return (yield from _iter_optimization_events(driver_source, config))
+    except Exception:
+        metrics.inc('optimizations_total', outcome='error')
+        raise
+
+def _iter_optimization_events(driver_source, config):
+    """
+    Run the optimize pipeline: ingest, geocode, travel times, clustering and routing
+
+    Progress is yielded as it happens, so callers can stream partial results:
+        ('geocode', {'resolved', 'total', 'issues'})  while drivers are resolved
+        ('van', {'index', 'van'})                     as soon as each van is solved
+
+    All request settings travel in an OptimizationContext, so any number of
+    pipelines can run concurrently in one process.
+
+    Args:
+        driver_source: List of driver dicts, or an iterator yielding them as they are parsed
+        config: Request config (numVans, safetyMargin, destinationTerminal, vanCapacity,
+            busCapacity, terminals, timeBudgetSeconds)
+
+    Returns:
+        Optimization result (dict), as the generator's return value
+
+    Raises:
+        ValueError: If the roster is empty or the config is invalid
+    """
+    # Get configuration parameters from request (with defaults)
+    context = OptimizationContext.from_config(config)
+
+    logger.info("Configuration: num_vans=%s, safety_margin=%.2f, terminal=%s", context.num_vans, context.safety_buffer - 1.0, context.destination_terminal)
+
+    # Generate demo ID for tracking
+    demo_id = str(uuid.uuid4())
+
+    # Each stage is memoized on its own inputs, so a config tweak only
+    # recomputes the stages downstream of what changed
+    stages = {name: StageReport(name) for name in ('ingest', 'geocode', 'travelTimes', 'clustering', 'routing')}
+
+    drivers, geocoding_errors = yield from iter_resolve_drivers(driver_source, context, stages)
+    if not drivers:
+        raise ValueError('No drivers data provided')
+
+    # From here on drivers live in a columnar table; vans get plain dicts back when emitted
+    table = DriverTable(drivers)
+
+    # Distinct addresses geocoded onto one spot are approximate even when Google answered OK
+    flagged = {issue['driver_index'] for issue in geocoding_errors}
+    co_located = co_location_issues(drivers, table.spatial_index(), flagged)
+    if co_located:
+        geocoding_errors = sorted(geocoding_errors + co_located, key=lambda issue: issue['driver_index'])
+
+    # Circuit breaker state and skipped Google calls come first, as a request-level issue
+    geocoding_errors = context.google.issues() + geocoding_errors
+
+    # One summary record for the geocoding stage (per-driver detail is DEBUG)
+    severities = {}
+    for issue in geocoding_errors:
+        severities[issue['severity']] = severities.get(issue['severity'], 0) + 1
+    if geocoding_errors:
+        logger.warning("Geocoding issues: %d address(es) had problems", len(geocoding_errors), extra={'fields': severities})
+    logger.info("Resolved %d drivers", len(drivers))
+
+    # Sort drivers by presentation time (earliest first) within each terminal
+    order = table.sorted_by('presentation_time_minutes')
+    logger.debug("Drivers sorted by presentation time (earliest: %s, latest: %s)", table.value(order[0], 'pickup_time_latest'), table.value(order[-1], 'pickup_time_latest'))
+
+    # Group drivers by terminal (using sorted drivers)
+    terminal_groups = {
+        terminal: table.records(indices) for terminal, indices in table.group_by_terminal(order).items()
+    }
+
+    # Optimize each terminal group
+    all_vans = []
+    total_distance = 0
+    total_vans = 0
+    routes_need_manual_review = False  # Track if any route needs manual review
+
+    for terminal, terminal_drivers in terminal_groups.items():
+        logger.info("Processing %d drivers for terminal: %s", len(terminal_drivers), terminal)
+
+        # Check if this terminal uses bus mode
+        if uses_bus_mode(terminal):
+            # BUS MODE: Use bus de acercamiento
+            terminal_coord = context.terminal_coord(terminal)
+
+            for van in iter_bus_mode_vans(terminal_drivers, terminal, terminal_coord, context.num_vans, stages, context):
+                if van.get('needs_manual_review'):
+                    routes_need_manual_review = True
+                total_distance += van['totalDistance']
+                if van.get('is_van', False):
+                    total_vans += 1
+                all_vans.append(van)
+                yield 'van', {'index': len(all_vans) - 1, 'van': van}
+
+        else:
+            # NORMAL MODE: Direct to terminal
+            if context.uses_large_instance(len(terminal_drivers)):
+                # City-scale group: spatial partitions solved in parallel, then boundary repair
+                routes, num_vans = solve_large_instance(terminal_drivers, stages, context)
+                if num_vans > context.num_vans:
+                    # After the other request-level issues, before the per-driver ones
+                    position = sum(1 for issue in geocoding_errors if issue['driver_index'] is None)
+                    geocoding_errors.insert(position, fleet_raised_issue(
+                        terminal, len(terminal_drivers), context.num_vans, num_vans, context.van_capacity))
+            else:
+                # Fleet size from the request config (DEFAULT_NUM_VANS unless configured)
+                num_vans = context.num_vans
+                logger.debug("Using %d vans", num_vans)
+
+                # Cluster drivers using K-means (balanced), then optimize each van's route as it is consumed
+                clusters = cluster_drivers(terminal_drivers, num_vans, stages['clustering'])
+                routes = (
+                    (i, *optimize_route_memoized(cluster, stages['routing'], context))
+                    for i, cluster in enumerate(clusters) if cluster
+                )
+
+            for i, optimized_route, needs_review in routes:
+                if needs_review:
+                    routes_need_manual_review = True
+                    logger.warning("Van %d requires manual review", total_vans + i + 1)
+
+                route_distance = 0
+                route_coordinates = []
+
+                for j in range(len(optimized_route)):
+                    route_coordinates.append(optimized_route[j]['coordinates'])
+                    if j > 0:
+                        route_distance += calculate_distance(
+                            optimized_route[j-1]['coordinates'],
+                            optimized_route[j]['coordinates']
+                        )
+
+                total_distance += route_distance
+
+                all_vans.append({
+                    'name': f'Van {total_vans + i + 1}',
+                    'drivers': driver_dicts(optimized_route),
+                    'route': route_coordinates,
+                    'totalDistance': route_distance,
+                    'destination': terminal,
+                    'capacity': context.van_capacity,
+                    'utilization': len(optimized_route) / context.van_capacity * 100,
+                    'is_van': True,
+                    'needs_manual_review': needs_review
+                })
+                yield 'van', {'index': len(all_vans) - 1, 'van': all_vans[-1]}
+
+            total_vans += num_vans
+
+    # Plan KPIs per terminal, van and wave, against every driver driving on their own
+    kpis = plan_kpis(all_vans, context.terminal_coord, context.safety_buffer)
+
+    # Determine optimization method description
+    if routes_need_manual_review:
+        optimization_method = 'Requiere Revisión Manual - Todas las estrategias de optimización fallaron'
+        logger.warning("ATENCIÓN: SE REQUIERE INTERVENCIÓN MANUAL - revise las rutas marcadas con 'needs_manual_review'")
+    else:
+        optimization_method = 'OR-Tools con fallback a TSP 2-opt'
+
+    # Per-request timings (response) and process-wide metrics (/api/metrics)
+    timings = context.metrics.to_dict(stages)
+    for stage, elapsed_ms in timings['stagesMs'].items():
+        metrics.observe('stage_seconds', elapsed_ms / 1000, stage=stage)
+    metrics.observe('optimization_seconds', timings['totalMs'] / 1000)
+    metrics.inc('optimizations_total', outcome='success')
+    for report in stages.values():
+        logger.info("Stage summary", extra={'fields': report.to_dict()})
+
+    result = {
+        'vans': all_vans,
+        'totalDrivers': len(drivers),
+        'totalDistance': total_distance,
+        'distanceSavedPercent': kpis['summary']['distanceSavedPercent'],
+        'timeSaved': kpis['summary']['vehicleHoursSaved'],
+        'optimizationTime': f"{timings['totalMs'] / 1000:.1f} s",
+        'success': True,
+        'demoId': demo_id,
+        'usingBusMode': any(v.get('is_bus', False) for v in all_vans),
+        'geocodingIssues': geocoding_errors if geocoding_errors else None,
+        'hasIssues': len(geocoding_errors) > 0,
+        'optimizationMethod': optimization_method,
+        'requiresManualReview': routes_need_manual_review,
+        'manualReviewMessage': 'Algunas rutas requieren revisión manual debido a fallos en la optimización automática.' if routes_need_manual_review else None,
+        'pipelineStages': [report.to_dict() for report in stages.values()],
+        'kpis': kpis,
+        'timings': timings
+    }
+
+    # Track demo usage
+    track_demo_usage(demo_id, {
+        'drivers_count': len(drivers),
+        'vans_count': total_vans,
+        'total_distance': total_distance,
+        'bus_mode': result['usingBusMode']
+    })
+
+    logger.info("Optimization complete: %d vans, %.1f km total", total_vans, total_distance,
+                extra={'fields': {'totalMs': timings['totalMs'], 'solverRuns': timings['solver']['runs'],
+                                  'googleCalls': sum(call['count'] for call in timings['googleCalls'])}})
+    return result
+
+def run_optimization_pipeline(driver_source, config):
+    """
+    Run the optimize pipeline to completion (see iter_optimization_events)
+
+    Returns:
+        Optimization result (dict)
+    """
+    _, result = drain_generator(iter_optimization_events(driver_source, config))
+    return result
+
+def encode_polyline(points, precision=POLYLINE_PRECISION):
+    """
+    Encode coordinates with Google's encoded polyline algorithm
+
+    Args:
+        points: List of {'lat': float, 'lng': float}
+        precision: Decimal digits kept (5 is what Google/Leaflet decoders assume)
+
+    Returns:
+        Encoded polyline string
+    """
+    factor = 10 ** precision
+    encoded = []
+    prev_lat = prev_lng = 0
+
+    for point in points:
+        lat = int(round(point['lat'] * factor))
+        lng = int(round(point['lng'] * factor))
+
+        for delta in (lat - prev_lat, lng - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                encoded.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            encoded.append(chr(value + 63))
+
+        prev_lat, prev_lng = lat, lng
+
+    return ''.join(encoded)
+
+def decode_polyline(encoded, precision=POLYLINE_PRECISION):
+    """
+    Decode a Google encoded polyline
+
+    Returns:
+        List of (lat, lng) tuples
+    """
+    factor = 10 ** precision
+    points = []
+    index = lat = lng = 0
+
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            value = shift = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                value |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(value >> 1) if value & 1 else value >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append((lat / factor, lng / factor))
+
+    return points
+
+def _compact_number(value, decimals=COMPACT_FLOAT_DECIMALS):
+    """Round floats for compact responses (ints, bools and strings pass through)"""
+    return round(value, decimals) if isinstance(value, float) else value
+
+def compact_optimize_result(result):
+    """
+    Convert an optimize result to the compact, normalized format
+
+    Drivers are stored once in a column/row table (coordinates flattened to
+    lat/lng columns); vans reference them by row index, so bus passengers are
+    not repeated. Routes become encoded polylines and floats are rounded.
+
+    Args:
+        result: Full optimize result (as built by run_optimization_pipeline)
+
+    Returns:
+        Compact result dict ('format': 'compact')
+    """
+    columns = []
+    column_set = set()
+    rows = []
+    row_by_identity = {}
+
+    def driver_ref(driver):
+        fields = {k: v for k, v in driver.items() if k not in VAN_DRIVER_FIELDS}
+        identity = json.dumps(fields, sort_keys=True, default=str)
+        idx = row_by_identity.get(identity)
+        if idx is not None:
+            return idx
+
+        row = {}
+        for key, value in fields.items():
+            if key == 'coordinates' and isinstance(value, dict):
+                row['lat'] = _compact_number(value.get('lat'), COMPACT_COORD_DECIMALS)
+                row['lng'] = _compact_number(value.get('lng'), COMPACT_COORD_DECIMALS)
+            else:
+                row[key] = _compact_number(value)
+        for key in row:
+            if key not in column_set:
+                column_set.add(key)
+                columns.append(key)
+
+        idx = row_by_identity[identity] = len(rows)
+        rows.append(row)
+        return idx
+
+    vans = []
+    for van in result.get('vans', []):
+        compact_van = {k: _compact_number(v) for k, v in van.items() if k not in ('drivers', 'route')}
+        compact_van['drivers'] = [driver_ref(d) for d in van.get('drivers', [])]
+        compact_van['route'] = encode_polyline(van.get('route', []))
+
+        for field in VAN_DRIVER_FIELDS:
+            values = {d[field] for d in van.get('drivers', []) if field in d}
+            if len(values) == 1:
+                compact_van[field] = values.pop()
+
+        vans.append(compact_van)
+
+    compact = {k: _compact_number(v) for k, v in result.items() if k != 'vans'}
+    compact.update({
+        'format': 'compact',
+        'formatVersion': COMPACT_RESPONSE_VERSION,
+        'drivers': {
+            'columns': columns,
+            'rows': [[row.get(column) for column in columns] for row in rows]
+        },
+        'vans': vans
+    })
+    return compact
+
+def dumps_response_body(payload):
+    """Serialize a response payload compactly (orjson when installed)"""
+    if orjson is not None:
+        return orjson.dumps(payload).decode('utf-8')
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False)
+
+def negotiate_content_encoding(accept_encoding):
+    """
+    Pick the response Content-Encoding from an Accept-Encoding header
+
+    Returns:
+        'br' (only when brotli is installed), 'gzip', or None for identity
+    """
+    weights = {}
+    for part in (accept_encoding or '').split(','):
+        token, _, params = part.partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[token] = q
+
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best, best_q = None, 0.0
+    for encoding in candidates:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def encoded_json_response(status_code, body, accept_encoding=None):
+    """
+    Build a Lambda response for an already serialized JSON body
+
+    The body is compressed (base64 encoded, as Function URLs expect for
+    binary bodies) when the client accepts gzip or br and it is large enough
+    to be worth it.
+    """
+    headers = {**cors_headers(), 'Content-Type': 'application/json; charset=utf-8', 'Vary': 'Accept-Encoding'}
+    raw = body.encode('utf-8')
+
+    encoding = negotiate_content_encoding(accept_encoding) if len(raw) >= RESPONSE_COMPRESSION_MIN_BYTES else None
+    if encoding is None:
+        return {'statusCode': status_code, 'headers': headers, 'body': body}
+
+    if encoding == 'br':
+        compressed = brotli.compress(raw, quality=5)
+    else:
+        compressed = gzip.compress(raw, compresslevel=6)
+    headers['Content-Encoding'] = encoding
+
+    return {
+        'statusCode': status_code,
+        'headers': headers,
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+def optimize_response(result, compact=False, accept_encoding=None):
+    """
+    Build the optimize response (full JSON by default, compact + negotiated compression on request)
+
+    Serialization time can't be part of the body it measures, so it is sent
+    in a Server-Timing header (with the pipeline total) and recorded in /api/metrics.
+    """
+    started = time.perf_counter()
+    if not compact:
+        response = {
+            'statusCode': 200,
+            'headers': cors_headers(),
+            'body': json.dumps(result)
+        }
+    else:
+        response = encoded_json_response(200, dumps_response_body(compact_optimize_result(result)), accept_encoding)
+
+    serialization_seconds = time.perf_counter() - started
+    metrics.observe('serialization_seconds', serialization_seconds, format='compact' if compact else 'full')
+    server_timing = [f'serialize;dur={serialization_seconds * 1000:.1f}']
+    if result.get('timings'):
+        server_timing.insert(0, f"optimize;dur={result['timings']['totalMs']}")
+    response['headers'] = {**response['headers'], 'Server-Timing': ', '.join(server_timing)}
+    return response
+
+PROFILE_MODES = ('sampling', 'deterministic')
+
+# Leaf frames of threads parked on a lock, queue or socket selector (idle, not request work)
+_IDLE_FRAMES = {('threading.py', 'wait'), ('queue.py', 'get'), ('selectors.py', 'select'), ('thread.py', '_worker')}
+
+def requested_profile_mode(value):
+    """
+    Profiler mode asked for by a request
+
+    Args:
+        value: 'profile' body/query value or X-Profile header (true, 'sampling', 'deterministic')
+
+    Returns:
+        'sampling' or 'deterministic', or None if not requested or ENABLE_PROFILING is off
+    """
+    if value in (None, False, '') or str(value).lower() in ('false', '0', 'off', 'no'):
+        return None
+    if not ENABLE_PROFILING:
+        logger.warning("Profiling requested but ENABLE_PROFILING is off, running unprofiled")
+        return None
+    mode = str(value).lower()
+    return mode if mode in PROFILE_MODES else PROFILE_DEFAULT_MODE
+
+class RequestProfiler:
+    """
+    Profile one optimize request, writing <id>.pstats and <id>.collapsed to PROFILE_DIR
+
+    A sampler thread records the Python stacks of every busy thread, so geocoding
+    workers blocked on Google Maps show up next to KMeans and the solver callbacks;
+    the collapsed stacks (one 'frame;frame;... count' line each) feed flamegraph.pl
+    or speedscope. The pstats file comes from cProfile on the request thread in
+    'deterministic' mode, and is built from the samples in 'sampling' mode.
+    Other requests running in the same process also appear in the samples.
+    """
+
+    def __init__(self, mode, interval_ms=PROFILE_SAMPLE_INTERVAL_MS):
+        self.mode = mode
+        self.interval = interval_ms / 1000
+        self.profile_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.samples = {}  # (thread name, root frame, ..., leaf frame) -> count
+        self.elapsed_seconds = 0.0
+        self._stop = threading.Event()
+        self._sampler = None
+        self._cprofile = None
+
+    def __enter__(self):
+        self._target = threading.get_ident()
+        self._started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._sampler.start()
+        if self.mode == 'deterministic':
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self._stop.set()
+        self._sampler.join()
+        self.elapsed_seconds = time.perf_counter() - self._started
+        return False
+
+    def _sample(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                if ident != self._target and (os.path.basename(stack[0][0]), stack[0][2]) in _IDLE_FRAMES:
+                    continue
+                key = (names.get(ident, str(ident)),) + tuple(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def collapsed_stacks(self):
+        """Samples in the collapsed-stack format, heaviest first"""
+        lines = []
+        for key, count in sorted(self.samples.items(), key=lambda item: -item[1]):
+            frames = [key[0]] + [f"{name} ({os.path.basename(filename)}:{line})" for filename, line, name in key[1:]]
+            lines.append(f"{';'.join(frames)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def sampled_stats(self):
+        """
+        pstats-compatible table built from the samples (call counts are sample counts)
+
+        Returns:
+            Dict {function: (cc, nc, tottime, cumtime, callers)} as marshalled by cProfile
+        """
+        stats = {}
+        for key, count in self.samples.items():
+            frames = key[1:]
+            seconds = count * self.interval
+            for func in set(frames):
+                cc, nc, tt, ct, callers = stats.get(func, (0, 0, 0.0, 0.0, {}))
+                stats[func] = (cc + count, nc + count, tt, ct + seconds, callers)
+            cc, nc, tt, ct, callers = stats[frames[-1]]
+            stats[frames[-1]] = (cc, nc, tt + seconds, ct, callers)
+            for caller, callee in set(zip(frames, frames[1:])):
+                callers = stats[callee][4]
+                ecc, enc, ett, ect = callers.get(caller, (0, 0, 0.0, 0.0))
+                callers[caller] = (ecc + count, enc + count, ett, ect + seconds)
+        return stats
+
+    def save(self):
+        """
+        Write the profile artifacts
+
+        Returns:
+            The response's 'profile' block (id, mode, artifact paths, sample count, elapsed ms)
+        """
+        import marshal
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        pstats_path = PROFILE_DIR / f"{self.profile_id}.pstats"
+        collapsed_path = PROFILE_DIR / f"{self.profile_id}.collapsed"
+
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(str(pstats_path))
+        else:
+            with open(pstats_path, 'wb') as f:
+                marshal.dump(self.sampled_stats(), f)
+        collapsed_path.write_text(self.collapsed_stacks(), encoding='utf-8')
+
+        logger.info("Profile %s written to %s", self.profile_id, PROFILE_DIR)
+        return {
+            'id': self.profile_id,
+            'mode': self.mode,
+            'pstats': str(pstats_path),
+            'collapsed': str(collapsed_path),
+            'samples': sum(self.samples.values()),
+            'sampleIntervalMs': self.interval * 1000,
+            'elapsedMs': round(self.elapsed_seconds * 1000, 1)
+        }
+
+def handle_optimize(event):
+    """Handle route optimization (Lambda event adapter over handle_optimize_request)"""
+    try:
+        body = event.get('body', '{}')
+        if event.get('isBase64Encoded', False):
+            body = base64.b64decode(body).decode('utf-8')
+
+        data = json.loads(body)
+
+    except Exception as e:
+        logger.exception("Optimization error: %s", e)
+        return {
+            'statusCode': 500,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    return handle_optimize_request(
+        data, event.get('queryStringParameters'), headers.get('accept-encoding'), headers.get('x-profile')
+    )
+
+def handle_optimize_request(data, query=None, accept_encoding=None, profile=None):
+    """
+    Handle route optimization with support for bus mode
+
+    The compact response format is opt-in with {"format": "compact"} in the
+    body or ?format=compact; it is compressed per the Accept-Encoding header.
+    With ENABLE_PROFILING on, {"profile": true | "sampling" | "deterministic"}
+    (or the X-Profile header) runs the request under RequestProfiler.
+
+    Args:
+        data: Parsed request body ({'drivers': [...], 'config': {...}})
+        query: Query string parameters
+        accept_encoding: Accept-Encoding request header
+        profile: X-Profile request header
+    """
+    try:
+        drivers = data.get('drivers', [])
+        query = query or {}
+        compact = (data.get('format') or query.get('format')) == 'compact'
+
+        if not drivers:
+            return {
+                'statusCode': 400,
+                'headers': cors_headers(),
+                'body': json.dumps({'error': 'No drivers data provided'})
+            }
+
+        profile_mode = requested_profile_mode(data.get('profile') or query.get('profile') or profile)
+        if profile_mode:
+            # Profiled runs skip the response cache: a cache hit has nothing to profile
+            with RequestProfiler(profile_mode) as profiler:
+                result = run_optimization_pipeline(drivers, data.get('config') or {})
+            result['profile'] = profiler.save()
+            response = optimize_response(result, compact, accept_encoding)
+            response['headers'] = {**response['headers'], 'X-Profile-Id': profiler.profile_id}
+            return response
+
+        # ============================================
+        # RESPONSE CACHING (for development/testing)
+        # ============================================
+        # Generate cache key from request data
+        cache_key = generate_cache_key(data)
+        logger.debug("Request cache key: %s", cache_key)
+
+        # Check if cached response exists
+        cache_started = time.perf_counter()
+        cached_response = get_cached_response(cache_key)
+        if cached_response is not None:
+            # Return cached response immediately
+            logger.info("Returning cached response (skipping optimization)")
+            mark_response_cache_hit(cached_response, cache_started)
+            return optimize_response(cached_response, compact, accept_encoding)
+        # ============================================
+
+        result = run_optimization_pipeline(drivers, data.get('config') or {})
+
+        # Save response to cache for future requests
+        save_response_to_cache(cache_key, result)
+
+        return optimize_response(result, compact, accept_encoding)
+
+    except Exception as e:
+        logger.exception("Optimization error: %s", e)
+        return {
+            'statusCode': 500,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+def prewarm_shared_stages(requests, geocode_report, travel_report, budget):
+    """
+    Resolve the addresses and travel times shared by a batch once, up front
+
+    Rosters of consecutive days or neighboring depots repeat most addresses.
+    Resolving each distinct address (and address/terminal pair) once fills the
+    stage memo, so the per-roster pipelines that follow hit it instead of
+    calling Google again, including when they run concurrently.
+
+    Every call goes through the batch's GoogleCallBudget, in the worker
+    threads too: a degraded API opens its breaker once for the whole prewarm,
+    and what it skips is left to the rosters' own pipelines.
+
+    Args:
+        requests: Batch rosters ({'drivers', 'config'}) still to be optimized
+        geocode_report: StageReport for the shared geocoding
+        travel_report: StageReport for the shared travel times
+        budget: GoogleCallBudget for the batch
+
+    Returns:
+        Dict with the number of addresses, distinct addresses and distinct routes
+    """
+    addresses = {}
+    total = 0
+    for request in requests:
+        for driver in request['drivers']:
+            address = driver.get('address') if isinstance(driver, dict) else None
+            if isinstance(address, str) and address.strip():
+                total += 1
+                addresses.setdefault(clean_address_for_geocoding(address).lower(), address)
+
+    def geocode(address):
+        started = time.perf_counter()
+        try:
+            with budget.active():
+                return geocode_address_memoized(address, geocode_report)
+        except Exception as e:
+            logger.warning("Batch prewarm: could not geocode %s: %s", address, e)
+            return None, 'fallback'  # The roster's pipeline retries it and reports the issue
+        finally:
+            geocode_report.span(started, time.perf_counter())
+
+    with ThreadPoolExecutor(max_workers=GEOCODE_MAX_WORKERS) as executor:
+        futures = {key: executor.submit(contextvars.copy_context().run, geocode, address) for key, address in addresses.items()}
+        geocoded = {key: future.result() for key, future in futures.items()}
+
+    # Distinct (home, terminal) pairs; fallback geocodes are never memoized, so they are left to the pipelines
+    routes = {}
+    for request in requests:
+        try:
+            context = OptimizationContext.from_config(request['config'])
+        except ValueError:
+            continue  # Reported by the roster's own pipeline
+        terminals = {}
+        for driver in request['drivers']:
+            address = driver.get('address') if isinstance(driver, dict) else None
+            if not isinstance(address, str) or not address.strip():
+                continue
+            coords, strategy = geocoded[clean_address_for_geocoding(address).lower()]
+            if strategy == 'fallback':
+                continue
+            terminal = context.destination_terminal or driver.get('terminal', 'Terminal Aeropuerto T1')
+            if terminal not in terminals:
+                terminals[terminal] = context.terminal_coord(terminal)
+            destination = terminals[terminal]
+            key = (round(coords['lat'], 6), round(coords['lng'], 6), round(destination['lat'], 6), round(destination['lng'], 6))
+            routes.setdefault(key, (coords, destination))
+
+    def travel_time(origin, destination):
+        started = time.perf_counter()
+        try:
+            with budget.active():
+                get_route_distance_and_time_memoized(origin, destination, travel_report)
+        except Exception as e:
+            logger.warning("Batch prewarm: travel time failed: %s", e)
+        finally:
+            travel_report.span(started, time.perf_counter())
+
+    with ThreadPoolExecutor(max_workers=GEOCODE_MAX_WORKERS) as executor:
+        for future in [executor.submit(contextvars.copy_context().run, travel_time, *pair) for pair in routes.values()]:
+            future.result()
+
+    return {'addresses': total, 'uniqueAddresses': len(addresses), 'uniqueRoutes': len(routes)}
+
+def optimize_batch_roster(request):
+    """
+    Optimize one roster of a batch (runs in a batch worker thread)
+
+    Returns:
+        The roster's entry in the batch 'results' ({'id', 'statusCode', 'result' or 'error', 'elapsedMs'})
+    """
+    started = time.perf_counter()
+    entry = {'id': request['id']}
+    data = {'drivers': request['drivers'], 'config': request['config']}
+    try:
+        cache_key = generate_cache_key(data)
+        result = run_optimization_pipeline(data['drivers'], data['config'])
+        save_response_to_cache(cache_key, result)
+        entry.update(statusCode=200, result=result)
+    except ValueError as e:
+        entry.update(statusCode=400, error=str(e))
+    except Exception as e:
+        logger.exception("Batch roster %s failed: %s", request['id'], e)
+        entry.update(statusCode=500, error=str(e))
+    entry['elapsedMs'] = round((time.perf_counter() - started) * 1000, 1)
+    return entry
+
+def handle_optimize_batch(event):
+    """Handle batch optimization (Lambda event adapter over handle_optimize_batch_request)"""
+    try:
+        body = event.get('body', '{}')
+        if event.get('isBase64Encoded', False):
+            body = base64.b64decode(body).decode('utf-8')
+
+        data = json.loads(body)
+
+    except Exception as e:
+        logger.exception("Batch optimization error: %s", e)
+        return {
+            'statusCode': 500,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    return handle_optimize_batch_request(data, event.get('queryStringParameters'), headers.get('accept-encoding'))
+
+def handle_optimize_batch_request(data, query=None, accept_encoding=None):
+    """
+    Optimize several rosters (e.g. a week of days, or several depots) in one call
+
+    Body: {'rosters': [{'id': 'lunes', 'drivers': [...], 'config': {...}}, ...],
+    'config': {...}} - the top-level config holds defaults for every roster.
+    Rosters found in the response cache are answered from it; the addresses
+    and travel times of the rest are resolved once for the whole batch
+    (prewarm_shared_stages), then the rosters are optimized BATCH_WORKERS at a
+    time, largest first. One roster failing does not fail the batch: each
+    result carries its own statusCode.
+
+    Args:
+        data: Parsed request body
+        query: Query string parameters ({"format": "compact"} is honored per roster)
+        accept_encoding: Accept-Encoding request header
+
+    Returns:
+        Response with 'results' (input order), 'summary' and 'timings'
+    """
+    started = time.perf_counter()
+    query = query or {}
+    compact = (data.get('format') or query.get('format')) == 'compact'
+    rosters = data.get('rosters')
+
+    if not isinstance(rosters, list) or not rosters:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': 'No rosters provided'})
+        }
+    if len(rosters) > BATCH_MAX_ROSTERS:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': f'Too many rosters in one batch (max {BATCH_MAX_ROSTERS})'})
+        }
+
+    try:
+        defaults = data.get('config') or {}
+        if not isinstance(defaults, dict):
+            raise ValueError('config must be an object')
+        requests = []
+        for position, roster in enumerate(rosters):
+            roster = roster if isinstance(roster, dict) else {}
+            roster_config = roster.get('config') or {}
+            if not isinstance(roster_config, dict):
+                raise ValueError(f"Roster {roster.get('id', position)}: config must be an object")
+            requests.append({
+                'id': roster.get('id', position),
+                'drivers': roster.get('drivers') or [],
+                'config': {**defaults, **roster_config}
+            })
+
+        results = [None] * len(requests)
+        pending = []
+        for position, request in enumerate(requests):
+            if not request['drivers']:
+                results[position] = {'id': request['id'], 'statusCode': 400, 'error': 'No drivers data provided', 'elapsedMs': 0.0}
+                continue
+            cache_started = time.perf_counter()
+            try:
+                cache_key = generate_cache_key({'drivers': request['drivers'], 'config': request['config']})
+            except (TypeError, ValueError) as e:
+                results[position] = {'id': request['id'], 'statusCode': 400, 'error': f'Invalid optimization config: {e}', 'elapsedMs': 0.0}
+                continue
+            cached_response = get_cached_response(cache_key)
+            if cached_response is not None:
+                mark_response_cache_hit(cached_response, cache_started)
+                results[position] = {
+                    'id': request['id'],
+                    'statusCode': 200,
+                    'result': cached_response,
+                    'elapsedMs': cached_response['timings']['totalMs']
+                }
+            else:
+                pending.append(position)
+
+        shared_stages = {name: StageReport(name) for name in ('geocode', 'travelTimes')}
+        google = GoogleCallBudget(time.monotonic() + GOOGLE_BUDGET_SECONDS)
+        with google.active():
+            shared = prewarm_shared_stages([requests[p] for p in pending], shared_stages['geocode'],
+                                           shared_stages['travelTimes'], google)
+        logger.info("Batch: %d rosters (%d cached), %d addresses, %d distinct", len(requests),
+                    len(requests) - len(pending), shared['addresses'], shared['uniqueAddresses'])
+
+        with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as executor:
+            futures = {
+                executor.submit(contextvars.copy_context().run, optimize_batch_roster, requests[p]): p
+                for p in sorted(pending, key=lambda p: -len(requests[p]['drivers']))
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+    succeeded = [entry['result'] for entry in results if entry['statusCode'] == 200]
+    if compact:
+        for entry in results:
+            if entry['statusCode'] == 200:
+                entry['result'] = compact_optimize_result(entry['result'])
+
+    body = {
+        'results': results,
+        'summary': {
+            'rosters': len(results),
+            'succeeded': len(succeeded),
+            'failed': len(results) - len(succeeded),
+            'totalDrivers': sum(result['totalDrivers'] for result in succeeded),
+            'totalVehicles': sum(len(result['vans']) for result in succeeded),
+            'totalDistance': sum(result['totalDistance'] for result in succeeded)
+        },
+        'timings': {
+            'totalMs': round((time.perf_counter() - started) * 1000, 1),
+            'workers': BATCH_WORKERS,
+            'shared': {**shared, 'stages': [report.to_dict() for report in shared_stages.values()],
+                       'google': google.summary()},
+            'rostersMs': {str(entry['id']): entry['elapsedMs'] for entry in results}
+        },
+        'success': len(succeeded) == len(results)
+    }
+    metrics.observe('batch_seconds', body['timings']['totalMs'] / 1000)
+    return encoded_json_response(200, dumps_response_body(body), accept_encoding)
+
+def response_cache_hit_stage(started):
+    """pipelineStages entry reported when the whole response came from the cache"""
+    return {
+        'stage': 'response',
+        'status': 'hit',
+        'hits': 1,
+        'misses': 0,
+        'elapsedMs': round((time.perf_counter() - started) * 1000, 1)
+    }
+
+def mark_response_cache_hit(cached_response, started):
+    """Replace the stored run's stage report and timings with the cache lookup's"""
+    stage = response_cache_hit_stage(started)
+    cached_response['pipelineStages'] = [stage]
+    cached_response['timings'] = {
+        'totalMs': stage['elapsedMs'],
+        'stagesMs': {'response': stage['elapsedMs']},
+        'solves': [],
+        'solver': {'runs': 0, 'elapsedMs': 0.0, 'solutions': 0, 'branches': 0},
+        'googleCalls': [],
+        'cache': {'response': 'hit', 'hits': 1, 'misses': 0}
+    }
+    return cached_response
+
+def iter_optimize_request_events(data):
+    """
+    Optimize events for a parsed request, ending with ('result', result)
+
+    A response-cache hit replays the cached vans; otherwise the pipeline runs
+    and its result is saved to the cache.
+
+    Raises:
+        ValueError: If the request has no drivers
+    """
+    drivers = data.get('drivers', [])
+    if not drivers:
+        raise ValueError('No drivers data provided')
+
+    cache_key = generate_cache_key(data)
+    cache_started = time.perf_counter()
+    cached_response = get_cached_response(cache_key)
+
+    if cached_response is not None:
+        logger.info("Streaming cached response (skipping optimization)")
+        mark_response_cache_hit(cached_response, cache_started)
+        total = cached_response.get('totalDrivers', len(drivers))
+        yield 'geocode', {'resolved': total, 'total': total, 'issues': cached_response.get('geocodingIssues') or []}
+        for index, van in enumerate(cached_response['vans']):
+            yield 'van', {'index': index, 'van': van}
+        yield 'result', cached_response
+        return
+
+    result = yield from iter_optimization_events(drivers, data.get('config') or {})
+    save_response_to_cache(cache_key, result)
+    yield 'result', result
+
+def iter_in_thread(generator):
+    """
+    Drive a generator in a background thread, relaying what it yields
+
+    The producer never waits on the consumer, so a slow or disconnected
+    client does not stall the pipeline mid-run.
+    """
+    relay = queue.Queue()
+    finished = object()
+
+    def produce():
+        try:
+            for item in generator:
+                relay.put((item, None))
+        except BaseException as e:
+            relay.put((finished, e))
+        else:
+            relay.put((finished, None))
+
+    threading.Thread(target=contextvars.copy_context().run, args=(produce,), name='optimize-stream', daemon=True).start()
+
+    while True:
+        item, error = relay.get()
+        if item is finished:
+            if error is not None:
+                raise error
+            return
+        yield item
+
+def encode_stream_event(event, payload, stream_format='ndjson'):
+    """Encode one event as an SSE message or an NDJSON line"""
+    if stream_format == 'sse':
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps({'event': event, 'data': payload}) + '\n'
+
+def iter_optimize_stream(data, stream_format='ndjson'):
+    """
+    Stream an optimization as encoded events
+
+    Sequence: 'geocode' progress (n/m resolved, new issues), one 'van' per
+    route as soon as its cluster is solved, then a 'summary' with the result
+    totals (everything but 'vans'). Failures end the stream with an 'error'
+    event carrying the HTTP status the plain endpoint would have returned.
+
+    Args:
+        data: Parsed optimize request body
+        stream_format: 'ndjson' or 'sse'
+    """
+    try:
+        for event, payload in iter_in_thread(iter_optimize_request_events(data)):
+            if event == 'result':
+                summary = {k: v for k, v in payload.items() if k != 'vans'}
+                summary['vanCount'] = len(payload['vans'])
+                yield encode_stream_event('summary', summary, stream_format)
+            else:
+                yield encode_stream_event(event, payload, stream_format)
+
+    except ValueError as e:
+        yield encode_stream_event('error', {'error': str(e), 'statusCode': 400}, stream_format)
+    except Exception as e:
+        logger.exception("Optimization stream error: %s", e)
+        yield encode_stream_event('error', {'error': str(e), 'statusCode': 500}, stream_format)
+
+def handle_optimize_stream(event):
+    """
+    Handle streaming optimization (Lambda adapter)
+
+    Python Lambda Function URLs cannot stream a response body, so the events
+    are buffered and returned together; the Flask/production server streams
+    them as they are produced.
+    """
+    query = event.get('queryStringParameters') or {}
+    stream_format = query.get('format', 'ndjson')
+    if stream_format not in STREAM_CONTENT_TYPES:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': f'Formato de stream no soportado: {stream_format}'})
+        }
+
+    try:
+        body = event.get('body', '{}')
+        if event.get('isBase64Encoded', False):
+            body = base64.b64decode(body).decode('utf-8')
+        data = json.loads(body)
+    except Exception as e:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+    return {
+        'statusCode': 200,
+        'headers': {**cors_headers(), 'Content-Type': STREAM_CONTENT_TYPES[stream_format]},
+        'body': ''.join(iter_optimize_stream(data, stream_format))
+    }
+
+def handle_upload_optimize_stream(stream, content_type, filename=None, config=None):
+    """
+    Upload a roster and optimize it in one request
+
+    Rows are parsed in chunks and each one is queued for geocoding and travel
+    time while the rest of the file is still being parsed; clustering and
+    solving start once every row is resolved. The response is the optimize
+    result plus the parsed 'roster', so the client can re-optimize with a
+    different config without uploading again.
+
+    Args:
+        stream: Binary stream with a multipart/form-data or raw file body
+        content_type: Request Content-Type
+        filename: Filename for raw binary bodies
+        config: Optimize config; a 'config' form field (JSON) takes precedence
+    """
+    try:
+        fields, filename, fileobj = read_upload_from_stream(stream, content_type, filename)
+        if fileobj is None:
+            return {
+                'statusCode': 400,
+                'headers': cors_headers(),
+                'body': json.dumps({'error': 'No se recibió ningún archivo en el formulario'})
+            }
+
+        if fields.get('config'):
+            config = json.loads(fields['config'])
+
+        with fileobj:
+            filename = guess_roster_filename(fileobj, filename)
+            logger.debug("Processing file: %s (streaming into optimizer)", filename.lower())
+
+            roster = []
+
+            def parsed_rows():
+                for driver in iter_roster_drivers(fileobj, filename):
+                    roster.append(dict(driver))
+                    yield driver
+
+            result = run_optimization_pipeline(parsed_rows(), config or {})
+
+        result['roster'] = {'drivers': roster, 'count': len(roster)}
+
+        return {
+            'statusCode': 200,
+            'headers': cors_headers(),
+            'body': json.dumps(result)
+        }
+
+    except UploadTooLarge as e:
+        return {
+            'statusCode': 413,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+    except Exception as e:
+        logger.exception("Upload-optimize error: %s", e)
         return {
-            'statusCode': 200,
+            'statusCode': 500,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+def handle_upload_optimize(event):
+    """Handle combined upload + optimize (config as a form field or ?config= JSON)"""
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    query = event.get('queryStringParameters') or {}
+
+    try:
+        config = json.loads(query['config']) if query.get('config') else None
+    except ValueError as e:
+        return {
+            'statusCode': 400,
             'headers': cors_headers(),
-            'body': json.dumps({
-                'status': 'ok',
-                'message': 'Route Optimizer Lambda is running'
+            'body': json.dumps({'error': f'config inválido: {e}'})
+        }
+
+    return handle_upload_optimize_stream(
+        lambda_body_stream(event),
+        headers.get('content-type', ''),
+        headers.get('x-filename') or query.get('filename'),
+        config
+    )
+
+def leg_geometry_key(origin, destination):
+    """Stage memo key of the street geometry between two stops"""
+    return stage_key(
+        'leg_geometry',
+        round(origin['lat'], 6), round(origin['lng'], 6),
+        round(destination['lat'], 6), round(destination['lng'], 6)
+    )
+
+def get_directions_legs(stops):
+    """
+    Street geometry of each leg of a route using Google Maps Directions API
+
+    Args:
+        stops: List of {'lat', 'lng'} (2 to DIRECTIONS_MAX_WAYPOINTS + 2 points)
+
+    Returns:
+        List of one dict per leg ('points' as (lat, lng) tuples, 'distance_km',
+        'duration_minutes'), or None if the API fails
+    """
+    if not GOOGLE_MAPS_API_KEY:
+        logger.debug("GOOGLE_MAPS_API_KEY not configured, drawing straight legs")
+        return None
+
+    try:
+        def point(stop):
+            return f"{stop['lat']},{stop['lng']}"
+
+        url = (
+            f"https://maps.googleapis.com/maps/api/directions/json"
+            f"?origin={point(stops[0])}"
+            f"&destination={point(stops[-1])}"
+            f"&mode=driving"
+            f"&language=es"
+            f"&key={GOOGLE_MAPS_API_KEY}"
+        )
+        if len(stops) > 2:
+            url += "&waypoints=" + '|'.join(point(stop) for stop in stops[1:-1])
+
+        response, data = google_maps_get('directions', url)
+
+        if data is None:
+            logger.warning("Directions API HTTP error: %s", response.status)
+            return None
+        if data.get('status') != 'OK' or not data.get('routes'):
+            logger.warning("Directions API status: %s", data.get('status'))
+            return None
+
+        legs = []
+        for leg in data['routes'][0].get('legs', []):
+            points = []
+            for step in leg.get('steps', []):
+                step_points = decode_polyline(step['polyline']['points'])
+                points.extend(step_points[1:] if points and step_points and step_points[0] == points[-1] else step_points)
+            legs.append({
+                'points': points,
+                'distance_km': round(leg['distance']['value'] / 1000.0, 2),
+                'duration_minutes': round(leg['duration']['value'] / 60.0, 1)
             })
+
+        if len(legs) != len(stops) - 1:
+            logger.warning("Directions API returned %d legs for %d stops", len(legs), len(stops))
+            return None
+        return legs
+
+    except Exception as e:
+        logger.warning("Directions API error: %s", e)
+
+    return None
+
+def resolve_route_legs(route, report=None):
+    """
+    Street geometry of every leg of a van route, reusing memoized legs
+
+    Consecutive legs missing from the memo are fetched together, one
+    Directions request per DIRECTIONS_MAX_WAYPOINTS stops. Legs the API could
+    not answer are drawn as straight lines and are not memoized, so they are
+    retried on the next render.
+
+    Args:
+        route: List of {'lat', 'lng'} stops, in visit order
+        report: StageReport counting memo hits/misses per leg
+
+    Returns:
+        List of leg dicts ('points', 'distance_km', 'duration_minutes', 'street')
+    """
+    legs = [None] * (len(route) - 1)
+    for i in range(len(legs)):
+        found, leg = stage_memo.get(leg_geometry_key(route[i], route[i + 1]))
+        if report:
+            report.record(found)
+        if found:
+            legs[i] = leg
+
+    i = 0
+    while i < len(legs):
+        if legs[i] is not None:
+            i += 1
+            continue
+
+        # Run of missing legs i..end-1, capped to what one request can carry
+        end = i
+        while end < len(legs) and legs[end] is None and end - i < DIRECTIONS_MAX_WAYPOINTS + 1:
+            end += 1
+
+        fetched = get_directions_legs(route[i:end + 1])
+        for offset in range(end - i):
+            origin, destination = route[i + offset], route[i + offset + 1]
+            if fetched:
+                leg = dict(fetched[offset], street=True)
+                stage_memo.put(leg_geometry_key(origin, destination), leg)
+            else:
+                distance_km = calculate_distance(origin, destination)
+                leg = {
+                    'points': [(origin['lat'], origin['lng']), (destination['lat'], destination['lng'])],
+                    'distance_km': round(distance_km, 2),
+                    'duration_minutes': round(estimate_travel_time(distance_km), 1),
+                    'street': False
+                }
+            legs[i + offset] = leg
+        i = end
+
+    return legs
+
+def simplification_tolerance_meters(zoom, latitude):
+    """Length of ROUTE_GEOMETRY_TOLERANCE_PIXELS on a Web Mercator map at this zoom and latitude"""
+    meters_per_pixel = WEB_MERCATOR_METERS_PER_PIXEL * math.cos(math.radians(latitude)) / (2 ** zoom)
+    return ROUTE_GEOMETRY_TOLERANCE_PIXELS * meters_per_pixel
+
+def simplify_polyline(points, tolerance_meters):
+    """
+    Douglas-Peucker simplification of a polyline
+
+    Distances are measured on a local equirectangular projection, exact
+    enough at city scale. The first and last points are always kept.
+
+    Args:
+        points: List of (lat, lng) tuples
+        tolerance_meters: Max distance between the original line and the simplified one
+
+    Returns:
+        List of the (lat, lng) tuples kept, in order
+    """
+    if len(points) < 3 or tolerance_meters <= 0:
+        return list(points)
+
+    scale_x = KM_PER_DEGREE * 1000 * math.cos(math.radians(points[0][0]))
+    scale_y = KM_PER_DEGREE * 1000
+    xy = [(lng * scale_x, lat * scale_y) for lat, lng in points]
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = xy[first], xy[last]
+        dx, dy = x2 - x1, y2 - y1
+        length_sq = dx * dx + dy * dy
+
+        farthest, max_distance = None, tolerance_meters
+        for k in range(first + 1, last):
+            px, py = xy[k]
+            t = 0.0 if length_sq == 0 else max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / length_sq))
+            distance = math.hypot(px - x1 - t * dx, py - y1 - t * dy)
+            if distance > max_distance:
+                farthest, max_distance = k, distance
+
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+
+    return [point for point, kept in zip(points, keep) if kept]
+
+def route_geometry(route, zoom, report=None):
+    """
+    Encoded, simplified street polyline of one van route
+
+    Legs are simplified separately so every stop stays a vertex of the line
+    (pickup markers sit on it at any zoom).
+
+    Returns:
+        Dict with 'polyline', 'points', 'distance' (km), 'duration' (min) and
+        'straightLegs' (legs drawn without street geometry)
+    """
+    if len(route) < 2:
+        return {'polyline': encode_polyline(route), 'points': len(route), 'distance': 0, 'duration': 0, 'straightLegs': 0}
+
+    legs = resolve_route_legs(route, report)
+    tolerance = simplification_tolerance_meters(zoom, route[0]['lat'])
+
+    points = []
+    for leg in legs:
+        simplified = simplify_polyline(leg['points'], tolerance)
+        points.extend(simplified[1:] if points else simplified)
+
+    return {
+        'polyline': encode_polyline([{'lat': lat, 'lng': lng} for lat, lng in points]),
+        'points': len(points),
+        'distance': round(sum(leg['distance_km'] for leg in legs), 2),
+        'duration': round(sum(leg['duration_minutes'] for leg in legs), 1),
+        'straightLegs': sum(1 for leg in legs if not leg['street'])
+    }
+
+def parse_geometry_request(data, query=None):
+    """
+    Validate a route geometry request
+
+    Returns:
+        Tuple (vans as [(id, route)], zoom)
+
+    Raises:
+        ValueError: If the vans or zoom are invalid
+    """
+    query = query or {}
+    vans = data.get('vans')
+    if not isinstance(vans, list) or not vans:
+        raise ValueError('No vans provided')
+    if len(vans) > ROUTE_GEOMETRY_MAX_VANS:
+        raise ValueError(f'Too many vans: {len(vans)} (max {ROUTE_GEOMETRY_MAX_VANS})')
+
+    zoom = data.get('zoom', query.get('zoom', ROUTE_GEOMETRY_DEFAULT_ZOOM))
+    try:
+        zoom = int(zoom)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid zoom: {zoom}')
+    if not 0 <= zoom <= ROUTE_GEOMETRY_MAX_ZOOM:
+        raise ValueError(f'Invalid zoom: {zoom} (0-{ROUTE_GEOMETRY_MAX_ZOOM})')
+
+    parsed = []
+    for index, van in enumerate(vans):
+        if not isinstance(van, dict) or not isinstance(van.get('route'), list):
+            raise ValueError(f'Van {index + 1} has no route')
+        try:
+            route = [{'lat': float(stop['lat']), 'lng': float(stop['lng'])} for stop in van['route']]
+        except (TypeError, KeyError, ValueError):
+            raise ValueError(f'Van {index + 1} has an invalid route point')
+        parsed.append((van.get('id', van.get('name', index)), route))
+    return parsed, zoom
+
+def handle_route_geometry(event):
+    """Handle route geometry (Lambda event adapter over handle_route_geometry_request)"""
+    try:
+        body = event.get('body', '{}')
+        if event.get('isBase64Encoded', False):
+            body = base64.b64decode(body).decode('utf-8')
+
+        data = json.loads(body)
+
+    except Exception as e:
+        logger.exception("Route geometry error: %s", e)
+        return {
+            'statusCode': 500,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    return handle_route_geometry_request(data, event.get('queryStringParameters'), headers.get('accept-encoding'))
+
+def handle_route_geometry_request(data, query=None, accept_encoding=None):
+    """
+    Street-level geometry of a set of van routes, for the map
+
+    Body: {'vans': [{'id': 'Van 1', 'route': [{'lat', 'lng'}, ...]}, ...], 'zoom': 12}
+
+    Each leg (pair of consecutive stops) is fetched once from the Directions
+    API and memoized, so re-rendering an unchanged plan, or a plan where only
+    some vans changed, calls Google only for the new legs. Polylines are
+    simplified with Douglas-Peucker at a tolerance of
+    ROUTE_GEOMETRY_TOLERANCE_PIXELS at the requested zoom and returned encoded.
+
+    Args:
+        data: Parsed request body
+        query: Query string parameters ('zoom')
+        accept_encoding: Accept-Encoding request header
+
+    Returns:
+        Lambda response: {'vans': [{'id', 'polyline', 'points', 'distance',
+        'duration', 'straightLegs'}], 'zoom', 'timings', 'success'}
+    """
+    try:
+        vans, zoom = parse_geometry_request(data, query)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+    try:
+        request_metrics = RequestMetrics()
+        report = StageReport('legGeometry')
+
+        def geometry(route):
+            started = time.perf_counter()
+            try:
+                with request_metrics.collect():
+                    return route_geometry(route, zoom, report)
+            finally:
+                report.span(started, time.perf_counter())
+
+        # Vans are independent: their uncached legs are fetched concurrently
+        with ThreadPoolExecutor(max_workers=GEOCODE_MAX_WORKERS) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, geometry, route) for _, route in vans]
+            results = [{'id': van_id, **future.result()} for (van_id, _), future in zip(vans, futures)]
+
+        timings = request_metrics.to_dict({'legGeometry': report})
+        logger.info(
+            "Route geometry completed",
+            extra={'fields': {'vans': len(results), 'zoom': zoom, **report.to_dict()}}
+        )
+        body = {
+            'vans': results,
+            'zoom': zoom,
+            'timings': {
+                'totalMs': timings['totalMs'],
+                'stagesMs': timings['stagesMs'],
+                'googleCalls': timings['googleCalls'],
+                'cache': {'hits': report.hits, 'misses': report.misses}
+            },
+            'success': True
+        }
+        return encoded_json_response(200, dumps_response_body(body), accept_encoding)
+
+    except Exception as e:
+        logger.exception("Route geometry error: %s", e)
+        return {
+            'statusCode': 500,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+def haversine_km(origins, destinations):
+    """Great-circle distance in km between two (n, 2) lat/lng arrays, row by row"""
+    import numpy as np
+
+    lat1, lng1 = np.radians(origins).T
+    lat2, lng2 = np.radians(destinations).T
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * np.degrees(np.arcsin(np.sqrt(a))) * KM_PER_DEGREE
+
+def group_summary(values, groups, num_groups):
+    """
+    Count, sum, mean, min, median, p90 and max of values per group
+
+    One lexsort orders the values by (group, value); the order statistics are
+    then read at each group's offsets (nearest rank), with no per-group loop.
+
+    Returns:
+        Dict of arrays of length num_groups (NaN where a group is empty)
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype=float)
+    groups = np.asarray(groups, dtype=np.int64)
+    count = np.bincount(groups, minlength=num_groups)
+    total = np.bincount(groups, weights=values, minlength=num_groups)
+    ordered = values[np.lexsort((values, groups))]
+    starts = np.cumsum(count) - count
+
+    def rank(fraction):
+        if not len(ordered):
+            return np.full(num_groups, np.nan)
+        offsets = starts + np.maximum(np.ceil(count * fraction).astype(np.int64) - 1, 0)
+        return np.where(count > 0, ordered[np.minimum(offsets, len(ordered) - 1)], np.nan)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+    return {'count': count, 'sum': total, 'mean': mean, 'min': rank(0), 'p50': rank(0.5), 'p90': rank(0.9),
+            'max': rank(1.0)}
+
+def _kpi_number(value, decimals=1):
+    """Rounded float for KPI output (None for NaN)"""
+    value = float(value)
+    return None if value != value else round(value, decimals)
+
+def plan_kpis(vans, terminal_coord, safety_buffer=SAFETY_BUFFER):
+    """
+    KPI aggregates of a plan: per terminal, per van and per presentation-time wave
+
+    Every vehicle path is rebuilt from its drivers' order (so edited plans are
+    measured as they stand), ending at its terminal, or at its route's last
+    point for bus-mode trips. All legs of all vehicles are measured in one
+    vectorized pass and aggregated with bincount and group_summary.
+
+    Distances are great-circle, like totalDistance, and so is the naive
+    baseline (every driver driving alone from home to their terminal), so the
+    saving compares like with like. Ride times use the estimate_travel_time
+    speeds from each pickup to the end of the trip (plus the bus leg for bus
+    passengers) and PICKUP_TIME_MINUTES per remaining pickup. Vehicle hours
+    are each vehicle's path at the same speeds plus its pickups, against the
+    naive baseline's drive time. A vehicle's wave is its earliest presentation time.
+
+    Args:
+        vans: The plan's vehicles (optimize result 'vans')
+        terminal_coord: Callable returning a terminal's coordinates
+            (OptimizationContext.terminal_coord)
+        safety_buffer: Multiplier for estimated ride times (1 + safetyMargin)
+
+    Returns:
+        Dict with 'summary', 'byTerminal', 'byWave', 'byVan' and 'utilizationHistogram'
+    """
+    import numpy as np
+
+    terminal_coords = {}
+
+    def coords_of(terminal):
+        if terminal not in terminal_coords:
+            coord = terminal_coord(terminal)
+            terminal_coords[terminal] = (coord['lat'], coord['lng'])
+        return terminal_coords[terminal]
+
+    terminal_ids, wave_ids = {}, {}
+    stops, stop_vehicle = [], []
+    rider_vehicle, rider_stop, rider_pickups_left, rider_home, rider_terminal = [], [], [], [], []
+    vehicle_terminal, vehicle_wave, vehicle_occupants, vehicle_seats, vehicle_is_bus = [], [], [], [], []
+    vehicle_is_feeder = []
+    bus_vehicle_by_terminal = {}
+
+    for vehicle, van in enumerate(vans):
+        drivers = van.get('drivers') or []
+        is_bus = bool(van.get('is_bus'))
+        terminal = (drivers[0].get('terminal') if drivers and van.get('trip_type') == 'to_bus' else None) \
+            or van.get('destination') or 'Terminal Aeropuerto T1'
+        times = [d['presentation_time_minutes'] for d in drivers if d.get('presentation_time_minutes') is not None]
+        wave = min(times) if times else None
+
+        vehicle_terminal.append(terminal_ids.setdefault(terminal, len(terminal_ids)))
+        vehicle_wave.append(wave_ids.setdefault(wave, len(wave_ids)))
+        vehicle_occupants.append(len(drivers))
+        vehicle_seats.append(van.get('capacity') or (BUS_CAPACITY if is_bus else VAN_CAPACITY))
+        vehicle_is_bus.append(is_bus)
+        vehicle_is_feeder.append(van.get('trip_type') == 'to_bus')
+
+        if is_bus:
+            # Bus passengers ride (and are counted) in their feeder van; the bus leg extends their ride
+            path = [(p['lat'], p['lng']) for p in van.get('route') or []]
+            bus_vehicle_by_terminal[terminal] = vehicle
+        elif drivers:
+            end = van['route'][-1] if van.get('trip_type') and van.get('route') else None
+            path = [(d['coordinates']['lat'], d['coordinates']['lng']) for d in drivers]
+            path.append((end['lat'], end['lng']) if end else coords_of(terminal))
+            for position, driver in enumerate(drivers):
+                rider_vehicle.append(vehicle)
+                rider_stop.append(len(stops) + position)
+                rider_pickups_left.append(len(drivers) - 1 - position)
+                rider_home.append(path[position])
+                rider_terminal.append(coords_of(driver.get('terminal') or terminal))
+        else:
+            path = []
+
+        stops.extend(path)
+        stop_vehicle.extend([vehicle] * len(path))
+
+    num_vehicles, num_terminals, num_waves = len(vans), len(terminal_ids), len(wave_ids)
+    stops = np.array(stops, dtype=float).reshape(-1, 2)
+    stop_vehicle = np.array(stop_vehicle, dtype=np.int64)
+    vehicle_terminal = np.array(vehicle_terminal, dtype=np.int64)
+    vehicle_wave = np.array(vehicle_wave, dtype=np.int64)
+    vehicle_occupants = np.array(vehicle_occupants, dtype=float)
+    vehicle_seats = np.array(vehicle_seats, dtype=float)
+    vehicle_is_bus = np.array(vehicle_is_bus, dtype=bool)
+    vehicle_is_feeder = np.array(vehicle_is_feeder, dtype=bool)
+    rider_vehicle = np.array(rider_vehicle, dtype=np.int64)
+    rider_stop = np.array(rider_stop, dtype=np.int64)
+
+    # Leg from each stop to the next one of the same vehicle (0 at the end of each path)
+    leg_km = np.zeros(len(stops))
+    if len(stops) > 1:
+        same_vehicle = stop_vehicle[:-1] == stop_vehicle[1:]
+        leg_km[:-1] = np.where(same_vehicle, haversine_km(stops[:-1], stops[1:]), 0.0)
+    vehicle_km = np.bincount(stop_vehicle, weights=leg_km, minlength=num_vehicles)
+
+    # Ride distance: legs from the pickup to the end of the path (suffix sums), plus the bus leg
+    cumulative = np.cumsum(leg_km)
+    path_end = np.zeros(num_vehicles, dtype=np.int64)
+    path_end[stop_vehicle] = np.arange(len(stops))
+    ride_km = cumulative[path_end[rider_vehicle]] - cumulative[rider_stop] + leg_km[rider_stop]
+    terminal_bus_km = np.array([vehicle_km[bus_vehicle_by_terminal[name]] if name in bus_vehicle_by_terminal else 0.0
+                                for name in terminal_ids]).reshape(-1)
+    ride_km = ride_km + np.where(vehicle_is_feeder[rider_vehicle], terminal_bus_km[vehicle_terminal[rider_vehicle]], 0.0)
+
+    def drive_minutes(km):
+        """estimate_travel_time's speeds, vectorized, with the safety buffer"""
+        speed_kmh = np.where(km < CITY_DISTANCE_THRESHOLD, CITY_SPEED_KMH, HIGHWAY_SPEED_KMH * 0.7 + CITY_SPEED_KMH * 0.3)
+        return km / speed_kmh * 60 * safety_buffer
+
+    ride_minutes = drive_minutes(ride_km) + np.array(rider_pickups_left, dtype=float) * PICKUP_TIME_MINUTES
+
+    naive_km = haversine_km(np.array(rider_home, dtype=float).reshape(-1, 2),
+                            np.array(rider_terminal, dtype=float).reshape(-1, 2))
+    vehicle_naive_km = np.bincount(rider_vehicle, weights=naive_km, minlength=num_vehicles)
+
+    # Time on the road: each vehicle's path plus its pickups, against every driver driving alone
+    vehicle_minutes = drive_minutes(vehicle_km) + np.where(
+        vehicle_is_bus, 0.0, np.maximum(vehicle_occupants - 1, 0) * PICKUP_TIME_MINUTES)
+    vehicle_naive_minutes = np.bincount(rider_vehicle, weights=drive_minutes(naive_km), minlength=num_vehicles)
+    vehicle_riders = np.bincount(rider_vehicle, minlength=num_vehicles)
+    empty_seats = np.maximum(vehicle_seats - vehicle_occupants, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        utilization = vehicle_occupants / vehicle_seats * 100
+
+    def breakdown(vehicle_group, num_groups):
+        """Per-group KPI dicts for a vehicle grouping (riders follow their vehicle)"""
+        counts = np.bincount(vehicle_group, minlength=num_groups)
+        seats = np.bincount(vehicle_group, weights=vehicle_seats, minlength=num_groups)
+        occupants = np.bincount(vehicle_group, weights=vehicle_occupants, minlength=num_groups)
+        empty = np.bincount(vehicle_group, weights=empty_seats, minlength=num_groups)
+        distance = np.bincount(vehicle_group, weights=vehicle_km, minlength=num_groups)
+        naive = np.bincount(vehicle_group, weights=vehicle_naive_km, minlength=num_groups)
+        hours = np.bincount(vehicle_group, weights=vehicle_minutes, minlength=num_groups) / 60
+        naive_hours = np.bincount(vehicle_group, weights=vehicle_naive_minutes, minlength=num_groups) / 60
+        riders = np.bincount(vehicle_group, weights=vehicle_riders, minlength=num_groups)
+        vans_only = ~vehicle_is_bus
+        usage = group_summary(utilization[vans_only], vehicle_group[vans_only], num_groups)
+        rides = group_summary(ride_minutes, vehicle_group[rider_vehicle], num_groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            occupancy = occupants / seats * 100
+            saved = (naive - distance) / naive * 100
+
+        return [{
+            'vehicles': int(counts[g]),
+            'drivers': int(riders[g]),
+            'seats': int(seats[g]),
+            'emptySeats': int(empty[g]),
+            'utilizationPercent': _kpi_number(occupancy[g]),
+            'utilization': {stat: _kpi_number(usage[stat][g]) for stat in ('min', 'p50', 'p90', 'max')},
+            'distanceKm': _kpi_number(distance[g]),
+            'naiveDistanceKm': _kpi_number(naive[g]),
+            'distanceSavedKm': _kpi_number(naive[g] - distance[g]),
+            'distanceSavedPercent': _kpi_number(saved[g]),
+            'vehicleHours': _kpi_number(hours[g]),
+            'naiveVehicleHours': _kpi_number(naive_hours[g]),
+            'vehicleHoursSaved': _kpi_number(naive_hours[g] - hours[g]),
+            'rideMinutes': {stat: _kpi_number(rides[stat][g]) for stat in ('mean', 'p50', 'p90', 'max')}
+        } for g in range(num_groups)]
+
+    summary = breakdown(np.zeros(num_vehicles, dtype=np.int64), 1)[0]
+    # Bus-mode trips ("Van 1 - Grupo 1", "Van 1 - Grupo 2") are one physical van
+    summary['vans'] = len({str(van.get('name') or f'Van {i + 1}').split(' - ')[0]
+                           for i, van in enumerate(vans) if not van.get('is_bus')})
+
+    rides_by_vehicle = group_summary(ride_minutes, rider_vehicle, num_vehicles)
+    terminal_names, waves = list(terminal_ids), list(wave_ids)
+    by_van = [{
+        'name': van.get('name', f'Van {i + 1}'),
+        'terminal': terminal_names[vehicle_terminal[i]],
+        'wave': format_minutes_to_time(waves[vehicle_wave[i]]) if waves[vehicle_wave[i]] is not None else None,
+        'isBus': bool(vehicle_is_bus[i]),
+        'drivers': int(vehicle_occupants[i]),
+        'capacity': int(vehicle_seats[i]),
+        'emptySeats': int(empty_seats[i]),
+        'utilizationPercent': _kpi_number(utilization[i]),
+        'distanceKm': _kpi_number(vehicle_km[i]),
+        'naiveDistanceKm': _kpi_number(vehicle_naive_km[i]),
+        'vehicleHours': _kpi_number(vehicle_minutes[i] / 60),
+        'naiveVehicleHours': _kpi_number(vehicle_naive_minutes[i] / 60),
+        'rideMinutes': {stat: _kpi_number(rides_by_vehicle[stat][i]) for stat in ('mean', 'max')}
+    } for i, van in enumerate(vans)]
+
+    wave_order = sorted(range(num_waves), key=lambda w: (waves[w] is None, waves[w] or 0))
+    by_wave = breakdown(vehicle_wave, num_waves)
+    labels = ['≤25%'] + [f'{low}-{high}%' for low, high in zip(KPI_UTILIZATION_BINS, KPI_UTILIZATION_BINS[1:])] \
+        + [f'>{KPI_UTILIZATION_BINS[-1]}%']
+    histogram = np.bincount(np.digitize(utilization[~vehicle_is_bus], KPI_UTILIZATION_BINS, right=True),
+                            minlength=len(labels))
+
+    return {
+        'summary': summary,
+        'byTerminal': [{'terminal': name, **kpis}
+                       for name, kpis in zip(terminal_names, breakdown(vehicle_terminal, num_terminals))],
+        'byWave': [{'wave': format_minutes_to_time(waves[w]) if waves[w] is not None else None, **by_wave[w]}
+                   for w in wave_order],
+        'byVan': by_van,
+        'utilizationHistogram': [{'range': label, 'vans': int(n)} for label, n in zip(labels, histogram)]
+    }
+
+def parse_kpi_request(data):
+    """
+    Validate a KPI request
+
+    Returns:
+        Tuple (vans, config): vans normalized to the fields plan_kpis reads
+
+    Raises:
+        ValueError: If the body is not an object, or the vans or config are missing or malformed
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    config = data.get('config')
+    if config is None:
+        config = {}
+    elif not isinstance(config, dict):
+        raise ValueError('config must be an object')
+
+    vans = data.get('vans')
+    if not isinstance(vans, list) or not vans:
+        raise ValueError('No vans provided')
+    if len(vans) > KPI_MAX_VANS:
+        raise ValueError(f'Too many vans: {len(vans)} (max {KPI_MAX_VANS})')
+
+    parsed = []
+    for index, van in enumerate(vans):
+        if not isinstance(van, dict) or not isinstance(van.get('drivers', []), list):
+            raise ValueError(f'Van {index + 1} has no drivers list')
+        try:
+            drivers = [{
+                'coordinates': {'lat': float(d['coordinates']['lat']), 'lng': float(d['coordinates']['lng'])},
+                'terminal': d.get('terminal'),
+                'presentation_time_minutes': d.get('presentation_time_minutes')
+            } for d in van.get('drivers', [])]
+            route = [{'lat': float(p['lat']), 'lng': float(p['lng'])} for p in van.get('route') or []]
+        except (TypeError, KeyError, ValueError):
+            raise ValueError(f'Van {index + 1} has an invalid coordinate')
+        parsed.append({
+            'name': str(van.get('name', f'Van {index + 1}')),
+            'destination': van.get('destination'),
+            'capacity': van.get('capacity'),
+            'trip_type': van.get('trip_type'),
+            'is_bus': bool(van.get('is_bus')),
+            'route': route,
+            'drivers': drivers
+        })
+    return parsed, config
+
+def handle_kpis(event):
+    """Handle plan KPIs (Lambda event adapter over handle_kpis_request)"""
+    try:
+        body = event.get('body', '{}')
+        if event.get('isBase64Encoded', False):
+            body = base64.b64decode(body).decode('utf-8')
+
+        data = json.loads(body)
+
+    except ValueError as e:
+        # Undecodable base64/UTF-8 or invalid JSON
+        return {
+            'statusCode': 400,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': f'Invalid JSON body: {e}'})
+        }
+
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    return handle_kpis_request(data, event.get('queryStringParameters'), headers.get('accept-encoding'))
+
+def handle_kpis_request(data, query=None, accept_encoding=None):
+    """
+    KPI aggregates of a plan (see plan_kpis), for the KPI dashboard
+
+    Body: {'vans': [...], 'config': {...}}, with vans as in the optimize
+    result and the optimization's config (terminal overrides, safetyMargin).
+    Optimize results already carry these KPIs in 'kpis'; this endpoint
+    recomputes them for plans edited by hand, so the dashboard never derives
+    them from the plan itself.
+
+    Args:
+        data: Parsed request body
+        query: Query string parameters (unused)
+        accept_encoding: Accept-Encoding request header
+
+    Returns:
+        Lambda response: {'summary', 'byTerminal', 'byWave', 'byVan',
+        'utilizationHistogram', 'timings', 'success'}
+    """
+    try:
+        vans, config = parse_kpi_request(data)
+        context = OptimizationContext.from_config(config)
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+    try:
+        kpis = plan_kpis(vans, context.terminal_coord, context.safety_buffer)
+        timings = context.metrics.to_dict({})
+        logger.info("KPIs computed", extra={'fields': {'vans': len(vans), 'totalMs': timings['totalMs']}})
+
+        body = {
+            **kpis,
+            'timings': {'totalMs': timings['totalMs'], 'googleCalls': timings['googleCalls']},
+            'success': True
+        }
+        return encoded_json_response(200, dumps_response_body(body), accept_encoding)
+
+    except Exception as e:
+        logger.exception("KPI error: %s", e)
+        return {
+            'statusCode': 500,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+def iter_plan_stops(result):
+    """
+    Every stop of an optimize result, van by van in route order
+
+    Handles both response formats: compact results reference rows of their
+    driver table, which are expanded one at a time.
+
+    Yields:
+        Tuples (van, stop number from 1, driver dict)
+    """
+    table = result.get('drivers') if result.get('format') == 'compact' else None
+    for van in result.get('vans') or []:
+        for order, driver in enumerate(van.get('drivers') or [], start=1):
+            if table is not None:
+                driver = dict(zip(table['columns'], table['rows'][driver]))
+                driver['coordinates'] = {'lat': driver.pop('lat', None), 'lng': driver.pop('lng', None)}
+                for field in VAN_DRIVER_FIELDS:
+                    if field in van:
+                        driver.setdefault(field, van[field])
+            yield van, order, driver
+
+def export_row(van, order, driver):
+    """One export row (EXPORT_COLUMNS order) for a stop"""
+    coordinates = driver.get('coordinates') or {}
+    return [
+        van.get('name'), order, driver.get('code'), driver.get('name'), driver.get('rut'), driver.get('phone'),
+        driver.get('address'), driver.get('pickup_time_latest'), driver.get('presentation_time') or driver.get('time'),
+        driver.get('terminal'), van.get('destination'), coordinates.get('lat'), coordinates.get('lng')
+    ]
+
+def iter_export_csv(result, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Stream a plan as CSV, EXPORT_CHUNK_ROWS rows per chunk
+
+    UTF-8 with a byte order mark and EXPORT_CSV_DELIMITER, so Excel opens it
+    with accents intact; memory stays at one chunk whatever the plan size.
+
+    Yields:
+        Encoded chunks (bytes)
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=EXPORT_CSV_DELIMITER)
+    writer.writerow(EXPORT_COLUMNS)
+    encoding = 'utf-8-sig'  # BOM on the first chunk only
+
+    for count, stop in enumerate(iter_plan_stops(result), start=1):
+        writer.writerow(export_row(*stop))
+        if count % chunk_rows == 0:
+            yield buffer.getvalue().encode(encoding)
+            buffer.seek(0)
+            buffer.truncate()
+            encoding = 'utf-8'
+
+    if buffer.tell() or encoding == 'utf-8-sig':
+        yield buffer.getvalue().encode(encoding)
+
+def iter_export_xlsx(result, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """
+    Stream a plan as an .xlsx workbook
+
+    openpyxl's write-only mode writes each row to a temporary file as it is
+    appended; the workbook is then zipped into a spooled file (on /tmp above
+    UPLOAD_SPOOL_BYTES) and sent in chunks, so memory stays flat whatever the
+    plan size.
+
+    Yields:
+        Chunks of the .xlsx file (bytes)
+    """
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Rutas')
+    sheet.freeze_panes = 'A2'
+    sheet.append(EXPORT_COLUMNS)
+    for stop in iter_plan_stops(result):
+        sheet.append(export_row(*stop))
+
+    with tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES) as spool:
+        workbook.save(spool)
+        spool.seek(0)
+        for chunk in iter(lambda: spool.read(chunk_bytes), b''):
+            yield chunk
+
+def iter_export(result, export_format):
+    """Chunks of a plan export in export_format ('xlsx' or 'csv')"""
+    if export_format == 'csv':
+        return iter_export_csv(result)
+    return iter_export_xlsx(result)
+
+def parse_export_request(data, query=None):
+    """
+    Validate an export request
+
+    The body is an optimize result (full or compact format), either as is or
+    under 'result'; the format comes from the query string.
+
+    Returns:
+        Tuple (result, export_format)
+
+    Raises:
+        ValueError: If the format is unknown or the result has no vans
+    """
+    export_format = (query or {}).get('format', 'xlsx')
+    if export_format not in EXPORT_CONTENT_TYPES:
+        raise ValueError(f'Formato de exportación no soportado: {export_format}')
+
+    result = data.get('result', data) if isinstance(data, dict) else None
+    if not isinstance(result, dict) or not isinstance(result.get('vans'), list) or not result['vans']:
+        raise ValueError('No vans provided')
+    if result.get('format') == 'compact' and not isinstance(result.get('drivers'), dict):
+        raise ValueError('Compact result without a drivers table')
+    return result, export_format
+
+def export_headers(export_format):
+    """Response headers for a plan export (attachment named after today's date)"""
+    filename = f"rutas-{datetime.now(timezone.utc):%Y-%m-%d}.{export_format}"
+    return {
+        'Content-Type': EXPORT_CONTENT_TYPES[export_format],
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    }
+
+def handle_export(event):
+    """
+    Export a plan as xlsx or CSV (Lambda adapter)
+
+    Python Lambda Function URLs cannot stream a response body, so the file is
+    assembled and returned base64-encoded; the Flask/production server streams
+    it as it is produced.
+    """
+    try:
+        body = event.get('body', '{}')
+        if event.get('isBase64Encoded', False):
+            body = base64.b64decode(body).decode('utf-8')
+        result, export_format = parse_export_request(json.loads(body), event.get('queryStringParameters'))
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+    try:
+        content = b''.join(iter_export(result, export_format))
+        logger.info("Plan exported", extra={'fields': {'format': export_format, 'vans': len(result['vans']),
+                                                      'bytes': len(content)}})
+        return {
+            'statusCode': 200,
+            'headers': {**cors_headers(), **export_headers(export_format)},
+            'body': base64.b64encode(content).decode('ascii'),
+            'isBase64Encoded': True
+        }
+
+    except Exception as e:
+        logger.exception("Export error: %s", e)
+        return {
+            'statusCode': 500,
+            'headers': cors_headers(),
+            'body': json.dumps({'error': str(e)})
+        }
+
+def handle_health():
+    """Health check"""
+    return {
+        'statusCode': 200,
+        'headers': cors_headers(),
+        'body': json.dumps({
+            'status': 'ok',
+            'message': 'Route Optimizer Lambda is running'
+        })
+    }
+
+def handle_metrics():
+    """Metrics in the Prometheus text exposition format (every process sharing METRICS_DIR, or this one)"""
+    return {
+        'statusCode': 200,
+        'headers': {**cors_headers(), 'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+        'body': metrics.render()
+    }
+
+def lambda_handler(event, context):
+    """Main Lambda handler for Function URLs"""
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    request_id = begin_request_log(getattr(context, 'aws_request_id', None) or headers.get('x-request-id'))
+    method = event.get('requestContext', {}).get('http', {}).get('method', 'GET')
+    path = event.get('rawPath', event.get('path', ''))
+    logger.info("%s %s", method, path)
+
+    try:
+        response = route_request(event, method, path)
+        response['headers'] = {**(response.get('headers') or {}), 'X-Request-Id': request_id}
+        return response
+    finally:
+        flush_logs()  # The container may be frozen as soon as we return
+
+def route_request(event, method, path):
+    """Dispatch a Function URL event to its handler"""
+    # Handle OPTIONS for CORS preflight
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': cors_headers(),
+            'body': ''
         }
+
+    # Route to appropriate handler
+    if path == '/api/upload' or path == '/upload':
+        return handle_upload(event)
+    elif path == '/api/optimize' or path == '/optimize':
+        return handle_optimize(event)
+    elif path == '/api/optimize/stream' or path == '/optimize/stream':
+        return handle_optimize_stream(event)
+    elif path == '/api/optimize/batch' or path == '/optimize/batch':
+        return handle_optimize_batch(event)
+    elif path == '/api/upload-optimize' or path == '/upload-optimize':
+        return handle_upload_optimize(event)
+    elif path == '/api/route-geometry' or path == '/route-geometry':
+        return handle_route_geometry(event)
+    elif path == '/api/kpis' or path == '/kpis':
+        return handle_kpis(event)
+    elif path == '/api/export' or path == '/export':
+        return handle_export(event)
+    elif path == '/api/health' or path == '/health':
+        return handle_health()
+    elif path == '/api/metrics' or path == '/metrics':
+        return handle_metrics()
     else:
         return {
             'statusCode': 404,
@@ -21,6 +21,11 @@ function App() {
     setActiveView('map');
   };
 
+  // Routes streamed in after the first van (or the final summary): update without changing view
+  const handleRoutesUpdated = (data) => {
+    setOptimizedData(data);
+  };
+
   const handleViewChange = (view) => {
     setActiveView(view);
     setMobileMenuOpen(false); // Close menu on mobile when changing view
@@ -139,6 +144,7 @@ function App() {
           <Dashboard
             onDataUploaded={handleDataUploaded}
             onOptimized={handleOptimized}
+            onRoutesUpdated={handleRoutesUpdated}
             routeData={routeData}
           />
         )}
@@ -4,7 +4,54 @@ import axios from 'axios';
 import { Loader2, CheckCircle, AlertCircle } from 'lucide-react';
 import { API_BASE_URL } from '../config/api';
 
-const Dashboard = ({ onDataUploaded, onOptimized, routeData }) => {
+// Read /api/optimize/stream (NDJSON): geocoding progress, each van as soon as its
+// cluster is solved, then a summary with the totals
+const streamOptimization = async (payload, { onGeocode, onVan }) => {
+  const response = await fetch(`${API_BASE_URL}/api/optimize/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(payload),
+  });
+  if (!response.ok || !response.body) {
+    throw new Error(`HTTP error! status: ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  const vans = [];
+  let buffered = '';
+
+  while (true) {
+    const { value, done } = await reader.read();
+    buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+    const lines = buffered.split('\n');
+    buffered = done ? '' : lines.pop();
+
+    for (const line of lines) {
+      if (!line.trim()) continue;
+      const { event, data } = JSON.parse(line);
+
+      if (event === 'geocode') {
+        onGeocode(data);
+      } else if (event === 'van') {
+        vans[data.index] = data.van;
+        onVan(vans.filter(Boolean));
+      } else if (event === 'summary') {
+        return { ...data, vans: vans.filter(Boolean) };
+      } else if (event === 'error') {
+        const error = new Error(data.error);
+        error.fromServer = true;
+        throw error;
+      }
+    }
+
+    if (done) {
+      throw new Error('El stream de optimización terminó sin resumen');
+    }
+  }
+};
+
+const Dashboard = ({ onDataUploaded, onOptimized, onRoutesUpdated, routeData }) => {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
   const [uploadedFile, setUploadedFile] = useState(null);
@@ -28,81 +75,60 @@ const Dashboard = ({ onDataUploaded, onOptimized, routeData }) => {
     setProgress({ stage: 'Leyendo archivo...', percent: 10 });
 
     try {
-      // Convert file to base64
-      const reader = new FileReader();
-      reader.onload = async () => {
-        const base64Content = reader.result.split(',')[1]; // Remove data:*/*;base64, prefix
-
-        try {
-          // Upload and parse file
-          setProgress({ stage: 'Subiendo y procesando datos...', percent: 25 });
-          const response = await axios.post(`${API_BASE_URL}/api/upload`, {
-            file_content: base64Content,
-            filename: file.name
+      // Upload the raw file as multipart/form-data (no base64 round trip)
+      setProgress({ stage: 'Subiendo y procesando datos...', percent: 25 });
+      const formData = new FormData();
+      formData.append('file', file, file.name);
+
+      const response = await axios.post(`${API_BASE_URL}/api/upload`, formData);
+
+      onDataUploaded(response.data);
+      setProgress({ stage: 'Datos procesados correctamente', percent: 50 });
+      setParsedData(response.data);
+
+      // Validate van count if not in auto mode
+      if (!isAutoMode) {
+        const driverCount = response.data.drivers.length;
+        const VAN_CAPACITY = 10;
+        const TRIPS_PER_VAN = 2; // Maximum 2 trips per van
+        const requiredVans = Math.ceil(driverCount / (VAN_CAPACITY * TRIPS_PER_VAN));
+
+        // Check if not enough vans (even with 2 trips)
+        if (numVans < requiredVans) {
+          setShowWarning(true);
+          setWarningData({
+            type: 'insufficient',
+            driverCount,
+            selectedVans: numVans,
+            requiredVans,
+            capacity: numVans * VAN_CAPACITY * TRIPS_PER_VAN
           });
-
-          onDataUploaded(response.data);
-          setProgress({ stage: 'Datos procesados correctamente', percent: 50 });
-          setParsedData(response.data);
-
-          // Validate van count if not in auto mode
-          if (!isAutoMode) {
-            const driverCount = response.data.drivers.length;
-            const VAN_CAPACITY = 10;
-            const TRIPS_PER_VAN = 2; // Maximum 2 trips per van
-            const requiredVans = Math.ceil(driverCount / (VAN_CAPACITY * TRIPS_PER_VAN));
-
-            // Check if not enough vans (even with 2 trips)
-            if (numVans < requiredVans) {
-              setShowWarning(true);
-              setWarningData({
-                type: 'insufficient',
-                driverCount,
-                selectedVans: numVans,
-                requiredVans,
-                capacity: numVans * VAN_CAPACITY * TRIPS_PER_VAN
-              });
-              setLoading(false);
-              setProgress({ stage: '', percent: 0 });
-              return; // Stop optimization until user decides
-            }
-
-            // Check if too many vans
-            if (numVans > requiredVans) {
-              setShowWarning(true);
-              setWarningData({
-                type: 'excess',
-                driverCount,
-                selectedVans: numVans,
-                requiredVans,
-                unusedVans: numVans - requiredVans
-              });
-              setLoading(false);
-              setProgress({ stage: '', percent: 0 });
-              return; // Stop optimization until user confirms
-            }
-          }
-
-          // Automatically trigger optimization
-          await handleOptimize(response.data);
-
-        } catch (err) {
-          setError(err.response?.data?.error || 'Error al procesar el archivo');
           setLoading(false);
           setProgress({ stage: '', percent: 0 });
+          return; // Stop optimization until user decides
         }
-      };
 
-      reader.onerror = () => {
-        setError('Error al leer el archivo');
-        setLoading(false);
-        setProgress({ stage: '', percent: 0 });
-      };
+        // Check if too many vans
+        if (numVans > requiredVans) {
+          setShowWarning(true);
+          setWarningData({
+            type: 'excess',
+            driverCount,
+            selectedVans: numVans,
+            requiredVans,
+            unusedVans: numVans - requiredVans
+          });
+          setLoading(false);
+          setProgress({ stage: '', percent: 0 });
+          return; // Stop optimization until user confirms
+        }
+      }
 
-      reader.readAsDataURL(file);
+      // Automatically trigger optimization
+      await handleOptimize(response.data);
 
     } catch (err) {
-      setError(err.message || 'Error al procesar el archivo');
+      setError(err.response?.data?.error || err.message || 'Error al procesar el archivo');
       setLoading(false);
       setProgress({ stage: '', percent: 0 });
     }
@@ -112,11 +138,6 @@ const Dashboard = ({ onDataUploaded, onOptimized, routeData }) => {
     try {
       setProgress({ stage: 'Geocodificando direcciones...', percent: 65 });
 
-      // Simulate geocoding progress (the actual work happens in Lambda)
-      setTimeout(() => {
-        setProgress({ stage: 'Optimizando rutas con algoritmos avanzados...', percent: 85 });
-      }, 1000);
-
       // Include configuration parameters in the request
       const optimizationData = {
         ...(data || routeData),
@@ -127,10 +148,46 @@ const Dashboard = ({ onDataUploaded, onOptimized, routeData }) => {
         }
       };
 
-      const response = await axios.post(`${API_BASE_URL}/api/optimize`, optimizationData);
+      let result;
+      let shownRoutes = false;
+      try {
+        // Stream: the map opens with the first solved van and fills in as the rest finish
+        result = await streamOptimization(optimizationData, {
+          onGeocode: ({ resolved, total }) => {
+            setProgress({
+              stage: `Geocodificando direcciones... (${resolved}/${total})`,
+              percent: 65 + Math.round((resolved / total) * 20)
+            });
+          },
+          onVan: (vans) => {
+            const partial = { vans, totalDrivers: optimizationData.drivers.length, streaming: true, config: optimizationData.config };
+            if (!shownRoutes) {
+              shownRoutes = true;
+              onOptimized(partial);
+            } else {
+              onRoutesUpdated(partial);
+            }
+          }
+        });
+      } catch (streamError) {
+        if (streamError.fromServer) {
+          throw streamError;
+        }
+        // Streaming unavailable (e.g. proxy buffering or older backend): fall back to the plain endpoint
+        console.warn('Optimization stream failed, using /api/optimize:', streamError);
+        setProgress({ stage: 'Optimizando rutas con algoritmos avanzados...', percent: 85 });
+        const response = await axios.post(`${API_BASE_URL}/api/optimize`, optimizationData);
+        result = response.data;
+      }
 
       setProgress({ stage: 'Finalizado! Preparando visualización...', percent: 100 });
-      onOptimized(response.data);
+      // Keep the config with the plan: /api/kpis recomputes edited plans with the same terminals and safety margin
+      result = { ...result, config: optimizationData.config };
+      if (shownRoutes) {
+        onRoutesUpdated(result);
+      } else {
+        onOptimized(result);
+      }
 
       // Clear progress after a short delay
       setTimeout(() => {
@@ -139,7 +196,7 @@ const Dashboard = ({ onDataUploaded, onOptimized, routeData }) => {
       }, 800);
 
     } catch (err) {
-      setError(err.response?.data?.error || 'Error al optimizar rutas');
+      setError(err.response?.data?.error || (err.fromServer && err.message) || 'Error al optimizar rutas');
       setLoading(false);
       setProgress({ stage: '', percent: 0 });
     }
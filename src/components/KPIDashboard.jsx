@@ -1,47 +1,79 @@
-import React from 'react';
-import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer, PieChart, Pie, Cell, LineChart, Line } from 'recharts';
+import React, { useEffect, useState } from 'react';
+import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from 'recharts';
 import { TrendingDown, Truck, Users, Clock } from 'lucide-react';
+import { API_BASE_URL } from '../config/api';
+
+// KPIs are computed by the backend: optimize results carry them in `kpis`; plans edited in the
+// RouteEditor (kpis cleared) are sent to /api/kpis once and only the aggregates come back.
+// While the optimization is still streaming, the final summary brings them
+const fetchKpis = async (data) => {
+  const response = await fetch(`${API_BASE_URL}/api/kpis`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ vans: data.vans, config: data.config || {} }),
+  });
+  if (!response.ok) {
+    const errorText = await response.text();
+    throw new Error(`HTTP error! status: ${response.status}, body: ${errorText}`);
+  }
+  return response.json();
+};
 
-const COLORS = ['#3B82F6', '#10B981', '#F59E0B', '#8B5CF6', '#EF4444', '#EC4899'];
+const formatNumber = (value, suffix = '') => (value === null || value === undefined ? '-' : `${value}${suffix}`);
 
 const KPIDashboard = ({ data }) => {
+  const [fetchedKpis, setFetchedKpis] = useState(null);
+  const [error, setError] = useState(null);
+  const kpis = data?.kpis || fetchedKpis;
+
+  useEffect(() => {
+    setFetchedKpis(null);
+    setError(null);
+    if (!data?.vans || data.kpis || data.streaming) return;
+
+    let cancelled = false;
+    fetchKpis(data)
+      .then(result => { if (!cancelled) setFetchedKpis(result); })
+      .catch(err => {
+        console.error('❌ [KPIDashboard] Error fetching KPIs:', err);
+        if (!cancelled) setError('No se pudieron calcular los KPIs');
+      });
+    return () => { cancelled = true; };
+  }, [data]);
+
   if (!data || !data.vans) {
     return <div className="p-8">No hay datos disponibles</div>;
   }
+  if (error) {
+    return <div className="p-8 text-red-600">{error}</div>;
+  }
+  if (!kpis) {
+    return <div className="p-8">Calculando KPIs...</div>;
+  }
 
-  // Calculate KPIs
-  const totalDrivers = data.totalDrivers || 0;
-
-  // Count unique vans (excluding bus and multiple trips)
-  const uniqueVans = new Set(
-    data.vans
-      .filter(van => !van.name.toLowerCase().includes('bus'))
-      .map(van => van.name.match(/Van\s+(\d+)/)?.[1])
-      .filter(Boolean)
-  );
-  const totalVans = uniqueVans.size;
-
-  const totalDistance = data.totalDistance || 0;
-  const avgDriversPerVan = (totalDrivers / totalVans).toFixed(1);
-  const estimatedTimeSaved = data.timeSaved || '15-20';
-  const distanceSaved = data.distanceSavedPercent || 12;
+  const { summary } = kpis;
 
-  // Prepare data for charts
-  const vanDistributionData = data.vans.map((van, index) => ({
+  // Chart data straight from the server-side aggregates
+  const vanData = kpis.byVan.map(van => ({
     name: van.name,
-    conductores: van.drivers.length,
-    distancia: parseFloat(van.totalDistance?.toFixed(1) || 0)
+    conductores: van.drivers,
+    asientosLibres: van.emptySeats,
+    distancia: van.distanceKm,
+    viajeMedio: van.rideMinutes.mean
   }));
 
-  const pieData = data.vans.map((van, index) => ({
-    name: van.name,
-    value: van.drivers.length
+  const terminalData = kpis.byTerminal.map(terminal => ({
+    name: terminal.terminal.split('(')[0].trim(),
+    individual: terminal.naiveDistanceKm,
+    optimizado: terminal.distanceKm
   }));
 
-  const comparisonData = [
-    { method: 'Manual', distancia: (totalDistance * 1.12).toFixed(0), tiempo: 180 },
-    { method: 'Optimizado', distancia: totalDistance.toFixed(0), tiempo: 150 }
-  ];
+  const waveData = kpis.byWave.map(wave => ({
+    name: wave.wave || 'Sin hora',
+    vehiculos: wave.vehicles,
+    asientosLibres: wave.emptySeats,
+    viajeP90: wave.rideMinutes.p90
+  }));
 
   return (
     <div className="p-8 bg-gray-50 min-h-full">
@@ -53,37 +85,37 @@ const KPIDashboard = ({ data }) => {
         <div className="bg-gradient-to-br from-blue-500 to-blue-600 text-white rounded-xl shadow-lg p-6">
           <div className="flex items-center justify-between mb-2">
             <Truck className="w-8 h-8" />
-            <span className="text-3xl font-bold">{totalVans}</span>
+            <span className="text-3xl font-bold">{summary.vans}</span>
           </div>
           <h3 className="text-lg font-semibold">Vans Asignadas</h3>
-          <p className="text-blue-100 text-sm mt-1">Flota activa</p>
+          <p className="text-blue-100 text-sm mt-1">Ocupación {formatNumber(summary.utilizationPercent, '%')}</p>
         </div>
 
         <div className="bg-gradient-to-br from-green-500 to-green-600 text-white rounded-xl shadow-lg p-6">
           <div className="flex items-center justify-between mb-2">
             <Users className="w-8 h-8" />
-            <span className="text-3xl font-bold">{totalDrivers}</span>
+            <span className="text-3xl font-bold">{summary.drivers}</span>
           </div>
           <h3 className="text-lg font-semibold">Conductores</h3>
-          <p className="text-green-100 text-sm mt-1">Total asignados</p>
+          <p className="text-green-100 text-sm mt-1">{summary.emptySeats} asientos libres</p>
         </div>
 
         <div className="bg-gradient-to-br from-purple-500 to-purple-600 text-white rounded-xl shadow-lg p-6">
           <div className="flex items-center justify-between mb-2">
             <TrendingDown className="w-8 h-8" />
-            <span className="text-3xl font-bold">{distanceSaved}%</span>
+            <span className="text-3xl font-bold">{formatNumber(summary.distanceSavedPercent, '%')}</span>
           </div>
           <h3 className="text-lg font-semibold">Reducción KM</h3>
-          <p className="text-purple-100 text-sm mt-1">vs asignación manual</p>
+          <p className="text-purple-100 text-sm mt-1">vs cada conductor por su cuenta</p>
         </div>
 
         <div className="bg-gradient-to-br from-orange-500 to-orange-600 text-white rounded-xl shadow-lg p-6">
           <div className="flex items-center justify-between mb-2">
             <Clock className="w-8 h-8" />
-            <span className="text-3xl font-bold">{estimatedTimeSaved}</span>
+            <span className="text-3xl font-bold">{formatNumber(summary.rideMinutes.mean)}</span>
           </div>
-          <h3 className="text-lg font-semibold">Min Ahorrados</h3>
-          <p className="text-orange-100 text-sm mt-1">Por ruta estimado</p>
+          <h3 className="text-lg font-semibold">Min de Viaje</h3>
+          <p className="text-orange-100 text-sm mt-1">Promedio por conductor (p90 {formatNumber(summary.rideMinutes.p90)})</p>
         </div>
       </div>
 
@@ -92,98 +124,110 @@ const KPIDashboard = ({ data }) => {
         {/* Bar Chart - Distribution */}
         <div className="bg-white rounded-xl shadow-lg p-6">
           <h2 className="text-xl font-bold text-gray-800 mb-4">
-            Distribución de Conductores por Van
+            Conductores y Asientos Libres por Van
           </h2>
           <ResponsiveContainer width="100%" height={300}>
-            <BarChart data={vanDistributionData}>
+            <BarChart data={vanData}>
               <CartesianGrid strokeDasharray="3 3" />
               <XAxis dataKey="name" />
               <YAxis />
               <Tooltip />
               <Legend />
-              <Bar dataKey="conductores" fill="#3B82F6" name="Conductores" />
+              <Bar dataKey="conductores" stackId="asientos" fill="#3B82F6" name="Conductores" />
+              <Bar dataKey="asientosLibres" stackId="asientos" fill="#CBD5E1" name="Asientos libres" />
             </BarChart>
           </ResponsiveContainer>
         </div>
 
-        {/* Pie Chart - Distribution */}
+        {/* Utilization distribution */}
         <div className="bg-white rounded-xl shadow-lg p-6">
           <h2 className="text-xl font-bold text-gray-800 mb-4">
-            Proporción de Asignación
+            Distribución de Ocupación
           </h2>
           <ResponsiveContainer width="100%" height={300}>
-            <PieChart>
-              <Pie
-                data={pieData}
-                cx="50%"
-                cy="50%"
-                labelLine={false}
-                label={({ name, percent }) => `${name}: ${(percent * 100).toFixed(0)}%`}
-                outerRadius={100}
-                fill="#8884d8"
-                dataKey="value"
-              >
-                {pieData.map((entry, index) => (
-                  <Cell key={`cell-${index}`} fill={COLORS[index % COLORS.length]} />
-                ))}
-              </Pie>
+            <BarChart data={kpis.utilizationHistogram}>
+              <CartesianGrid strokeDasharray="3 3" />
+              <XAxis dataKey="range" />
+              <YAxis allowDecimals={false} />
               <Tooltip />
-            </PieChart>
+              <Legend />
+              <Bar dataKey="vans" fill="#8B5CF6" name="Vans" />
+            </BarChart>
           </ResponsiveContainer>
         </div>
       </div>
 
       {/* Distance Comparison */}
-      <div className="grid grid-cols-1 lg:grid-cols-2 gap-6">
+      <div className="grid grid-cols-1 lg:grid-cols-2 gap-6 mb-8">
         <div className="bg-white rounded-xl shadow-lg p-6">
           <h2 className="text-xl font-bold text-gray-800 mb-4">
-            Distancia por Van (km)
+            Distancia y Viaje Medio por Van
           </h2>
           <ResponsiveContainer width="100%" height={300}>
-            <BarChart data={vanDistributionData}>
+            <BarChart data={vanData}>
               <CartesianGrid strokeDasharray="3 3" />
               <XAxis dataKey="name" />
               <YAxis />
               <Tooltip />
               <Legend />
               <Bar dataKey="distancia" fill="#10B981" name="Distancia (km)" />
+              <Bar dataKey="viajeMedio" fill="#F59E0B" name="Viaje medio (min)" />
             </BarChart>
           </ResponsiveContainer>
         </div>
 
         <div className="bg-white rounded-xl shadow-lg p-6">
           <h2 className="text-xl font-bold text-gray-800 mb-4">
-            Comparativa: Manual vs Optimizado
+            Comparativa por Terminal: Individual vs Optimizado
           </h2>
           <ResponsiveContainer width="100%" height={300}>
-            <BarChart data={comparisonData}>
+            <BarChart data={terminalData}>
               <CartesianGrid strokeDasharray="3 3" />
-              <XAxis dataKey="method" />
+              <XAxis dataKey="name" />
               <YAxis />
               <Tooltip />
               <Legend />
-              <Bar dataKey="distancia" fill="#EF4444" name="Distancia Total (km)" />
-              <Bar dataKey="tiempo" fill="#8B5CF6" name="Tiempo Total (min)" />
+              <Bar dataKey="individual" fill="#EF4444" name="Cada conductor solo (km)" />
+              <Bar dataKey="optimizado" fill="#10B981" name="Optimizado (km)" />
             </BarChart>
           </ResponsiveContainer>
         </div>
       </div>
 
+      {/* Presentation-time waves */}
+      <div className="bg-white rounded-xl shadow-lg p-6">
+        <h2 className="text-xl font-bold text-gray-800 mb-4">
+          Por Hora de Presentación
+        </h2>
+        <ResponsiveContainer width="100%" height={300}>
+          <BarChart data={waveData}>
+            <CartesianGrid strokeDasharray="3 3" />
+            <XAxis dataKey="name" />
+            <YAxis />
+            <Tooltip />
+            <Legend />
+            <Bar dataKey="vehiculos" fill="#3B82F6" name="Vehículos" />
+            <Bar dataKey="asientosLibres" fill="#CBD5E1" name="Asientos libres" />
+            <Bar dataKey="viajeP90" fill="#F59E0B" name="Viaje p90 (min)" />
+          </BarChart>
+        </ResponsiveContainer>
+      </div>
+
       {/* Summary Stats */}
       <div className="mt-8 bg-white rounded-xl shadow-lg p-6">
         <h2 className="text-xl font-bold text-gray-800 mb-4">Resumen de Optimización</h2>
         <div className="grid grid-cols-1 md:grid-cols-3 gap-4">
           <div className="border-l-4 border-blue-500 pl-4">
             <p className="text-sm text-gray-600">Distancia Total</p>
-            <p className="text-2xl font-bold text-gray-800">{totalDistance.toFixed(1)} km</p>
+            <p className="text-2xl font-bold text-gray-800">{formatNumber(summary.distanceKm, ' km')}</p>
           </div>
           <div className="border-l-4 border-green-500 pl-4">
-            <p className="text-sm text-gray-600">Promedio por Van</p>
-            <p className="text-2xl font-bold text-gray-800">{avgDriversPerVan} conductores</p>
+            <p className="text-sm text-gray-600">Km Ahorrados</p>
+            <p className="text-2xl font-bold text-gray-800">{formatNumber(summary.distanceSavedKm, ' km')}</p>
           </div>
           <div className="border-l-4 border-purple-500 pl-4">
-            <p className="text-sm text-gray-600">Eficiencia</p>
-            <p className="text-2xl font-bold text-green-600">Óptima ✓</p>
+            <p className="text-sm text-gray-600">Ocupación (mediana por van)</p>
+            <p className="text-2xl font-bold text-gray-800">{formatNumber(summary.utilization.p50, '%')}</p>
           </div>
         </div>
       </div>
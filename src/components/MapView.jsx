@@ -1,7 +1,8 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { MapContainer, TileLayer, Marker, Popup, Polyline, Tooltip } from 'react-leaflet';
 import L from 'leaflet';
 import 'leaflet/dist/leaflet.css';
+import { API_BASE_URL } from '../config/api';
 
 // Fix for default marker icons in React-Leaflet
 delete L.Icon.Default.prototype._getIconUrl;
@@ -18,10 +19,42 @@ const COLORS = [
 
 const BUS_COLOR = '#DC2626'; // Rojo distintivo para el bus
 
+const MAP_ZOOM = 12; // Initial zoom; street routes are simplified for it
+
+// Decode a Google encoded polyline (as returned by /api/route-geometry) into {lat, lng} points
+const decodePolyline = (encoded) => {
+  const points = [];
+  let index = 0;
+  let lat = 0;
+  let lng = 0;
+
+  while (index < encoded.length) {
+    for (const axis of ['lat', 'lng']) {
+      let shift = 0;
+      let result = 0;
+      let byte;
+      do {
+        byte = encoded.charCodeAt(index++) - 63;
+        result |= (byte & 0x1f) << shift;
+        shift += 5;
+      } while (byte >= 0x20);
+      const delta = result & 1 ? ~(result >> 1) : result >> 1;
+      if (axis === 'lat') lat += delta; else lng += delta;
+    }
+    points.push({ lat: lat / 1e5, lng: lng / 1e5 });
+  }
+
+  return points;
+};
+
+// Street routes are cached per waypoint sequence, so vans that stream in later only fetch their own route
+const routeKey = (van) => `${van.name}|${(van.route || []).map(p => `${p.lat},${p.lng}`).join(';')}`;
+
 const MapView = ({ data, mobileMenuOpen = false }) => {
   const [center, setCenter] = useState([-33.4489, -70.6693]); // Santiago de Chile default
-  const [streetRoutes, setStreetRoutes] = useState({}); // Rutas por calles desde Google Maps
-  const [loadingRoutes, setLoadingRoutes] = useState(false);
+  const [streetRoutes, setStreetRoutes] = useState({}); // Rutas por calles desde Google Maps (por routeKey)
+  const [loadingRoutes, setLoadingRoutes] = useState(0); // Street route requests in flight
+  const requestedRoutes = useRef(new Set()); // routeKeys already requested
   const [routeErrors, setRouteErrors] = useState({});
   const [hoveredRoute, setHoveredRoute] = useState(null); // Track which route is being hovered
   const [selectedRoute, setSelectedRoute] = useState(null); // Track which route is locked (clicked)
@@ -38,99 +71,69 @@ const MapView = ({ data, mobileMenuOpen = false }) => {
     }
   }, [data]);
 
-  // Fetch street routes from Google Maps API via Vercel serverless function
+  // Fetch street routes for all new vans in one call to the backend (legs are cached server-side)
   useEffect(() => {
-    console.log('🔍 [MapView] useEffect triggered, data:', data);
-
     if (!data?.vans || data.vans.length === 0) {
       console.log('⚠️ [MapView] No vans data, skipping street routes');
       return;
     }
 
-    console.log(`🚀 [MapView] Starting to fetch street routes for ${data.vans.length} vans`);
+    // Vans arrive incrementally while the optimization streams: only fetch the new ones
+    const pendingVans = data.vans.filter(van => !requestedRoutes.current.has(routeKey(van)));
+    if (pendingVans.length === 0) {
+      return;
+    }
+    pendingVans.forEach(van => requestedRoutes.current.add(routeKey(van)));
+
+    // Only vans with at least 2 waypoints have a street route
+    const routableVans = pendingVans.filter(van => van.route && van.route.length >= 2);
+    if (routableVans.length === 0) {
+      return;
+    }
+
+    console.log(`🚀 [MapView] Fetching street routes for ${routableVans.length} new vans`);
 
     const fetchStreetRoutes = async () => {
-      setLoadingRoutes(true);
+      setLoadingRoutes(count => count + 1);
       const newStreetRoutes = {};
       const errors = {};
 
-      // Create array of promises for parallel execution
-      const routePromises = data.vans.map(async (van, i) => {
-        // Only fetch routes for vans with at least 2 waypoints
-        if (!van.route || van.route.length < 2) {
-          console.log(`⚠️ [MapView] Skipping ${van.name} - insufficient waypoints (${van.route?.length || 0})`);
-          return { index: i, route: null };
+      try {
+        const response = await fetch(`${API_BASE_URL}/api/route-geometry`, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify({
+            vans: routableVans.map(van => ({ id: routeKey(van), route: van.route })),
+            zoom: MAP_ZOOM
+          })
+        });
+
+        if (!response.ok) {
+          const errorText = await response.text();
+          throw new Error(`HTTP error! status: ${response.status}, body: ${errorText}`);
         }
 
-        try {
-          console.log(`📡 [MapView] Fetching street route for ${van.name}...`);
-          console.log(`   Waypoints count: ${van.route.length}`);
-          console.log(`   First waypoint:`, van.route[0]);
-          console.log(`   Last waypoint:`, van.route[van.route.length - 1]);
-
-          const response = await fetch('/api/get-street-route', {
-            method: 'POST',
-            headers: {
-              'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-              waypoints: van.route
-            })
-          });
-
-          console.log(`📥 [MapView] Response status for ${van.name}:`, response.status);
-
-          if (!response.ok) {
-            const errorText = await response.text();
-            console.error(`❌ [MapView] HTTP error for ${van.name}:`, response.status, errorText);
-            throw new Error(`HTTP error! status: ${response.status}, body: ${errorText}`);
+        const result = await response.json();
+        result.vans.forEach(van => {
+          newStreetRoutes[van.id] = decodePolyline(van.polyline);
+          if (van.straightLegs > 0) {
+            errors[van.id] = `${van.straightLegs} tramo(s) sin ruta por calles`;
           }
+        });
+        console.log(`✅ [MapView] Street routes loaded: ${result.vans.length} vans, ${result.timings.googleCalls.length ? 'Google Maps called' : 'all legs cached'}`);
+      } catch (error) {
+        // Fallback to the original straight-line routes
+        console.error('❌ [MapView] Error fetching street routes:', error);
+        routableVans.forEach(van => {
+          errors[routeKey(van)] = error.message;
+        });
+      }
 
-          const result = await response.json();
-          console.log(`📦 [MapView] Response data for ${van.name}:`, result);
-
-          if (result.success && result.route) {
-            console.log(`✅ [MapView] Street route loaded for ${van.name}:`);
-            console.log(`   Original waypoints: ${van.route.length}`);
-            console.log(`   Street route points: ${result.route.length}`);
-            console.log(`   Distance: ${result.distance.toFixed(1)} km`);
-            console.log(`   Duration: ${result.duration.toFixed(0)} min`);
-            return { index: i, route: result.route, error: null };
-          } else {
-            console.error(`❌ [MapView] Invalid response for ${van.name}:`, result);
-            throw new Error(result.error || 'Unknown error');
-          }
-        } catch (error) {
-          console.error(`❌ [MapView] Error fetching street route for ${van.name}:`, error);
-          console.error(`   Error details:`, error.message);
-          // Fallback to original route
-          console.log(`⚠️ [MapView] Using fallback route for ${van.name}`);
-          return { index: i, route: van.route, error: error.message };
-        }
-      });
-
-      // Execute all requests in parallel
-      console.log(`🚀 [MapView] Executing ${routePromises.length} route requests in parallel...`);
-      const results = await Promise.all(routePromises);
-
-      // Process results
-      results.forEach(result => {
-        if (result.route) {
-          newStreetRoutes[result.index] = result.route;
-        }
-        if (result.error) {
-          errors[result.index] = result.error;
-        }
-      });
-
-      console.log('📊 [MapView] Final street routes loaded:', Object.keys(newStreetRoutes).length);
-      console.log('📊 [MapView] Errors:', errors);
-
-      setStreetRoutes(newStreetRoutes);
-      setRouteErrors(errors);
-      setLoadingRoutes(false);
-
-      console.log('✅ [MapView] Street routes fetch completed');
+      setStreetRoutes(prev => ({ ...prev, ...newStreetRoutes }));
+      setRouteErrors(prev => ({ ...prev, ...errors }));
+      setLoadingRoutes(count => count - 1);
     };
 
     fetchStreetRoutes();
@@ -149,7 +152,7 @@ const MapView = ({ data, mobileMenuOpen = false }) => {
       {/* Map */}
       <MapContainer 
         center={center} 
-        zoom={12} 
+        zoom={MAP_ZOOM} 
         className="h-full w-full"
         scrollWheelZoom={true}
       >
@@ -163,8 +166,9 @@ const MapView = ({ data, mobileMenuOpen = false }) => {
           const color = isBus ? BUS_COLOR : COLORS[vanIndex % COLORS.length];
 
           // Use street route if available, otherwise use original route
-          const routeToDisplay = streetRoutes[vanIndex] || van.route;
-          const isStreetRoute = streetRoutes[vanIndex] && streetRoutes[vanIndex].length > van.route.length;
+          const streetRoute = streetRoutes[routeKey(van)];
+          const routeToDisplay = streetRoute || van.route;
+          const isStreetRoute = streetRoute && !routeErrors[routeKey(van)];
 
           // Determine active route (selectedRoute takes precedence over hoveredRoute)
           const activeRoute = selectedRoute !== null ? selectedRoute : hoveredRoute;
@@ -344,7 +348,7 @@ const MapView = ({ data, mobileMenuOpen = false }) => {
       <div className={`absolute top-4 right-4 bg-white rounded-lg shadow-xl p-4 z-[1000] max-h-96 overflow-y-auto transition-opacity duration-300 ${mobileMenuOpen ? 'opacity-0 pointer-events-none lg:opacity-100 lg:pointer-events-auto' : ''}`}>
         <div className="flex items-center justify-between mb-3">
           <h3 className="font-bold text-lg">Rutas por Vehículo</h3>
-          {loadingRoutes && (
+          {loadingRoutes > 0 && (
             <div className="flex items-center gap-2 text-xs text-blue-600">
               <div className="animate-spin rounded-full h-3 w-3 border-b-2 border-blue-600"></div>
               <span>Cargando rutas...</span>
@@ -357,6 +361,13 @@ const MapView = ({ data, mobileMenuOpen = false }) => {
           )}
         </div>
 
+        {data.streaming && (
+          <div className="mb-2 flex items-center gap-2 text-xs text-blue-600">
+            <div className="animate-spin rounded-full h-3 w-3 border-b-2 border-blue-600"></div>
+            <span>Optimizando... {data.vans.length} vehículo(s) listo(s)</span>
+          </div>
+        )}
+
         {/* Hint for user interaction */}
         <div className="mb-3 pb-2 border-b border-gray-200">
           <p className="text-xs text-gray-500">
@@ -1,12 +1,48 @@
 import React, { useState } from 'react';
 import { DragDropContext, Droppable, Draggable } from 'react-beautiful-dnd';
-import { Users, Truck, Navigation, AlertCircle } from 'lucide-react';
+import { Users, Truck, Navigation, AlertCircle, Download } from 'lucide-react';
+import { API_BASE_URL } from '../config/api';
 
 const COLORS = ['#EF4444', '#3B82F6', '#10B981', '#F59E0B', '#8B5CF6'];
 
+// Download the plan (as edited) for dispatch; the backend streams the xlsx/CSV file
+const downloadPlan = async (vans, format) => {
+  const response = await fetch(`${API_BASE_URL}/api/export?format=${format}`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ vans }),
+  });
+  if (!response.ok) {
+    const errorText = await response.text();
+    throw new Error(`HTTP error! status: ${response.status}, body: ${errorText}`);
+  }
+
+  const disposition = response.headers.get('Content-Disposition') || '';
+  const filename = disposition.match(/filename="([^"]+)"/)?.[1] || `rutas.${format}`;
+  const url = URL.createObjectURL(await response.blob());
+  const link = document.createElement('a');
+  link.href = url;
+  link.download = filename;
+  link.click();
+  URL.revokeObjectURL(url);
+};
+
 const RouteEditor = ({ data, onUpdate }) => {
   const [vans, setVans] = useState(data.vans || []);
   const [changes, setChanges] = useState([]);
+  const [exporting, setExporting] = useState(null);
+
+  const handleExport = async (format) => {
+    setExporting(format);
+    try {
+      await downloadPlan(vans, format);
+    } catch (error) {
+      console.error('❌ [RouteEditor] Error exporting plan:', error);
+      alert('No se pudo exportar el plan');
+    } finally {
+      setExporting(null);
+    }
+  };
 
   const handleDragEnd = (result) => {
     const { source, destination } = result;
@@ -42,15 +78,31 @@ const RouteEditor = ({ data, onUpdate }) => {
     setChanges([change, ...changes]);
 
     // Update parent
-    onUpdate({ ...data, vans: newVans });
+    // KPIs no longer match the plan: the KPI dashboard recomputes them from /api/kpis
+    onUpdate({ ...data, vans: newVans, kpis: null });
   };
 
   return (
     <div className="p-8 bg-gray-50 min-h-full">
       <h1 className="text-4xl font-bold text-gray-800 mb-2">Editor Manual de Rutas</h1>
-      <p className="text-gray-600 mb-6">
-        Arrastra conductores entre vans para ajustar las asignaciones
-      </p>
+      <div className="flex flex-wrap items-center justify-between gap-4 mb-6">
+        <p className="text-gray-600">
+          Arrastra conductores entre vans para ajustar las asignaciones
+        </p>
+        <div className="flex gap-2">
+          {['xlsx', 'csv'].map(format => (
+            <button
+              key={format}
+              onClick={() => handleExport(format)}
+              disabled={exporting !== null}
+              className="flex items-center gap-2 px-4 py-2 bg-white border border-gray-300 rounded-lg shadow-sm hover:bg-gray-100 disabled:opacity-50"
+            >
+              <Download className="w-4 h-4" />
+              {exporting === format ? 'Exportando...' : `Exportar ${format === 'xlsx' ? 'Excel' : 'CSV'}`}
+            </button>
+          ))}
+        </div>
+      </div>
 
       {changes.length > 0 && (
         <div className="mb-6 bg-blue-50 border-l-4 border-blue-500 p-4 rounded">
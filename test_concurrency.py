@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Concurrency stress test for the optimize pipeline.
+
+Runs optimizations with different configs (safety margin, fleet size, van
+capacity, destination terminal and terminal overrides) first one at a time,
+then many at once from a thread pool, and checks that every concurrent result
+matches its sequential baseline - i.e. request settings never bleed between
+optimizations running in the same process.
+
+Geocoding and the Distance Matrix API are replaced by deterministic offline
+stand-ins, so travel times come from estimate_travel_time() and depend
+directly on each request's safety margin.
+
+Usage:
+    python test_concurrency.py [--threads 8] [--copies 3] [--drivers 24]
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('ENABLE_RESPONSE_CACHE', 'false')
+os.environ.setdefault('ROUTE_SOLVER_TIME_LIMIT_SECONDS', '1')
+
+import lambda_function_updated as lambda_function
+
+
+def fake_geocode(address):
+    """Deterministic coordinates around Santiago for an address"""
+    digest = hashlib.sha256(address.encode()).digest()
+    return {'lat': -33.60 + digest[0] / 255 * 0.35, 'lng': -70.85 + digest[1] / 255 * 0.35}, 'full_address'
+
+
+def build_roster(count):
+    return [
+        {
+            'name': f'Conductor {i + 1}',
+            'address': f'Calle Prueba {100 + i * 7}, Santiago',
+            'terminal': 'Terminal Aeropuerto T1',
+            'time': f'{6 + i % 4:02d}:{(i * 15) % 60:02d}'
+        }
+        for i in range(count)
+    ]
+
+
+def build_configs():
+    """One config per variant; every setting differs between neighbours"""
+    configs = []
+    for k in range(8):
+        config = {
+            'numVans': 2 + k % 3,
+            'safetyMargin': round(k * 0.1, 2),
+            'vanCapacity': 8 + k,
+            'destinationTerminal': 'Terminal Conquistador' if k % 4 == 0 else 'Terminal Aeropuerto T1'
+        }
+        if k % 4 == 1:
+            config['terminals'] = {'Terminal Aeropuerto T1': {'lat': -33.30 - k * 0.01, 'lng': -70.70}}
+        configs.append(config)
+    return configs
+
+
+def fingerprint(result):
+    """Order-independent summary of everything a request's config controls"""
+    drivers = {}
+    vans = []
+    for van in result['vans']:
+        names = sorted(d['name'] for d in van['drivers'])
+        vans.append((van['name'], van['capacity'], names))
+        for driver in van['drivers']:
+            drivers[driver['name']] = (driver['travel_time_minutes'], driver['pickup_time_latest'], driver['distance_to_terminal_km'])
+    return json.dumps({'vans': sorted(vans), 'drivers': drivers}, sort_keys=True)
+
+
+def run(roster, config):
+    response = lambda_function.handle_optimize_request({'drivers': roster, 'config': config})
+    if response['statusCode'] != 200:
+        raise RuntimeError(f"Optimization failed: {response['body']}")
+    return fingerprint(json.loads(response['body']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8, help='Concurrent optimizations')
+    parser.add_argument('--copies', type=int, default=3, help='Times each config is submitted concurrently')
+    parser.add_argument('--drivers', type=int, default=24, help='Drivers per roster')
+    parser.add_argument('--verbose', action='store_true', help='Show pipeline logs')
+    args = parser.parse_args()
+
+    lambda_function.geocode_address_with_strategy = fake_geocode
+    lambda_function.get_route_distance_and_time = lambda origin, destination: None
+
+    roster = build_roster(args.drivers)
+    configs = build_configs()
+    logs = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    with logs:
+        baseline = [run(roster, config) for config in configs]
+
+        # Start cold so the concurrent requests also run clustering and the solver together
+        lambda_function.stage_memo = lambda_function.StageMemo(lambda_function.STAGE_MEMO_MAX_ENTRIES)
+
+        jobs = [k for k in range(len(configs)) for _ in range(args.copies)]
+        random.Random(42).shuffle(jobs)
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            results = list(executor.map(lambda k: (k, run(roster, configs[k])), jobs))
+        lambda_function.flush_logs()  # Write queued log records while stdout is still redirected
+
+    if len(set(baseline)) != len(baseline):
+        print("❌ Configs do not produce distinct results; the test would not detect bleeding")
+        sys.exit(1)
+
+    mismatches = [k for k, result in results if result != baseline[k]]
+    print(f"{len(results)} concurrent optimizations across {len(configs)} configs, {args.threads} threads")
+    if mismatches:
+        for k in sorted(set(mismatches)):
+            print(f"❌ Config {k} ({json.dumps(configs[k])}) differed from its sequential result")
+        sys.exit(1)
+    print("✓ Every concurrent result matches its sequential baseline")
+
+
+if __name__ == '__main__':
+    main()